@@ -0,0 +1,26 @@
+"""Gunicorn server hooks of Rights API
+
+Gunicorn reads this file from working directory. When PROMETHEUS_MULTIPROC_DIR
+environment variable is set, metrics of the previous run are removed at startup
+and metrics of exited workers are marked as dead.
+"""
+
+import glob
+import os
+
+from prometheus_client import multiprocess
+
+
+def on_starting(server):  # pylint: disable=unused-argument
+    """Remove metrics files of the previous run"""
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        os.makedirs(path, exist_ok=True)
+        for file_name in glob.glob(os.path.join(path, '*.db')):
+            os.remove(file_name)
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Remove live gauges of exited worker"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+"""Run microbenchmarks of request processing and compare them with baseline.
+
+Does not need a database: queries are answered by a mock cursor. Results of
+base version are stored with --output and compared on the same machine, for example:
+    python3 bench_rights.py --output baseline.json
+    python3 bench_rights.py --baseline baseline.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import timeit
+from types import SimpleNamespace
+from unittest.mock import patch
+import psycopg2.extensions
+from flask import Flask
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import rights  # pylint: disable=wrong-import-position,import-error
+
+CLIENT_DN = 'OU=xtss,O=RIA,C=EE'
+CONFIG = f"""
+db_host: localhost
+db_port: 5432
+db_db: postgres
+db_user: postgres
+db_pass: password
+# Readiness is checked with every request instead of using cached status
+status_cache_ttl: 0
+status_deep_check: true
+allowed:
+  - {CLIENT_DN}
+"""
+SEARCH_ROWS = 100
+SET_RIGHT = {
+    'person': {'code': '12345678901', 'first_name': 'First', 'last_name': 'Last'},
+    'organization': {'code': '00000000', 'name': 'Org 0'},
+    'right': {
+        'right_type': 'RIGHT1', 'valid_from': '2030-01-01T10:35:45.555',
+        'valid_to': '2030-12-31T10:35:45.555'}}
+SEARCH_KWARGS = {
+    'persons': ['12345678901'], 'organizations': ['00000000'], 'rights': ['RIGHT1'],
+    'only_valid': True, 'limit': 1000, 'offset': 0, 'after_id': None,
+    'days_to_expiration': None, 'count': 'exact'}
+
+
+def make_records(rows):
+    """Make search right records as they are returned by search query"""
+    return [
+        (f'P{i:011d}', f'First{i}', f'Last{i}', f'O{i % 997:08d}', f'Org {i % 997}',
+         f'RIGHT{i % 7}', '2020-01-01T10:35:45.555000',
+         '2020-01-31T10:35:45.555000' if i % 10 == 0 else None, i % 3 == 0, i + 1)
+        for i in range(rows)]
+
+
+class MockCursor:
+    """Cursor that answers queries of the service without database
+
+    Search queries return the given records, upserts return ids of all
+    requested codes and all other statements affect a single row.
+    """
+    def __init__(self, records):
+        self.records = records
+        self.sql = ''
+        self.params = {}
+        self.position = 0
+        self.rowcount = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def __iter__(self):
+        return iter(self.records)
+
+    @staticmethod
+    def mogrify(sql, params):
+        """Return query without binding parameters"""
+        del params
+        return sql.encode('utf-8')
+
+    def execute(self, sql, params=None):
+        """Remember query for fetch methods"""
+        self.sql = sql
+        self.params = params or {}
+        self.position = 0
+
+    def fetchone(self):
+        """Return count, plan, database role or id with names of person or organization"""
+        if 'pg_is_in_recovery()' in self.sql:
+            return (False, None)
+        if 'explain (format json)' in self.sql:
+            return ([{'Plan': {'Plan Rows': len(self.records)}}],)
+        if 'select count(1)' in self.sql:
+            return (len(self.records),)
+        return (1, 'First', 'Last')
+
+    def fetchall(self):
+        """Return ids of upserted codes, added rights or revoked counts"""
+        if 'returning code, id' in self.sql:
+            return [(code, num) for num, code in enumerate(self.params['codes'], 1)]
+        if 'returning person_id, organization_id, right_type' in self.sql:
+            return list(zip(
+                self.params['person_ids'], self.params['organization_ids'],
+                self.params['right_types']))
+        if 'from revoked' in self.sql:
+            indexes = [
+                idx for key, value in self.params.items() if key.endswith('_idx')
+                for idx in value]
+            return [(None, len(indexes))] + [(idx, 1) for idx in indexes]
+        return self.records
+
+    def fetchmany(self, size):
+        """Return next batch of records"""
+        rows = self.records[self.position:self.position + size]
+        self.position += size
+        return rows
+
+    def copy_expert(self, sql, writer):
+        """Write exported records as CSV"""
+        del sql
+        for rec in self.records:
+            writer.write(','.join(str(value) for value in rec[:9]) + '\n')
+
+
+class MockConnection:
+    """Connection that returns mock cursors"""
+    def __init__(self, records):
+        self.records = records
+        self.closed = 0
+        self.autocommit = False
+        self.info = SimpleNamespace(
+            transaction_status=psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+
+    def cursor(self, name=None):
+        """Return mock cursor"""
+        del name
+        return MockCursor(self.records)
+
+    def commit(self):
+        """Do nothing"""
+
+    def rollback(self):
+        """Do nothing"""
+
+    def close(self):
+        """Mark connection as closed"""
+        self.closed = 1
+
+
+def get_unit_benchmarks():
+    """Get benchmarks of functions that are called for every request"""
+    app = Flask(__name__)
+    search_response = {
+        'rights': [rights.get_right_from_record(rec) for rec in make_records(1000)],
+        'limit': 1000, 'offset': 0, 'total': 1000, 'count': 'exact'}
+
+    def make_response():
+        with app.app_context():
+            rights.make_response(
+                {'http_status': 200, 'code': 'OK', 'msg': 'Found 1000 rights',
+                 'response': search_response}, '', log_level='debug', float_free=True)
+
+    benchmarks = {
+        'validate_set_right_request': lambda: rights.validate_set_right_request(
+            json.loads(json.dumps(SET_RIGHT)), ''),
+        'parse_interval': lambda: rights.parse_interval(
+            SET_RIGHT['right']['valid_from'], SET_RIGHT['right']['valid_to'], SET_RIGHT, ''),
+        'get_search_rights_sql': lambda: rights.get_search_rights_sql(
+            True, ['12345678901'], ['00000000'], ['RIGHT1'], (0, 30)),
+        'make_response_1k': make_response}
+    for rows, name in ((1000, '1k'), (10000, '10k'), (100000, '100k')):
+        cur = MockCursor(make_records(rows))
+        kwargs = dict(SEARCH_KWARGS, limit=rows)
+        benchmarks[f'search_rights_{name}'] = (
+            lambda cur=cur, kwargs=kwargs: rights.search_rights(cur, **kwargs))
+    return benchmarks
+
+
+def get_client(config_dir):
+    """Create service with mock database and return its test client"""
+    config_file = os.path.join(config_dir, 'config.yaml')
+    with open(config_file, 'w', encoding='utf-8') as file:
+        file.write(CONFIG)
+    app = rights.create_app(config_file)
+    rights.LOGGER.setLevel(logging.WARNING)
+    return app.test_client()
+
+
+def get_endpoint_benchmarks(client):
+    """Get benchmarks of test client requests to every endpoint"""
+    requests = {
+        'set-right': SET_RIGHT,
+        'set-rights': [SET_RIGHT],
+        'revoke-right': {
+            'person_code': '12345678901', 'organization_code': '00000000',
+            'right_type': 'RIGHT1'},
+        'revoke-rights': [{'person_code': '12345678901', 'right_type': 'RIGHT1'}],
+        'rights': {'persons': ['12345678901'], 'only_valid': True},
+        'rights-stream': {'persons': ['12345678901'], 'only_valid': True, 'stream': True},
+        'rights/export': {'persons': ['12345678901'], 'format': 'csv'},
+        'person': {'code': '12345678901', 'first_name': 'First', 'last_name': 'Last'},
+        'organization': {'code': '00000000', 'name': 'Org 0'}}
+    headers = {'X-Ssl-Client-S-Dn': CLIENT_DN}
+    benchmarks = {}
+    for endpoint, data in requests.items():
+        path = '/' + endpoint.removesuffix('-stream')
+
+        def post(path=path, data=data):
+            response = client.post(path, json=data, headers=headers)
+            # Consuming streamed responses
+            response.get_data()
+            if response.status_code >= 300:
+                raise RuntimeError(f'Request to {path} failed: {response.get_data()}')
+
+        benchmarks[f'endpoint_{endpoint.replace("/", "_")}'] = post
+
+    status_requests = {
+        'status': '/status', 'status_live': '/status/live', 'status_ready': '/status/ready',
+        'status_ready_deep': '/status/ready?deep=true', 'status_pool': '/status/pool',
+        'metrics': '/metrics'}
+    for name, path in status_requests.items():
+
+        def get(path=path):
+            response = client.get(path)
+            if response.status_code >= 300:
+                raise RuntimeError(f'Request to {path} failed: {response.get_data()}')
+
+        benchmarks[f'endpoint_{name}'] = get
+    return benchmarks
+
+
+def measure(func, repeat):
+    """Get minimal duration of a single call in microseconds"""
+    timer = timeit.Timer(func)
+    number = timer.autorange()[0]
+    return round(min(timer.repeat(repeat, number)) / number * 1e6, 3)
+
+
+def compare(results, baseline, tolerance):
+    """Print comparison with baseline and return names of regressed benchmarks"""
+    regressions = []
+    for name, duration in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f'{name:40} {duration:14.3f} us   (no baseline)')
+            continue
+        change = duration / base - 1
+        flag = ''
+        if change > tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f'{name:40} {duration:14.3f} us {change:+8.1%}{flag}')
+    return regressions
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', maxsplit=1)[0])
+    parser.add_argument('--repeat', type=int, default=5, help='duration is minimum of repeats')
+    parser.add_argument('--filter', default='', help='run benchmarks containing this string')
+    parser.add_argument('--output', help='write results to JSON file')
+    parser.add_argument('--baseline', help='compare results with JSON file of earlier run')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.2,
+        help='maximal allowed slowdown compared to baseline, default 0.2 (20%%)')
+    args = parser.parse_args()
+
+    rights.LOGGER.setLevel(logging.WARNING)
+    results = {}
+    with tempfile.TemporaryDirectory() as config_dir, \
+            patch('rights.get_db_connection', side_effect=lambda *args: MockConnection(
+                make_records(SEARCH_ROWS))):
+        benchmarks = get_unit_benchmarks()
+        benchmarks.update(get_endpoint_benchmarks(get_client(config_dir)))
+        for name, func in benchmarks.items():
+            if args.filter in name:
+                results[name] = measure(func, args.repeat)
+
+    report = {
+        'python': platform.python_version(), 'orjson': rights.orjson is not None,
+        'unit': 'us', 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+            file.write('\n')
+
+    if not args.baseline:
+        print(json.dumps(report, indent=2))
+        return
+    with open(args.baseline, 'r', encoding='utf-8') as file:
+        baseline = json.load(file)['results']
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f'Regressions over {args.tolerance:.0%}: {", ".join(regressions)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""Compare search response serialization of Python and database formatted timestamps.
+
+Does not need a database: search records are generated in memory, for example:
+    python3 bench_serialization.py --rows 10000
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from flask import Flask, jsonify
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import rights  # pylint: disable=wrong-import-position,import-error
+
+
+def make_records(rows):
+    """Make search right records with timestamps as datetime objects"""
+    start = datetime(2020, 1, 1, 10, 35, 45, 555)
+    return [
+        (f'P{i:011d}', f'First{i}', f'Last{i}', f'O{i % 997:08d}', f'Org {i % 997}',
+         f'RIGHT{i % 7}', start + timedelta(seconds=i),
+         start + timedelta(days=30, seconds=i) if i % 10 == 0 else None, i % 3 == 0, i)
+        for i in range(rows)]
+
+
+def format_records(records):
+    """Format timestamps of records in the same way as database does"""
+    return [
+        rec[:6] + tuple(
+            value.strftime(rights.TIME_FORMAT) if value else None for value in rec[6:8])
+        + rec[8:] for rec in records]
+
+
+def legacy_right_from_record(rec):
+    """Convert record to right object by formatting timestamps in Python"""
+    valid_from = rec[6]
+    if isinstance(valid_from, datetime):
+        valid_from = valid_from.strftime(rights.TIME_FORMAT)
+    valid_to = rec[7]
+    if isinstance(valid_to, datetime):
+        valid_to = valid_to.strftime(rights.TIME_FORMAT)
+    return {
+        'person': {'code': rec[0], 'first_name': rec[1], 'last_name': rec[2]},
+        'organization': {'code': rec[3], 'name': rec[4]},
+        'right': {
+            'right_type': rec[5], 'valid_from': valid_from, 'valid_to': valid_to,
+            'revoked': rec[8]}}
+
+
+def legacy_response(records):
+    """Serialize search response with Python timestamps and flask.jsonify"""
+    response = {
+        'rights': [legacy_right_from_record(rec) for rec in records], 'limit': len(records),
+        'offset': 0, 'total': len(records), 'count': 'exact'}
+    return jsonify({'code': 'OK', 'msg': 'Found rights', 'response': response})
+
+
+def current_response(records):
+    """Serialize search response in the same way as the service does"""
+    response = {
+        'rights': [rights.get_right_from_record(rec) for rec in records],
+        'limit': len(records), 'offset': 0, 'total': len(records), 'count': 'exact'}
+    return rights.make_response(
+        {'http_status': 200, 'code': 'OK', 'msg': 'Found rights', 'response': response}, '',
+        float_free=True)
+
+
+def measure(func, records, runs):
+    """Get response body and minimal duration of runs in milliseconds"""
+    times = []
+    body = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        body = func(records).get_data()
+        times.append(time.perf_counter() - start)
+    return body, round(min(times) * 1000, 3)
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', maxsplit=1)[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--runs', type=int, default=10, help='duration is minimum of runs')
+    args = parser.parse_args()
+
+    rights.LOGGER.setLevel(logging.WARNING)
+    records = make_records(args.rows)
+    formatted = format_records(records)
+    with Flask(__name__).app_context():
+        legacy_body, legacy_ms = measure(legacy_response, records, args.runs)
+        current_body, current_ms = measure(current_response, formatted, args.runs)
+    if legacy_body != current_body:
+        raise RuntimeError('Serialized responses differ')
+    print(json.dumps({
+        'rows': args.rows, 'orjson': rights.orjson is not None, 'legacy_ms': legacy_ms,
+        'current_ms': current_ms, 'speedup': round(legacy_ms / current_ms, 2)}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+"""Compare set-right latency of separate statements and rights.set_right function.
+
+Run against local docker compose database after Liquibase update, for example:
+    python3 compare_set_right.py --db-host localhost --iterations 2000
+"""
+
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import rights  # pylint: disable=wrong-import-position,import-error
+import db_options  # pylint: disable=wrong-import-position,import-error
+
+
+def percentile(values, pct):
+    """Get percentile of sorted values"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summarize(latencies):
+    """Summarize latencies in milliseconds"""
+    values = sorted(latency * 1000 for latency in latencies)
+    return {
+        'count': len(values),
+        'mean_ms': round(statistics.mean(values), 3),
+        'p50_ms': round(percentile(values, 50), 3),
+        'p95_ms': round(percentile(values, 95), 3),
+        'p99_ms': round(percentile(values, 99), 3),
+        'max_ms': round(values[-1], 3)}
+
+
+def make_request(rnd, args):
+    """Make random set-right request"""
+    person = rnd.randrange(args.persons)
+    organization = rnd.randrange(args.organizations)
+    return {
+        'person': {
+            'code': f'P{person:011d}', 'first_name': f'First{person}',
+            'last_name': f'Last{person}'},
+        'organization': {'code': f'O{organization:08d}', 'name': f'Org {organization}'},
+        'right': {'right_type': f'RIGHT{rnd.randrange(args.right_types)}'}}
+
+
+def run(conf, args, use_function):
+    """Run set-right requests and return latencies"""
+    my_conf = dict(conf, db_set_right_function=use_function)
+    rnd = random.Random(args.seed)
+    latencies = []
+    for i in range(args.warmup + args.iterations):
+        json_data = make_request(rnd, args)
+        start = time.perf_counter()
+        response = rights.process_set_right(my_conf, json_data, '')
+        duration = time.perf_counter() - start
+        if response['code'] != 'CREATED':
+            raise RuntimeError(f'Unexpected response: {response}')
+        if i >= args.warmup:
+            latencies.append(duration)
+    return latencies
+
+
+def main():
+    """Main function"""
+    parser = db_options.get_parser(__doc__)
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--persons', type=int, default=1000)
+    parser.add_argument('--organizations', type=int, default=50)
+    parser.add_argument('--right-types', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    conf = db_options.load_config(args)
+    rights.init_db_pool(conf)
+
+    statements = summarize(run(conf, args, False))
+    function = summarize(run(conf, args, True))
+    print(json.dumps({
+        'statements': statements, 'function': function,
+        'p50_speedup': round(statements['p50_ms'] / function['p50_ms'], 2)}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
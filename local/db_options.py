@@ -0,0 +1,38 @@
+"""Command line options of local scripts that connect to the database.
+
+Configuration is read from config.yaml of this directory by default, database
+host and credentials can be overridden with options.
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import rights  # pylint: disable=wrong-import-position,import-error
+
+
+def get_parser(doc):
+    """Create argument parser with configuration and database options
+
+    Description is the first line of script docstring.
+    """
+    parser = argparse.ArgumentParser(description=doc.split('\n', maxsplit=1)[0])
+    parser.add_argument('--config', default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'config.yaml'))
+    parser.add_argument('--db-host', help='override "db_host" from configuration')
+    parser.add_argument('--db-user', help='override "db_user" from configuration')
+    parser.add_argument('--db-pass', help='override "db_pass" from configuration')
+    return parser
+
+
+def load_config(args):
+    """Load configuration with database options applied, API logging is quieted"""
+    conf = rights.load_config(args.config)
+    for key in ('db_host', 'db_user', 'db_pass'):
+        if getattr(args, key):
+            conf[key] = getattr(args, key)
+    rights.LOGGER.setLevel(logging.WARNING)
+    return conf
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+"""Show query plans of hot rights queries with and without rights table indexes.
+
+Indexes are dropped inside a transaction that is rolled back, so the
+database is not changed, but dropping requires table owner privileges.
+Run against local docker compose database after Liquibase update, for example:
+    python3 explain_plans.py --db-host localhost --db-user postgres --fill 2000000
+"""
+
+import json
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import rights  # pylint: disable=wrong-import-position,import-error
+import db_options  # pylint: disable=wrong-import-position,import-error
+
+# Indexes created by Liquibase changesets for hot queries
+INDEXES = (
+    'right_person_id_id_idx', 'right_organization_id_id_idx', 'right_active_key_idx',
+    'right_active_type_id_idx', 'right_active_id_idx', 'right_active_valid_to_idx')
+
+# Same condition as in rights.check_right trigger
+SQL_CHECK_RIGHT = """
+            select exists(
+                select 1 from rights."right"
+                where person_id=%(person_id)s and organization_id=%(organization_id)s
+                    and right_type=%(right_type)s and revoked = false and id <> 0)"""
+
+SQL_DELETE_PERSON = """
+            delete from rights.person where id=%(person_id)s"""
+
+
+def fill(cur, args):
+    """Add generated rights without running row triggers
+
+    Person, organization and right type of a generated right repeat after
+    persons * organizations * right_types rows (when those numbers are
+    pairwise coprime). Only the last repetition can contain not revoked
+    rights, so check_right trigger constraint is not violated.
+    """
+    params = {
+        'rights': args.fill, 'persons': args.persons, 'organizations': args.organizations,
+        'right_types': args.right_types,
+        'repeat': args.persons * args.organizations * args.right_types}
+    cur.execute('set session_replication_role = replica')
+    cur.execute(
+        """
+            insert into rights.person (code, first_name, last_name)
+            select 'P' || lpad(g::text, 11, '0'), 'First' || g, 'Last' || g
+            from generate_series(0, %(persons)s - 1) g
+            on conflict (code) do nothing""", params)
+    cur.execute(
+        """
+            insert into rights.organization (code, name)
+            select 'O' || lpad(g::text, 8, '0'), 'Org ' || g
+            from generate_series(0, %(organizations)s - 1) g
+            on conflict (code) do nothing""", params)
+    cur.execute(
+        """
+            insert into rights.right (
+                person_id, organization_id, right_type, valid_from, valid_to, revoked)
+            select p.id, o.id, 'RIGHT' || (g %% %(right_types)s),
+                current_timestamp - interval '1 day',
+                case when g %% 10 = 0 then current_timestamp + (g %% 30) * interval '1 day' end,
+                g <= %(rights)s - %(repeat)s or g %% 3 = 0
+            from generate_series(1, %(rights)s) g
+            join rights.person p on (p.code='P' || lpad((g %% %(persons)s)::text, 11, '0'))
+            join rights.organization o
+                on (o.code='O' || lpad((g %% %(organizations)s)::text, 8, '0'))
+            order by md5(g::text)""", params)
+    cur.execute('set session_replication_role = default')
+    cur.execute('analyze rights.person')
+    cur.execute('analyze rights.organization')
+    cur.execute('analyze rights.right')
+
+
+def get_sample(cur):
+    """Get identifiers of a not revoked right to use as query parameters"""
+    cur.execute(
+        """
+            select r.person_id, r.organization_id, r.right_type, p.code, o.code
+            from rights.right r
+            join rights.person p on (p.id=r.person_id)
+            join rights.organization o on (o.id=r.organization_id)
+            where not r.revoked
+            order by r.id desc
+            limit 1""")
+    rec = cur.fetchone()
+    if rec is None:
+        raise RuntimeError('No rights found, use --fill to generate rights')
+    return {
+        'person_id': rec[0], 'organization_id': rec[1], 'right_type': rec[2],
+        'persons': [rec[3]], 'organizations': [rec[4]], 'rights': [rec[2]],
+        'limit': 100, 'offset': 0, 'after_id': 0, 'expiration_from': 0, 'expiration_to': 6}
+
+
+def get_queries():
+    """Get list of (name, SQL) of hot queries"""
+    return [
+        ('revoke_right', rights.SQL_REVOKE_RIGHT),
+        ('check_right', SQL_CHECK_RIGHT),
+        ('search_only_valid', rights.get_search_rights_sql(True, None, None, None, None)[0]),
+        ('search_only_valid_right_type', rights.get_search_rights_sql(
+            True, None, None, ['RIGHT1'], None)[0]),
+        ('search_person', rights.get_search_rights_sql(False, ['P'], None, None, None)[0]),
+        ('search_organization_cursor', rights.get_search_rights_sql(
+            True, None, ['O'], None, None, 0)[0]),
+        ('search_days_to_expiration', rights.get_search_rights_sql(
+            True, None, None, None, (0, 6))[0]),
+        ('delete_person_cascade', SQL_DELETE_PERSON)]
+
+
+def explain(cur, sql, params, drop_indexes, runs):
+    """Explain query in a transaction that is rolled back
+
+    Returns tuple of: plan text, minimal execution time in milliseconds
+    """
+    times = []
+    plan = ''
+    for _ in range(runs):
+        try:
+            if drop_indexes:
+                for index in INDEXES:
+                    cur.execute(f'drop index if exists rights.{index}')
+            cur.execute('explain (analyze, buffers) ' + sql, params)
+            plan = '\n'.join(rec[0] for rec in cur.fetchall())
+        finally:
+            cur.connection.rollback()
+        times.append(float(re.search(r'Execution Time: ([0-9.]+) ms', plan).group(1)))
+    return plan, min(times)
+
+
+def main():
+    """Main function"""
+    parser = db_options.get_parser(__doc__)
+    parser.add_argument('--fill', type=int, default=0, help='number of rights to generate')
+    parser.add_argument('--persons', type=int, default=99991)
+    parser.add_argument('--organizations', type=int, default=997)
+    parser.add_argument('--right-types', type=int, default=7)
+    parser.add_argument('--runs', type=int, default=3, help='execution time is minimum of runs')
+    parser.add_argument('--plans', action='store_true', help='print query plans')
+    args = parser.parse_args()
+
+    conf = db_options.load_config(args)
+
+    conn = rights.get_db_connection(conf)
+    try:
+        with conn.cursor() as cur:
+            if args.fill:
+                fill(cur, args)
+                conn.commit()
+            params = get_sample(cur)
+            conn.rollback()
+            summary = {}
+            for name, sql in get_queries():
+                without_plan, without_ms = explain(cur, sql, params, True, args.runs)
+                with_plan, with_ms = explain(cur, sql, params, False, args.runs)
+                if args.plans:
+                    print(f'== {name} without indexes ==\n{without_plan}\n')
+                    print(f'== {name} with indexes ==\n{with_plan}\n')
+                summary[name] = {'without_indexes_ms': without_ms, 'with_indexes_ms': with_ms}
+    finally:
+        conn.close()
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
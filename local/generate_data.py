@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+
+"""Bulk load generated persons, organizations, rights and change log with COPY.
+
+Rows are loaded without running row triggers (that requires superuser), so
+the database must be updated by Liquibase first. Existing data is deleted
+before loading, because generated codes and ids always start from the first
+ones. Run against local docker compose database, for example:
+    python3 generate_data.py --db-host localhost --db-user postgres --truncate \\
+        --rights 5000000 --persons 500000 --organizations 5000 --seed 1
+
+The same arguments and seed generate the same data. Timestamps are relative to
+the time of loading, so that the share of valid, expired and future rights
+does not depend on the date.
+"""
+
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import rights  # pylint: disable=wrong-import-position,import-error
+import db_options  # pylint: disable=wrong-import-position,import-error
+
+DEFAULT_STATES = 'valid=60,expired=15,revoked=20,future=5'
+RIGHT_STATES = ('valid', 'expired', 'revoked', 'future')
+# Attempts to find a key without active right before the right is generated as revoked
+MAX_KEY_ATTEMPTS = 10
+COPY_SIZE = 65536
+
+SQL_TRUNCATE = """
+            truncate rights.change_log, rights.right, rights.person, rights.organization
+            restart identity"""
+
+# Same row values as rights.logger trigger writes, INSERT of a revoked right
+# is logged with revoked=false and revoking as UPDATE
+SQL_CHANGE_LOG = """
+            insert into rights.change_log (
+                table_name, record_id, operation, old_value, new_value, created)
+            select table_name, record_id, operation, old_value, new_value, created
+            from (
+                select 'rights.organization' as table_name, o.id as record_id,
+                    'INSERT' as operation, null::text as old_value,
+                    ROW(o.*)::text as new_value, o.created
+                from rights.organization o
+                union all
+                select 'rights.person', p.id, 'INSERT', null, ROW(p.*)::text, p.created
+                from rights.person p
+                union all
+                select 'rights.right', r.id, 'INSERT', null,
+                    ROW(r.id, r.person_id, r.organization_id, r.right_type, r.valid_from,
+                        r.valid_to, false, r.created, r.created)::text,
+                    r.created
+                from rights.right r
+                union all
+                select 'rights.right', r.id, 'UPDATE',
+                    ROW(r.id, r.person_id, r.organization_id, r.right_type, r.valid_from,
+                        r.valid_to, false, r.created, r.created)::text,
+                    ROW(r.*)::text, r.last_modified
+                from rights.right r
+                where r.revoked) c
+            order by created, record_id"""
+
+
+def parse_states(states):
+    """Parse right states "name=weight,..." into dict of state: weight"""
+    weights = {}
+    for item in states.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in RIGHT_STATES:
+            raise ValueError(
+                f'Unknown right state "{name}", allowed values: {", ".join(RIGHT_STATES)}')
+        weights[name] = float(weight) if weight else 1.0
+    return weights
+
+
+def get_picker(rnd, size, skew):
+    """Get function returning random index of range(size)
+
+    With skew > 0 index k is picked with weight 1 / (k + 1) ** skew (Zipf
+    distribution), so that few persons or organizations have most rights.
+    """
+    if not skew:
+        return lambda: rnd.randrange(size)
+    cum_weights = list(itertools.accumulate(1 / (k + 1) ** skew for k in range(size)))
+    indexes = range(size)
+    return lambda: rnd.choices(indexes, cum_weights=cum_weights)[0]
+
+
+def format_copy_value(value):
+    """Format value for COPY text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return str(value)
+
+
+class CopyReader:  # pylint: disable=too-few-public-methods
+    """File-like object that reads generated rows in COPY text format"""
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = b''
+
+    def read(self, size=-1):
+        """Read at least size bytes unless rows are exhausted"""
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        if size < 0 or length < size:
+            for row in self.rows:
+                line = ('\t'.join(format_copy_value(value) for value in row) + '\n').encode(
+                    'utf-8')
+                chunks.append(line)
+                length += len(line)
+                if 0 <= size <= length:
+                    break
+        data = b''.join(chunks)
+        if size < 0:
+            size = len(data)
+        self.buffer = data[size:]
+        return data[:size]
+
+
+class Generator:
+    """Generated rows of rights schema tables
+
+    Person, organization and right type codes are the same as used by
+    other local scripts: P00000000000, O00000000 and RIGHT0. Ids start
+    from 1 in the same order.
+    """
+    def __init__(self, args):
+        self.args = args
+        self.now = datetime.now().replace(microsecond=0)
+        self.start = self.now - timedelta(days=args.history_days)
+        self.counts = dict.fromkeys(RIGHT_STATES, 0)
+
+    def persons(self):
+        """Generate person rows"""
+        for num in range(self.args.persons):
+            yield (
+                num + 1, f'P{num:011d}', f'First{num}', f'Last{num}', self.start, self.start)
+
+    def organizations(self):
+        """Generate organization rows"""
+        for num in range(self.args.organizations):
+            yield (num + 1, f'O{num:08d}', f'Org {num}', self.start, self.start)
+
+    def days(self, rnd, days):
+        """Get random timedelta of up to days"""
+        return timedelta(seconds=round(rnd.uniform(0, days * 86400), 3))
+
+    def validity(self, rnd, state):
+        """Get valid_from, valid_to and time of revoking for right state"""
+        valid_to = None
+        revoked = None
+        if state == 'future':
+            valid_from = self.now + self.days(rnd, self.args.expiration_days)
+        else:
+            valid_from = self.now - self.days(rnd, self.args.history_days)
+        if state == 'expired':
+            valid_to = valid_from + (self.now - valid_from) * rnd.random()
+        elif rnd.random() < self.args.valid_to_share:
+            if state == 'revoked':
+                valid_to = valid_from + self.days(rnd, self.args.history_days)
+            else:
+                valid_to = max(self.now, valid_from) + self.days(
+                    rnd, self.args.expiration_days)
+        if state == 'revoked':
+            revoked = valid_from + (self.now - valid_from) * rnd.random()
+        return valid_from, valid_to, revoked
+
+    def key_picker(self, rnd):
+        """Get function returning random (person, organization, right type) indexes"""
+        pick_person = get_picker(rnd, self.args.persons, self.args.person_skew)
+        pick_organization = get_picker(
+            rnd, self.args.organizations, self.args.organization_skew)
+        return lambda: (pick_person(), pick_organization(), rnd.randrange(self.args.right_types))
+
+    def rights(self):
+        """Generate right rows
+
+        Not revoked rights have unique person, organization and right type
+        as required by check_right trigger. Right that cannot get unique key
+        in MAX_KEY_ATTEMPTS is generated as revoked.
+        """
+        rnd = random.Random(self.args.seed)
+        pick_key = self.key_picker(rnd)
+        weights = parse_states(self.args.states)
+        states = list(weights)
+        cum_weights = list(itertools.accumulate(weights.values()))
+        active = set()
+
+        for num in range(self.args.rights):
+            state = rnd.choices(states, cum_weights=cum_weights)[0]
+            key = pick_key()
+            attempts = 1
+            while state != 'revoked' and key in active:
+                if attempts == MAX_KEY_ATTEMPTS:
+                    state = 'revoked'
+                    break
+                key = pick_key()
+                attempts += 1
+            if state != 'revoked':
+                active.add(key)
+            self.counts[state] += 1
+
+            valid_from, valid_to, revoked = self.validity(rnd, state)
+            created = min(valid_from, self.now - self.days(rnd, self.args.expiration_days))
+            yield (
+                num + 1, key[0] + 1, key[1] + 1, f'RIGHT{key[2]}', valid_from, valid_to,
+                revoked is not None, created, revoked or created)
+
+
+def copy_rows(cur, table, columns, rows):
+    """Load rows into table with COPY"""
+    cur.copy_expert(
+        f'copy rights."{table}" ({", ".join(columns)}) from stdin', CopyReader(rows),
+        size=COPY_SIZE)
+
+
+def load(cur, args, durations):
+    """Load generated data and return counts of right states"""
+    start = time.perf_counter()
+    cur.execute(SQL_TRUNCATE)
+    # Skipping row triggers: stamper would overwrite timestamps, logger and
+    # notify triggers are too slow for bulk load
+    cur.execute('set session_replication_role = replica')
+    generator = Generator(args)
+
+    copy_rows(
+        cur, 'person', ('id', 'code', 'first_name', 'last_name', 'created', 'last_modified'),
+        generator.persons())
+    copy_rows(
+        cur, 'organization', ('id', 'code', 'name', 'created', 'last_modified'),
+        generator.organizations())
+    durations['persons_organizations_s'] = round(time.perf_counter() - start, 3)
+
+    start = time.perf_counter()
+    copy_rows(
+        cur, 'right', (
+            'id', 'person_id', 'organization_id', 'right_type', 'valid_from', 'valid_to',
+            'revoked', 'created', 'last_modified'),
+        generator.rights())
+    durations['rights_s'] = round(time.perf_counter() - start, 3)
+
+    start = time.perf_counter()
+    if not args.no_change_log:
+        cur.execute(SQL_CHANGE_LOG)
+    cur.execute('set session_replication_role = default')
+    for table in ('person', 'organization', 'right'):
+        # Ids were set explicitly, sequences must continue after them
+        cur.execute(
+            f"""
+            select setval(pg_get_serial_sequence('rights."{table}"', 'id'), max(id))
+            from rights."{table}"
+            having max(id) is not null""")
+    durations['change_log_s'] = round(time.perf_counter() - start, 3)
+    return generator.counts
+
+
+def main():
+    """Main function"""
+    parser = db_options.get_parser(__doc__)
+    parser.add_argument(
+        '--truncate', action='store_true',
+        help='required, confirms that existing data is deleted before loading')
+    parser.add_argument('--rights', type=int, default=2000000)
+    parser.add_argument('--persons', type=int, default=200000)
+    parser.add_argument('--organizations', type=int, default=2000)
+    parser.add_argument('--right-types', type=int, default=10)
+    parser.add_argument(
+        '--states', default=DEFAULT_STATES,
+        help=f'weights of right states, default: {DEFAULT_STATES}')
+    parser.add_argument(
+        '--valid-to-share', type=float, default=0.3,
+        help='share of not expired rights that have "valid_to", default 0.3')
+    parser.add_argument(
+        '--person-skew', type=float, default=0,
+        help='Zipf exponent of rights per person, default 0 (uniform)')
+    parser.add_argument(
+        '--organization-skew', type=float, default=1,
+        help='Zipf exponent of rights per organization, default 1')
+    parser.add_argument(
+        '--history-days', type=int, default=3650,
+        help='maximal age of "valid_from" of past rights')
+    parser.add_argument(
+        '--expiration-days', type=int, default=365,
+        help='maximal distance of "valid_to" and future "valid_from"')
+    parser.add_argument(
+        '--no-change-log', action='store_true', help='do not add change_log history')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    if not args.truncate:
+        parser.error(
+            'existing data is deleted before loading, confirm it with --truncate')
+    try:
+        parse_states(args.states)
+    except ValueError as err:
+        parser.error(str(err))
+
+    conf = db_options.load_config(args)
+
+    durations = {}
+    conn = rights.get_db_connection(conf)
+    try:
+        with conn.cursor() as cur:
+            counts = load(cur, args, durations)
+            conn.commit()
+            start = time.perf_counter()
+            conn.autocommit = True
+            for table in ('person', 'organization', 'right', 'change_log'):
+                cur.execute(f'vacuum analyze rights."{table}"')
+            durations['vacuum_analyze_s'] = round(time.perf_counter() - start, 3)
+    finally:
+        conn.close()
+    print(json.dumps({
+        'persons': args.persons, 'organizations': args.organizations, 'rights': counts,
+        'seed': args.seed, 'durations': durations}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+"""Generate load against the service and report latencies per endpoint.
+
+Run against local docker compose service, for example:
+    python3 load_test.py --concurrency 20 --duration 60
+    python3 load_test.py --rate 200 --mix set-right=1,rights=4 --output report.json
+
+Without --rate every worker sends next request after receiving previous
+response (closed loop). With --rate requests are scheduled at constant rate
+regardless of responses (open loop) and latency is measured from scheduled
+time, so that time spent waiting for a free worker is included.
+"""
+
+import argparse
+import http.client
+import json
+import queue
+import random
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_MIX = 'status=1,set-right=4,rights=4,revoke=1,person=1,organization=1'
+REQUEST_PATHS = {
+    'status': '/status',
+    'set-right': '/set-right',
+    'rights': '/rights',
+    'revoke': '/revoke-right',
+    'person': '/person',
+    'organization': '/organization'}
+
+
+def percentile(values, pct):
+    """Get percentile of sorted values"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summarize(results, duration):
+    """Summarize latencies in milliseconds, throughput and response codes"""
+    values = sorted(latency * 1000 for latency, _ in results)
+    codes = {}
+    for _, code in results:
+        codes[code] = codes.get(code, 0) + 1
+    summary = {
+        'count': len(values), 'throughput_rps': round(len(values) / duration, 2),
+        'codes': dict(sorted(codes.items()))}
+    if values:
+        summary.update({
+            'mean_ms': round(statistics.mean(values), 3),
+            'p50_ms': round(percentile(values, 50), 3),
+            'p95_ms': round(percentile(values, 95), 3),
+            'p99_ms': round(percentile(values, 99), 3),
+            'max_ms': round(values[-1], 3)})
+    return summary
+
+
+def parse_mix(mix):
+    """Parse request mix "name=weight,..." into dict of request name: weight"""
+    weights = {}
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in REQUEST_PATHS:
+            raise ValueError(
+                f'Unknown request "{name}", allowed values: {", ".join(REQUEST_PATHS)}')
+        weights[name] = float(weight) if weight else 1.0
+    return weights
+
+
+class RequestFactory:
+    """Random requests of the mix over persons, organizations and right types"""
+    def __init__(self, args, seed):
+        self.args = args
+        self.rnd = random.Random(seed)
+        weights = parse_mix(args.mix)
+        self.names = list(weights)
+        self.weights = list(weights.values())
+
+    def person(self):
+        """Get random person"""
+        num = self.rnd.randrange(self.args.persons)
+        return {'code': f'P{num:011d}', 'first_name': f'First{num}', 'last_name': f'Last{num}'}
+
+    def organization(self):
+        """Get random organization"""
+        num = self.rnd.randrange(self.args.organizations)
+        return {'code': f'O{num:08d}', 'name': f'Org {num}'}
+
+    def right_type(self):
+        """Get random right type"""
+        return f'RIGHT{self.rnd.randrange(self.args.right_types)}'
+
+    def make_request(self):
+        """Get tuple of request name and JSON body (None for GET request)"""
+        name = self.rnd.choices(self.names, self.weights)[0]
+        body = None
+        if name == 'set-right':
+            body = {
+                'person': self.person(), 'organization': self.organization(),
+                'right': {'right_type': self.right_type()}}
+        elif name == 'rights':
+            if self.rnd.random() < 0.5:
+                body = {'persons': [self.person()['code']]}
+            else:
+                body = {'organizations': [self.organization()['code']]}
+            body.update({'only_valid': False, 'limit': self.args.search_limit})
+        elif name == 'revoke':
+            body = {
+                'person_code': self.person()['code'],
+                'organization_code': self.organization()['code'],
+                'right_type': self.right_type()}
+        elif name == 'person':
+            body = self.person()
+        elif name == 'organization':
+            body = self.organization()
+        return name, body
+
+
+class Client:
+    """HTTP client with persistent connection of a single worker"""
+    def __init__(self, args):
+        url = urlsplit(args.url)
+        if url.scheme == 'https':
+            self.conn = http.client.HTTPSConnection(url.netloc, timeout=args.timeout)
+        else:
+            self.conn = http.client.HTTPConnection(url.netloc, timeout=args.timeout)
+        self.prefix = url.path.rstrip('/')
+        self.headers = {'X-Ssl-Client-S-Dn': args.client_dn}
+
+    def send(self, name, body):
+        """Send request and return response code as "<HTTP status> <service code>"""
+        try:
+            if body is None:
+                self.conn.request(
+                    'GET', self.prefix + REQUEST_PATHS[name], headers=self.headers)
+            else:
+                self.conn.request(
+                    'POST', self.prefix + REQUEST_PATHS[name], body=json.dumps(body),
+                    headers=dict(self.headers, **{'Content-Type': 'application/json'}))
+            response = self.conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException) as err:
+            # Connection is opened again by next request
+            self.conn.close()
+            return f'ERROR {type(err).__name__}'
+        try:
+            code = json.loads(data).get('code')
+        except (ValueError, AttributeError):
+            code = None
+        return f'{response.status} {code}' if code else str(response.status)
+
+    def close(self):
+        """Close connection"""
+        self.conn.close()
+
+
+class LoadTest:
+    """Load test run with results of every request
+
+    Results are collected as request name: list of (latency, response code).
+    """
+    def __init__(self, args):
+        self.args = args
+        self.results = {name: [] for name in parse_mix(args.mix)}
+        self.lock = threading.Lock()
+        self.not_sent = 0
+        self.deadline = None
+
+    def record(self, name, latency, code):
+        """Store result of request"""
+        with self.lock:
+            self.results[name].append((latency, code))
+
+    def closed_loop_worker(self, num):
+        """Send next request after receiving response until deadline"""
+        factory = RequestFactory(self.args, self.args.seed + num)
+        client = Client(self.args)
+        while time.monotonic() < self.deadline:
+            name, body = factory.make_request()
+            start = time.perf_counter()
+            code = client.send(name, body)
+            self.record(name, time.perf_counter() - start, code)
+        client.close()
+
+    def open_loop_worker(self, requests):
+        """Send scheduled requests, requests left after deadline are not sent"""
+        client = Client(self.args)
+        while True:
+            item = requests.get()
+            if item is None:
+                break
+            scheduled, name, body = item
+            if time.monotonic() >= self.deadline:
+                with self.lock:
+                    self.not_sent += 1
+                continue
+            # Latency includes waiting for a free worker
+            code = client.send(name, body)
+            self.record(name, time.monotonic() - scheduled, code)
+        client.close()
+
+    def schedule(self, requests):
+        """Put requests into queue at constant rate until deadline"""
+        factory = RequestFactory(self.args, self.args.seed)
+        start = time.monotonic()
+        num = 0
+        while True:
+            scheduled = start + num / self.args.rate
+            if scheduled >= self.deadline:
+                break
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            requests.put((scheduled,) + factory.make_request())
+            num += 1
+        for _ in range(self.args.concurrency):
+            requests.put(None)
+
+    def run(self):
+        """Run load test and return its duration in seconds"""
+        start = time.monotonic()
+        self.deadline = start + self.args.duration
+        if self.args.rate:
+            requests = queue.SimpleQueue()
+            threads = [
+                threading.Thread(target=self.open_loop_worker, args=(requests,))
+                for _ in range(self.args.concurrency)]
+            threads.append(threading.Thread(target=self.schedule, args=(requests,)))
+        else:
+            threads = [
+                threading.Thread(target=self.closed_loop_worker, args=(num,))
+                for num in range(self.args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.monotonic() - start
+
+    def report(self, duration):
+        """Get report of load test"""
+        all_results = [result for results in self.results.values() for result in results]
+        report = {
+            'url': self.args.url, 'mode': 'open' if self.args.rate else 'closed',
+            'concurrency': self.args.concurrency, 'rate_rps': self.args.rate,
+            'duration_s': round(duration, 3), 'persons': self.args.persons,
+            'organizations': self.args.organizations, 'right_types': self.args.right_types,
+            'total': summarize(all_results, duration),
+            'endpoints': {
+                name: summarize(results, duration) for name, results in self.results.items()}}
+        if self.args.rate:
+            report['not_sent'] = self.not_sent
+        return report
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', maxsplit=1)[0])
+    parser.add_argument('--url', default='http://localhost:5080')
+    parser.add_argument('--client-dn', default='OU=XTSS,O=RIA,C=EE')
+    parser.add_argument('--concurrency', type=int, default=20, help='number of workers')
+    parser.add_argument('--duration', type=float, default=30, help='duration in seconds')
+    parser.add_argument(
+        '--rate', type=float, help='requests per second, enables open loop mode')
+    parser.add_argument(
+        '--mix', default=DEFAULT_MIX, help=f'request weights, default: {DEFAULT_MIX}')
+    parser.add_argument('--persons', type=int, default=1000)
+    parser.add_argument('--organizations', type=int, default=50)
+    parser.add_argument('--right-types', type=int, default=5)
+    parser.add_argument('--search-limit', type=int, default=10)
+    parser.add_argument('--timeout', type=float, default=30, help='request timeout in seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write report to JSON file instead of stdout')
+    args = parser.parse_args()
+    try:
+        parse_mix(args.mix)
+    except ValueError as err:
+        parser.error(str(err))
+
+    load_test = LoadTest(args)
+    report = load_test.report(load_test.run())
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+            file.write('\n')
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+# pylint: disable=too-many-lines
 
 """This is a module for Rights storage API.
 
@@ -13,34 +14,167 @@ This module allows:
 
 __version__ = '1.2.0'
 
-from datetime import datetime
+import abc
+import atexit
+import base64
+from collections import OrderedDict
+from contextlib import contextmanager
+import contextvars
+from datetime import datetime, timedelta
+import functools
+import importlib
+import json
 import logging
 import logging.config
+import logging.handlers
 import os
+import queue
+import random
+import select
+import socket
+import threading
+import time
 import uuid
-from flask import Flask, request, jsonify
+from flask import Flask, Response, current_app, g, request, jsonify
 from flask_restful import Api, Resource
+import prometheus_client
+import prometheus_client.multiprocess
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
 import yaml
 
+try:
+    import orjson
+except ImportError:
+    orjson = None  # pylint: disable=invalid-name
+
 LOGGER = logging.getLogger(__name__)
 DEFAULT_CONFIG_FILE = 'config.yaml'
 SAVE_PATH_DIR_MODE = 0o700
 FILE_UMASK = 0o137
 LOG_BUFFER = 100
+# Maximal value of bigint id column
+MAX_RIGHT_ID = 2 ** 63 - 1
 
 DEFAULT_ONLY_VALID = True
 DEFAULT_LIMIT = 100
 DEFAULT_OFFSET = 0
+DEFAULT_COUNT = 'exact'
 DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_POOL_MIN_SIZE = 1
+DEFAULT_POOL_MAX_SIZE = 10
+DEFAULT_POOL_IDLE_TIMEOUT = 300
+DEFAULT_POOL_MAX_LIFETIME = 3600
+DEFAULT_POOL_TIMEOUT = 5
+DEFAULT_BULK_MAX_ITEMS = 10000
+DEFAULT_STREAM_FETCH_SIZE = 1000
+DEFAULT_EXPORT_CHUNK_SIZE = 65536
+DEFAULT_EXPORT_FORMAT = 'csv'
+# Maximum number of export chunks waiting to be sent to client
+EXPORT_QUEUE_SIZE = 16
+DEFAULT_SEARCH_CACHE_SIZE = 0
+DEFAULT_SEARCH_CACHE_TTL = 300
+DEFAULT_ID_CACHE_SIZE = 0
+DEFAULT_STATUS_CACHE_TTL = 5
+DEFAULT_REPLICA_MAX_LAG = 10
+DEFAULT_REPLICA_CHECK_INTERVAL = 5
+DEFAULT_REPLICA_MAX_SILENCE = 60
+DEFAULT_LOG_QUEUE_SIZE = 0
+DEFAULT_LOG_MAX_ITEMS = 100
+DEFAULT_SLOW_QUERY_EXPLAIN_INTERVAL = 60
+# Statement timeout in seconds of EXPLAIN ANALYZE of slow statements
+SLOW_QUERY_EXPLAIN_TIMEOUT = 30
+DEFAULT_TRACING_SERVICE_NAME = 'xtss-rights'
+DEFAULT_TRACING_SAMPLE_RATE = 1.0
+DEFAULT_TRACING_UDP_HOST = 'localhost'
+DEFAULT_TRACING_UDP_PORT = 9411
+# Channel of notifications sent by database triggers when rights data changes
+CHANGE_CHANNEL = 'rights_changed'
+# Seconds between liveness checks of idle change listener connection
+LISTENER_CHECK_INTERVAL = 30
+# Seconds to wait before reconnecting change listener
+LISTENER_RETRY_INTERVAL = 5
+NDJSON_MIMETYPE = 'application/x-ndjson'
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'ndjson': NDJSON_MIMETYPE}
 TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
 TIME_FORMAT_SEC = '%Y-%m-%dT%H:%M:%S'
 TIME_FORMAT_DB = '%Y-%m-%d %H:%M:%S'
+# PostgreSQL to_char format that produces the same text as TIME_FORMAT
+TIME_FORMAT_SQL = 'YYYY-MM-DD"T"HH24:MI:SS.US'
+
+# Modes of calculating total number of found rights
+COUNT_MODES = ('exact', 'window', 'estimate', 'none')
+
+# Keys of bulk revoke selectors, at least one of person and organization codes is required
+REVOKE_SELECTOR_KEYS = ('person_code', 'organization_code', 'right_type')
 
 DB_ERROR_MSG = 'Unclassified database error'
 INCOMING_REQUEST_MSG = 'Incoming request'
 CLIENT_DN_MSG = 'Client DN'
 
+# Database connection pool of current worker process, created by create_app
+DB_POOL = None
+
+# Read-only replicas of current worker process, created by create_app if configured
+REPLICAS = None
+
+# Change listener and caches of current worker process, created by create_app
+CHANGE_LISTENER = None
+SEARCH_CACHE = None
+ID_CACHE = None
+
+# Handler of asynchronous logging of current worker process, created by configure_app
+LOG_QUEUE_HANDLER = None
+
+# Maximum number of logged list items, set by configure_app
+LOG_MAX_ITEMS = 0
+
+# Slow statement log of current worker process, created by create_app if configured
+SLOW_QUERY_LOG = None
+
+# Log header and search filters of the request that executes SQL statements
+SQL_CONTEXT = contextvars.ContextVar('sql_context', default=('', None))
+
+# Tracer of current worker process, created by create_app if configured
+TRACER = None
+
+# Finished spans and current span of traced request
+TRACE_CONTEXT = contextvars.ContextVar('trace_context', default=None)
+
+# Phase durations of current request for Server-Timing header, None if not collected
+SERVER_TIMING = contextvars.ContextVar('server_timing', default=None)
+
+# Server-Timing phases of statements, other statements belong to "db-query"
+SERVER_TIMING_STATEMENTS = {'count_rights': 'db-count', 'estimate_rights': 'db-count'}
+
+# Cached readiness and deep readiness check results of current worker process
+READY_STATUS = {'expires': 0.0, 'response': None}
+DEEP_STATUS = {'expires': 0.0, 'response': None}
+READY_STATUS_LOCK = threading.Lock()
+
+# Prometheus metrics, shared by workers when PROMETHEUS_MULTIPROC_DIR is set
+REQUEST_DURATION = prometheus_client.Histogram(
+    'rights_request_duration_seconds', 'Time of processing API requests',
+    ['resource', 'code'])
+DB_CONNECT_DURATION = prometheus_client.Histogram(
+    'rights_db_connect_duration_seconds', 'Time of opening database connections')
+DB_QUERY_DURATION = prometheus_client.Histogram(
+    'rights_db_query_duration_seconds', 'Time of executing database statements',
+    ['statement'])
+JSON_DURATION = prometheus_client.Histogram(
+    'rights_json_serialization_duration_seconds', 'Time of serializing JSON responses')
+POOL_CONNECTIONS = prometheus_client.Gauge(
+    'rights_db_pool_connections', 'Connections of database connection pools',
+    ['pool', 'state'], multiprocess_mode='livesum')
+POOL_MAX_SIZE = prometheus_client.Gauge(
+    'rights_db_pool_max_size', 'Maximum number of connections of database connection pools',
+    ['pool'], multiprocess_mode='livesum')
+POOL_WAITS = prometheus_client.Counter(
+    'rights_db_pool_waits', 'Checkouts that waited for a free connection', ['pool'])
+POOL_TIMEOUTS = prometheus_client.Counter(
+    'rights_db_pool_timeouts', 'Checkouts that failed after pool timeout', ['pool'])
+
 
 def load_config(config_file):
     """Load configuration from YAML file"""
@@ -85,11 +219,232 @@ def configure_app(config_file):
             'from "%s" configuration file', config_file)
         LOGGER.removeHandler(console_handler)
 
+    global LOG_MAX_ITEMS  # pylint: disable=global-statement
+    LOG_MAX_ITEMS = config.get('log_max_items', DEFAULT_LOG_MAX_ITEMS)
+
+    log_queue_size = config.get('log_queue_size', DEFAULT_LOG_QUEUE_SIZE)
+    if log_queue_size:
+        init_log_queue(log_queue_size)
+
     return config
 
 
-def get_db_connection(conf):
-    """Get connection object for Central Server database"""
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """Logging handler that puts records to a bounded queue
+
+    Records are formatted and written by QueueListener thread. When the
+    queue is full, records are dropped and their number is logged later.
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.reported = 0
+
+    def prepare(self, record):
+        # Formatting is left to listener thread, logged arguments are not modified afterwards
+        return record
+
+    def enqueue(self, record):
+        # Called under handler lock
+        try:
+            if self.dropped > self.reported:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': LOGGER.name, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': 'Dropped %s log records because log queue was full',
+                    'args': (self.dropped - self.reported,)}))
+                self.reported = self.dropped
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self):
+        """Get log queue statistics"""
+        return {
+            'queued': self.queue.qsize(), 'max_size': self.queue.maxsize,
+            'dropped': self.dropped}
+
+
+def init_log_queue(size):
+    """Move handlers of logger to a background thread"""
+    global LOG_QUEUE_HANDLER  # pylint: disable=global-statement
+    handlers = LOGGER.handlers[:]
+    LOG_QUEUE_HANDLER = LogQueueHandler(queue.Queue(size))
+    listener = logging.handlers.QueueListener(
+        LOG_QUEUE_HANDLER.queue, *handlers, respect_handler_level=True)
+    for handler in handlers:
+        LOGGER.removeHandler(handler)
+    LOGGER.addHandler(LOG_QUEUE_HANDLER)
+    listener.start()
+    # Writing queued records before exit
+    atexit.register(listener.stop)
+
+
+def summarize_log_data(data):
+    """Shorten long lists of logged data
+
+    Lists longer than LOG_MAX_ITEMS are replaced by their first items and the
+    number of omitted items. Data is returned unchanged if nothing is omitted.
+    """
+    if not LOG_MAX_ITEMS:
+        return data
+    if isinstance(data, list):
+        items = [summarize_log_data(item) for item in data[:LOG_MAX_ITEMS]]
+        if len(data) > LOG_MAX_ITEMS:
+            items.append(f'... {len(data) - LOG_MAX_ITEMS} more items')
+        elif all(item is orig for item, orig in zip(items, data)):
+            return data
+        return items
+    if isinstance(data, dict):
+        items = {key: summarize_log_data(value) for key, value in data.items()}
+        if all(items[key] is value for key, value in data.items()):
+            return data
+        return items
+    return data
+
+
+def new_span(trace_id, parent_id, name):
+    """Create span in Zipkin v2 format, duration is set when span ends"""
+    span = {
+        'traceId': trace_id, 'id': os.urandom(8).hex(), 'name': name,
+        'timestamp': time.time_ns() // 1000}
+    if parent_id:
+        span['parentId'] = parent_id
+    return span
+
+
+@contextmanager
+def trace_span(name):
+    """Record child span of current span, does nothing if request is not traced"""
+    context = TRACE_CONTEXT.get()
+    if context is None:
+        yield
+        return
+    spans, parent = context
+    span = new_span(parent['traceId'], parent['id'], name)
+    token = TRACE_CONTEXT.set((spans, span))
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        span['duration'] = max((time.perf_counter_ns() - start) // 1000, 1)
+        TRACE_CONTEXT.reset(token)
+        spans.append(span)
+
+
+def traced(name):
+    """Decorator that records span of each function call"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with trace_span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class FileSpanExporter:  # pylint: disable=too-few-public-methods
+    """Span exporter that appends spans of each request as a JSON line to file"""
+    def __init__(self, conf):
+        self.path = conf['tracing_file']
+        self.lock = threading.Lock()
+
+    def export(self, spans):
+        """Write spans to file"""
+        data = dumps_json(spans) + b'\n'
+        with self.lock:
+            with open(self.path, 'ab') as file:
+                file.write(data)
+
+
+class UdpSpanExporter:  # pylint: disable=too-few-public-methods
+    """Span exporter that sends spans of each request as a JSON datagram"""
+    def __init__(self, conf):
+        self.address = (
+            conf.get('tracing_udp_host', DEFAULT_TRACING_UDP_HOST),
+            conf.get('tracing_udp_port', DEFAULT_TRACING_UDP_PORT))
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def export(self, spans):
+        """Send spans to UDP address"""
+        self.sock.sendto(dumps_json(spans), self.address)
+
+
+def get_span_exporter(conf):
+    """Create span exporter using "tracing_exporter" configuration parameter
+
+    Parameter is "file", "udp" or full name of exporter class. Exporter class
+    is created with configuration as an argument and must have method
+    export(spans) that receives list of spans in Zipkin v2 format.
+    """
+    name = conf['tracing_exporter']
+    if name == 'file':
+        return FileSpanExporter(conf)
+    if name == 'udp':
+        return UdpSpanExporter(conf)
+    module_name, _, class_name = name.rpartition('.')
+    return getattr(importlib.import_module(module_name), class_name)(conf)
+
+
+class Tracer:
+    """Starts traces of requests and exports their spans"""
+    def __init__(self, conf):
+        self.service_name = conf.get('tracing_service_name', DEFAULT_TRACING_SERVICE_NAME)
+        self.sample_rate = conf.get('tracing_sample_rate', DEFAULT_TRACING_SAMPLE_RATE)
+        self.exporter = get_span_exporter(conf)
+
+    def start(self, name, headers):
+        """Create server span of request using incoming B3 headers
+
+        Returns None if request is not sampled. Sampling decision of caller is
+        followed, requests without it are sampled using "tracing_sample_rate".
+        """
+        sampled = '1' if headers.get('X-B3-Flags') == '1' else headers.get('X-B3-Sampled')
+        if sampled is None:
+            sampled = '1' if random.random() < self.sample_rate else '0'
+        if sampled not in ('1', 'true'):
+            return None
+        span = new_span(
+            headers.get('X-B3-TraceId') or os.urandom(16).hex(), headers.get('X-B3-SpanId'),
+            name)
+        span['kind'] = 'SERVER'
+        return span
+
+    def export(self, spans):
+        """Export spans of request, export errors are only logged"""
+        for span in spans:
+            span['localEndpoint'] = {'serviceName': self.service_name}
+        try:
+            self.exporter.export(spans)
+        except Exception as err:  # pylint: disable=broad-exception-caught
+            LOGGER.warning('Cannot export trace spans: %s', err)
+
+
+def add_server_timing(name, duration):
+    """Add duration in seconds to phase of Server-Timing header if it is collected"""
+    timings = SERVER_TIMING.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + duration
+
+
+def format_server_timing(timings):
+    """Format Server-Timing header value, durations are in milliseconds"""
+    return ', '.join(f'{name};dur={duration * 1000:.1f}' for name, duration in timings.items())
+
+
+def init_tracing(conf):
+    """Create tracer for current worker process if configured"""
+    global TRACER  # pylint: disable=global-statement
+    TRACER = None
+    if conf.get('tracing_exporter'):
+        TRACER = Tracer(conf)
+    return TRACER
+
+
+def get_db_dsn(conf, replica_host=None):
+    """Get connection string of Central Server database
+
+    Primary database is used unless replica_host is set.
+    """
     connect_timeout = DEFAULT_CONNECT_TIMEOUT
     if 'db_connect_timeout' in conf:
         connect_timeout = conf['db_connect_timeout']
@@ -104,125 +459,1229 @@ def get_db_connection(conf):
         optional_config += f"sslcert={conf['db_ssl_cert']} "
     if 'db_ssl_key' in conf:
         optional_config += f"sslkey={conf['db_ssl_key']} "
-    return psycopg2.connect(
-        f"host={conf['db_host']} port={conf['db_port']} dbname={conf['db_db']} "
+    host = conf['db_host']
+    target_session_attrs = 'read-write'
+    if replica_host is not None:
+        host = replica_host
+        target_session_attrs = 'any'
+    return (
+        f"host={host} port={conf['db_port']} dbname={conf['db_db']} "
         f"user={conf['db_user']} {optional_config}"
-        f"connect_timeout={connect_timeout} target_session_attrs=read-write"
+        f"connect_timeout={connect_timeout} target_session_attrs={target_session_attrs}"
     )
 
 
-def get_person(cur, code):
-    """Get person data from db"""
-    cur.execute("""
+def get_db_connection(conf, replica_host=None):
+    """Get connection object for Central Server database
+
+    Connection to primary database is opened unless replica_host is set.
+    """
+    with DB_CONNECT_DURATION.time():
+        return psycopg2.connect(get_db_dsn(conf, replica_host))
+
+
+def execute_sql(cur, statement, *args):
+    """Execute SQL with cursor and record duration of statement
+
+    Statements slower than "slow_query_threshold" are logged.
+    """
+    start = time.perf_counter()
+    try:
+        with trace_span(f'sql {statement}'):
+            cur.execute(*args)
+    finally:
+        duration = time.perf_counter() - start
+        DB_QUERY_DURATION.labels(statement).observe(duration)
+        add_server_timing(SERVER_TIMING_STATEMENTS.get(statement, 'db-query'), duration)
+    if SLOW_QUERY_LOG is not None and duration > SLOW_QUERY_LOG.threshold:
+        SLOW_QUERY_LOG.log(cur, statement, args, duration)
+
+
+@traced('commit')
+def commit(conn):
+    """Commit transaction of connection"""
+    conn.commit()
+
+
+class SlowQueryLog:
+    """Log of statements that exceed configured duration
+
+    Plans of slow SELECT statements are optionally captured with EXPLAIN
+    ANALYZE in a background thread, at most once per explain interval in
+    each worker.
+    """
+    def __init__(self, conf):
+        self.conf = conf
+        self.threshold = conf['slow_query_threshold']
+        self.explain = conf.get('slow_query_explain', False)
+        self.explain_interval = conf.get(
+            'slow_query_explain_interval', DEFAULT_SLOW_QUERY_EXPLAIN_INTERVAL)
+        self.lock = threading.Lock()
+        self.next_explain = 0.0
+
+    def log(self, cur, statement, args, duration):
+        """Log slow statement and start capturing its plan if allowed"""
+        log_header, kwargs = SQL_CONTEXT.get()
+        LOGGER.warning(
+            '%sSlow SQL statement %s: duration %.3f s, rows %s, filters: %s, params: %s',
+            log_header, statement, duration, cur.rowcount, summarize_log_data(kwargs),
+            summarize_log_data(args[1] if len(args) > 1 else None))
+        if self.explain and args[0].lstrip()[:6].lower() == 'select' \
+                and self.reserve_explain():
+            threading.Thread(
+                target=self.log_plan, name='slow-query-explain',
+                args=(log_header, statement, cur.mogrify(*args).decode('utf-8')),
+                daemon=True).start()
+
+    def reserve_explain(self):
+        """Check if explain interval has passed and start a new interval"""
+        with self.lock:
+            now = time.monotonic()
+            if now < self.next_explain:
+                return False
+            self.next_explain = now + self.explain_interval
+            return True
+
+    def log_plan(self, log_header, statement, sql):
+        """Run EXPLAIN ANALYZE of statement and log the plan"""
+        try:
+            with db_read_connection(self.conf) as conn:
+                with conn.cursor() as cur:
+                    # Statement is executed again, read-only transaction prevents changes
+                    cur.execute('set transaction read only')
+                    cur.execute(
+                        f'set local statement_timeout = {SLOW_QUERY_EXPLAIN_TIMEOUT * 1000}')
+                    cur.execute(f'explain (analyze, buffers) {sql}')
+                    plan = '\n'.join(row[0] for row in cur.fetchall())
+        except psycopg2.Error as err:
+            LOGGER.warning(
+                '%sCannot get plan of slow SQL statement %s: %s', log_header, statement, err)
+            return
+        LOGGER.warning('%sPlan of slow SQL statement %s:\n%s', log_header, statement, plan)
+
+
+def init_slow_query_log(conf):
+    """Create slow statement log for current worker process if configured"""
+    global SLOW_QUERY_LOG  # pylint: disable=global-statement
+    SLOW_QUERY_LOG = None
+    if conf.get('slow_query_threshold'):
+        SLOW_QUERY_LOG = SlowQueryLog(conf)
+    return SLOW_QUERY_LOG
+
+
+class ConnectionPool:
+    """Thread-safe pool of database connections
+
+    Pool belongs to a single worker process and opens connections lazily.
+    Connections are rolled back when returned to the pool and closed when
+    they exceed idle timeout or maximum lifetime.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, conf, replica_host=None):
+        self.conf = conf
+        self.replica_host = replica_host
+        self.min_size = conf.get('db_pool_min_size', DEFAULT_POOL_MIN_SIZE)
+        self.max_size = conf.get('db_pool_max_size', DEFAULT_POOL_MAX_SIZE)
+        self.idle_timeout = conf.get('db_pool_idle_timeout', DEFAULT_POOL_IDLE_TIMEOUT)
+        self.max_lifetime = conf.get('db_pool_max_lifetime', DEFAULT_POOL_MAX_LIFETIME)
+        self.timeout = conf.get('db_pool_timeout', DEFAULT_POOL_TIMEOUT)
+        self.lock = threading.Condition()
+        self.pid = os.getpid()
+        # Idle connections as (connection, returned time) pairs, most recently used last
+        self.idle = []
+        # Creation time of every open connection
+        self.created = {}
+        self.in_use = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+        self.opened = 0
+        self.closed = 0
+        # Label of pool metrics
+        self.name = replica_host or 'primary'
+        POOL_MAX_SIZE.labels(self.name).set(self.max_size)
+
+    def update_metrics(self):
+        """Update connection gauges, called under pool lock"""
+        POOL_CONNECTIONS.labels(self.name, 'in_use').set(self.in_use)
+        POOL_CONNECTIONS.labels(self.name, 'idle').set(len(self.idle))
+
+    def check_pid(self):
+        """Forget connections inherited from parent process after fork"""
+        if self.pid != os.getpid():
+            # Closing inherited connections would terminate parent sessions
+            self.pid = os.getpid()
+            self.idle = []
+            self.created = {}
+            self.in_use = 0
+
+    def discard(self, conn):
+        """Close connection and forget it"""
+        self.created.pop(conn, None)
+        self.closed += 1
+        try:
+            conn.close()
+        except psycopg2.Error as err:
+            LOGGER.warning('Cannot close pooled database connection: %s', err)
+
+    def expired(self, conn, now):
+        """Check if connection exceeded its maximum lifetime"""
+        return now - self.created.get(conn, now) > self.max_lifetime
+
+    def prune(self, now):
+        """Close idle connections above minimum pool size that exceeded idle timeout"""
+        while self.idle and len(self.idle) + self.in_use > self.min_size \
+                and now - self.idle[0][1] > self.idle_timeout:
+            self.discard(self.idle.pop(0)[0])
+
+    def pop_idle(self, now):
+        """Get usable idle connection or None"""
+        while self.idle:
+            conn = self.idle.pop()[0]
+            if conn.closed or self.expired(conn, now):
+                self.discard(conn)
+                continue
+            return conn
+        return None
+
+    @traced('pool_checkout')
+    def getconn(self):
+        """Check out connection from pool, opening a new one if pool is not full
+
+        Raises psycopg2.pool.PoolError when no connection becomes available
+        during checkout timeout.
+        """
+        start = time.monotonic()
+        waited = False
+        with self.lock:
+            self.check_pid()
+            self.prune(start)
+            while True:
+                conn = self.pop_idle(time.monotonic())
+                if conn is not None or self.in_use < self.max_size:
+                    # Reserving a slot also for a connection that is opened below
+                    self.in_use += 1
+                    break
+                remaining = start + self.timeout - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    POOL_TIMEOUTS.labels(self.name).inc()
+                    self.wait_time += time.monotonic() - start
+                    raise psycopg2.pool.PoolError('Connection pool exhausted')
+                if not waited:
+                    self.waits += 1
+                    POOL_WAITS.labels(self.name).inc()
+                    waited = True
+                self.lock.wait(remaining)
+            if waited:
+                self.wait_time += time.monotonic() - start
+            self.update_metrics()
+
+        if conn is None:
+            try:
+                conn = get_db_connection(self.conf, self.replica_host)
+            except BaseException:
+                with self.lock:
+                    self.in_use -= 1
+                    self.lock.notify()
+                raise
+            with self.lock:
+                self.created[conn] = time.monotonic()
+                self.opened += 1
+        add_server_timing('db-connect', time.monotonic() - start)
+        return conn
+
+    def putconn(self, conn):
+        """Reset connection and return it to pool"""
+        discard = bool(conn.closed)
+        if not discard:
+            try:
+                # Rollback is a no-op without a network round trip for idle connections
+                conn.rollback()
+                conn.autocommit = False
+                discard = conn.info.transaction_status \
+                    != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+            except psycopg2.Error:
+                discard = True
+
+        with self.lock:
+            now = time.monotonic()
+            if self.pid != os.getpid():
+                # Connection was checked out before fork, do not touch it
+                return
+            self.in_use -= 1
+            if discard or self.expired(conn, now):
+                self.discard(conn)
+            else:
+                self.idle.append((conn, now))
+            self.prune(now)
+            self.update_metrics()
+            self.lock.notify()
+
+    @contextmanager
+    def connection(self):
+        """Context manager that checks out connection and returns it to pool"""
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        """Close all idle connections"""
+        with self.lock:
+            self.check_pid()
+            while self.idle:
+                self.discard(self.idle.pop()[0])
+            self.update_metrics()
+
+    def stats(self):
+        """Get pool statistics"""
+        with self.lock:
+            self.check_pid()
+            return {
+                'size': self.in_use + len(self.idle), 'in_use': self.in_use,
+                'idle': len(self.idle), 'min_size': self.min_size, 'max_size': self.max_size,
+                'waits': self.waits, 'wait_time': round(self.wait_time, 6),
+                'timeouts': self.timeouts, 'opened': self.opened, 'closed': self.closed}
+
+
+def init_db_pool(conf):
+    """Create database connection pool for current worker process"""
+    global DB_POOL  # pylint: disable=global-statement
+    DB_POOL = ConnectionPool(conf)
+    return DB_POOL
+
+
+@contextmanager
+def db_connection(conf):
+    """Get database connection from worker pool
+
+    Dedicated connection is opened and closed when pool is not initialized.
+    """
+    if DB_POOL is None:
+        start = time.perf_counter()
+        conn = get_db_connection(conf)
+        add_server_timing('db-connect', time.perf_counter() - start)
+        try:
+            yield conn
+        finally:
+            conn.close()
+    else:
+        with DB_POOL.connection() as conn:
+            yield conn
+
+
+SQL_CHECK_REPLICA = """
+                        select pg_is_in_recovery(),
+                            case
+                                when not pg_is_in_recovery()
+                                    or pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+                                    then 0
+                                else extract(epoch from now() - pg_last_xact_replay_timestamp())
+                                end,
+                            r.pid is not null, r.status,
+                            extract(epoch from now() - r.last_msg_receipt_time)
+                        from (select 1) s
+                        left join pg_stat_wal_receiver r on true"""
+
+
+class ReplicaSet:
+    """Read-only database replicas of a single worker process
+
+    Monitor thread checks replicas every "db_replica_check_interval" seconds
+    using their connection pools. Replica is healthy if the check succeeds and
+    its replication lag does not exceed "db_replica_max_lag" seconds. Reads
+    are distributed between healthy replicas in turns.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, conf):
+        self.max_lag = conf.get('db_replica_max_lag', DEFAULT_REPLICA_MAX_LAG)
+        self.check_interval = conf.get(
+            'db_replica_check_interval', DEFAULT_REPLICA_CHECK_INTERVAL)
+        self.max_silence = conf.get('db_replica_max_silence', DEFAULT_REPLICA_MAX_SILENCE)
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.pools = {host: ConnectionPool(conf, host) for host in conf['db_replica_hosts']}
+        # Replica state as host: (healthy, replication lag in seconds or None)
+        self.state = {host: (False, None) for host in self.pools}
+        self.turn = 0
+        self.thread = None
+
+    def get_pool(self):
+        """Get pool of next healthy replica or None, start monitor thread if it is not running"""
+        with self.lock:
+            if self.pid != os.getpid():
+                # Monitor thread of parent process does not exist after fork
+                self.pid = os.getpid()
+                self.thread = None
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name='replica-monitor', daemon=True)
+                self.thread.start()
+            healthy = [host for host, state in self.state.items() if state[0]]
+            if not healthy:
+                return None
+            self.turn += 1
+            return self.pools[healthy[self.turn % len(healthy)]]
+
+    def set_state(self, host, healthy, lag, reason=None):
+        """Set replica state, log changes of health"""
+        with self.lock:
+            was_healthy = self.state[host][0]
+            self.state[host] = (healthy, lag)
+        if healthy and not was_healthy:
+            LOGGER.info('Replica %s is healthy, replication lag: %s', host, lag)
+        elif was_healthy and not healthy:
+            LOGGER.warning('Replica %s is unhealthy: %s', host, reason)
+
+    def check_replica(self, host):
+        """Check replica and update its state
+
+        Replica that has replayed all received WAL has no lag even if primary
+        has been idle since the last replayed transaction, but only while its
+        WAL receiver is connected to primary.
+        """
+        try:
+            with self.pools[host].connection() as conn:
+                with conn.cursor() as cur:
+                    execute_sql(cur, 'check_replica', SQL_CHECK_REPLICA)
+                    lag, reason = self.get_replica_lag(cur.fetchone())
+        except psycopg2.Error as err:
+            self.set_state(host, False, None, str(err).strip())
+            return
+        self.set_state(host, reason is None, lag, reason)
+
+    def get_replica_lag(self, rec):
+        """Get replication lag and reason why replica is unhealthy (None if healthy)
+
+        Record contains: recovery flag, replication lag, WAL receiver flag,
+        WAL receiver status and seconds since the last message from primary.
+        Receiver status and last message time are NULL unless database user
+        has privileges of pg_read_all_stats role.
+        """
+        in_recovery, lag, receiver, status, silence = rec
+        if lag is not None:
+            lag = max(0.0, float(lag))
+        if in_recovery:
+            # Replayed everything received is not up to date when nothing is received
+            if not receiver:
+                return lag, 'WAL receiver is not running'
+            if status is not None and status != 'streaming':
+                return lag, f'WAL receiver is {status}'
+            if silence is not None and float(silence) > self.max_silence:
+                return lag, f'no message from primary in {float(silence)} seconds'
+        if lag is None:
+            return None, 'no transactions replayed'
+        if lag > self.max_lag:
+            return lag, f'replication lag {lag} exceeds {self.max_lag}'
+        return lag, None
+
+    def run(self):
+        """Check replicas periodically"""
+        while True:
+            for host in self.pools:
+                self.check_replica(host)
+            time.sleep(self.check_interval)
+
+    def stats(self):
+        """Get state of replicas"""
+        with self.lock:
+            return [
+                {'host': host, 'healthy': state[0], 'replication_lag': state[1]}
+                for host, state in self.state.items()]
+
+
+def init_replicas(conf):
+    """Create read-only replica set of current worker process if replicas are configured"""
+    global REPLICAS  # pylint: disable=global-statement
+    REPLICAS = None
+    if conf.get('db_replica_hosts'):
+        REPLICAS = ReplicaSet(conf)
+    return REPLICAS
+
+
+@contextmanager
+def db_read_connection(conf):
+    """Get database connection for read-only queries
+
+    Connection to a healthy replica is used if replicas are configured.
+    Primary database is used when no replica is healthy, connecting to
+    replica fails or replica pool is exhausted.
+    """
+    pool = None if REPLICAS is None else REPLICAS.get_pool()
+    conn = None
+    if pool is not None:
+        try:
+            conn = pool.getconn()
+        except psycopg2.pool.PoolError as err:
+            # Busy replica is still healthy
+            LOGGER.debug('Using primary database, replica %s: %s', pool.replica_host, err)
+        except psycopg2.Error as err:
+            REPLICAS.set_state(pool.replica_host, False, None, str(err).strip())
+    if conn is None:
+        with db_connection(conf) as conn:
+            yield conn
+        return
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+def get_change_codes(codes):
+    """Get set of codes from change notification, None means any code"""
+    if codes is None or None in codes:
+        return None
+    return frozenset(codes)
+
+
+def codes_overlap(codes, changed_codes):
+    """Check if codes of cache entry overlap with changed codes, None means any code"""
+    return codes is None or changed_codes is None or not codes.isdisjoint(changed_codes)
+
+
+class ChangeListener:
+    """Listener of change notifications sent by database triggers
+
+    Listener thread of a single worker process receives notifications using a
+    dedicated database connection and passes them to caches. Caches must not
+    be used while listener is not connected, because changes would be missed,
+    and are cleared when listener connects or disconnects.
+    """
+
+    def __init__(self, conf):
+        self.conf = conf
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.caches = []
+        self.listening = False
+        self.thread = None
+
+    def is_listening(self):
+        """Check if listener is connected, start listener thread if it is not running"""
+        with self.lock:
+            if self.pid != os.getpid():
+                # Listener thread of parent process does not exist after fork
+                self.pid = os.getpid()
+                self.listening = False
+                self.thread = None
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name='change-listener', daemon=True)
+                self.thread.start()
+            return self.listening
+
+    def set_listening(self, listening):
+        """Set listener state and clear caches"""
+        if not listening:
+            self.listening = False
+        for cache in self.caches:
+            cache.clear()
+        self.listening = listening
+
+    def handle_change(self, payload):
+        """Pass change notification to caches"""
+        try:
+            change = json.loads(payload)
+            table = change['table']
+            persons = get_change_codes(change['persons'])
+            organizations = get_change_codes(change['organizations'])
+            if not isinstance(table, str):
+                raise TypeError('Table name is not a string')
+        except (ValueError, TypeError, KeyError):
+            LOGGER.warning('Invalid change notification: %s', payload)
+            for cache in self.caches:
+                cache.clear()
+            return
+        for cache in self.caches:
+            cache.handle_change(table, persons, organizations)
+
+    def listen(self):
+        """Receive change notifications until database connection fails"""
+        conn = get_db_connection(self.conf)
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f'LISTEN {CHANGE_CHANNEL}')
+                self.set_listening(True)
+                LOGGER.info('Change listener connected')
+                while True:
+                    if select.select([conn], [], [], LISTENER_CHECK_INTERVAL) == ([], [], []):
+                        cur.execute('select 1')
+                    conn.poll()
+                    while conn.notifies:
+                        self.handle_change(conn.notifies.pop(0).payload)
+        finally:
+            conn.close()
+
+    def run(self):
+        """Run listener, reconnecting after failures"""
+        while True:
+            try:
+                self.listen()
+            except (psycopg2.Error, OSError) as err:
+                LOGGER.warning('Change listener failed: %s', err)
+            self.set_listening(False)
+            time.sleep(LISTENER_RETRY_INTERVAL)
+
+
+class ChangeCache(abc.ABC):
+    """Thread-safe LRU cache of a single worker process invalidated by change listener
+
+    Entries are stored as key: (value, expiry time). Subclasses decide which
+    entries are affected by a change.
+    """
+
+    def __init__(self, listener, max_size):
+        self.listener = listener
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.entries = OrderedDict()
+        # Incremented on every eviction, values read from database before an
+        # eviction are not cached
+        self.generation = 0
+        listener.caches.append(self)
+
+    def check_pid(self):
+        """Forget entries inherited from parent process after fork"""
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.entries.clear()
+            self.generation += 1
+
+    def get(self, key):
+        """Get cached value
+
+        Returns tuple of: cached value or None, cache generation or None if
+        cache cannot be used
+        """
+        with self.lock:
+            self.check_pid()
+            if not self.listener.is_listening():
+                return None, None
+            entry = self.entries.get(key)
+            if entry is None:
+                return None, self.generation
+            if entry[1] <= time.monotonic():
+                del self.entries[key]
+                return None, self.generation
+            self.entries.move_to_end(key)
+            return entry[0], self.generation
+
+    def put(self, key, value, generation, ttl=None):
+        """Add value to cache unless there were evictions after cache generation"""
+        with self.lock:
+            if generation != self.generation or (ttl is not None and ttl <= 0):
+                return
+            self.entries[key] = (
+                value, float('inf') if ttl is None else time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def evict(self, matches):
+        """Evict entries for which matches(key, value) is true"""
+        with self.lock:
+            self.generation += 1
+            for key in [key for key, entry in self.entries.items() if matches(key, entry[0])]:
+                del self.entries[key]
+
+    def clear(self):
+        """Evict all entries"""
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    @abc.abstractmethod
+    def handle_change(self, table, persons, organizations):
+        """Evict entries affected by change of table rows, None means any code"""
+
+
+class SearchCache(ChangeCache):
+    """Cache of search results
+
+    Entries are evicted when rights, persons or organizations they may contain
+    are changed. Cached values are (result, persons, organizations) where
+    persons and organizations are codes of search filter or None.
+    """
+
+    def __init__(self, conf, listener):
+        super().__init__(
+            listener, conf.get('search_cache_size', DEFAULT_SEARCH_CACHE_SIZE))
+        self.ttl = conf.get('search_cache_ttl', DEFAULT_SEARCH_CACHE_TTL)
+        # Replicas may return results that do not contain changes yet, results
+        # affected by changes of the last replica_delay seconds are not cached
+        self.replica_delay = 0
+        if conf.get('db_replica_hosts'):
+            self.replica_delay = conf.get('db_replica_max_lag', DEFAULT_REPLICA_MAX_LAG) \
+                + conf.get('db_replica_check_interval', DEFAULT_REPLICA_CHECK_INTERVAL)
+        # Recent changes as (expiry time, persons, organizations)
+        self.changes = []
+
+    def add(self, key, result, kwargs, ttl, generation):
+        """Add search result to cache unless it is affected by recent changes"""
+        persons = frozenset(kwargs['persons']) or None
+        organizations = frozenset(kwargs['organizations']) or None
+        with self.lock:
+            now = time.monotonic()
+            self.changes = [change for change in self.changes if change[0] > now]
+            if any(codes_overlap(persons, change[1]) and codes_overlap(organizations, change[2])
+                   for change in self.changes):
+                return
+        self.put(key, (result, persons, organizations), generation, ttl)
+
+    def handle_change(self, table, persons, organizations):
+        """Evict results that may contain changed persons and organizations"""
+        self.evict(lambda key, value: codes_overlap(value[1], persons)
+                   and codes_overlap(value[2], organizations))
+        if self.replica_delay:
+            with self.lock:
+                self.changes.append(
+                    (time.monotonic() + self.replica_delay, persons, organizations))
+
+
+class IdCache(ChangeCache):
+    """Cache of person and organization ids
+
+    Keys are (table, code) and cached values are (id, names) where names is a
+    tuple of names set by the last write or None if names are unknown.
+    Entries are evicted when person or organization is updated or deleted,
+    changes of rights do not affect the cache.
+    """
+
+    def __init__(self, conf, listener):
+        super().__init__(listener, conf.get('id_cache_size', DEFAULT_ID_CACHE_SIZE))
+
+    def handle_change(self, table, persons, organizations):
+        """Evict changed persons or organizations"""
+        changed = {'person': persons, 'organization': organizations}
+        if table not in changed:
+            return
+        self.evict(lambda key, value: key[0] == table
+                   and codes_overlap(frozenset([key[1]]), changed[table]))
+
+
+def init_caches(conf):
+    """Create caches of current worker process that are enabled"""
+    global CHANGE_LISTENER, SEARCH_CACHE, ID_CACHE  # pylint: disable=global-statement
+    CHANGE_LISTENER = ChangeListener(conf)
+    SEARCH_CACHE = None
+    ID_CACHE = None
+    if conf.get('search_cache_size', DEFAULT_SEARCH_CACHE_SIZE) > 0:
+        SEARCH_CACHE = SearchCache(conf, CHANGE_LISTENER)
+    if conf.get('id_cache_size', DEFAULT_ID_CACHE_SIZE) > 0:
+        ID_CACHE = IdCache(conf, CHANGE_LISTENER)
+    return SEARCH_CACHE, ID_CACHE
+
+
+def lookup_id(table, code, names):
+    """Get person or organization id from id cache
+
+    Id is returned only if names that are set (not None) match cached names,
+    otherwise names must be written to database.
+
+    Returns tuple of: id or None, cache generation or None if cache is not used
+    """
+    if ID_CACHE is None:
+        return None, None
+    entry, generation = ID_CACHE.get((table, code))
+    if entry is None:
+        return None, generation
+    cached_names = entry[1] or (None,) * len(names)
+    if all(name is None or name == cached for name, cached in zip(names, cached_names)):
+        return entry[0], generation
+    return None, generation
+
+
+def store_id(table, code, entity_id, names, generation):
+    """Add committed person or organization id to id cache
+
+    Names that are None are unknown, because database value was kept.
+    """
+    if generation is not None and entity_id is not None:
+        ID_CACHE.put((table, code), (entity_id, names), generation)
+
+
+def discard_id(table, code):
+    """Evict stale person or organization id from id cache"""
+    if ID_CACHE is not None:
+        ID_CACHE.evict(lambda key, value: key == (table, code))
+
+
+SQL_GET_PERSON = """
         select id, first_name, last_name
         from rights.person
-        where code=%(str)s""", {'str': code})
+        where code=%(str)s"""
+
+
+def get_person(cur, code):
+    """Get person data from db"""
+    execute_sql(cur, 'get_person', SQL_GET_PERSON, {'str': code})
     rec = cur.fetchone()
     if rec:
         return rec[0], rec[1], rec[2]
     return None, None, None
 
 
+SQL_SET_PERSON = """
+            with upsert as (
+                insert into rights.person as p (code, first_name, last_name)
+                values (%(code)s, %(first_name)s, %(last_name)s)
+                on conflict (code) do update
+                set first_name=COALESCE(excluded.first_name, p.first_name),
+                    last_name=COALESCE(excluded.last_name, p.last_name)
+                where (p.first_name, p.last_name) is distinct from (
+                    COALESCE(excluded.first_name, p.first_name),
+                    COALESCE(excluded.last_name, p.last_name))
+                returning id)
+            select id from upsert
+            union all
+            select id from rights.person where code=%(code)s
+            limit 1"""
+
+
 def set_person(cur, code, first_name, last_name):
-    """Get person data from db and update or insert if necessary"""
-    current_id, current_first_name, current_last_name = get_person(cur, code)
-    if current_id is None:
-        cur.execute(
-            """
-                insert into rights.person(code, first_name, last_name)
-                values(%(code)s, %(first_name)s, %(last_name)s)
-                returning id""",
-            {'code': code, 'first_name': first_name, 'last_name': last_name})
-        return cur.fetchone()[0]
-    if (first_name is not None and current_first_name != first_name) \
-            or (last_name is not None and current_last_name != last_name):
-        cur.execute(
-            """
-                update rights.person
-                set first_name=COALESCE(%(first_name)s, first_name),
-                    last_name=COALESCE(%(last_name)s, last_name)
-                where id=%(id)s""",
-            {'first_name': first_name, 'last_name': last_name, 'id': current_id})
-    return current_id
+    """Insert person or update person names that were provided and differ
 
+    Upsert is a single statement that does not fail when the same person is
+    inserted concurrently. Unchanged person is not updated (and not logged
+    to change_log). Returns person id.
+    """
+    execute_sql(
+        cur, 'set_person', SQL_SET_PERSON,
+        {'code': code, 'first_name': first_name, 'last_name': last_name})
+    rec = cur.fetchone()
+    if rec:
+        return rec[0]
+    # Unchanged person was committed by concurrent transaction after statement snapshot
+    return get_person(cur, code)[0]
 
-def get_organization(cur, code):
-    """Get organization data from db"""
-    cur.execute("""
+
+SQL_GET_ORGANIZATION = """
         select id, name
         from rights.organization
-        where code=%(str)s""", {'str': code})
+        where code=%(str)s"""
+
+
+def get_organization(cur, code):
+    """Get organization data from db"""
+    execute_sql(cur, 'get_organization', SQL_GET_ORGANIZATION, {'str': code})
     rec = cur.fetchone()
     if rec:
         return rec[0], rec[1]
     return None, None
 
 
+SQL_SET_ORGANIZATION = """
+            with upsert as (
+                insert into rights.organization as o (code, name)
+                values (%(code)s, %(name)s)
+                on conflict (code) do update
+                set name=COALESCE(excluded.name, o.name)
+                where o.name is distinct from COALESCE(excluded.name, o.name)
+                returning id)
+            select id from upsert
+            union all
+            select id from rights.organization where code=%(code)s
+            limit 1"""
+
+
 def set_organization(cur, code, name):
-    """Get organization data from db and update or insert if necessary"""
-    current_id, current_name = get_organization(cur, code)
-    if current_id is None:
-        cur.execute(
-            """
-                insert into rights.organization(code, name)
-                values(%(code)s, %(name)s)
-                returning id""",
-            {'code': code, 'name': name})
-        return cur.fetchone()[0]
-    if name is not None and current_name != name:
-        cur.execute(
-            """
-                update rights.organization
-                set name=%(name)s
-                where id=%(id)s""",
-            {'name': name, 'id': current_id})
-    return current_id
+    """Insert organization or update organization name if it was provided and differs
+
+    Upsert is a single statement that does not fail when the same organization
+    is inserted concurrently. Unchanged organization is not updated (and not
+    logged to change_log). Returns organization id.
+    """
+    execute_sql(cur, 'set_organization', SQL_SET_ORGANIZATION, {'code': code, 'name': name})
+    rec = cur.fetchone()
+    if rec:
+        return rec[0]
+    # Unchanged organization was committed by concurrent transaction after statement snapshot
+    return get_organization(cur, code)[0]
 
 
-def revoke_right(cur, person_id, organization_id, right_type):
-    """Revoke person right in db"""
-    cur.execute(
-        """
+SQL_REVOKE_RIGHT = """
             update rights.right
             set
                 revoked=true
             where person_id=%(person_id)s and organization_id=%(organization_id)s
                 and right_type=%(right_type)s
-                and not revoked""",
+                and not revoked"""
+
+
+def revoke_right(cur, person_id, organization_id, right_type):
+    """Revoke person right in db"""
+    execute_sql(
+        cur, 'revoke_right', SQL_REVOKE_RIGHT,
         {'person_id': person_id, 'organization_id': organization_id, 'right_type': right_type})
     return cur.rowcount
 
 
+SQL_ADD_RIGHT = """
+            insert into rights.right (person_id, organization_id, right_type, valid_from, valid_to)
+            values (%(person_id)s, %(organization_id)s, %(right_type)s,
+                COALESCE(%(valid_from)s, current_timestamp),
+                %(valid_to)s)"""
+
+
 def add_right(cur, **kwargs):
     """Add new person right to db
 
     Required keyword arguments:
     person_id, organization_id, right_type, valid_from, valid_to
     """
-    cur.execute(
-        """
-            insert into rights.right (person_id, organization_id, right_type, valid_from, valid_to)
-            values (%(person_id)s, %(organization_id)s, %(right_type)s,
-                COALESCE(%(valid_from)s, current_timestamp),
-                %(valid_to)s)""",
+    execute_sql(
+        cur, 'add_right', SQL_ADD_RIGHT,
         {
             'person_id': kwargs['person_id'], 'organization_id': kwargs['organization_id'],
             'right_type': kwargs['right_type'], 'valid_from': kwargs['valid_from'],
             'valid_to': kwargs['valid_to']})
 
 
-def get_search_rights_sql(only_valid, persons, organizations, rights, days_to_expiration):
-    """Get SQL string for search right query"""
-    sql_what = """
+SQL_UPSERT_PERSONS = """
+            with upsert as (
+                insert into rights.person as p (code, first_name, last_name)
+                select code, first_name, last_name
+                from unnest(%(codes)s::varchar[], %(first_names)s::varchar[],
+                    %(last_names)s::varchar[]) as t(code, first_name, last_name)
+                order by code
+                on conflict (code) do update
+                set first_name=COALESCE(excluded.first_name, p.first_name),
+                    last_name=COALESCE(excluded.last_name, p.last_name)
+                where (p.first_name, p.last_name) is distinct from (
+                    COALESCE(excluded.first_name, p.first_name),
+                    COALESCE(excluded.last_name, p.last_name))
+                returning code, id)
+            select code, id from upsert
+            union all
+            select code, id from rights.person where code=ANY(%(codes)s)"""
+
+
+SQL_GET_PERSON_IDS = """
+                select code, id from rights.person where code=ANY(%(codes)s)"""
+
+
+def upsert_persons(cur, persons):
+    """Insert persons or update person names that were provided and differ
+
+    Persons is a dict of person code -> (first_name, last_name).
+    Rows are upserted in the order of codes to keep lock order deterministic.
+    Returns dict of person code -> person id.
+    """
+    codes = sorted(persons)
+    execute_sql(
+        cur, 'upsert_persons', SQL_UPSERT_PERSONS,
+        {
+            'codes': codes, 'first_names': [persons[code][0] for code in codes],
+            'last_names': [persons[code][1] for code in codes]})
+    ids = dict(cur.fetchall())
+    missing = [code for code in codes if code not in ids]
+    if missing:
+        # Unchanged persons committed by concurrent transaction after statement snapshot
+        execute_sql(cur, 'get_person_ids', SQL_GET_PERSON_IDS, {'codes': missing})
+        ids.update(cur.fetchall())
+    return ids
+
+
+SQL_UPSERT_ORGANIZATIONS = """
+            with upsert as (
+                insert into rights.organization as o (code, name)
+                select code, name
+                from unnest(%(codes)s::varchar[], %(names)s::varchar[]) as t(code, name)
+                order by code
+                on conflict (code) do update
+                set name=COALESCE(excluded.name, o.name)
+                where o.name is distinct from COALESCE(excluded.name, o.name)
+                returning code, id)
+            select code, id from upsert
+            union all
+            select code, id from rights.organization where code=ANY(%(codes)s)"""
+
+
+SQL_GET_ORGANIZATION_IDS = """
+                select code, id from rights.organization where code=ANY(%(codes)s)"""
+
+
+def upsert_organizations(cur, organizations):
+    """Insert organizations or update organization names that were provided and differ
+
+    Organizations is a dict of organization code -> name.
+    Rows are upserted in the order of codes to keep lock order deterministic.
+    Returns dict of organization code -> organization id.
+    """
+    codes = sorted(organizations)
+    execute_sql(
+        cur, 'upsert_organizations', SQL_UPSERT_ORGANIZATIONS,
+        {'codes': codes, 'names': [organizations[code] for code in codes]})
+    ids = dict(cur.fetchall())
+    missing = [code for code in codes if code not in ids]
+    if missing:
+        # Unchanged organizations committed by concurrent transaction after statement snapshot
+        execute_sql(cur, 'get_organization_ids', SQL_GET_ORGANIZATION_IDS, {'codes': missing})
+        ids.update(cur.fetchall())
+    return ids
+
+
+SQL_REVOKE_RIGHTS_BY_KEYS = """
+            with locked as (
+                select r.id
+                from rights.right r
+                join unnest(%(person_ids)s::bigint[], %(organization_ids)s::bigint[],
+                    %(right_types)s::varchar[]) as t(person_id, organization_id, right_type)
+                    on (r.person_id=t.person_id and r.organization_id=t.organization_id
+                        and r.right_type=t.right_type)
+                where not r.revoked
+                order by r.id
+                for update of r)
+            update rights.right r
+            set
+                revoked=true
+            from locked l
+            where r.id=l.id"""
+
+
+def revoke_rights_by_keys(cur, keys):
+    """Revoke active rights in db
+
+    Keys is a list of (person_id, organization_id, right_type).
+    Rights are locked in the order of their ids before revoking.
+    Returns number of revoked rights.
+    """
+    execute_sql(
+        cur, 'revoke_rights_by_keys', SQL_REVOKE_RIGHTS_BY_KEYS, get_right_keys_params(keys))
+    return cur.rowcount
+
+
+def get_right_keys_params(keys):
+    """Get query parameters of (person_id, organization_id, right_type) keys"""
+    return {
+        'person_ids': [key[0] for key in keys],
+        'organization_ids': [key[1] for key in keys],
+        'right_types': [key[2] for key in keys]}
+
+
+SQL_ADD_RIGHTS = """
+            insert into rights.right (person_id, organization_id, right_type, valid_from, valid_to)
+            select person_id, organization_id, right_type,
+                COALESCE(valid_from, current_timestamp), valid_to
+            from unnest(%(person_ids)s::bigint[], %(organization_ids)s::bigint[],
+                %(right_types)s::varchar[], %(valid_froms)s::timestamp[],
+                %(valid_tos)s::timestamp[])
+                as t(person_id, organization_id, right_type, valid_from, valid_to)
+            order by person_id, organization_id, right_type
+            returning person_id, organization_id, right_type"""
+
+
+def add_rights(cur, new_rights):
+    """Add new person rights to db
+
+    New rights is a list of dicts with keys:
+    person_id, organization_id, right_type, valid_from, valid_to
+    Returns set of (person_id, organization_id, right_type) of added rights.
+    """
+    execute_sql(cur, 'add_rights', SQL_ADD_RIGHTS, get_new_rights_params(new_rights))
+    return set(tuple(rec) for rec in cur.fetchall())
+
+
+def get_new_rights_params(new_rights):
+    """Get query parameters of new rights"""
+    return {
+        'person_ids': [item['person_id'] for item in new_rights],
+        'organization_ids': [item['organization_id'] for item in new_rights],
+        'right_types': [item['right_type'] for item in new_rights],
+        'valid_froms': [item['valid_from'] for item in new_rights],
+        'valid_tos': [item['valid_to'] for item in new_rights]}
+
+
+def get_revoke_rights_sql(shapes):
+    """Get SQL string for bulk revoke query
+
+    Shapes is a list of selector key tuples. Selectors of each shape are
+    joined by equality conditions, so that indexes on codes can be used.
+    Query parameters for shape N are "sN_idx" and "sN_<key>" arrays.
+    """
+    sql_matched = []
+    for num, keys in enumerate(shapes):
+        columns = ', '.join(('idx',) + keys)
+        arrays = ', '.join(
+            [f'%(s{num}_idx)s::int[]'] + [f'%(s{num}_{key})s::varchar[]' for key in keys])
+        sql_join = ''
+        right_conditions = []
+        if 'person_code' in keys:
+            sql_join += """
+                join rights.person p on (p.code=s.person_code)"""
+            right_conditions.append('r.person_id=p.id')
+        if 'organization_code' in keys:
+            sql_join += """
+                join rights.organization o on (o.code=s.organization_code)"""
+            right_conditions.append('r.organization_id=o.id')
+        if 'right_type' in keys:
+            right_conditions.append('r.right_type=s.right_type')
+        sql_matched.append(f"""
+                select r.id, s.idx
+                from unnest({arrays}) as s({columns}){sql_join}
+                join rights.right r on ({' and '.join(right_conditions)})
+                where not r.revoked""")
+
+    sql_union = """
+                union all""".join(sql_matched)
+    return f"""
+            with matched as ({sql_union}),
+            locked as (
+                select r.id
+                from rights.right r
+                where r.id in (select id from matched)
+                order by r.id
+                for update),
+            revoked as (
+                update rights.right r
+                set
+                    revoked=true
+                from locked l
+                where r.id=l.id and not r.revoked
+                returning r.id)
+            select null::int, count(1) from revoked
+            union all
+            select m.idx, count(1)
+            from matched m
+            join revoked v on (v.id=m.id)
+            group by m.idx"""
+
+
+def revoke_rights(cur, selectors):
+    """Revoke rights matching any of the selectors in a single statement
+
+    Selectors is a list of dicts with optional keys from REVOKE_SELECTOR_KEYS.
+    Returns tuple of: total number of revoked rights, list of revoked rights per selector
+    """
+    shapes, params = get_revoke_rights_params(selectors)
+    execute_sql(cur, 'revoke_rights', get_revoke_rights_sql(shapes), params)
+    return get_revoke_rights_counts(cur.fetchall(), len(selectors))
+
+
+def get_revoke_rights_params(selectors):
+    """Group revoke selectors by the keys they contain
+
+    Returns tuple of: list of shapes for get_revoke_rights_sql, query parameters
+    """
+    shapes = {}
+    for idx, selector in enumerate(selectors):
+        keys = tuple(key for key in REVOKE_SELECTOR_KEYS if selector.get(key) is not None)
+        shapes.setdefault(keys, []).append(idx)
+
+    params = {}
+    for num, (keys, indexes) in enumerate(shapes.items()):
+        params[f's{num}_idx'] = indexes
+        for key in keys:
+            params[f's{num}_{key}'] = [selectors[idx][key] for idx in indexes]
+    return list(shapes), params
+
+
+def get_revoke_rights_counts(records, size):
+    """Get total number of revoked rights and list of revoked rights per selector"""
+    total = 0
+    counts = [0] * size
+    for idx, count in records:
+        if idx is None:
+            total = count
+        else:
+            counts[idx] = count
+    return total, counts
+
+
+SQL_CALL_SET_RIGHT = """
+            select rights.set_right(
+                %(person_code)s, %(first_name)s, %(last_name)s,
+                %(organization_code)s, %(organization_name)s,
+                %(right_type)s, %(valid_from)s, %(valid_to)s)"""
+
+
+def call_set_right(cur, person, organization, right):
+    """Set person right using rights.set_right database function
+
+    Function upserts person and organization, revokes existing right and
+    adds new right in a single statement. Returns id of the new right.
+    """
+    execute_sql(
+        cur, 'call_set_right', SQL_CALL_SET_RIGHT,
+        get_call_set_right_params(person, organization, right))
+    return cur.fetchone()[0]
+
+
+def get_call_set_right_params(person, organization, right):
+    """Get query parameters of rights.set_right database function call"""
+    return {
+        'person_code': person['code'], 'first_name': person['first_name'],
+        'last_name': person['last_name'], 'organization_code': organization['code'],
+        'organization_name': organization['name'], 'right_type': right['right_type'],
+        'valid_from': right['valid_from'], 'valid_to': right['valid_to']}
+
+
+def get_search_rights_sql(
+        only_valid, persons, organizations, rights, days_to_expiration, after_id=None,
+        count=DEFAULT_COUNT):
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    """Get SQL string for search right query
+
+    Rights are ordered by id. If after_id is set then keyset pagination is
+    used instead of offset: only rights with id greater than after_id are
+    returned. Total count does not depend on pagination.
+
+    If days_to_expiration (tuple of minimum and maximum number of days) is
+    set then only rights with valid_to inside that range of days are returned.
+    Range is compared to valid_to column directly so that index can be used.
+
+    Count mode "window" adds total count as the last column of search query,
+    "estimate" returns planner estimate query instead of count query and
+    "none" returns no count query.
+
+    Timestamps are formatted by database, formatting them in Python is slower.
+    """
+    sql_what = f"""
         select p.code, p.first_name, p.last_name, o.code, o.name,
-            r.right_type, r.valid_from, r.valid_to, r.revoked"""
+            r.right_type, to_char(r.valid_from, '{TIME_FORMAT_SQL}'),
+            to_char(r.valid_to, '{TIME_FORMAT_SQL}'), r.revoked, r.id"""
+    if count == 'window':
+        sql_what += """,
+            count(1) over ()"""
     sql_cnt = """
         select count(1)"""
-    sql_from = """
+    if count == 'estimate':
+        sql_cnt = """
+        explain (format json) select 1"""
+    sql_where = get_search_rights_filter(
+        only_valid, persons, organizations, rights, days_to_expiration)
+    if after_id is None:
+        sql_page = ''
+        sql_limit = """
+        order by r.id
+        limit %(limit)s offset %(offset)s"""
+    else:
+        sql_page = """
+            and r.id>%(after_id)s"""
+        sql_limit = """
+        order by r.id
+        limit %(limit)s"""
+
+    sql_query = sql_what + sql_where + sql_page + sql_limit
+    sql_total = None
+    if count != 'none':
+        sql_total = sql_cnt + sql_where
+
+    return sql_query, sql_total
+
+
+def get_search_rights_filter(only_valid, persons, organizations, rights, days_to_expiration):
+    """Get FROM and WHERE clauses of search right query"""
+    sql_where = """
         from rights.right r
         join rights.person p on (p.id=r.person_id)
-        join rights.organization o on (o.id=r.organization_id)"""
-    sql_where = """
+        join rights.organization o on (o.id=r.organization_id)
         where true"""
     if only_valid:
         sql_where += """
@@ -238,67 +1697,534 @@ def get_search_rights_sql(only_valid, persons, organizations, rights, days_to_ex
     if rights:
         sql_where += """
             and r.right_type=ANY(%(rights)s)"""
-    if days_to_expiration:
+    if days_to_expiration is not None:
         sql_where += """
-            and (DATE(r.valid_to) - current_date) = %(days_to_expiration)s"""
-    sql_limit = """
-        limit %(limit)s offset %(offset)s"""
+            and r.valid_to>=current_date + %(expiration_from)s
+            and r.valid_to<current_date + %(expiration_to)s + 1"""
+    return sql_where
 
-    sql_query = sql_what + sql_from + sql_where + sql_limit
-    sql_total = sql_cnt + sql_from + sql_where
 
-    return sql_query, sql_total
+def get_export_rights_sql(kwargs, export_format):
+    """Get COPY statement for exporting rights
+
+    Timestamps are formatted in the same way as in search results. NDJSON is
+    produced by PostgreSQL as single column CSV where quote and delimiter
+    characters are control characters. JSON escapes them and line breaks
+    inside strings, so CSV output never quotes the column and every line is a
+    JSON document.
+    """
+    sql_filter = get_search_rights_filter(
+        kwargs['only_valid'], kwargs['persons'], kwargs['organizations'], kwargs['rights'],
+        kwargs['days_to_expiration'])
+    valid_from = f"to_char(r.valid_from, '{TIME_FORMAT_SQL}')"
+    valid_to = f"to_char(r.valid_to, '{TIME_FORMAT_SQL}')"
+    if export_format == 'ndjson':
+        sql_what = f"""
+        select json_build_object(
+            'person', json_build_object(
+                'code', p.code, 'first_name', p.first_name, 'last_name', p.last_name),
+            'organization', json_build_object('code', o.code, 'name', o.name),
+            'right', json_build_object(
+                'right_type', r.right_type, 'valid_from', {valid_from},
+                'valid_to', {valid_to}, 'revoked', r.revoked))"""
+        sql_options = "format csv, quote e'\\x01', delimiter e'\\x02'"
+    else:
+        sql_what = f"""
+        select p.code as person_code, p.first_name as person_first_name,
+            p.last_name as person_last_name, o.code as organization_code,
+            o.name as organization_name, r.right_type, {valid_from} as valid_from,
+            {valid_to} as valid_to, r.revoked::text as revoked"""
+        sql_options = 'format csv, header true'
+    return f"""
+        copy ({sql_what}{sql_filter}
+        order by r.id) to stdout with ({sql_options})"""
+
+
+def encode_cursor(right_id):
+    """Encode id of the last returned right as opaque pagination cursor"""
+    return base64.urlsafe_b64encode(str(right_id).encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Decode pagination cursor to id of the last returned right
+
+    Empty cursor means first page. Raises ValueError for invalid cursors,
+    including ids outside of bigint range.
+    """
+    if cursor is None or cursor == '':
+        return 0
+    if not isinstance(cursor, str):
+        raise ValueError('Cursor must be a string')
+    right_id = int(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii'))
+    if right_id < 0:
+        raise ValueError('Negative cursor')
+    if right_id > MAX_RIGHT_ID:
+        raise ValueError('Cursor out of range')
+    return right_id
+
+
+def get_plan_rows(plan):
+    """Get estimated number of rows from EXPLAIN (FORMAT JSON) output"""
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def get_search_rights_params(kwargs):
+    """Get parameters of search right query from search_rights kwargs"""
+    # In keyset mode one extra row tells if next page exists
+    return {
+        'persons': kwargs['persons'], 'organizations': kwargs['organizations'],
+        'rights': kwargs['rights'],
+        'limit': kwargs['limit'] if kwargs['after_id'] is None else kwargs['limit'] + 1,
+        'offset': kwargs['offset'], 'after_id': kwargs['after_id'],
+        'expiration_from': (kwargs['days_to_expiration'] or (None, None))[0],
+        'expiration_to': (kwargs['days_to_expiration'] or (None, None))[1]}
+
+
+def get_right_from_record(rec):
+    """Convert record of search right query to right object
+
+    Timestamps are already formatted by search right query.
+    """
+    return {
+        'person': {'code': rec[0], 'first_name': rec[1], 'last_name': rec[2]},
+        'organization': {'code': rec[3], 'name': rec[4]},
+        'right': {
+            'right_type': rec[5], 'valid_from': rec[6], 'valid_to': rec[7],
+            'revoked': rec[8]}}
 
 
 def search_rights(cur, **kwargs):
     """Search for rights in db
     Required keyword arguments:
-    persons, organizations, rights, only_valid, limit, offset, days_to_expiration
+    persons, organizations, rights, only_valid, limit, offset, after_id, days_to_expiration,
+    count
+
+    If after_id is not None then keyset pagination is used and response
+    contains "next_cursor" instead of "offset". Response "count" contains the
+    count mode that was actually used: window function cannot count rights
+    that precede the cursor, so "window" falls back to "exact" with keyset
+    pagination.
     """
+    count, sql_query, sql_total, params = get_search_rights_query(kwargs)
+    LOGGER.debug('SQL: %s', cur.mogrify(sql_query, params).decode('utf-8'))
+    execute_sql(cur, 'search_rights', sql_query, params)
+    result = get_search_rights_page(kwargs, count, cur)
+
+    if result['count'] == 'exact':
+        LOGGER.debug('SQL total: %s', cur.mogrify(sql_total, params).decode('utf-8'))
+        execute_sql(cur, 'count_rights', sql_total, params)
+        result['total'] = cur.fetchone()[0]
+    elif result['count'] == 'estimate':
+        LOGGER.debug('SQL estimate: %s', cur.mogrify(sql_total, params).decode('utf-8'))
+        execute_sql(cur, 'estimate_rights', sql_total, params)
+        result['total'] = get_plan_rows(cur.fetchone()[0])
+    return result
+
+
+def get_search_rights_query(kwargs):
+    """Get count mode, search query, count query and parameters of search_rights"""
+    count = kwargs['count']
+    if count == 'window' and kwargs['after_id'] is not None:
+        count = 'exact'
     sql_query, sql_total = get_search_rights_sql(
         kwargs['only_valid'], kwargs['persons'], kwargs['organizations'], kwargs['rights'],
-        kwargs['days_to_expiration'])
+        kwargs['days_to_expiration'], kwargs['after_id'], count)
+    return count, sql_query, sql_total, get_search_rights_params(kwargs)
 
-    params = {
-        'persons': kwargs['persons'], 'organizations': kwargs['organizations'],
-        'rights': kwargs['rights'], 'limit': kwargs['limit'], 'offset': kwargs['offset'],
-        'days_to_expiration': kwargs['days_to_expiration']}
+
+def get_search_rights_page(kwargs, count, records):
+    """Get search_rights result from records of search query
+
+    Total is not set when count query is still needed: result "count" is
+    "exact" or "estimate".
+    """
+    after_id = kwargs['after_id']
     rights = []
+    last_id = None
+    has_more = False
+    total = None
+    for rec in records:
+        if after_id is not None and len(rights) == kwargs['limit']:
+            has_more = True
+            break
+        last_id = rec[9]
+        if count == 'window':
+            total = rec[10]
+        rights.append(get_right_from_record(rec))
+
+    if count == 'window' and not rights:
+        if kwargs['offset']:
+            # Page after the last right has no rows to carry the window count
+            count = 'exact'
+        else:
+            total = 0
+
+    if after_id is None:
+        return {
+            'rights': rights, 'limit': kwargs['limit'], 'offset': kwargs['offset'],
+            'total': total, 'count': count}
 
-    LOGGER.debug('SQL: %s', cur.mogrify(sql_query, params).decode('utf-8'))
-    cur.execute(sql_query, params)
-    for rec in cur:
-        valid_from = rec[6]
-        if isinstance(valid_from, datetime):
-            valid_from = valid_from.strftime(TIME_FORMAT)
-        valid_to = rec[7]
-        if isinstance(valid_to, datetime):
-            valid_to = valid_to.strftime(TIME_FORMAT)
-        rights.append({
-            'person': {'code': rec[0], 'first_name': rec[1], 'last_name': rec[2]},
-            'organization': {'code': rec[3], 'name': rec[4]},
-            'right': {
-                'right_type': rec[5], 'valid_from': valid_from, 'valid_to': valid_to,
-                'revoked': rec[8]}})
-
-    LOGGER.debug('SQL total: %s', cur.mogrify(sql_total, params).decode('utf-8'))
-    cur.execute(sql_total, params)
-    total = cur.fetchone()[0]
-
-    return {'rights': rights, 'limit': kwargs['limit'], 'offset': kwargs['offset'], 'total': total}
-
-
-def make_response(data, log_header, log_level='info'):
-    """Create JSON response object"""
-    response = jsonify({'code': data['code'], 'msg': data['msg']})
+    next_cursor = encode_cursor(last_id) if has_more else None
+    return {
+        'rights': rights, 'limit': kwargs['limit'], 'next_cursor': next_cursor,
+        'total': total, 'count': count}
+
+
+def dumps_json(data, sort_keys=False, float_free=False):
+    """Serialize object as compact ASCII JSON bytes
+
+    Output is the same as output of json module. When data is known to
+    contain no floats (float_free) orjson is used if it is installed: orjson
+    formats floats differently (5e-6 and 0.000027 instead of 5e-06 and
+    2.7e-05). orjson does not escape non-ASCII characters, so such documents
+    are serialized again with json module.
+    """
+    # pylint: disable=no-member
+    if float_free and orjson is not None:
+        try:
+            body = orjson.dumps(data, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+            if body.isascii() and b'\x7f' not in body:
+                return body
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(data, sort_keys=sort_keys, separators=(',', ':')).encode('ascii')
+
+
+def get_search_cache_key(kwargs):
+    """Get cache key of normalized search right kwargs"""
+    return tuple(
+        (name, tuple(sorted(set(value))) if isinstance(value, list) else value)
+        for name, value in sorted(kwargs.items()))
+
+
+def get_search_cache_ttl(cur, kwargs, result, max_ttl):
+    """Get number of seconds until search result may change without data changes
+
+    Valid rights change when valid_from or valid_to of a not revoked right
+    passes. Days to expiration change at midnight.
+
+    Query over all matching rights costs as much as counting them, so it is
+    only used when total is counted exactly or by window function, or when
+    earlier pages of offset pagination may change. Otherwise TTL ends when
+    the first returned right expires or the first matching right becomes
+    valid, which is found by index of valid_from of not revoked rights.
+    """
+    if not kwargs['only_valid']:
+        return get_returned_rights_ttl(kwargs, result, max_ttl)
+
+    boundaries = []
+    sql_filter = get_search_rights_filter(
+        False, kwargs['persons'], kwargs['organizations'], kwargs['rights'], None) + """
+            and not r.revoked"""
+    if result['count'] in ('exact', 'window') or kwargs['offset']:
+        if kwargs['days_to_expiration'] is not None:
+            boundaries.append('(current_date + 1)::timestamptz')
+        boundaries.append('min(r.valid_from) filter (where r.valid_from>current_timestamp)')
+        boundaries.append('min(r.valid_to) filter (where r.valid_to>current_timestamp)')
+    else:
+        max_ttl = get_returned_rights_ttl(kwargs, result, max_ttl)
+        boundaries.append('min(r.valid_from)')
+        sql_filter += """
+            and r.valid_from>current_timestamp"""
+
+    sql_query = f"""
+        select extract(epoch from least({', '.join(boundaries)}) - current_timestamp)""" \
+        + sql_filter
+    params = get_search_rights_params(kwargs)
+    LOGGER.debug('SQL cache TTL: %s', cur.mogrify(sql_query, params).decode('utf-8'))
+    execute_sql(cur, 'search_cache_ttl', sql_query, params)
+    ttl = cur.fetchone()[0]
+    if ttl is None:
+        return max_ttl
+    return min(max_ttl, float(ttl))
+
+
+def get_returned_rights_ttl(kwargs, result, max_ttl):
+    """Get number of seconds until returned rights or days to expiration change
+
+    Formatted timestamps are compared as strings, they sort in time order.
+    """
+    now = get_datetime_now()
+    ttl = max_ttl
+    if kwargs['days_to_expiration'] is not None:
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        ttl = min(ttl, (midnight - now).total_seconds())
+    if kwargs['only_valid']:
+        now_str = now.strftime(TIME_FORMAT)
+        valid_to = min((
+            item['right']['valid_to'] for item in result['rights']
+            if item['right']['valid_to'] is not None and item['right']['valid_to'] > now_str),
+            default=None)
+        if valid_to is not None:
+            ttl = min(ttl, (datetime.strptime(valid_to, TIME_FORMAT) - now).total_seconds())
+    return ttl
+
+
+def cached_search_rights(conf, kwargs):
+    """Search for rights using search result cache if it is enabled
+
+    Returns tuple of: search result, True if result was cached
+    """
+    entry = None
+    generation = None
+    if SEARCH_CACHE is not None:
+        cache_key = get_search_cache_key(kwargs)
+        entry, generation = SEARCH_CACHE.get(cache_key)
+    if entry is not None:
+        return entry[0], True
+
+    with db_read_connection(conf) as conn:
+        with conn.cursor() as cur:
+            result = search_rights(cur, **kwargs)
+            if generation is not None:
+                SEARCH_CACHE.add(
+                    cache_key, result, kwargs,
+                    get_search_cache_ttl(cur, kwargs, result, SEARCH_CACHE.ttl), generation)
+    return result, False
+
+
+def get_ndjson_line(data):
+    """Serialize object as a single NDJSON line"""
+    return dumps_json(data, float_free=True).decode('ascii') + '\n'
+
+
+def stream_search_rights(conf, kwargs, log_header):
+    """Generate search results as NDJSON lines using server-side cursor
+
+    Rights are fetched in batches of "stream_fetch_size" rows, so memory usage
+    does not depend on the number of returned rights. Generator yields an
+    empty string after the query is executed, so that database errors can be
+    handled before response status is sent. Every right is a separate line,
+    the last line contains status of the stream and "next_cursor" when keyset
+    pagination is used. Total count is not calculated.
+    """
+    fetch_size = conf.get('stream_fetch_size', DEFAULT_STREAM_FETCH_SIZE)
+    sql_query, params = get_stream_rights_query(kwargs)
+    stream = SearchStream(kwargs)
+
+    with db_read_connection(conf) as conn:
+        with conn.cursor(name=f'search_rights_{uuid.uuid4().hex}') as cur:
+            LOGGER.debug('SQL: %s', cur.mogrify(sql_query, params).decode('utf-8'))
+            execute_sql(cur, 'stream_rights', sql_query, params)
+            rows = cur.fetchmany(fetch_size)
+            yield ''
+            try:
+                while rows:
+                    yield from stream.get_chunks(rows)
+                    rows = [] if stream.has_more else cur.fetchmany(fetch_size)
+            except psycopg2.Error as err:
+                yield get_stream_db_error(log_header, err)
+                return
+
+    yield stream.get_trailer(log_header)
+
+
+def get_stream_rights_query(kwargs):
+    """Get query and parameters of streamed search, total count is not calculated"""
+    sql_query = get_search_rights_sql(
+        kwargs['only_valid'], kwargs['persons'], kwargs['organizations'], kwargs['rights'],
+        kwargs['days_to_expiration'], kwargs['after_id'], 'none')[0]
+    return sql_query, get_search_rights_params(kwargs)
+
+
+class SearchStream:
+    """Progress of streamed search results
+
+    Converts fetched rows into NDJSON lines and remembers what is needed for
+    the last line of the stream. The same progress is used by the ASGI
+    application, only fetching differs.
+    """
+    def __init__(self, kwargs):
+        self.after_id = kwargs['after_id']
+        self.limit = kwargs['limit']
+        self.returned = 0
+        self.last_id = None
+        self.has_more = False
+
+    def get_chunks(self, rows):
+        """Get list of NDJSON lines of fetched rows as a single chunk
+
+        List is empty if no rows are returned. Extra row of keyset pagination
+        is not returned, no more rows must be fetched after "has_more" is set.
+        """
+        if self.after_id is not None and self.returned + len(rows) > self.limit:
+            rows = rows[:self.limit - self.returned]
+            self.has_more = True
+        if not rows:
+            return []
+        self.returned += len(rows)
+        self.last_id = rows[-1][9]
+        return [''.join(get_ndjson_line(get_right_from_record(rec)) for rec in rows)]
+
+    def get_trailer(self, log_header):
+        """Log the number of streamed rights and get the last line of stream"""
+        LOGGER.info('%sStreamed %s rights', log_header, self.returned)
+        return get_ndjson_line(
+            get_stream_trailer(self.returned, self.after_id, self.last_id, self.has_more))
+
+
+def get_stream_trailer(returned, after_id, last_id, has_more):
+    """Get the last line of streamed search results"""
+    trailer = {'code': 'OK', 'msg': f'Returned {returned} rights', 'returned': returned}
+    if after_id is not None:
+        trailer['next_cursor'] = encode_cursor(last_id) if has_more else None
+    return trailer
+
+
+def get_stream_db_error(log_header, err):
+    """Log database error and get the last line of interrupted stream"""
+    LOGGER.error('%sDB_ERROR: %s: %s', log_header, DB_ERROR_MSG, err)
+    return get_ndjson_line({'code': 'DB_ERROR', 'msg': DB_ERROR_MSG})
+
+
+class ExportWriter:
+    """File-like object that passes COPY output to export queue in chunks
+
+    After cancel() data is discarded, so that COPY is never blocked by a full
+    queue when client has gone away.
+    """
+    def __init__(self, chunks, chunk_size):
+        self.chunks = chunks
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.buffered = 0
+        self.cancelled = threading.Event()
+
+    def put(self, item):
+        """Put item into queue unless export is cancelled"""
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data):
+        """Buffer COPY output and put full chunks into queue"""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Put buffered data into queue"""
+        if self.buffer:
+            self.put(b''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def cancel(self):
+        """Stop passing data to queue"""
+        self.cancelled.set()
+
+
+def copy_to_writer(cur, sql, writer):
+    """Run COPY statement in export thread
+
+    Queue receives chunks of COPY output followed by None on success or by
+    the exception that stopped COPY. The last item is always put, otherwise
+    export generator would wait for it forever.
+    """
+    end = None
+    try:
+        with DB_QUERY_DURATION.labels('export_rights').time():
+            cur.copy_expert(sql, writer)
+        writer.flush()
+    except BaseException as err:  # pylint: disable=broad-exception-caught
+        # Exception is raised again by export generator
+        end = err
+    finally:
+        writer.put(end)
+
+
+def get_export_chunk(chunks):
+    """Get next chunk of COPY output, raise error of COPY or return None at the end"""
+    chunk = chunks.get()
+    if isinstance(chunk, BaseException):
+        raise chunk
+    return chunk
+
+
+def export_rights(conf, kwargs, log_header):
+    """Generate chunks of COPY output
+
+    COPY runs in a separate thread and passes output through a bounded queue,
+    so memory usage does not depend on the number of exported rights and no
+    Python objects are created for rows. Generator yields an empty chunk
+    after the first chunk of output is received, so that database errors can
+    be handled before response status is sent. Errors during export are
+    raised, which aborts the response.
+    """
+    chunks = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+    writer = ExportWriter(chunks, conf.get('export_chunk_size', DEFAULT_EXPORT_CHUNK_SIZE))
+    exported = 0
+    with db_read_connection(conf) as conn:
+        with conn.cursor() as cur:
+            # COPY does not support query parameters
+            sql = cur.mogrify(
+                get_export_rights_sql(kwargs, kwargs['format']),
+                get_search_rights_params(kwargs)).decode('utf-8')
+            LOGGER.debug('SQL: %s', sql)
+            thread = threading.Thread(target=copy_to_writer, args=(cur, sql, writer), daemon=True)
+            thread.start()
+            try:
+                chunk = get_export_chunk(chunks)
+                yield b''
+                while chunk is not None:
+                    exported += len(chunk)
+                    yield chunk
+                    chunk = get_export_chunk(chunks)
+            finally:
+                if thread.is_alive():
+                    writer.cancel()
+                    conn.cancel()
+                    thread.join()
+
+    LOGGER.info('%sExported %s bytes', log_header, exported)
+
+
+@traced('serialize_json')
+def jsonify_fast(data, float_free=False):
+    """Create JSON response object with the same body as flask.jsonify
+
+    Flask pretty prints JSON in debug mode, jsonify is used in that case.
+    Data without floats (float_free) is serialized faster.
+    """
+    provider = current_app.json
+    start = time.perf_counter()
+    if provider.compact is False or (provider.compact is None and current_app.debug):
+        response = jsonify(data)
+    else:
+        response = current_app.response_class(
+            dumps_json(data, sort_keys=True, float_free=float_free) + b'\n',
+            mimetype=provider.mimetype)
+    duration = time.perf_counter() - start
+    JSON_DURATION.observe(duration)
+    add_server_timing('serialize', duration)
+    return response
+
+
+def make_response(data, log_header, log_level='info', float_free=False):
+    """Create JSON response object
+
+    Responses of rights endpoints contain no floats (float_free), status
+    responses contain durations and ratios.
+    """
+    body = {'code': data['code'], 'msg': data['msg']}
     if 'response' in data:
-        response = jsonify(
-            {'code': data['code'], 'msg': data['msg'], 'response': data['response']})
+        body['response'] = data['response']
+    response = jsonify_fast(body, float_free=float_free)
     response.status_code = data['http_status']
+    # Label of request metrics
+    g.response_code = data['code']
     if log_level == 'debug':
-        LOGGER.debug('%sResponse: %s', log_header, data)
+        LOGGER.debug('%sResponse: %s', log_header, summarize_log_data(data))
     else:
-        LOGGER.info('%sResponse: %s', log_header, data)
+        LOGGER.info('%sResponse: %s', log_header, summarize_log_data(data))
     return response
 
 
@@ -313,6 +2239,36 @@ def validate_config(conf, log_header):
     return None
 
 
+def validate_process_request(conf, validator, json_data, log_header, *args):
+    """Validate configuration and request parameters before processing request
+
+    Extra args are passed to validator after request parameters.
+    Returns tuple of: kwargs (items of bulk request), error message
+    """
+    conf_error = validate_config(conf, log_header)
+    if conf_error:
+        return None, conf_error
+    return validator(json_data, *args, log_header)
+
+
+def get_bulk_max_items(conf):
+    """Get maximal number of items in bulk request"""
+    return conf.get('bulk_max_items', DEFAULT_BULK_MAX_ITEMS)
+
+
+def get_valid_items(items):
+    """Get kwargs of bulk request items that passed validation"""
+    return [kwargs for kwargs, _ in items if kwargs is not None]
+
+
+def get_db_error(log_header, err):
+    """Log database error and get error response"""
+    LOGGER.error('%sDB_ERROR: %s: %s', log_header, DB_ERROR_MSG, err)
+    return {
+        'http_status': 500, 'code': 'DB_ERROR',
+        'msg': DB_ERROR_MSG}
+
+
 def get_required_parameter(name, json_data, log_header):
     """Get required parameter from request
 
@@ -475,8 +2431,8 @@ def parse_interval(valid_from, valid_to, json_data, log_header):
     return valid_from, valid_to, None
 
 
-def validate_set_right_request(json_data, log_header):
-    """Check request parameters of set_right
+def check_set_right_item(json_data, log_header):
+    """Check parameters of a single right of set_right or set_rights
 
     Returns tuple of: kwargs, error message
     """
@@ -506,144 +2462,633 @@ def validate_set_right_request(json_data, log_header):
     return kwargs, None
 
 
-def process_set_right(conf, json_data, log_header):
-    """Process incoming set_right query"""
-    conf_error = validate_config(conf, log_header)
-    if conf_error:
-        return conf_error
-
-    kwargs, request_error = validate_set_right_request(json_data, log_header)
+@traced('validate')
+def validate_set_right_request(json_data, log_header):
+    """Check request parameters of set_right
+
+    Returns tuple of: kwargs, error message
+    """
+    return check_set_right_item(json_data, log_header)
+
+
+def set_right_with_ids(cur, kwargs, person_id, organization_id):
+    """Set person right, updating person and organization whose ids are not known
+
+    Returns tuple of: person id, organization id
+    """
+    # Update person
+    if person_id is None:
+        person_id = set_person(
+            cur, kwargs['person']['code'], kwargs['person']['first_name'],
+            kwargs['person']['last_name'])
+
+    # Update organization
+    if organization_id is None:
+        organization_id = set_organization(
+            cur, kwargs['organization']['code'], kwargs['organization']['name'])
+
+    # Revoke existing right if it exists
+    revoke_right(cur, person_id, organization_id, kwargs['right']['right_type'])
+
+    # Add new right
+    add_right(
+        cur, person_id=person_id, organization_id=organization_id,
+        right_type=kwargs['right']['right_type'],
+        valid_from=kwargs['right']['valid_from'],
+        valid_to=kwargs['right']['valid_to'])
+    return person_id, organization_id
+
+
+def set_right_statements(conf, kwargs):
+    """Set person right using separate statements in one transaction
+
+    Person and organization are not updated when id cache contains their ids
+    and names. Cached id is stale only if person or organization was deleted
+    and then the right cannot be added, so change is repeated without cache.
+    """
+    person = kwargs['person']
+    organization = kwargs['organization']
+    person_names = (person['first_name'], person['last_name'])
+    organization_names = (organization['name'],)
+    person_id, person_generation = lookup_id('person', person['code'], person_names)
+    organization_id, organization_generation = lookup_id(
+        'organization', organization['code'], organization_names)
+
+    with db_connection(conf) as conn:
+        with conn.cursor() as cur:
+            try:
+                ids = set_right_with_ids(cur, kwargs, person_id, organization_id)
+            except psycopg2.IntegrityError:
+                if person_id is None and organization_id is None:
+                    raise
+                conn.rollback()
+                discard_id('person', person['code'])
+                discard_id('organization', organization['code'])
+                ids = set_right_with_ids(cur, kwargs, None, None)
+        commit(conn)
+
+    store_id('person', person['code'], ids[0], person_names, person_generation)
+    store_id(
+        'organization', organization['code'], ids[1], organization_names,
+        organization_generation)
+
+
+def process_set_right(conf, json_data, log_header):
+    """Process incoming set_right query"""
+    kwargs, request_error = validate_process_request(
+        conf, validate_set_right_request, json_data, log_header)
+    if request_error:
+        return request_error
+
+    if conf.get('db_set_right_function'):
+        with db_connection(conf) as conn:
+            # Function call is atomic, autocommit avoids separate BEGIN and COMMIT round trips
+            conn.autocommit = True
+            try:
+                with conn.cursor() as cur:
+                    call_set_right(
+                        cur, kwargs['person'], kwargs['organization'], kwargs['right'])
+            finally:
+                conn.autocommit = False
+    else:
+        set_right_statements(conf, kwargs)
+
+    return get_set_right_response(kwargs, log_header)
+
+
+def get_set_right_response(kwargs, log_header):
+    """Get set_right response after the right is added"""
+    LOGGER.info(
+        '%sAdded new Right: person_code=%s, organization_code=%s, right_type=%s', log_header,
+        kwargs['person']['code'], kwargs['organization']['code'],
+        kwargs['right']['right_type'])
+
+    return {'http_status': 201, 'code': 'CREATED', 'msg': 'New right added'}
+
+
+@traced('validate')
+def validate_set_rights_request(json_data, max_items, log_header):
+    """Check request parameters of set_rights
+
+    Each item is validated like a set_right request.
+    Returns tuple of: list of (kwargs, item error message), error message
+    """
+    if not isinstance(json_data, list):
+        LOGGER.warning(
+            '%sINVALID_PARAMETER: Request must be a list of rights', log_header)
+        return None, {
+            'http_status': 400, 'code': 'INVALID_PARAMETER',
+            'msg': 'Request must be a list of rights'}
+
+    if len(json_data) > max_items:
+        LOGGER.warning(
+            '%sINVALID_PARAMETER: Too many rights in request: %s (maximum %s)',
+            log_header, len(json_data), max_items)
+        return None, {
+            'http_status': 400, 'code': 'INVALID_PARAMETER',
+            'msg': f'Too many rights in request: {len(json_data)} (maximum {max_items})'}
+
+    items = []
+    for item in json_data:
+        if isinstance(item, dict):
+            items.append(check_set_right_item(item, log_header))
+        else:
+            LOGGER.warning(
+                '%sINVALID_PARAMETER: Right must be an object (Request: %s)', log_header, item)
+            items.append((None, {
+                'http_status': 400, 'code': 'INVALID_PARAMETER',
+                'msg': 'Right must be an object'}))
+
+    return items, None
+
+
+def merge_set_rights(items):
+    """Merge persons, organizations and rights of set_rights items
+
+    Later names override earlier ones, missing names do not override anything.
+    Returns tuple of: persons dict, organizations dict,
+    dict of (person_code, organization_code, right_type) -> index of last item
+    """
+    persons = {}
+    organizations = {}
+    latest = {}
+    for idx, kwargs in enumerate(items):
+        if kwargs is None:
+            continue
+        person = persons.setdefault(kwargs['person']['code'], [None, None])
+        if kwargs['person']['first_name'] is not None:
+            person[0] = kwargs['person']['first_name']
+        if kwargs['person']['last_name'] is not None:
+            person[1] = kwargs['person']['last_name']
+        organization = kwargs['organization']
+        if organization['name'] is not None or organization['code'] not in organizations:
+            organizations[organization['code']] = organization['name']
+        latest[(
+            kwargs['person']['code'], organization['code'],
+            kwargs['right']['right_type'])] = idx
+    return persons, organizations, latest
+
+
+def set_rights(cur, items):
+    """Set multiple person rights in db
+
+    Items is a list of valid set_right kwargs (or None for invalid items).
+    When the same right is set multiple times then only the last item is applied.
+    Returns list of item statuses (None for invalid items).
+    """
+    persons, organizations, latest = merge_set_rights(items)
+    person_ids = upsert_persons(cur, persons)
+    organization_ids = upsert_organizations(cur, organizations)
+    new_rights = get_new_rights(items, latest, person_ids, organization_ids)
+    revoke_rights_by_keys(cur, [
+        (item['person_id'], item['organization_id'], item['right_type'])
+        for item in new_rights])
+    added = add_rights(cur, new_rights)
+    return get_set_rights_statuses(items, new_rights, added)
+
+
+def get_new_rights(items, latest, person_ids, organization_ids):
+    """Get list of rights to add from set_rights items
+
+    Latest is a dict of (person_code, organization_code, right_type) -> index
+    of last item returned by merge_set_rights.
+    """
+    new_rights = []
+    for (person_code, organization_code, right_type), idx in sorted(latest.items()):
+        new_rights.append({
+            'idx': idx, 'person_id': person_ids[person_code],
+            'organization_id': organization_ids[organization_code], 'right_type': right_type,
+            'valid_from': items[idx]['right']['valid_from'],
+            'valid_to': items[idx]['right']['valid_to']})
+    return new_rights
+
+
+def get_set_rights_statuses(items, new_rights, added):
+    """Get list of set_rights item statuses (None for invalid items)"""
+    statuses = [
+        None if kwargs is None else {
+            'code': 'DUPLICATE', 'msg': 'Right is overridden by a later item'}
+        for kwargs in items]
+    for item in new_rights:
+        if (item['person_id'], item['organization_id'], item['right_type']) in added:
+            statuses[item['idx']] = {'code': 'CREATED', 'msg': 'New right added'}
+        else:
+            statuses[item['idx']] = {
+                'code': 'RIGHT_NOT_ADDED', 'msg': 'Right was rejected by database'}
+    return statuses
+
+
+def process_set_rights(conf, json_data, log_header):
+    """Process incoming set_rights query"""
+    items, request_error = validate_process_request(
+        conf, validate_set_rights_request, json_data, log_header, get_bulk_max_items(conf))
+    if request_error:
+        return request_error
+
+    statuses = [None] * len(items)
+    if any(kwargs is not None for kwargs, _ in items):
+        with db_connection(conf) as conn:
+            with conn.cursor() as cur:
+                statuses = set_rights(cur, [kwargs for kwargs, _ in items])
+            commit(conn)
+
+    return get_set_rights_response(items, statuses, log_header)
+
+
+def get_set_rights_response(items, statuses, log_header):
+    """Get set_rights response from statuses of valid items and errors of invalid items"""
+    for idx, (_, item_error) in enumerate(items):
+        if item_error:
+            statuses[idx] = {'code': item_error['code'], 'msg': item_error['msg']}
+    created = sum(1 for status in statuses if status['code'] == 'CREATED')
+
+    LOGGER.info(
+        '%sAdded %s new Rights, %s items failed', log_header, created, len(statuses) - created)
+
+    return {
+        'http_status': 200, 'code': 'OK',
+        'msg': f'Added {created} of {len(statuses)} rights',
+        'response': {'created': created, 'failed': len(statuses) - created, 'items': statuses}}
+
+
+@traced('validate')
+def validate_revoke_right_request(json_data, log_header):
+    """Check request parameters of revoke_right
+
+    Returns tuple of: kwargs, error message
+    """
+    kwargs = {}
+
+    # Check required parameters
+    req_params = [
+        'person_code',
+        'organization_code',
+        'right_type'
+    ]
+    for param in req_params:
+        kwargs[param], param_error = get_required_parameter(param, json_data, log_header)
+        if param_error:
+            return None, param_error
+
+    return kwargs, None
+
+
+def process_revoke_right(conf, json_data, log_header):
+    """Process incoming revoke_right query"""
+    kwargs, request_error = validate_process_request(
+        conf, validate_revoke_right_request, json_data, log_header)
+    if request_error:
+        return request_error
+
+    person_id, person_generation = lookup_id('person', kwargs['person_code'], ())
+    organization_id, organization_generation = lookup_id(
+        'organization', kwargs['organization_code'], ())
+    with db_connection(conf) as conn:
+        with conn.cursor() as cur:
+            cached = person_id is not None and organization_id is not None \
+                and revoke_right(cur, person_id, organization_id, kwargs['right_type'])
+            if not cached:
+                # Ids are not cached or cached ids may be stale
+                person_id = get_person(cur, kwargs['person_code'])[0]
+                organization_id = get_organization(cur, kwargs['organization_code'])[0]
+
+                # Revoke existing right if it exists
+                if not revoke_right(cur, person_id, organization_id, kwargs['right_type']):
+                    return {
+                        'http_status': 200, 'code': 'RIGHT_NOT_FOUND',
+                        'msg': 'No right was found'}
+        commit(conn)
+
+    if not cached:
+        store_id('person', kwargs['person_code'], person_id, None, person_generation)
+        store_id(
+            'organization', kwargs['organization_code'], organization_id, None,
+            organization_generation)
+
+    return get_revoke_right_response(kwargs, log_header)
+
+
+def get_revoke_right_response(kwargs, log_header):
+    """Get revoke_right response after the right is revoked"""
+    LOGGER.info(
+        '%sRevoked Right: person_code=%s, organization_code=%s, right_type=%s', log_header,
+        kwargs['person_code'], kwargs['organization_code'],
+        kwargs['right_type'])
+
+    return {'http_status': 200, 'code': 'OK', 'msg': 'Right revoked'}
+
+
+@traced('validate')
+def validate_revoke_rights_request(json_data, max_items, log_header):
+    """Check request parameters of revoke_rights
+
+    Each item must contain "person_code" or "organization_code" and may
+    additionally contain "right_type".
+    Returns tuple of: list of (kwargs, item error message), error message
+    """
+    if not isinstance(json_data, list):
+        LOGGER.warning(
+            '%sINVALID_PARAMETER: Request must be a list of rights', log_header)
+        return None, {
+            'http_status': 400, 'code': 'INVALID_PARAMETER',
+            'msg': 'Request must be a list of rights'}
+
+    if len(json_data) > max_items:
+        LOGGER.warning(
+            '%sINVALID_PARAMETER: Too many rights in request: %s (maximum %s)',
+            log_header, len(json_data), max_items)
+        return None, {
+            'http_status': 400, 'code': 'INVALID_PARAMETER',
+            'msg': f'Too many rights in request: {len(json_data)} (maximum {max_items})'}
+
+    items = []
+    for item in json_data:
+        if not isinstance(item, dict):
+            LOGGER.warning(
+                '%sINVALID_PARAMETER: Right must be an object (Request: %s)', log_header, item)
+            items.append((None, {
+                'http_status': 400, 'code': 'INVALID_PARAMETER',
+                'msg': 'Right must be an object'}))
+            continue
+        # Only absent key matches any value, invalid value must not widen the revoke
+        invalid = [
+            key for key in REVOKE_SELECTOR_KEYS
+            if key in item and (not isinstance(item[key], str) or not item[key])]
+        if invalid:
+            LOGGER.warning(
+                '%sINVALID_PARAMETER: Parameter "%s" must be a non-empty string (Request: %s)',
+                log_header, invalid[0], item)
+            items.append((None, {
+                'http_status': 400, 'code': 'INVALID_PARAMETER',
+                'msg': f'Parameter "{invalid[0]}" must be a non-empty string'}))
+            continue
+        kwargs = {key: item.get(key) for key in REVOKE_SELECTOR_KEYS}
+        if kwargs['person_code'] is None and kwargs['organization_code'] is None:
+            LOGGER.warning(
+                '%sMISSING_PARAMETER: Missing parameter "person_code" or "organization_code" '
+                '(Request: %s)', log_header, item)
+            items.append((None, {
+                'http_status': 400, 'code': 'MISSING_PARAMETER',
+                'msg': 'Missing parameter "person_code" or "organization_code"'}))
+            continue
+        items.append((kwargs, None))
+
+    return items, None
+
+
+def process_revoke_rights(conf, json_data, log_header):
+    """Process incoming revoke_rights query"""
+    items, request_error = validate_process_request(
+        conf, validate_revoke_rights_request, json_data, log_header, get_bulk_max_items(conf))
+    if request_error:
+        return request_error
+
+    selectors = get_valid_items(items)
+    total = 0
+    counts = []
+    if selectors:
+        with db_connection(conf) as conn:
+            with conn.cursor() as cur:
+                total, counts = revoke_rights(cur, selectors)
+            commit(conn)
+
+    return get_revoke_rights_response(items, total, counts, log_header)
+
+
+def get_revoke_rights_response(items, total, counts, log_header):
+    """Get revoke_rights response from revoked counts and errors of items"""
+    statuses = []
+    counts = iter(counts)
+    for _, item_error in items:
+        if item_error:
+            statuses.append({'code': item_error['code'], 'msg': item_error['msg'], 'revoked': 0})
+            continue
+        count = next(counts)
+        if count:
+            statuses.append({'code': 'OK', 'msg': 'Rights revoked', 'revoked': count})
+        else:
+            statuses.append({'code': 'RIGHT_NOT_FOUND', 'msg': 'No right was found', 'revoked': 0})
+
+    LOGGER.info('%sRevoked %s Rights', log_header, total)
+
+    return {
+        'http_status': 200, 'code': 'OK',
+        'msg': f'Revoked {total} rights',
+        'response': {'revoked': total, 'items': statuses}}
+
+
+def get_expiration_range(json_data, log_header):
+    """Get range of days to expiration from search_rights request
+
+    Either "days_to_expiration" or "days_to_expiration_range" object with
+    "min" and "max" days (inclusive) can be used.
+    Returns tuple of: (minimum days, maximum days) or None, error message
+    """
+    days = get_int_parameter('days_to_expiration', json_data)
+    days_range = json_data.get('days_to_expiration_range')
+    if days_range is None:
+        return (days, days) if days is not None else None, None
+
+    if days is not None:
+        LOGGER.warning(
+            '%sINVALID_PARAMETER: Parameters "days_to_expiration" and '
+            '"days_to_expiration_range" cannot be used together (Request: %s)',
+            log_header, json_data)
+        return None, {
+            'http_status': 400, 'code': 'INVALID_PARAMETER',
+            'msg': 'Parameters "days_to_expiration" and "days_to_expiration_range" cannot be '
+                   'used together'}
+
+    if not isinstance(days_range, dict) or get_int_parameter('min', days_range) is None \
+            or get_int_parameter('max', days_range) is None \
+            or days_range['min'] > days_range['max']:
+        LOGGER.warning(
+            '%sINVALID_PARAMETER: Invalid days to expiration range (Request: %s)',
+            log_header, json_data)
+        return None, {
+            'http_status': 400, 'code': 'INVALID_PARAMETER',
+            'msg': 'Parameter "days_to_expiration_range" must contain integers "min" and "max" '
+                   'where "min" is not bigger than "max"'}
+
+    return (days_range['min'], days_range['max']), None
+
+
+@traced('validate')
+def validate_search_rights_request(json_data, log_header):
+    """Check request parameters of search_rights
+
+    Presence of "cursor" parameter enables keyset pagination, empty cursor
+    returns the first page.
+    Returns tuple of: kwargs, error message
+    """
+    kwargs = {
+        'persons': get_list_of_strings_parameter('persons', json_data),
+        'organizations': get_list_of_strings_parameter('organizations', json_data),
+        'rights': get_list_of_strings_parameter('rights', json_data),
+        'only_valid': get_bool_parameter('only_valid', json_data),
+        'limit': get_int_parameter('limit', json_data),
+        'offset': get_int_parameter('offset', json_data),
+        'count': json_data.get('count')}
+
+    # Setting default values
+    if kwargs['only_valid'] is None:
+        kwargs['only_valid'] = DEFAULT_ONLY_VALID
+    if kwargs['limit'] is None:
+        kwargs['limit'] = DEFAULT_LIMIT
+    if kwargs['offset'] is None:
+        kwargs['offset'] = DEFAULT_OFFSET
+    if kwargs['count'] is None:
+        kwargs['count'] = DEFAULT_COUNT
+
+    kwargs['days_to_expiration'], range_error = get_expiration_range(json_data, log_header)
+    if range_error:
+        return None, range_error
+
+    if kwargs['count'] not in COUNT_MODES:
+        LOGGER.warning(
+            '%sINVALID_PARAMETER: Invalid count mode (Request: %s)', log_header, json_data)
+        return None, {
+            'http_status': 400, 'code': 'INVALID_PARAMETER',
+            'msg': f'Invalid parameter "count", allowed values: {", ".join(COUNT_MODES)}'}
+
+    kwargs['after_id'] = None
+    if 'cursor' in json_data:
+        if kwargs['offset']:
+            LOGGER.warning(
+                '%sINVALID_PARAMETER: Parameters "cursor" and "offset" cannot be used together '
+                '(Request: %s)', log_header, json_data)
+            return None, {
+                'http_status': 400, 'code': 'INVALID_PARAMETER',
+                'msg': 'Parameters "cursor" and "offset" cannot be used together'}
+        if kwargs['limit'] < 1:
+            # Page without rights has no id for "next_cursor"
+            LOGGER.warning(
+                '%sINVALID_PARAMETER: Parameter "limit" must be positive with "cursor" '
+                '(Request: %s)', log_header, json_data)
+            return None, {
+                'http_status': 400, 'code': 'INVALID_PARAMETER',
+                'msg': 'Parameter "limit" must be positive with "cursor"'}
+        try:
+            kwargs['after_id'] = decode_cursor(json_data['cursor'])
+        except ValueError:
+            LOGGER.warning(
+                '%sINVALID_PARAMETER: Invalid cursor (Request: %s)', log_header, json_data)
+            return None, {
+                'http_status': 400, 'code': 'INVALID_PARAMETER',
+                'msg': 'Invalid parameter "cursor"'}
+
+    return kwargs, None
+
+
+def process_search_rights(conf, json_data, log_header):
+    """Process incoming search_rights query"""
+    kwargs, request_error = validate_process_request(
+        conf, validate_search_rights_request, json_data, log_header)
     if request_error:
         return request_error
+    SQL_CONTEXT.set((log_header, kwargs))
 
-    with get_db_connection(conf) as conn:
-        with conn.cursor() as cur:
-            # Update person
-            person_id = set_person(
-                cur, kwargs['person']['code'], kwargs['person']['first_name'],
-                kwargs['person']['last_name'])
-
-            # Update organization
-            organization_id = set_organization(
-                cur, kwargs['organization']['code'], kwargs['organization']['name'])
-
-            # Revoke existing right if it exists
-            revoke_right(cur, person_id, organization_id, kwargs['right']['right_type'])
-
-            # Add new right
-            add_right(
-                cur, person_id=person_id, organization_id=organization_id,
-                right_type=kwargs['right']['right_type'],
-                valid_from=kwargs['right']['valid_from'],
-                valid_to=kwargs['right']['valid_to'])
-        conn.commit()
-
-    LOGGER.info(
-        '%sAdded new Right: person_code=%s, organization_code=%s, right_type=%s', log_header,
-        kwargs['person']['code'], kwargs['organization']['code'],
-        kwargs['right']['right_type'])
-
-    return {'http_status': 201, 'code': 'CREATED', 'msg': 'New right added'}
-
-
-def validate_revoke_right_request(json_data, log_header):
-    """Check request parameters of revoke_right
+    result, cached = cached_search_rights(conf, kwargs)
+    if cached:
+        LOGGER.debug('%sSearch result found in cache', log_header)
 
-    Returns tuple of: kwargs, error message
-    """
-    kwargs = {}
+    return get_search_rights_response(kwargs, result, log_header)
 
-    # Check required parameters
-    req_params = [
-        'person_code',
-        'organization_code',
-        'right_type'
-    ]
-    for param in req_params:
-        kwargs[param], param_error = get_required_parameter(param, json_data, log_header)
-        if param_error:
-            return None, param_error
 
-    return kwargs, None
+def get_search_rights_response(kwargs, result, log_header):
+    """Get search_rights response from search result"""
+    if kwargs['after_id'] is None:
+        LOGGER.info(
+            '%sFound %s rights (%s count), returning %s rights with offset %s',
+            log_header, result['total'], result['count'], len(result['rights']),
+            result['offset'])
+    else:
+        LOGGER.info(
+            '%sFound %s rights (%s count), returning %s rights with cursor',
+            log_header, result['total'], result['count'], len(result['rights']))
 
+    msg = f"Found {result['total']} rights"
+    if result['total'] is None:
+        msg = f"Returning {len(result['rights'])} rights"
+    return {
+        'http_status': 200, 'code': 'OK',
+        'msg': msg,
+        'response': result}
 
-def process_revoke_right(conf, json_data, log_header):
-    """Process incoming revoke_right query"""
-    conf_error = validate_config(conf, log_header)
-    if conf_error:
-        return conf_error
 
-    kwargs, request_error = validate_revoke_right_request(json_data, log_header)
+def process_search_rights_stream(conf, json_data, log_header):
+    """Process incoming search_rights query with streaming response"""
+    kwargs, request_error = validate_process_request(
+        conf, validate_search_rights_request, json_data, log_header)
     if request_error:
         return request_error
+    SQL_CONTEXT.set((log_header, kwargs))
 
-    with get_db_connection(conf) as conn:
-        with conn.cursor() as cur:
-            person_id = get_person(cur, kwargs['person_code'])[0]
-            organization_id = get_organization(cur, kwargs['organization_code'])[0]
+    lines = stream_search_rights(conf, kwargs, log_header)
+    # Executing query before response status is sent
+    next(lines)
 
-            # Revoke existing right if it exists
-            if not revoke_right(cur, person_id, organization_id, kwargs['right_type']):
-                return {'http_status': 200, 'code': 'RIGHT_NOT_FOUND', 'msg': 'No right was found'}
-        conn.commit()
+    return get_stream_response('Streaming rights', lines, NDJSON_MIMETYPE)
 
-    LOGGER.info(
-        '%sRevoked Right: person_code=%s, organization_code=%s, right_type=%s', log_header,
-        kwargs['person_code'], kwargs['organization_code'],
-        kwargs['right_type'])
 
-    return {'http_status': 200, 'code': 'OK', 'msg': 'Right revoked'}
+def get_stream_response(msg, stream, mimetype):
+    """Get response with generator of response body"""
+    return {
+        'http_status': 200, 'code': 'OK',
+        'msg': msg,
+        'stream': stream, 'mimetype': mimetype}
 
 
-def validate_search_rights_request(json_data):
-    """Check request parameters of search_rights
+@traced('validate')
+def validate_export_rights_request(json_data, log_header):
+    """Check request parameters of export_rights
 
-    Validation never fails (no required parameters)
-    Returns: kwargs
+    Filters are the same as in search_rights request.
+    Returns tuple of: kwargs, error message
     """
     kwargs = {
         'persons': get_list_of_strings_parameter('persons', json_data),
         'organizations': get_list_of_strings_parameter('organizations', json_data),
         'rights': get_list_of_strings_parameter('rights', json_data),
         'only_valid': get_bool_parameter('only_valid', json_data),
-        'days_to_expiration': get_int_parameter('days_to_expiration', json_data),
-        'limit': get_int_parameter('limit', json_data),
-        'offset': get_int_parameter('offset', json_data)}
+        'format': json_data.get('format'),
+        'limit': None, 'offset': None, 'after_id': None}
 
     # Setting default values
     if kwargs['only_valid'] is None:
         kwargs['only_valid'] = DEFAULT_ONLY_VALID
-    if kwargs['limit'] is None:
-        kwargs['limit'] = DEFAULT_LIMIT
-    if kwargs['offset'] is None:
-        kwargs['offset'] = DEFAULT_OFFSET
+    if kwargs['format'] is None:
+        kwargs['format'] = DEFAULT_EXPORT_FORMAT
 
-    return kwargs
+    if kwargs['format'] not in EXPORT_MIMETYPES:
+        LOGGER.warning(
+            '%sINVALID_PARAMETER: Invalid export format (Request: %s)', log_header, json_data)
+        return None, {
+            'http_status': 400, 'code': 'INVALID_PARAMETER',
+            'msg': f'Invalid parameter "format", allowed values: {", ".join(EXPORT_MIMETYPES)}'}
 
+    kwargs['days_to_expiration'], range_error = get_expiration_range(json_data, log_header)
+    if range_error:
+        return None, range_error
 
-def process_search_rights(conf, json_data, log_header):
-    """Process incoming search_rights query"""
-    conf_error = validate_config(conf, log_header)
-    if conf_error:
-        return conf_error
+    return kwargs, None
 
-    kwargs = validate_search_rights_request(json_data)
 
-    with get_db_connection(conf) as conn:
-        with conn.cursor() as cur:
-            result = search_rights(
-                cur, **kwargs)
+def process_export_rights(conf, json_data, log_header):
+    """Process incoming export_rights query"""
+    kwargs, request_error = validate_process_request(
+        conf, validate_export_rights_request, json_data, log_header)
+    if request_error:
+        return request_error
 
-    LOGGER.info(
-        '%sFound %s rights, returning %s rights with offset %s',
-        log_header, result['total'], len(result['rights']), result['offset'])
+    chunks = export_rights(conf, kwargs, log_header)
+    # Starting export before response status is sent
+    next(chunks)
 
-    return {
-        'http_status': 200, 'code': 'OK',
-        'msg': f"Found {result['total']} rights",
-        'response': result}
+    return get_stream_response('Exporting rights', chunks, EXPORT_MIMETYPES[kwargs['format']])
 
 
+@traced('validate')
 def validate_set_person_request(json_data, log_header):
     """Check request parameters of set_person
 
@@ -665,24 +3110,32 @@ def validate_set_person_request(json_data, log_header):
 
 def process_set_person(conf, json_data, log_header):
     """Process incoming set_person query"""
-    conf_error = validate_config(conf, log_header)
-    if conf_error:
-        return conf_error
-
-    kwargs, request_error = validate_set_person_request(json_data, log_header)
+    kwargs, request_error = validate_process_request(
+        conf, validate_set_person_request, json_data, log_header)
     if request_error:
         return request_error
 
-    with get_db_connection(conf) as conn:
-        with conn.cursor() as cur:
-            set_person(cur, kwargs['code'], kwargs['first_name'], kwargs['last_name'])
-        conn.commit()
+    names = (kwargs['first_name'], kwargs['last_name'])
+    person_id, generation = lookup_id('person', kwargs['code'], names)
+    if person_id is None:
+        with db_connection(conf) as conn:
+            with conn.cursor() as cur:
+                person_id = set_person(
+                    cur, kwargs['code'], kwargs['first_name'], kwargs['last_name'])
+            commit(conn)
+        store_id('person', kwargs['code'], person_id, names, generation)
+
+    return get_set_person_response(kwargs, log_header)
+
 
+def get_set_person_response(kwargs, log_header):
+    """Get set_person response after the person is updated"""
     LOGGER.info('%sPerson updated: code=%s', log_header, kwargs['code'])
 
     return {'http_status': 200, 'code': 'OK', 'msg': 'Person updated'}
 
 
+@traced('validate')
 def validate_set_organization_request(json_data, log_header):
     """Check request parameters of set_organization
 
@@ -703,23 +3156,29 @@ def validate_set_organization_request(json_data, log_header):
 
 def process_set_organization(conf, json_data, log_header):
     """Process incoming set_organization query"""
-    conf_error = validate_config(conf, log_header)
-    if conf_error:
-        return conf_error
-
-    kwargs, request_error = validate_set_organization_request(json_data, log_header)
+    kwargs, request_error = validate_process_request(
+        conf, validate_set_organization_request, json_data, log_header)
     if request_error:
         return request_error
 
-    with get_db_connection(conf) as conn:
-        with conn.cursor() as cur:
-            set_organization(cur, kwargs['code'], kwargs['name'])
-        conn.commit()
+    organization_id, generation = lookup_id('organization', kwargs['code'], (kwargs['name'],))
+    if organization_id is None:
+        with db_connection(conf) as conn:
+            with conn.cursor() as cur:
+                organization_id = set_organization(cur, kwargs['code'], kwargs['name'])
+            commit(conn)
+        store_id('organization', kwargs['code'], organization_id, (kwargs['name'],), generation)
+
+    return get_set_organization_response(kwargs, log_header)
 
+
+def get_set_organization_response(kwargs, log_header):
+    """Get set_organization response after the organization is updated"""
     LOGGER.info('%sOrganization updated: code=%s', log_header, kwargs['code'])
     return {'http_status': 200, 'code': 'OK', 'msg': 'Organization updated'}
 
 
+@traced('check_client')
 def check_client(config, client_dn):
     """Check if client dn is in whitelist"""
     if config.get('allow_all', False) is True:
@@ -737,10 +3196,15 @@ def check_client(config, client_dn):
 
 def incorrect_client(client_dn, log_header):
     """Return error response when client is not allowed"""
+    return make_response(get_incorrect_client_response(client_dn, log_header), log_header)
+
+
+def get_incorrect_client_response(client_dn, log_header):
+    """Get error response when client is not allowed"""
     LOGGER.error('%sFORBIDDEN: Client certificate is not allowed: %s', log_header, client_dn)
-    return make_response({
+    return {
         'http_status': 403, 'code': 'FORBIDDEN',
-        'msg': f'Client certificate is not allowed: {client_dn}'}, log_header)
+        'msg': f'Client certificate is not allowed: {client_dn}'}
 
 
 def test_db(conf, log_header):
@@ -749,23 +3213,148 @@ def test_db(conf, log_header):
     if conf_error:
         return conf_error
 
-    with get_db_connection(conf) as conn:
+    with db_read_connection(conf) as conn:
         with conn.cursor() as cur:
-            cur.execute("""select count(1) from rights."right";""")
+            execute_sql(cur, 'test_db', 'select 1')
+            cur.fetchone()
             return {
                 'http_status': 200, 'code': 'OK',
                 'msg': 'API is ready'}
 
 
+def get_cached_status(status, check, conf, log_header):
+    """Get result of status check, result is cached for "status_cache_ttl" seconds
+
+    Failures are cached too, so that frequent probes do not overload database
+    that is already unavailable. Concurrent probes wait for a single check.
+    """
+    with READY_STATUS_LOCK:
+        now = time.monotonic()
+        if status['response'] is not None and status['expires'] > now:
+            return status['response']
+        try:
+            response = check(conf, log_header)
+        except psycopg2.Error as err:
+            response = get_db_error(log_header, err)
+        status['response'] = response
+        status['expires'] = now + conf.get('status_cache_ttl', DEFAULT_STATUS_CACHE_TTL)
+        return response
+
+
+def get_ready_status(conf, log_header):
+    """Get readiness status, result is cached for "status_cache_ttl" seconds"""
+    return get_cached_status(READY_STATUS, test_db, conf, log_header)
+
+
+def get_deep_status_disabled(conf, log_header):
+    """Get error response if deep readiness check is not enabled by configuration
+
+    Readiness endpoints do not require client certificate.
+    """
+    if conf.get('status_deep_check', False) is True:
+        return None
+    LOGGER.warning('%sFORBIDDEN: Deep readiness check is not enabled', log_header)
+    return {
+        'http_status': 403, 'code': 'FORBIDDEN',
+        'msg': 'Deep readiness check is not enabled'}
+
+
+def get_deep_ready_status(conf, log_header):
+    """Get deep readiness status, result is cached like readiness status"""
+    disabled_error = get_deep_status_disabled(conf, log_header)
+    if disabled_error:
+        return disabled_error
+    return get_cached_status(DEEP_STATUS, get_deep_status, conf, log_header)
+
+
+SQL_DATABASE_ROLE = """
+                select pg_is_in_recovery(), case when pg_is_in_recovery()
+                    then extract(epoch from now() - pg_last_xact_replay_timestamp()) end"""
+
+
+def get_deep_status(conf, log_header):
+    """Get database role, replication lag and pool saturation"""
+    conf_error = validate_config(conf, log_header)
+    if conf_error:
+        return conf_error
+
+    with db_connection(conf) as conn:
+        with conn.cursor() as cur:
+            execute_sql(cur, 'database_role', SQL_DATABASE_ROLE)
+            in_recovery, lag = cur.fetchone()
+
+    return get_deep_status_response(
+        in_recovery, lag, None if DB_POOL is None else DB_POOL.stats(), REPLICAS)
+
+
+def get_deep_status_response(in_recovery, lag, pool_stats, replicas=None):
+    """Get deep readiness response from database role, lag and pool statistics"""
+    response = {
+        'role': 'replica' if in_recovery else 'primary',
+        'replication_lag': None if lag is None else float(lag)}
+    if pool_stats is not None:
+        response['pool'] = get_pool_saturation(pool_stats)
+    if replicas is not None:
+        response['replicas'] = replicas.stats()
+    if LOG_QUEUE_HANDLER is not None:
+        response['log_queue'] = LOG_QUEUE_HANDLER.stats()
+    return {
+        'http_status': 200, 'code': 'OK',
+        'msg': 'API is ready',
+        'response': response}
+
+
+def get_pool_saturation(stats):
+    """Get saturation summary from connection pool statistics"""
+    return {
+        'in_use': stats['in_use'], 'max_size': stats['max_size'],
+        'saturation': round(stats['in_use'] / stats['max_size'], 3),
+        'waits': stats['waits'], 'timeouts': stats['timeouts']}
+
+
+def get_pool_status(log_header):
+    """Get database connection pool statistics"""
+    if DB_POOL is None:
+        LOGGER.warning('%sDB pool is not initialized', log_header)
+        return {
+            'http_status': 200, 'code': 'POOL_DISABLED',
+            'msg': 'Database connection pool is not initialized'}
+
+    return {
+        'http_status': 200, 'code': 'OK',
+        'msg': 'Database connection pool statistics',
+        'response': DB_POOL.stats()}
+
+
 def get_log_header(method):
-    """Get log header string"""
-    trace_id = request.headers.get('X-B3-TraceId')
+    """Get log header string
+
+    Trace and span ids of traced request are used in log header. Log header
+    is also remembered for logging slow SQL statements of request.
+    """
+    context = TRACE_CONTEXT.get()
+    if context is None:
+        log_header = format_log_header(method, request.headers.get('X-B3-TraceId'))
+    else:
+        log_header = format_log_header(method, context[1]['traceId'], context[1]['id'])
+    SQL_CONTEXT.set((log_header, None))
+    return log_header
+
+
+def format_log_header(method, trace_id, span_id=None):
+    """Format log header string of request method and optional trace id"""
     if trace_id:
-        return f'[{method} {trace_id},{uuid.uuid4()}] '
+        return f'[{method} {trace_id},{span_id or uuid.uuid4()}] '
 
     return f'[{method}] '
 
 
+@traced('parse_json')
+def get_request_json():
+    """Parse JSON body of request"""
+    return request.get_json(force=True)
+
+
 class SetRightApi(Resource):  # pylint: disable=too-few-public-methods
     """SetRight API class for Flask"""
     def __init__(self, config):
@@ -774,10 +3363,11 @@ class SetRightApi(Resource):  # pylint: disable=too-few-public-methods
     def post(self):
         """POST method for changing or adding right"""
         log_header = get_log_header('SetRight:post')
-        json_data = request.get_json(force=True)
+        json_data = get_request_json()
         client_dn = request.headers.get('X-Ssl-Client-S-Dn')
 
-        LOGGER.info('%s%s: %s', log_header, INCOMING_REQUEST_MSG, json_data)
+        LOGGER.info(
+            '%s%s: %s', log_header, INCOMING_REQUEST_MSG, summarize_log_data(json_data))
         LOGGER.info('%s%s: %s', log_header, CLIENT_DN_MSG, client_dn)
 
         if not check_client(self.config, client_dn):
@@ -786,12 +3376,36 @@ class SetRightApi(Resource):  # pylint: disable=too-few-public-methods
         try:
             response = process_set_right(self.config, json_data, log_header)
         except psycopg2.Error as err:
-            LOGGER.error('%sDB_ERROR: %s: %s', log_header, DB_ERROR_MSG, err)
-            response = {
-                'http_status': 500, 'code': 'DB_ERROR',
-                'msg': DB_ERROR_MSG}
+            response = get_db_error(log_header, err)
+
+        return make_response(response, log_header, float_free=True)
+
+
+class SetRightsApi(Resource):  # pylint: disable=too-few-public-methods
+    """SetRights API class for Flask"""
+    def __init__(self, config):
+        self.config = config
+
+    def post(self):
+        """POST method for changing or adding multiple rights"""
+        log_header = get_log_header('SetRights:post')
+        json_data = get_request_json()
+        client_dn = request.headers.get('X-Ssl-Client-S-Dn')
+
+        LOGGER.info(
+            '%s%s: %s', log_header, INCOMING_REQUEST_MSG, summarize_log_data(json_data))
+        LOGGER.info('%s%s: %s', log_header, CLIENT_DN_MSG, client_dn)
+
+        if not check_client(self.config, client_dn):
+            return incorrect_client(client_dn, log_header)
+
+        try:
+            response = process_set_rights(self.config, json_data, log_header)
+        except psycopg2.Error as err:
+            response = get_db_error(log_header, err)
 
-        return make_response(response, log_header)
+        # Logging responses (that may be big) only on DEBUG level
+        return make_response(response, log_header, log_level='debug', float_free=True)
 
 
 class RevokeRightApi(Resource):  # pylint: disable=too-few-public-methods
@@ -802,10 +3416,11 @@ class RevokeRightApi(Resource):  # pylint: disable=too-few-public-methods
     def post(self):
         """POST method for revoking right"""
         log_header = get_log_header('RevokeRight:post')
-        json_data = request.get_json(force=True)
+        json_data = get_request_json()
         client_dn = request.headers.get('X-Ssl-Client-S-Dn')
 
-        LOGGER.info('%s%s: %s', log_header, INCOMING_REQUEST_MSG, json_data)
+        LOGGER.info(
+            '%s%s: %s', log_header, INCOMING_REQUEST_MSG, summarize_log_data(json_data))
         LOGGER.info('%s%s: %s', log_header, CLIENT_DN_MSG, client_dn)
 
         if not check_client(self.config, client_dn):
@@ -814,12 +3429,36 @@ class RevokeRightApi(Resource):  # pylint: disable=too-few-public-methods
         try:
             response = process_revoke_right(self.config, json_data, log_header)
         except psycopg2.Error as err:
-            LOGGER.error('%sDB_ERROR: %s: %s', log_header, DB_ERROR_MSG, err)
-            response = {
-                'http_status': 500, 'code': 'DB_ERROR',
-                'msg': DB_ERROR_MSG}
+            response = get_db_error(log_header, err)
+
+        return make_response(response, log_header, float_free=True)
+
+
+class RevokeRightsApi(Resource):  # pylint: disable=too-few-public-methods
+    """RevokeRights API class for Flask"""
+    def __init__(self, config):
+        self.config = config
+
+    def post(self):
+        """POST method for revoking multiple rights"""
+        log_header = get_log_header('RevokeRights:post')
+        json_data = get_request_json()
+        client_dn = request.headers.get('X-Ssl-Client-S-Dn')
+
+        LOGGER.info(
+            '%s%s: %s', log_header, INCOMING_REQUEST_MSG, summarize_log_data(json_data))
+        LOGGER.info('%s%s: %s', log_header, CLIENT_DN_MSG, client_dn)
+
+        if not check_client(self.config, client_dn):
+            return incorrect_client(client_dn, log_header)
+
+        try:
+            response = process_revoke_rights(self.config, json_data, log_header)
+        except psycopg2.Error as err:
+            response = get_db_error(log_header, err)
 
-        return make_response(response, log_header)
+        # Logging responses (that may be big) only on DEBUG level
+        return make_response(response, log_header, log_level='debug', float_free=True)
 
 
 class RightsApi(Resource):  # pylint: disable=too-few-public-methods
@@ -830,25 +3469,68 @@ class RightsApi(Resource):  # pylint: disable=too-few-public-methods
     def post(self):
         """POST method for searching for rights"""
         log_header = get_log_header('Rights:post')
-        json_data = request.get_json(force=True)
+        json_data = get_request_json()
         client_dn = request.headers.get('X-Ssl-Client-S-Dn')
 
-        LOGGER.info('%s%s: %s', log_header, INCOMING_REQUEST_MSG, json_data)
+        LOGGER.info(
+            '%s%s: %s', log_header, INCOMING_REQUEST_MSG, summarize_log_data(json_data))
         LOGGER.info('%s%s: %s', log_header, CLIENT_DN_MSG, client_dn)
 
         if not check_client(self.config, client_dn):
             return incorrect_client(client_dn, log_header)
 
+        # Streaming is requested with Accept header or "stream" parameter
+        stream = request.accept_mimetypes.best == NDJSON_MIMETYPE \
+            or (isinstance(json_data, dict) and json_data.get('stream') is True)
+
         try:
-            response = process_search_rights(self.config, json_data, log_header)
+            if stream:
+                response = process_search_rights_stream(self.config, json_data, log_header)
+            else:
+                response = process_search_rights(self.config, json_data, log_header)
         except psycopg2.Error as err:
-            LOGGER.error('%sDB_ERROR: %s: %s', log_header, DB_ERROR_MSG, err)
-            response = {
-                'http_status': 500, 'code': 'DB_ERROR',
-                'msg': DB_ERROR_MSG}
+            response = get_db_error(log_header, err)
+
+        if 'stream' in response:
+            # Disabling Nginx buffering so that rights reach client as they are fetched
+            return Response(
+                response['stream'], mimetype=NDJSON_MIMETYPE,
+                headers={'X-Accel-Buffering': 'no'})
 
         # Logging responses (that may be big) only on DEBUG level
-        return make_response(response, log_header, log_level='debug')
+        return make_response(response, log_header, log_level='debug', float_free=True)
+
+
+class ExportRightsApi(Resource):  # pylint: disable=too-few-public-methods
+    """ExportRights API class for Flask"""
+    def __init__(self, config):
+        self.config = config
+
+    def post(self):
+        """POST method for exporting rights"""
+        log_header = get_log_header('ExportRights:post')
+        json_data = get_request_json()
+        client_dn = request.headers.get('X-Ssl-Client-S-Dn')
+
+        LOGGER.info(
+            '%s%s: %s', log_header, INCOMING_REQUEST_MSG, summarize_log_data(json_data))
+        LOGGER.info('%s%s: %s', log_header, CLIENT_DN_MSG, client_dn)
+
+        if not check_client(self.config, client_dn):
+            return incorrect_client(client_dn, log_header)
+
+        try:
+            response = process_export_rights(self.config, json_data, log_header)
+        except psycopg2.Error as err:
+            response = get_db_error(log_header, err)
+
+        if 'stream' in response:
+            # Disabling Nginx buffering so that export reaches client as it is produced
+            return Response(
+                response['stream'], mimetype=response['mimetype'],
+                headers={'X-Accel-Buffering': 'no'})
+
+        return make_response(response, log_header, float_free=True)
 
 
 class PersonApi(Resource):  # pylint: disable=too-few-public-methods
@@ -859,10 +3541,11 @@ class PersonApi(Resource):  # pylint: disable=too-few-public-methods
     def post(self):
         """POST method form changing or adding person"""
         log_header = get_log_header('Person:post')
-        json_data = request.get_json(force=True)
+        json_data = get_request_json()
         client_dn = request.headers.get('X-Ssl-Client-S-Dn')
 
-        LOGGER.info('%s%s: %s', log_header, INCOMING_REQUEST_MSG, json_data)
+        LOGGER.info(
+            '%s%s: %s', log_header, INCOMING_REQUEST_MSG, summarize_log_data(json_data))
         LOGGER.info('%s%s: %s', log_header, CLIENT_DN_MSG, client_dn)
 
         if not check_client(self.config, client_dn):
@@ -871,12 +3554,9 @@ class PersonApi(Resource):  # pylint: disable=too-few-public-methods
         try:
             response = process_set_person(self.config, json_data, log_header)
         except psycopg2.Error as err:
-            LOGGER.error('%sDB_ERROR: %s: %s', log_header, DB_ERROR_MSG, err)
-            response = {
-                'http_status': 500, 'code': 'DB_ERROR',
-                'msg': DB_ERROR_MSG}
+            response = get_db_error(log_header, err)
 
-        return make_response(response, log_header)
+        return make_response(response, log_header, float_free=True)
 
 
 class OrganizationApi(Resource):  # pylint: disable=too-few-public-methods
@@ -887,10 +3567,11 @@ class OrganizationApi(Resource):  # pylint: disable=too-few-public-methods
     def post(self):
         """POST method for changing or adding organization"""
         log_header = get_log_header('Organization:post')
-        json_data = request.get_json(force=True)
+        json_data = get_request_json()
         client_dn = request.headers.get('X-Ssl-Client-S-Dn')
 
-        LOGGER.info('%s%s: %s', log_header, INCOMING_REQUEST_MSG, json_data)
+        LOGGER.info(
+            '%s%s: %s', log_header, INCOMING_REQUEST_MSG, summarize_log_data(json_data))
         LOGGER.info('%s%s: %s', log_header, CLIENT_DN_MSG, client_dn)
 
         if not check_client(self.config, client_dn):
@@ -899,12 +3580,9 @@ class OrganizationApi(Resource):  # pylint: disable=too-few-public-methods
         try:
             response = process_set_organization(self.config, json_data, log_header)
         except psycopg2.Error as err:
-            LOGGER.error('%sDB_ERROR: %s: %s', log_header, DB_ERROR_MSG, err)
-            response = {
-                'http_status': 500, 'code': 'DB_ERROR',
-                'msg': DB_ERROR_MSG}
+            response = get_db_error(log_header, err)
 
-        return make_response(response, log_header)
+        return make_response(response, log_header, float_free=True)
 
 
 class StatusApi(Resource):  # pylint: disable=too-few-public-methods
@@ -916,30 +3594,179 @@ class StatusApi(Resource):  # pylint: disable=too-few-public-methods
         """GET method"""
         log_header = get_log_header('Status:get')
         LOGGER.info('%sIncoming status request', log_header)
+        return make_response(get_ready_status(self.config, log_header), log_header)
 
-        try:
-            response = test_db(self.config, log_header)
-        except psycopg2.Error as err:
-            LOGGER.error('%sDB_ERROR: %s: %s', log_header, DB_ERROR_MSG, err)
-            response = {
-                'http_status': 500, 'code': 'DB_ERROR',
-                'msg': DB_ERROR_MSG}
 
-        return make_response(response, log_header)
+class LiveStatusApi(Resource):  # pylint: disable=too-few-public-methods
+    """Liveness status API class for Flask"""
+    def __init__(self, config):
+        self.config = config
+
+    def get(self):
+        """GET method"""
+        log_header = get_log_header('LiveStatus:get')
+        LOGGER.info('%sIncoming liveness status request', log_header)
+        return make_response(
+            {'http_status': 200, 'code': 'OK', 'msg': 'API is live'}, log_header)
+
+
+class ReadyStatusApi(Resource):  # pylint: disable=too-few-public-methods
+    """Readiness status API class for Flask"""
+    def __init__(self, config):
+        self.config = config
+
+    def get(self):
+        """GET method"""
+        log_header = get_log_header('ReadyStatus:get')
+        LOGGER.info('%sIncoming readiness status request', log_header)
+
+        if request.args.get('deep', '').lower() not in ('true', '1'):
+            return make_response(get_ready_status(self.config, log_header), log_header)
+
+        return make_response(get_deep_ready_status(self.config, log_header), log_header)
+
+
+class PoolStatusApi(Resource):  # pylint: disable=too-few-public-methods
+    """Database pool status API class for Flask"""
+    def __init__(self, config):
+        self.config = config
+
+    def get(self):
+        """GET method"""
+        log_header = get_log_header('PoolStatus:get')
+        LOGGER.info('%sIncoming pool status request', log_header)
+        return make_response(get_pool_status(log_header), log_header)
+
+
+def get_metrics():
+    """Get metrics in Prometheus text format
+
+    Metrics of all workers are collected when PROMETHEUS_MULTIPROC_DIR
+    environment variable is set, otherwise only of current worker.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = prometheus_client.CollectorRegistry()
+        prometheus_client.multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry)
+
+
+class MetricsApi(Resource):  # pylint: disable=too-few-public-methods
+    """Prometheus metrics API class for Flask"""
+    def __init__(self, config):
+        self.config = config
+
+    def get(self):
+        """GET method"""
+        log_header = get_log_header('Metrics:get')
+        # Metrics are scraped frequently
+        LOGGER.debug('%sIncoming metrics request', log_header)
+        return Response(get_metrics(), content_type=prometheus_client.CONTENT_TYPE_LATEST)
+
+
+def get_resource_name():
+    """Get name of API resource that handles request"""
+    view = current_app.view_functions.get(request.endpoint)
+    return 'unknown' if view is None else view.view_class.__name__.removesuffix('Api')
+
+
+def start_request_timer():
+    """Remember start time of request"""
+    g.request_start = time.perf_counter()
+    g.pop('response_code', None)
+
+
+def observe_request(response):
+    """Record duration of request by resource and response code
+
+    Responses without API response code (streams and errors of Flask) are
+    labeled with HTTP status. Duration of streams ends when streaming starts.
+    """
+    REQUEST_DURATION.labels(
+        get_resource_name(), g.get('response_code', str(response.status_code))).observe(
+            time.perf_counter() - g.request_start)
+    return response
+
+
+def start_trace():
+    """Start trace of request if it is sampled"""
+    span = TRACER.start(get_resource_name(), request.headers)
+    TRACE_CONTEXT.set(None if span is None else ([], span))
+    g.trace_start = time.perf_counter_ns()
+
+
+def finish_trace(response):
+    """Finish server span of request and export spans of request
+
+    Spans of streamed responses end when streaming starts.
+    """
+    context = TRACE_CONTEXT.get()
+    if context is None:
+        return response
+    TRACE_CONTEXT.set(None)
+    spans, span = context
+    span['duration'] = max((time.perf_counter_ns() - g.trace_start) // 1000, 1)
+    span['tags'] = {
+        'http.method': request.method, 'http.path': request.path,
+        'http.status_code': str(response.status_code),
+        'code': g.get('response_code', str(response.status_code))}
+    TRACER.export(spans + [span])
+    return response
+
+
+def start_server_timing():
+    """Start collecting phase durations of request"""
+    SERVER_TIMING.set({})
+    g.server_timing_start = time.perf_counter()
+
+
+def add_server_timing_header(response):
+    """Add Server-Timing header with phase durations and total duration of request
+
+    Durations of streamed responses end when streaming starts.
+    """
+    timings = SERVER_TIMING.get()
+    if timings is None:
+        return response
+    SERVER_TIMING.set(None)
+    timings['total'] = time.perf_counter() - g.server_timing_start
+    response.headers['Server-Timing'] = format_server_timing(timings)
+    return response
 
 
 def create_app(config_file=DEFAULT_CONFIG_FILE):
     """Create Flask application"""
     config = configure_app(config_file)
+    init_db_pool(config)
+    init_replicas(config)
+    init_slow_query_log(config)
+    init_caches(config)
 
     app = Flask(__name__)
+    app.before_request(start_request_timer)
+    app.after_request(observe_request)
+    if init_tracing(config) is not None:
+        app.before_request(start_trace)
+        app.after_request(finish_trace)
+    if config.get('server_timing'):
+        app.before_request(start_server_timing)
+        app.after_request(add_server_timing_header)
     api = Api(app)
     api.add_resource(SetRightApi, '/set-right', resource_class_kwargs={'config': config})
+    api.add_resource(SetRightsApi, '/set-rights', resource_class_kwargs={'config': config})
     api.add_resource(RevokeRightApi, '/revoke-right', resource_class_kwargs={'config': config})
+    api.add_resource(RevokeRightsApi, '/revoke-rights', resource_class_kwargs={'config': config})
     api.add_resource(RightsApi, '/rights', resource_class_kwargs={'config': config})
+    api.add_resource(
+        ExportRightsApi, '/rights/export', resource_class_kwargs={'config': config})
     api.add_resource(PersonApi, '/person', resource_class_kwargs={'config': config})
     api.add_resource(OrganizationApi, '/organization', resource_class_kwargs={'config': config})
     api.add_resource(StatusApi, '/status', resource_class_kwargs={'config': config})
+    api.add_resource(LiveStatusApi, '/status/live', resource_class_kwargs={'config': config})
+    api.add_resource(ReadyStatusApi, '/status/ready', resource_class_kwargs={'config': config})
+    api.add_resource(PoolStatusApi, '/status/pool', resource_class_kwargs={'config': config})
+    api.add_resource(MetricsApi, '/metrics', resource_class_kwargs={'config': config})
 
     LOGGER.info('Starting Rights API v%s', __version__)
 
@@ -0,0 +1,826 @@
+#!/usr/bin/env python3
+
+"""This is an ASGI entry point of Rights storage API.
+
+Alternative to the Flask application created by rights.create_app. Requests
+are handled by asyncio and database is accessed through psycopg 3
+asynchronous connection pool, so a single worker process can have hundreds
+of requests in flight. Request validation, SQL statements and response
+bodies are shared with the rights module, so responses are the same.
+
+Request metrics, tracing and Server-Timing header work as in the Flask
+application. Search result cache, id cache, read-only replicas and slow query
+log are not used, connection pool is monitored by /status/pool instead of
+pool metrics.
+"""
+
+import asyncio
+import json
+import time
+import urllib.parse
+import uuid
+from contextlib import AsyncExitStack, asynccontextmanager
+import prometheus_client
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+from werkzeug.datastructures import Headers, MIMEAccept
+from werkzeug.http import parse_accept_header
+from werkzeug.utils import get_content_type
+
+import rights
+
+LOGGER = rights.LOGGER
+
+# Bodies of framework errors are the same as in Flask application
+NOT_FOUND_BODY = (
+    b'<!doctype html>\n<html lang=en>\n<title>404 Not Found</title>\n<h1>Not Found</h1>\n'
+    b'<p>The requested URL was not found on the server. If you entered the URL manually '
+    b'please check your spelling and try again.</p>\n')
+BAD_REQUEST_MSG = 'The browser (or proxy) sent a request that this server could not understand.'
+METHOD_NOT_ALLOWED_MSG = 'The method is not allowed for the requested URL.'
+
+# Statements of upserting persons and organizations and reading ids of unchanged rows
+UPSERT_PERSONS = (
+    ('upsert_persons', rights.SQL_UPSERT_PERSONS), ('get_person_ids', rights.SQL_GET_PERSON_IDS))
+UPSERT_ORGANIZATIONS = (
+    ('upsert_organizations', rights.SQL_UPSERT_ORGANIZATIONS),
+    ('get_organization_ids', rights.SQL_GET_ORGANIZATION_IDS))
+
+
+def create_pool(conf):
+    """Create asynchronous database connection pool, pool is opened by RightsApp"""
+    # Client-side binding keeps query parameters handling the same as in psycopg2
+    return AsyncConnectionPool(
+        rights.get_db_dsn(conf), open=False,
+        kwargs={'cursor_factory': psycopg.AsyncClientCursor},
+        min_size=conf.get('db_pool_min_size', rights.DEFAULT_POOL_MIN_SIZE),
+        max_size=conf.get('db_pool_max_size', rights.DEFAULT_POOL_MAX_SIZE),
+        max_idle=conf.get('db_pool_idle_timeout', rights.DEFAULT_POOL_IDLE_TIMEOUT),
+        max_lifetime=conf.get('db_pool_max_lifetime', rights.DEFAULT_POOL_MAX_LIFETIME),
+        timeout=conf.get('db_pool_timeout', rights.DEFAULT_POOL_TIMEOUT))
+
+
+def get_pool_stats(pool):
+    """Get pool statistics in the same format as rights.ConnectionPool.stats"""
+    stats = pool.get_stats()
+    size = stats.get('pool_size', 0)
+    idle = stats.get('pool_available', 0)
+    return {
+        'size': size, 'in_use': size - idle, 'idle': idle, 'min_size': pool.min_size,
+        'max_size': pool.max_size, 'waits': stats.get('requests_queued', 0),
+        'wait_time': round(stats.get('requests_wait_ms', 0) / 1000, 6),
+        'timeouts': stats.get('requests_errors', 0),
+        'opened': stats.get('connections_num', 0),
+        'closed': stats.get('connections_lost', 0)}
+
+
+@asynccontextmanager
+async def connection(pool):
+    """Check out connection from pool, checkout is traced and timed as in rights module"""
+    async with AsyncExitStack() as stack:
+        start = time.perf_counter()
+        with rights.trace_span('pool_checkout'):
+            conn = await stack.enter_async_context(pool.connection())
+        rights.add_server_timing('db-connect', time.perf_counter() - start)
+        yield conn
+
+
+async def execute_sql(cur, statement, *args):
+    """Execute SQL with cursor and record duration of statement
+
+    Works like rights.execute_sql, slow statements are not logged.
+    """
+    start = time.perf_counter()
+    try:
+        with rights.trace_span(f'sql {statement}'):
+            await cur.execute(*args)
+    finally:
+        duration = time.perf_counter() - start
+        rights.DB_QUERY_DURATION.labels(statement).observe(duration)
+        rights.add_server_timing(
+            rights.SERVER_TIMING_STATEMENTS.get(statement, 'db-query'), duration)
+
+
+async def set_person(cur, code, first_name, last_name):
+    """Insert person or update person names, returns person id"""
+    await execute_sql(
+        cur, 'set_person', rights.SQL_SET_PERSON,
+        {'code': code, 'first_name': first_name, 'last_name': last_name})
+    rec = await cur.fetchone()
+    if rec:
+        return rec[0]
+    return await get_id(cur, 'get_person', rights.SQL_GET_PERSON, code)
+
+
+async def set_organization(cur, code, name):
+    """Insert organization or update organization name, returns organization id"""
+    await execute_sql(
+        cur, 'set_organization', rights.SQL_SET_ORGANIZATION, {'code': code, 'name': name})
+    rec = await cur.fetchone()
+    if rec:
+        return rec[0]
+    return await get_id(cur, 'get_organization', rights.SQL_GET_ORGANIZATION, code)
+
+
+async def get_id(cur, statement, sql, code):
+    """Get person or organization id or None"""
+    await execute_sql(cur, statement, sql, {'str': code})
+    rec = await cur.fetchone()
+    return rec[0] if rec else None
+
+
+async def revoke_right(cur, person_id, organization_id, right_type):
+    """Revoke person right, returns number of revoked rights"""
+    await execute_sql(cur, 'revoke_right', rights.SQL_REVOKE_RIGHT, {
+        'person_id': person_id, 'organization_id': organization_id, 'right_type': right_type})
+    return cur.rowcount
+
+
+async def upsert(cur, statements, codes, params):
+    """Upsert persons or organizations, returns dict of code -> id
+
+    Statements are UPSERT_PERSONS or UPSERT_ORGANIZATIONS.
+    """
+    (statement, sql), (statement_ids, sql_ids) = statements
+    await execute_sql(cur, statement, sql, params)
+    ids = dict(await cur.fetchall())
+    missing = [code for code in codes if code not in ids]
+    if missing:
+        # Unchanged rows committed by concurrent transaction after statement snapshot
+        await execute_sql(cur, statement_ids, sql_ids, {'codes': missing})
+        ids.update(await cur.fetchall())
+    return ids
+
+
+async def set_rights(cur, items):
+    """Set multiple person rights, returns list of item statuses"""
+    persons, organizations, latest = rights.merge_set_rights(items)
+    codes = sorted(persons)
+    person_ids = await upsert(
+        cur, UPSERT_PERSONS, codes, {
+            'codes': codes, 'first_names': [persons[code][0] for code in codes],
+            'last_names': [persons[code][1] for code in codes]})
+    codes = sorted(organizations)
+    organization_ids = await upsert(
+        cur, UPSERT_ORGANIZATIONS, codes, {
+            'codes': codes, 'names': [organizations[code] for code in codes]})
+    new_rights = rights.get_new_rights(items, latest, person_ids, organization_ids)
+    await execute_sql(
+        cur, 'revoke_rights_by_keys', rights.SQL_REVOKE_RIGHTS_BY_KEYS,
+        rights.get_right_keys_params([
+            (item['person_id'], item['organization_id'], item['right_type'])
+            for item in new_rights]))
+    await execute_sql(
+        cur, 'add_rights', rights.SQL_ADD_RIGHTS, rights.get_new_rights_params(new_rights))
+    added = set(tuple(rec) for rec in await cur.fetchall())
+    return rights.get_set_rights_statuses(items, new_rights, added)
+
+
+async def search_rights(cur, kwargs):
+    """Search for rights, returns the same result as rights.search_rights"""
+    count, sql_query, sql_total, params = rights.get_search_rights_query(kwargs)
+    LOGGER.debug('SQL: %s', cur.mogrify(sql_query, params))
+    await execute_sql(cur, 'search_rights', sql_query, params)
+    result = rights.get_search_rights_page(kwargs, count, await cur.fetchall())
+
+    if result['count'] == 'exact':
+        LOGGER.debug('SQL total: %s', cur.mogrify(sql_total, params))
+        await execute_sql(cur, 'count_rights', sql_total, params)
+        result['total'] = (await cur.fetchone())[0]
+    elif result['count'] == 'estimate':
+        LOGGER.debug('SQL estimate: %s', cur.mogrify(sql_total, params))
+        await execute_sql(cur, 'estimate_rights', sql_total, params)
+        result['total'] = rights.get_plan_rows((await cur.fetchone())[0])
+    return result
+
+
+async def stream_search_rights(pool, conf, kwargs, log_header):
+    """Generate search results as NDJSON lines using server-side cursor
+
+    Works like rights.stream_search_rights.
+    """
+    fetch_size = conf.get('stream_fetch_size', rights.DEFAULT_STREAM_FETCH_SIZE)
+    sql_query, params = rights.get_stream_rights_query(kwargs)
+    stream = rights.SearchStream(kwargs)
+
+    async with connection(pool) as conn:
+        # Named cursor uses server-side binding, query is bound by client as in psycopg2
+        sql_query = conn.cursor().mogrify(sql_query, params)
+        LOGGER.debug('SQL: %s', sql_query)
+        async with conn.cursor(name=f'search_rights_{uuid.uuid4().hex}') as cur:
+            await execute_sql(cur, 'stream_rights', sql_query)
+            rows = await cur.fetchmany(fetch_size)
+            yield ''
+            try:
+                while rows:
+                    for chunk in stream.get_chunks(rows):
+                        yield chunk
+                    rows = [] if stream.has_more else await cur.fetchmany(fetch_size)
+            except psycopg.Error as err:
+                yield rights.get_stream_db_error(log_header, err)
+                return
+
+    yield stream.get_trailer(log_header)
+
+
+async def export_rights(pool, conf, kwargs, log_header):
+    """Generate chunks of COPY output
+
+    Works like rights.export_rights. Rows received from COPY are joined into
+    chunks of "export_chunk_size" bytes. Leaving COPY early cancels it.
+    """
+    chunk_size = conf.get('export_chunk_size', rights.DEFAULT_EXPORT_CHUNK_SIZE)
+    exported = 0
+    async with connection(pool) as conn:
+        async with conn.cursor() as cur:
+            # COPY does not support query parameters
+            sql = cur.mogrify(
+                rights.get_export_rights_sql(kwargs, kwargs['format']),
+                rights.get_search_rights_params(kwargs))
+            LOGGER.debug('SQL: %s', sql)
+            async with cur.copy(sql) as copy:
+                buffer = bytearray()
+                started = False
+                async for data in copy:
+                    buffer += data
+                    if not started:
+                        started = True
+                        yield b''
+                    if len(buffer) >= chunk_size:
+                        exported += len(buffer)
+                        yield bytes(buffer)
+                        buffer.clear()
+                if not started:
+                    yield b''
+                if buffer:
+                    exported += len(buffer)
+                    yield bytes(buffer)
+
+    LOGGER.info('%sExported %s bytes', log_header, exported)
+
+
+async def process_set_right(pool, conf, json_data, log_header):
+    """Process incoming set_right query"""
+    kwargs, request_error = rights.validate_process_request(
+        conf, rights.validate_set_right_request, json_data, log_header)
+    if request_error:
+        return request_error
+
+    person = kwargs['person']
+    organization = kwargs['organization']
+    async with connection(pool) as conn:
+        if conf.get('db_set_right_function'):
+            # Function call is atomic, autocommit avoids separate BEGIN and COMMIT round trips
+            await conn.set_autocommit(True)
+            try:
+                async with conn.cursor() as cur:
+                    await execute_sql(
+                        cur, 'call_set_right', rights.SQL_CALL_SET_RIGHT, rights.get_call_set_right_params(
+                            person, organization, kwargs['right']))
+            finally:
+                await conn.set_autocommit(False)
+        else:
+            async with conn.cursor() as cur:
+                person_id = await set_person(
+                    cur, person['code'], person['first_name'], person['last_name'])
+                organization_id = await set_organization(
+                    cur, organization['code'], organization['name'])
+                await revoke_right(
+                    cur, person_id, organization_id, kwargs['right']['right_type'])
+                await execute_sql(cur, 'add_right', rights.SQL_ADD_RIGHT, {
+                    'person_id': person_id, 'organization_id': organization_id,
+                    'right_type': kwargs['right']['right_type'],
+                    'valid_from': kwargs['right']['valid_from'],
+                    'valid_to': kwargs['right']['valid_to']})
+
+    return rights.get_set_right_response(kwargs, log_header)
+
+
+async def process_set_rights(pool, conf, json_data, log_header):
+    """Process incoming set_rights query"""
+    items, request_error = rights.validate_process_request(
+        conf, rights.validate_set_rights_request, json_data, log_header,
+        rights.get_bulk_max_items(conf))
+    if request_error:
+        return request_error
+
+    statuses = [None] * len(items)
+    if any(kwargs is not None for kwargs, _ in items):
+        async with connection(pool) as conn:
+            async with conn.cursor() as cur:
+                statuses = await set_rights(cur, [kwargs for kwargs, _ in items])
+
+    return rights.get_set_rights_response(items, statuses, log_header)
+
+
+async def process_revoke_right(pool, conf, json_data, log_header):
+    """Process incoming revoke_right query"""
+    kwargs, request_error = rights.validate_process_request(
+        conf, rights.validate_revoke_right_request, json_data, log_header)
+    if request_error:
+        return request_error
+
+    async with connection(pool) as conn:
+        async with conn.cursor() as cur:
+            person_id = await get_id(
+                cur, 'get_person', rights.SQL_GET_PERSON, kwargs['person_code'])
+            organization_id = await get_id(
+                cur, 'get_organization', rights.SQL_GET_ORGANIZATION,
+                kwargs['organization_code'])
+            if not await revoke_right(cur, person_id, organization_id, kwargs['right_type']):
+                return {
+                    'http_status': 200, 'code': 'RIGHT_NOT_FOUND',
+                    'msg': 'No right was found'}
+
+    return rights.get_revoke_right_response(kwargs, log_header)
+
+
+async def process_revoke_rights(pool, conf, json_data, log_header):
+    """Process incoming revoke_rights query"""
+    items, request_error = rights.validate_process_request(
+        conf, rights.validate_revoke_rights_request, json_data, log_header,
+        rights.get_bulk_max_items(conf))
+    if request_error:
+        return request_error
+
+    selectors = rights.get_valid_items(items)
+    total = 0
+    counts = []
+    if selectors:
+        shapes, params = rights.get_revoke_rights_params(selectors)
+        async with connection(pool) as conn:
+            async with conn.cursor() as cur:
+                await execute_sql(
+                    cur, 'revoke_rights', rights.get_revoke_rights_sql(shapes), params)
+                total, counts = rights.get_revoke_rights_counts(
+                    await cur.fetchall(), len(selectors))
+
+    return rights.get_revoke_rights_response(items, total, counts, log_header)
+
+
+async def process_search_rights(pool, conf, json_data, log_header):
+    """Process incoming search_rights query"""
+    kwargs, request_error = rights.validate_process_request(
+        conf, rights.validate_search_rights_request, json_data, log_header)
+    if request_error:
+        return request_error
+
+    async with connection(pool) as conn:
+        async with conn.cursor() as cur:
+            result = await search_rights(cur, kwargs)
+
+    return rights.get_search_rights_response(kwargs, result, log_header)
+
+
+async def process_search_rights_stream(pool, conf, json_data, log_header):
+    """Process incoming search_rights query with streaming response"""
+    kwargs, request_error = rights.validate_process_request(
+        conf, rights.validate_search_rights_request, json_data, log_header)
+    if request_error:
+        return request_error
+
+    lines = stream_search_rights(pool, conf, kwargs, log_header)
+    # Executing query before response status is sent
+    await anext(lines)
+
+    return rights.get_stream_response('Streaming rights', lines, rights.NDJSON_MIMETYPE)
+
+
+async def process_export_rights(pool, conf, json_data, log_header):
+    """Process incoming export_rights query"""
+    kwargs, request_error = rights.validate_process_request(
+        conf, rights.validate_export_rights_request, json_data, log_header)
+    if request_error:
+        return request_error
+
+    chunks = export_rights(pool, conf, kwargs, log_header)
+    # Starting export before response status is sent
+    await anext(chunks)
+
+    return rights.get_stream_response(
+        'Exporting rights', chunks, rights.EXPORT_MIMETYPES[kwargs['format']])
+
+
+async def process_set_person(pool, conf, json_data, log_header):
+    """Process incoming set_person query"""
+    kwargs, request_error = rights.validate_process_request(
+        conf, rights.validate_set_person_request, json_data, log_header)
+    if request_error:
+        return request_error
+
+    async with connection(pool) as conn:
+        async with conn.cursor() as cur:
+            await set_person(cur, kwargs['code'], kwargs['first_name'], kwargs['last_name'])
+
+    return rights.get_set_person_response(kwargs, log_header)
+
+
+async def process_set_organization(pool, conf, json_data, log_header):
+    """Process incoming set_organization query"""
+    kwargs, request_error = rights.validate_process_request(
+        conf, rights.validate_set_organization_request, json_data, log_header)
+    if request_error:
+        return request_error
+
+    async with connection(pool) as conn:
+        async with conn.cursor() as cur:
+            await set_organization(cur, kwargs['code'], kwargs['name'])
+
+    return rights.get_set_organization_response(kwargs, log_header)
+
+
+async def test_db(pool, conf, log_header):
+    """Test DB connection"""
+    conf_error = rights.validate_config(conf, log_header)
+    if conf_error:
+        return conf_error
+
+    async with connection(pool) as conn:
+        async with conn.cursor() as cur:
+            await execute_sql(cur, 'test_db', 'select 1')
+            await cur.fetchone()
+            return {
+                'http_status': 200, 'code': 'OK',
+                'msg': 'API is ready'}
+
+
+async def get_deep_status(pool, conf, log_header):
+    """Get database role, replication lag and pool saturation"""
+    conf_error = rights.validate_config(conf, log_header)
+    if conf_error:
+        return conf_error
+
+    async with connection(pool) as conn:
+        async with conn.cursor() as cur:
+            await execute_sql(cur, 'database_role', rights.SQL_DATABASE_ROLE)
+            in_recovery, lag = await cur.fetchone()
+
+    return rights.get_deep_status_response(in_recovery, lag, get_pool_stats(pool))
+
+
+class Request:  # pylint: disable=too-few-public-methods
+    """HTTP request of ASGI connection scope"""
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = {}
+        for name, value in scope['headers']:
+            # Repeated headers are joined as in WSGI environment
+            name = name.decode('latin-1').lower()
+            value = value.decode('latin-1')
+            self.headers[name] = f'{self.headers[name]},{value}' \
+                if name in self.headers else value
+        self.args = dict(urllib.parse.parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        self.body = body
+        # API response code used as label of request metrics
+        self.response_code = None
+
+    def log_header(self, method):
+        """Get log header string, trace and span ids of traced request are used"""
+        context = rights.TRACE_CONTEXT.get()
+        if context is None:
+            return rights.format_log_header(method, self.headers.get('x-b3-traceid'))
+        return rights.format_log_header(method, context[1]['traceId'], context[1]['id'])
+
+
+class InstrumentedSend:
+    """ASGI send callable that records metrics, trace and Server-Timing of request
+
+    Works like before_request and after_request functions of the Flask
+    application. Request is finished when response starts, so streamed
+    responses are measured until the stream starts.
+    """
+    def __init__(self, send, request, resource, server_timing):
+        self.send = send
+        self.request = request
+        self.resource = resource
+        self.start = time.perf_counter()
+        span = None if rights.TRACER is None else rights.TRACER.start(
+            resource, Headers(request.headers))
+        rights.TRACE_CONTEXT.set(None if span is None else ([], span))
+        self.trace_start = time.perf_counter_ns()
+        rights.SERVER_TIMING.set({} if server_timing else None)
+
+    async def __call__(self, message):
+        if message['type'] == 'http.response.start':
+            message = self.finish(message)
+        await self.send(message)
+
+    def finish(self, message):
+        """Finish request when response starts, returns message of response start"""
+        status = str(message['status'])
+        code = self.request.response_code or status
+        rights.REQUEST_DURATION.labels(self.resource, code).observe(
+            time.perf_counter() - self.start)
+
+        context = rights.TRACE_CONTEXT.get()
+        if context is not None:
+            rights.TRACE_CONTEXT.set(None)
+            spans, span = context
+            span['duration'] = max((time.perf_counter_ns() - self.trace_start) // 1000, 1)
+            span['tags'] = {
+                'http.method': self.request.method, 'http.path': self.request.path,
+                'http.status_code': status, 'code': code}
+            rights.TRACER.export(spans + [span])
+
+        timings = rights.SERVER_TIMING.get()
+        if timings is not None:
+            rights.SERVER_TIMING.set(None)
+            timings['total'] = time.perf_counter() - self.start
+            message = dict(message, headers=list(message['headers']) + [
+                (b'server-timing', rights.format_server_timing(timings).encode('latin-1'))])
+        return message
+
+
+class RightsApp:
+    """ASGI application of Rights API
+
+    Database connection pool is opened at lifespan startup or with the first
+    request and closed at lifespan shutdown.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.pool = create_pool(config)
+        self.pool_opened = False
+        self.ready_status = {'expires': 0.0, 'response': None}
+        self.deep_status = {'expires': 0.0, 'response': None}
+        self.ready_lock = asyncio.Lock()
+        self.post_routes = {
+            '/set-right': ('SetRight:post', process_set_right, 'info'),
+            '/set-rights': ('SetRights:post', process_set_rights, 'debug'),
+            '/revoke-right': ('RevokeRight:post', process_revoke_right, 'info'),
+            '/revoke-rights': ('RevokeRights:post', process_revoke_rights, 'debug'),
+            '/rights': ('Rights:post', process_search_rights, 'debug'),
+            '/rights/export': ('ExportRights:post', process_export_rights, 'info'),
+            '/person': ('Person:post', process_set_person, 'info'),
+            '/organization': ('Organization:post', process_set_organization, 'info')}
+        self.get_routes = {
+            '/status': ('Status:get', self.status),
+            '/status/live': ('LiveStatus:get', self.live_status),
+            '/status/ready': ('ReadyStatus:get', self.ready_status_get),
+            '/status/pool': ('PoolStatus:get', self.pool_status),
+            '/metrics': ('Metrics:get', self.metrics)}
+
+    async def open_pool(self):
+        """Open database connection pool if it is not open"""
+        if not self.pool_opened:
+            self.pool_opened = True
+            await self.pool.open(wait=False)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.open_pool()
+            body = b''
+            more_body = True
+            while more_body:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body += message.get('body', b'')
+                more_body = message.get('more_body', False)
+            await self.handle(Request(scope, body), receive, send)
+
+    async def lifespan(self, receive, send):
+        """Handle ASGI lifespan events"""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.open_pool()
+                LOGGER.info('Starting Rights API v%s (ASGI)', rights.__version__)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.pool.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def handle(self, request, receive, send):
+        """Route request to handler"""
+        if request.path in self.post_routes:
+            method = self.post_routes[request.path][0]
+            allowed = 'OPTIONS, POST'
+            handler = self.post if request.method == 'POST' else None
+        elif request.path in self.get_routes:
+            method = self.get_routes[request.path][0]
+            allowed = 'OPTIONS, GET, HEAD'
+            handler = self.get if request.method in ('GET', 'HEAD') else None
+        else:
+            method = allowed = handler = None
+
+        # Resource is unknown for requests that Flask rejects before finding the view
+        resource = 'unknown'
+        if handler is not None or (method is not None and request.method == 'OPTIONS'):
+            resource = method.partition(':')[0]
+        send = InstrumentedSend(send, request, resource, self.config.get('server_timing'))
+        if method is None:
+            await send_response(
+                send, 404, NOT_FOUND_BODY, 'text/html; charset=utf-8')
+            return
+
+        if request.method == 'OPTIONS':
+            await send_response(send, 200, b'', 'text/html; charset=utf-8', [('allow', allowed)])
+        elif handler is None:
+            await send_response(
+                send, 405, get_message_body(METHOD_NOT_ALLOWED_MSG), 'application/json',
+                [('allow', allowed)])
+        else:
+            await handler(request, receive, send)
+
+    async def get(self, request, _, send):
+        """GET method of status and metrics endpoints"""
+        method, handler = self.get_routes[request.path]
+        log_header = request.log_header(method)
+        response = await handler(request, log_header)
+        if 'body' in response:
+            await send_response(
+                send, response['http_status'], response['body'], response['content_type'],
+                head_only=request.method == 'HEAD')
+            return
+        request.response_code = response['code']
+        await send_json(send, response, log_header, head_only=request.method == 'HEAD')
+
+    async def post(self, request, receive, send):
+        """POST method of rights endpoints"""
+        method, process, log_level = self.post_routes[request.path]
+        log_header = request.log_header(method)
+        try:
+            with rights.trace_span('parse_json'):
+                json_data = json.loads(request.body)
+        except ValueError:
+            await send_response(
+                send, 400, get_message_body(BAD_REQUEST_MSG), 'application/json')
+            return
+        client_dn = request.headers.get('x-ssl-client-s-dn')
+
+        LOGGER.info(
+            '%s%s: %s', log_header, rights.INCOMING_REQUEST_MSG,
+            rights.summarize_log_data(json_data))
+        LOGGER.info('%s%s: %s', log_header, rights.CLIENT_DN_MSG, client_dn)
+
+        if not rights.check_client(self.config, client_dn):
+            response = rights.get_incorrect_client_response(client_dn, log_header)
+            request.response_code = response['code']
+            await send_json(send, response, log_header)
+            return
+
+        if request.path == '/rights':
+            # Streaming is requested with Accept header or "stream" parameter
+            stream = parse_accept_header(
+                request.headers.get('accept'), MIMEAccept).best == rights.NDJSON_MIMETYPE \
+                or (isinstance(json_data, dict) and json_data.get('stream') is True)
+            if stream:
+                process = process_search_rights_stream
+
+        try:
+            response = await process(self.pool, self.config, json_data, log_header)
+        except psycopg.Error as err:
+            response = rights.get_db_error(log_header, err)
+
+        if 'stream' in response:
+            await send_stream(send, receive, response)
+        else:
+            request.response_code = response['code']
+            await send_json(send, response, log_header, log_level=log_level, float_free=True)
+
+    async def status(self, _, log_header):
+        """Status endpoint"""
+        LOGGER.info('%sIncoming status request', log_header)
+        return await self.get_cached_status(self.ready_status, test_db, log_header)
+
+    async def live_status(self, _, log_header):
+        """Liveness status endpoint"""
+        LOGGER.info('%sIncoming liveness status request', log_header)
+        return {'http_status': 200, 'code': 'OK', 'msg': 'API is live'}
+
+    async def ready_status_get(self, request, log_header):
+        """Readiness status endpoint"""
+        LOGGER.info('%sIncoming readiness status request', log_header)
+
+        if request.args.get('deep', '').lower() not in ('true', '1'):
+            return await self.get_cached_status(self.ready_status, test_db, log_header)
+
+        disabled_error = rights.get_deep_status_disabled(self.config, log_header)
+        if disabled_error:
+            return disabled_error
+        return await self.get_cached_status(self.deep_status, get_deep_status, log_header)
+
+    async def pool_status(self, _, log_header):
+        """Database pool status endpoint"""
+        LOGGER.info('%sIncoming pool status request', log_header)
+        return {
+            'http_status': 200, 'code': 'OK',
+            'msg': 'Database connection pool statistics',
+            'response': get_pool_stats(self.pool)}
+
+    @staticmethod
+    async def metrics(_, log_header):
+        """Prometheus metrics endpoint, response is not JSON"""
+        # Metrics are scraped frequently
+        LOGGER.debug('%sIncoming metrics request', log_header)
+        return {
+            'http_status': 200, 'body': rights.get_metrics(),
+            'content_type': prometheus_client.CONTENT_TYPE_LATEST}
+
+    async def get_cached_status(self, status, check, log_header):
+        """Get result of status check, result is cached for "status_cache_ttl" seconds
+
+        Works like rights.get_cached_status.
+        """
+        async with self.ready_lock:
+            now = asyncio.get_running_loop().time()
+            if status['response'] is not None and status['expires'] > now:
+                return status['response']
+            try:
+                response = await check(self.pool, self.config, log_header)
+            except psycopg.Error as err:
+                response = rights.get_db_error(log_header, err)
+            status['response'] = response
+            status['expires'] = now + self.config.get(
+                'status_cache_ttl', rights.DEFAULT_STATUS_CACHE_TTL)
+            return response
+
+
+def get_message_body(msg):
+    """Get JSON body of framework error in the same format as Flask-RESTful"""
+    return json.dumps({'message': msg}).encode('ascii') + b'\n'
+
+
+async def send_response(send, status, body, content_type, headers=None, head_only=False):
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    """Send complete HTTP response"""
+    await send({
+        'type': 'http.response.start', 'status': status,
+        'headers': [
+            (b'content-type', content_type.encode('latin-1')),
+            (b'content-length', str(len(body)).encode('latin-1'))] + [
+                (name.encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers or []]})
+    await send({'type': 'http.response.body', 'body': b'' if head_only else body})
+
+
+async def send_json(
+        send, data, log_header, log_level='info', head_only=False, float_free=False):
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    """Send JSON response with the same body as rights.make_response"""
+    body = {'code': data['code'], 'msg': data['msg']}
+    if 'response' in data:
+        body['response'] = data['response']
+    start = time.perf_counter()
+    with rights.trace_span('serialize_json'):
+        body = rights.dumps_json(body, sort_keys=True, float_free=float_free) + b'\n'
+    duration = time.perf_counter() - start
+    rights.JSON_DURATION.observe(duration)
+    rights.add_server_timing('serialize', duration)
+    if log_level == 'debug':
+        LOGGER.debug('%sResponse: %s', log_header, rights.summarize_log_data(data))
+    else:
+        LOGGER.info('%sResponse: %s', log_header, rights.summarize_log_data(data))
+    await send_response(
+        send, data['http_status'], body, 'application/json', head_only=head_only)
+
+
+async def send_stream(send, receive, response):
+    """Send streaming response until the stream ends or client disconnects
+
+    Generator is closed when client disconnects, which cancels database query.
+    Errors of the stream are raised, which aborts the response.
+    """
+    disconnected = asyncio.Event()
+
+    async def wait_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    watcher = asyncio.create_task(wait_disconnect())
+    stream = response['stream']
+    try:
+        # Disabling Nginx buffering so that data reaches client as it is produced
+        await send({
+            'type': 'http.response.start', 'status': response['http_status'],
+            'headers': [
+                (b'content-type', get_content_type(response['mimetype'], 'utf-8').encode(
+                    'latin-1')),
+                (b'x-accel-buffering', b'no')]})
+        async for data in stream:
+            if disconnected.is_set():
+                break
+            if data:
+                await send({
+                    'type': 'http.response.body',
+                    'body': data.encode('utf-8') if isinstance(data, str) else data,
+                    'more_body': True})
+        if not disconnected.is_set():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+        await stream.aclose()
+
+
+def create_app(config_file=rights.DEFAULT_CONFIG_FILE):
+    """Create ASGI application"""
+    config = rights.configure_app(config_file)
+    rights.init_tracing(config)
+    return RightsApp(config)
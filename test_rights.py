@@ -4,15 +4,26 @@
 # pylint: disable=too-many-arguments too-many-positional-arguments
 
 import json
+import queue
 from datetime import datetime
+from decimal import Decimal
 import unittest
-from unittest.mock import patch, MagicMock, mock_open, call
+from unittest.mock import patch, MagicMock, mock_open, call, ANY
 from flask import Flask, jsonify
 from flask_restful import Api
+import prometheus_client
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
 import rights
 
 
+class PlainChangeCache(rights.ChangeCache):
+    """Change cache that evicts all entries on any change"""
+    def handle_change(self, table, persons, organizations):
+        self.clear()
+
+
 class MainTestCase(unittest.TestCase):
     def setUp(self):
         self.config = {
@@ -31,16 +42,34 @@ class MainTestCase(unittest.TestCase):
         self.api = Api(self.app)
         self.api.add_resource(rights.SetRightApi, '/set-right', resource_class_kwargs={
             'config': self.config})
+        self.api.add_resource(rights.SetRightsApi, '/set-rights', resource_class_kwargs={
+            'config': self.config})
         self.api.add_resource(rights.RevokeRightApi, '/revoke-right', resource_class_kwargs={
             'config': self.config})
+        self.api.add_resource(rights.RevokeRightsApi, '/revoke-rights', resource_class_kwargs={
+            'config': self.config})
         self.api.add_resource(rights.RightsApi, '/rights', resource_class_kwargs={
             'config': self.config})
+        self.api.add_resource(rights.ExportRightsApi, '/rights/export', resource_class_kwargs={
+            'config': self.config})
         self.api.add_resource(rights.PersonApi, '/person', resource_class_kwargs={
             'config': self.config})
         self.api.add_resource(rights.OrganizationApi, '/organization', resource_class_kwargs={
             'config': self.config})
         self.api.add_resource(rights.StatusApi, '/status', resource_class_kwargs={
             'config': self.config})
+        self.api.add_resource(rights.PoolStatusApi, '/status/pool', resource_class_kwargs={
+            'config': self.config})
+        self.api.add_resource(rights.LiveStatusApi, '/status/live', resource_class_kwargs={
+            'config': self.config})
+        self.api.add_resource(rights.ReadyStatusApi, '/status/ready', resource_class_kwargs={
+            'config': self.config})
+        self.api.add_resource(rights.MetricsApi, '/metrics', resource_class_kwargs={
+            'config': self.config})
+
+    @staticmethod
+    def get_metric(name, labels=None):
+        return prometheus_client.REGISTRY.get_sample_value(name, labels) or 0
 
     def test_load_config(self):
         # Valid json
@@ -108,6 +137,72 @@ class MainTestCase(unittest.TestCase):
         mock_load_config.assert_called_with('CONFIG_FILE')
         self.assertEqual({'a': 'b'}, config)
 
+    @patch('rights.LOG_MAX_ITEMS', 0)
+    @patch('rights.load_config', return_value={'log_queue_size': 1000, 'log_max_items': 5})
+    @patch('os.umask')
+    @patch('rights.init_log_queue')
+    def test_configure_app_log_queue(self, mock_init_log_queue, *_):
+        rights.configure_app('CONFIG_FILE')
+        mock_init_log_queue.assert_called_once_with(1000)
+        self.assertEqual(5, rights.LOG_MAX_ITEMS)
+
+    @patch('rights.LOG_MAX_ITEMS', 0)
+    @patch('rights.load_config', return_value={})
+    @patch('os.umask')
+    @patch('rights.init_log_queue')
+    def test_configure_app_no_log_queue(self, mock_init_log_queue, *_):
+        rights.configure_app('CONFIG_FILE')
+        mock_init_log_queue.assert_not_called()
+        self.assertEqual(100, rights.LOG_MAX_ITEMS)
+
+    def test_log_queue_handler(self):
+        handler = rights.LogQueueHandler(queue.Queue(2))
+        record = MagicMock()
+        handler.emit(record)
+        handler.emit(record)
+        handler.emit(record)
+        self.assertEqual({'queued': 2, 'max_size': 2, 'dropped': 1}, handler.stats())
+        self.assertIs(record, handler.queue.get_nowait())
+        handler.queue.get_nowait()
+        handler.emit(record)
+        dropped_record = handler.queue.get_nowait()
+        self.assertEqual(
+            'Dropped 1 log records because log queue was full', dropped_record.getMessage())
+        self.assertEqual('WARNING', dropped_record.levelname)
+        self.assertIs(record, handler.queue.get_nowait())
+        self.assertEqual({'queued': 0, 'max_size': 2, 'dropped': 1}, handler.stats())
+
+    @patch('rights.LOG_QUEUE_HANDLER', None)
+    @patch('atexit.register')
+    @patch('logging.handlers.QueueListener')
+    @patch('rights.LOGGER')
+    def test_init_log_queue(self, mock_logger, mock_listener, mock_atexit_register):
+        file_handler = MagicMock()
+        mock_logger.handlers = [file_handler]
+        rights.init_log_queue(10)
+        self.assertEqual(10, rights.LOG_QUEUE_HANDLER.queue.maxsize)
+        mock_listener.assert_called_once_with(
+            rights.LOG_QUEUE_HANDLER.queue, file_handler, respect_handler_level=True)
+        mock_logger.removeHandler.assert_called_once_with(file_handler)
+        mock_logger.addHandler.assert_called_once_with(rights.LOG_QUEUE_HANDLER)
+        mock_listener.return_value.start.assert_called_once_with()
+        mock_atexit_register.assert_called_once_with(mock_listener.return_value.stop)
+
+    @patch('rights.LOG_MAX_ITEMS', 2)
+    def test_summarize_log_data(self):
+        data = {'code': 'P1', 'items': [1, 2]}
+        self.assertIs(data, rights.summarize_log_data(data))
+        data = [{'code': 'P1'}, 'x']
+        self.assertIs(data, rights.summarize_log_data(data))
+        self.assertEqual(
+            [{'code': 'P1', 'items': [1, 2, '... 1 more items']}, [1, 2, '... 2 more items']],
+            rights.summarize_log_data([{'code': 'P1', 'items': [1, 2, 3]}, [1, 2, 3, 4]]))
+
+    @patch('rights.LOG_MAX_ITEMS', 0)
+    def test_summarize_log_data_unlimited(self):
+        data = [1, 2, 3]
+        self.assertIs(data, rights.summarize_log_data(data))
+
     @patch('psycopg2.connect')
     def test_get_db_connection(self, mock_pg_connect):
         rights.get_db_connection(self.config)
@@ -115,6 +210,119 @@ class MainTestCase(unittest.TestCase):
             'host=localhost port=5432 dbname=postgres user=postgres password=password '
             'connect_timeout=10 target_session_attrs=read-write')
 
+    @patch('psycopg2.connect')
+    def test_get_db_connection_metrics(self, mock_pg_connect):
+        count = self.get_metric('rights_db_connect_duration_seconds_count')
+        self.assertEqual(mock_pg_connect.return_value, rights.get_db_connection(self.config))
+        self.assertEqual(count + 1, self.get_metric('rights_db_connect_duration_seconds_count'))
+
+    def test_execute_sql(self):
+        labels = {'statement': 'test_statement'}
+        count = self.get_metric('rights_db_query_duration_seconds_count', labels)
+        cur = MagicMock()
+        rights.execute_sql(cur, 'test_statement', 'SQL', {'a': 1})
+        cur.execute.assert_called_once_with('SQL', {'a': 1})
+        cur.execute.side_effect = psycopg2.Error('ERR')
+        with self.assertRaises(psycopg2.Error):
+            rights.execute_sql(cur, 'test_statement', 'SQL')
+        cur.execute.assert_called_with('SQL')
+        self.assertEqual(
+            count + 2, self.get_metric('rights_db_query_duration_seconds_count', labels))
+
+    @patch('rights.SLOW_QUERY_LOG')
+    def test_execute_sql_slow(self, mock_slow_query_log):
+        cur = MagicMock()
+        mock_slow_query_log.threshold = 0.0
+        rights.execute_sql(cur, 'test_statement', 'SQL', {'a': 1})
+        mock_slow_query_log.log.assert_called_once_with(
+            cur, 'test_statement', ('SQL', {'a': 1}), ANY)
+        mock_slow_query_log.threshold = 1000.0
+        rights.execute_sql(cur, 'test_statement', 'SQL', {'a': 1})
+        mock_slow_query_log.log.assert_called_once()
+
+    @patch('rights.SLOW_QUERY_LOG', None)
+    def test_init_slow_query_log(self):
+        self.assertIsNone(rights.init_slow_query_log(self.config))
+        slow_query_log = rights.init_slow_query_log(dict(self.config, slow_query_threshold=0.5))
+        self.assertIs(slow_query_log, rights.SLOW_QUERY_LOG)
+        self.assertEqual(
+            (0.5, False, 60), (slow_query_log.threshold, slow_query_log.explain,
+                               slow_query_log.explain_interval))
+
+    @patch('threading.Thread')
+    def test_slow_query_log(self, mock_thread):
+        slow_query_log = rights.SlowQueryLog(dict(self.config, slow_query_threshold=0.5))
+        cur = MagicMock(rowcount=3)
+        token = rights.SQL_CONTEXT.set(('HEADER: ', {'persons': ['P1']}))
+        try:
+            with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+                slow_query_log.log(cur, 'search_rights', (' select 1', {'a': 1}), 0.75)
+                self.assertEqual([
+                    "WARNING:rights:HEADER: Slow SQL statement search_rights: duration 0.750 s, "
+                    "rows 3, filters: {'persons': ['P1']}, params: {'a': 1}"], cm.output)
+        finally:
+            rights.SQL_CONTEXT.reset(token)
+        mock_thread.assert_not_called()
+
+    @patch('time.monotonic')
+    @patch('threading.Thread')
+    def test_slow_query_log_explain(self, mock_thread, mock_monotonic):
+        slow_query_log = rights.SlowQueryLog(dict(
+            self.config, slow_query_threshold=0.5, slow_query_explain=True,
+            slow_query_explain_interval=10))
+        cur = MagicMock(rowcount=-1)
+        cur.mogrify.return_value = b'select 1'
+        mock_monotonic.return_value = 1000.0
+        token = rights.SQL_CONTEXT.set(('HEADER: ', None))
+        try:
+            with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+                slow_query_log.log(cur, 'search_rights', (' select 1',), 0.75)
+                # Rate limited
+                mock_monotonic.return_value = 1005.0
+                slow_query_log.log(cur, 'search_rights', ('select 1',), 0.75)
+                # Not a SELECT statement
+                mock_monotonic.return_value = 1020.0
+                slow_query_log.log(cur, 'add_rights', ('insert', {}), 0.75)
+                self.assertEqual(
+                    "WARNING:rights:HEADER: Slow SQL statement search_rights: duration 0.750 s, "
+                    "rows -1, filters: None, params: None", cm.output[0])
+        finally:
+            rights.SQL_CONTEXT.reset(token)
+        mock_thread.assert_called_once_with(
+            target=slow_query_log.log_plan, name='slow-query-explain',
+            args=('HEADER: ', 'search_rights', 'select 1'), daemon=True)
+        cur.mogrify.assert_called_once_with(' select 1')
+        mock_thread.return_value.start.assert_called_once_with()
+
+    @patch('rights.db_read_connection')
+    def test_slow_query_log_plan(self, mock_db_read_connection):
+        cur = mock_db_read_connection.return_value.__enter__.return_value.cursor.return_value \
+            .__enter__.return_value
+        cur.fetchall.return_value = [('Result  (cost=0.00..0.01)',), ('Execution Time: 1 ms',)]
+        slow_query_log = rights.SlowQueryLog(dict(self.config, slow_query_threshold=0.5))
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            slow_query_log.log_plan('HEADER: ', 'search_rights', 'select 1')
+            self.assertEqual([
+                'WARNING:rights:HEADER: Plan of slow SQL statement search_rights:\n'
+                'Result  (cost=0.00..0.01)\nExecution Time: 1 ms'], cm.output)
+        cur.execute.assert_has_calls([
+            call('set transaction read only'),
+            call('set local statement_timeout = 30000'),
+            call('explain (analyze, buffers) select 1')])
+        cur.execute.side_effect = psycopg2.Error('ERR')
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            slow_query_log.log_plan('HEADER: ', 'search_rights', 'select 1')
+            self.assertEqual([
+                'WARNING:rights:HEADER: Cannot get plan of slow SQL statement search_rights: '
+                'ERR'], cm.output)
+
+    @patch('psycopg2.connect')
+    def test_get_db_connection_replica(self, mock_pg_connect):
+        rights.get_db_connection(self.config, 'replica1')
+        mock_pg_connect.assert_called_with(
+            'host=replica1 port=5432 dbname=postgres user=postgres password=password '
+            'connect_timeout=10 target_session_attrs=any')
+
     @patch('psycopg2.connect')
     def test_get_db_connection_default_timeout(self, mock_pg_connect):
         my_config = self.config.copy()
@@ -138,6 +346,592 @@ class MainTestCase(unittest.TestCase):
             'sslmode=SSL_MODE sslrootcert=SSL_ROOT_CERT sslcert=SSl_CERT sslkey=SSL_KEY '
             'connect_timeout=10 target_session_attrs=read-write')
 
+    @staticmethod
+    def new_connection_mock(*_):
+        conn = MagicMock()
+        conn.closed = 0
+        conn.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        return conn
+
+    @patch('rights.get_db_connection')
+    def test_connection_pool_server_timing(self, mock_get_db_connection):
+        mock_get_db_connection.side_effect = self.new_connection_mock
+        pool = rights.ConnectionPool(self.config)
+        token = rights.SERVER_TIMING.set({})
+        try:
+            pool.putconn(pool.getconn())
+            self.assertIn('db-connect', rights.SERVER_TIMING.get())
+        finally:
+            rights.SERVER_TIMING.reset(token)
+
+    @patch('rights.get_db_connection')
+    def test_connection_pool_reuse(self, mock_get_db_connection):
+        mock_get_db_connection.side_effect = self.new_connection_mock
+        pool = rights.ConnectionPool(self.config)
+        with pool.connection() as conn1:
+            self.assertEqual(
+                {'size': 1, 'in_use': 1, 'idle': 0, 'min_size': 1, 'max_size': 10, 'waits': 0,
+                 'wait_time': 0.0, 'timeouts': 0, 'opened': 1, 'closed': 0},
+                pool.stats())
+        conn1.rollback.assert_called_once()
+        with pool.connection() as conn2:
+            self.assertIs(conn1, conn2)
+        mock_get_db_connection.assert_called_once_with(self.config, None)
+        self.assertEqual(
+            {'size': 1, 'in_use': 0, 'idle': 1, 'min_size': 1, 'max_size': 10, 'waits': 0,
+             'wait_time': 0.0, 'timeouts': 0, 'opened': 1, 'closed': 0},
+            pool.stats())
+
+    @patch('rights.get_db_connection')
+    def test_connection_pool_exhausted(self, mock_get_db_connection):
+        mock_get_db_connection.side_effect = self.new_connection_mock
+        my_config = self.config.copy()
+        my_config['db_pool_max_size'] = 1
+        my_config['db_pool_timeout'] = 0.01
+        pool = rights.ConnectionPool(my_config)
+        with pool.connection():
+            with self.assertRaises(psycopg2.pool.PoolError):
+                pool.getconn()
+        stats = pool.stats()
+        self.assertEqual((1, 1, 0), (stats['waits'], stats['timeouts'], stats['in_use']))
+        self.assertGreater(stats['wait_time'], 0)
+
+    @patch('rights.get_db_connection')
+    def test_connection_pool_broken_connection(self, mock_get_db_connection):
+        mock_get_db_connection.side_effect = self.new_connection_mock
+        pool = rights.ConnectionPool(self.config)
+        conn = pool.getconn()
+        conn.rollback.side_effect = psycopg2.OperationalError('BROKEN')
+        pool.putconn(conn)
+        conn.close.assert_called_once()
+        self.assertIsNot(conn, pool.getconn())
+        self.assertEqual((2, 1), (pool.stats()['opened'], pool.stats()['closed']))
+
+    @patch('rights.get_db_connection', side_effect=psycopg2.OperationalError('NO_DB'))
+    def test_connection_pool_connect_error(self, _):
+        pool = rights.ConnectionPool(self.config)
+        with self.assertRaises(psycopg2.OperationalError):
+            pool.getconn()
+        self.assertEqual(0, pool.stats()['in_use'])
+
+    @patch('time.monotonic')
+    @patch('rights.get_db_connection')
+    def test_connection_pool_timeouts(self, mock_get_db_connection, mock_monotonic):
+        mock_get_db_connection.side_effect = self.new_connection_mock
+        mock_monotonic.return_value = 1000.0
+        my_config = self.config.copy()
+        my_config['db_pool_min_size'] = 1
+        my_config['db_pool_idle_timeout'] = 10
+        my_config['db_pool_max_lifetime'] = 100
+        pool = rights.ConnectionPool(my_config)
+        conn1 = pool.getconn()
+        conn2 = pool.getconn()
+        pool.putconn(conn1)
+        pool.putconn(conn2)
+        # Idle timeout closes connections above minimum size
+        mock_monotonic.return_value = 1020.0
+        self.assertIs(conn2, pool.getconn())
+        conn1.close.assert_called_once()
+        self.assertEqual(1, self.get_metric(
+            'rights_db_pool_connections', {'pool': 'primary', 'state': 'in_use'}))
+        pool.putconn(conn2)
+        self.assertEqual(0, self.get_metric(
+            'rights_db_pool_connections', {'pool': 'primary', 'state': 'in_use'}))
+        self.assertEqual(1, self.get_metric(
+            'rights_db_pool_connections', {'pool': 'primary', 'state': 'idle'}))
+        # Maximum lifetime closes any connection
+        mock_monotonic.return_value = 1200.0
+        self.assertIsNot(conn2, pool.getconn())
+        conn2.close.assert_called_once()
+
+    @patch('os.getpid', return_value=1)
+    @patch('rights.get_db_connection')
+    def test_connection_pool_fork(self, mock_get_db_connection, mock_getpid):
+        mock_get_db_connection.side_effect = self.new_connection_mock
+        pool = rights.ConnectionPool(self.config)
+        conn1 = pool.getconn()
+        pool.putconn(conn1)
+        mock_getpid.return_value = 2
+        self.assertIsNot(conn1, pool.getconn())
+        conn1.close.assert_not_called()
+
+    @patch('rights.DB_POOL', None)
+    @patch('rights.get_db_connection')
+    def test_db_connection_no_pool(self, mock_get_db_connection):
+        with rights.db_connection(self.config) as conn:
+            self.assertEqual(mock_get_db_connection.return_value, conn)
+        mock_get_db_connection.assert_called_once_with(self.config)
+        mock_get_db_connection.return_value.close.assert_called_once()
+
+    @patch('rights.DB_POOL')
+    def test_db_connection_pool(self, mock_pool):
+        with rights.db_connection(self.config) as conn:
+            self.assertEqual(mock_pool.connection.return_value.__enter__.return_value, conn)
+
+    @patch('rights.DB_POOL', None)
+    def test_init_db_pool(self):
+        pool = rights.init_db_pool(self.config)
+        self.assertIsInstance(pool, rights.ConnectionPool)
+        self.assertIs(pool, rights.DB_POOL)
+
+    def new_replicas(self):
+        replicas = rights.ReplicaSet(dict(
+            self.config, db_replica_hosts=['replica1', 'replica2'], db_replica_max_lag=5))
+        replicas.thread = MagicMock()
+        replicas.thread.is_alive.return_value = True
+        return replicas
+
+    @staticmethod
+    def replica_cursor(replicas, host):
+        replicas.pools[host] = MagicMock()
+        return replicas.pools[host].connection.return_value.__enter__.return_value \
+            .cursor.return_value.__enter__.return_value
+
+    @patch('rights.threading.Thread')
+    def test_replica_set_get_pool(self, mock_thread):
+        replicas = rights.ReplicaSet(dict(self.config, db_replica_hosts=['replica1', 'replica2']))
+        self.assertEqual(
+            (10, 5, 60), (replicas.max_lag, replicas.check_interval, replicas.max_silence))
+        self.assertEqual('replica1', replicas.pools['replica1'].replica_host)
+        self.assertIsNone(replicas.get_pool())
+        mock_thread.assert_called_with(target=replicas.run, name='replica-monitor', daemon=True)
+        mock_thread.return_value.start.assert_called_once()
+        mock_thread.return_value.is_alive.return_value = True
+        replicas.set_state('replica1', True, 0.0)
+        replicas.set_state('replica2', True, 1.0)
+        self.assertIs(replicas.pools['replica2'], replicas.get_pool())
+        self.assertIs(replicas.pools['replica1'], replicas.get_pool())
+        replicas.set_state('replica2', False, None, 'ERR')
+        self.assertIs(replicas.pools['replica1'], replicas.get_pool())
+        self.assertIs(replicas.pools['replica1'], replicas.get_pool())
+        mock_thread.assert_called_once()
+
+    @patch('os.getpid', return_value=1)
+    @patch('rights.threading.Thread')
+    def test_replica_set_fork(self, mock_thread, mock_getpid):
+        replicas = rights.ReplicaSet(dict(self.config, db_replica_hosts=['replica1']))
+        mock_thread.return_value.is_alive.return_value = True
+        replicas.get_pool()
+        replicas.get_pool()
+        self.assertEqual(1, mock_thread.call_count)
+        mock_getpid.return_value = 2
+        replicas.get_pool()
+        self.assertEqual(2, mock_thread.call_count)
+
+    def test_replica_set_set_state(self):
+        replicas = self.new_replicas()
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            replicas.set_state('replica1', True, 0.5)
+            replicas.set_state('replica1', True, 1.5)
+            replicas.set_state('replica1', False, None, 'ERR')
+            replicas.set_state('replica1', False, None, 'ERR')
+            self.assertEqual([
+                'INFO:rights:Replica replica1 is healthy, replication lag: 0.5',
+                'WARNING:rights:Replica replica1 is unhealthy: ERR'], cm.output)
+
+    def test_replica_set_check_replica(self):
+        replicas = self.new_replicas()
+        cur = self.replica_cursor(replicas, 'replica1')
+        cur.fetchone.return_value = (True, Decimal('1.5'), True, 'streaming', Decimal('2.0'))
+        replicas.check_replica('replica1')
+        self.assertEqual((True, 1.5), replicas.state['replica1'])
+        self.assertIn('pg_last_xact_replay_timestamp()', cur.execute.call_args[0][0])
+        self.assertIn('pg_stat_wal_receiver', cur.execute.call_args[0][0])
+        cur.fetchone.return_value = (True, Decimal('-0.2'), True, None, None)
+        replicas.check_replica('replica1')
+        self.assertEqual((True, 0.0), replicas.state['replica1'])
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            cur.fetchone.return_value = (True, Decimal('5.5'), True, 'streaming', 1)
+            replicas.check_replica('replica1')
+            self.assertEqual((False, 5.5), replicas.state['replica1'])
+            replicas.set_state('replica1', True, 0.0)
+            cur.fetchone.return_value = (True, None, True, 'streaming', 1)
+            replicas.check_replica('replica1')
+            self.assertEqual((False, None), replicas.state['replica1'])
+            self.assertEqual([
+                'WARNING:rights:Replica replica1 is unhealthy: replication lag 5.5 exceeds 5',
+                'INFO:rights:Replica replica1 is healthy, replication lag: 0.0',
+                'WARNING:rights:Replica replica1 is unhealthy: no transactions replayed'],
+                cm.output)
+
+    def test_replica_set_check_replica_receiver(self):
+        replicas = self.new_replicas()
+        cur = self.replica_cursor(replicas, 'replica1')
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            # Replayed all received WAL, but receiver is disconnected
+            for rec in [
+                    (True, 0, False, None, None),
+                    (True, 0, True, 'waiting', Decimal('1.0')),
+                    (True, 0, True, 'streaming', Decimal('61.5'))]:
+                replicas.set_state('replica1', True, 0.0)
+                cur.fetchone.return_value = rec
+                replicas.check_replica('replica1')
+                self.assertEqual((False, 0.0), replicas.state['replica1'])
+            # Primary has no WAL receiver
+            cur.fetchone.return_value = (False, 0, False, None, None)
+            replicas.check_replica('replica1')
+            self.assertEqual((True, 0.0), replicas.state['replica1'])
+            self.assertEqual([
+                'INFO:rights:Replica replica1 is healthy, replication lag: 0.0',
+                'WARNING:rights:Replica replica1 is unhealthy: WAL receiver is not running',
+                'INFO:rights:Replica replica1 is healthy, replication lag: 0.0',
+                'WARNING:rights:Replica replica1 is unhealthy: WAL receiver is waiting',
+                'INFO:rights:Replica replica1 is healthy, replication lag: 0.0',
+                'WARNING:rights:Replica replica1 is unhealthy: no message from primary in 61.5 '
+                'seconds',
+                'INFO:rights:Replica replica1 is healthy, replication lag: 0.0'], cm.output)
+
+    def test_replica_set_check_replica_error(self):
+        replicas = self.new_replicas()
+        replicas.set_state('replica1', True, 0.0)
+        self.replica_cursor(replicas, 'replica1').execute.side_effect = \
+            psycopg2.OperationalError('NO_DB\n')
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            replicas.check_replica('replica1')
+            self.assertEqual(
+                ['WARNING:rights:Replica replica1 is unhealthy: NO_DB'], cm.output)
+        self.assertEqual((False, None), replicas.state['replica1'])
+
+    @patch('rights.time.sleep', side_effect=[None, StopIteration])
+    def test_replica_set_run(self, mock_sleep):
+        replicas = self.new_replicas()
+        replicas.check_replica = MagicMock()
+        with self.assertRaises(StopIteration):
+            replicas.run()
+        replicas.check_replica.assert_has_calls(
+            [call('replica1'), call('replica2'), call('replica1'), call('replica2')])
+        mock_sleep.assert_called_with(5)
+
+    def test_replica_set_stats(self):
+        replicas = self.new_replicas()
+        replicas.set_state('replica2', True, 0.5)
+        self.assertEqual([
+            {'host': 'replica1', 'healthy': False, 'replication_lag': None},
+            {'host': 'replica2', 'healthy': True, 'replication_lag': 0.5}], replicas.stats())
+
+    @patch('rights.REPLICAS', None)
+    def test_init_replicas(self):
+        self.assertIsNone(rights.init_replicas(self.config))
+        replicas = rights.init_replicas(dict(self.config, db_replica_hosts=['replica1']))
+        self.assertIsInstance(replicas, rights.ReplicaSet)
+        self.assertIs(replicas, rights.REPLICAS)
+        self.assertEqual(['replica1'], list(replicas.pools))
+
+    @patch('rights.REPLICAS', None)
+    @patch('rights.db_connection')
+    def test_db_read_connection_no_replicas(self, mock_db_connection):
+        with rights.db_read_connection(self.config) as conn:
+            self.assertEqual(mock_db_connection.return_value.__enter__.return_value, conn)
+        mock_db_connection.assert_called_with(self.config)
+
+    @patch('rights.db_connection')
+    def test_db_read_connection_replica(self, mock_db_connection):
+        replicas = self.new_replicas()
+        replicas.set_state('replica1', True, 0.0)
+        pool = replicas.pools['replica1'] = MagicMock()
+        with patch('rights.REPLICAS', replicas):
+            with rights.db_read_connection(self.config) as conn:
+                self.assertEqual(pool.getconn.return_value, conn)
+        pool.putconn.assert_called_with(pool.getconn.return_value)
+        mock_db_connection.assert_not_called()
+
+    @patch('rights.db_connection')
+    def test_db_read_connection_replica_error(self, mock_db_connection):
+        replicas = self.new_replicas()
+        replicas.set_state('replica1', True, 0.0)
+        pool = replicas.pools['replica1'] = MagicMock()
+        pool.replica_host = 'replica1'
+        pool.getconn.side_effect = psycopg2.OperationalError('NO_DB')
+        with patch('rights.REPLICAS', replicas):
+            with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+                with rights.db_read_connection(self.config) as conn:
+                    self.assertEqual(
+                        mock_db_connection.return_value.__enter__.return_value, conn)
+                self.assertEqual(
+                    ['WARNING:rights:Replica replica1 is unhealthy: NO_DB'], cm.output)
+        self.assertEqual((False, None), replicas.state['replica1'])
+
+    @patch('rights.db_connection')
+    def test_db_read_connection_replica_exhausted(self, mock_db_connection):
+        replicas = self.new_replicas()
+        replicas.set_state('replica1', True, 0.0)
+        pool = replicas.pools['replica1'] = MagicMock()
+        pool.replica_host = 'replica1'
+        pool.getconn.side_effect = psycopg2.pool.PoolError('Connection pool exhausted')
+        with patch('rights.REPLICAS', replicas):
+            with rights.db_read_connection(self.config) as conn:
+                self.assertEqual(mock_db_connection.return_value.__enter__.return_value, conn)
+        self.assertEqual((True, 0.0), replicas.state['replica1'])
+        pool.putconn.assert_not_called()
+
+    @patch('rights.ID_CACHE', None)
+    @patch('rights.SEARCH_CACHE', None)
+    @patch('rights.CHANGE_LISTENER', None)
+    def test_init_caches(self):
+        self.assertEqual((None, None), rights.init_caches(self.config))
+        self.assertIsInstance(rights.CHANGE_LISTENER, rights.ChangeListener)
+        self.assertEqual([], rights.CHANGE_LISTENER.caches)
+        search_cache, id_cache = rights.init_caches(
+            dict(self.config, search_cache_size=10, id_cache_size=20))
+        self.assertIsInstance(search_cache, rights.SearchCache)
+        self.assertIs(search_cache, rights.SEARCH_CACHE)
+        self.assertEqual(10, search_cache.max_size)
+        self.assertEqual(300, search_cache.ttl)
+        self.assertIsInstance(id_cache, rights.IdCache)
+        self.assertIs(id_cache, rights.ID_CACHE)
+        self.assertEqual(20, id_cache.max_size)
+        self.assertEqual([search_cache, id_cache], rights.CHANGE_LISTENER.caches)
+
+    def test_get_change_codes(self):
+        self.assertIsNone(rights.get_change_codes(None))
+        self.assertIsNone(rights.get_change_codes(['P1', None]))
+        self.assertEqual(frozenset(['P1', 'P2']), rights.get_change_codes(['P1', 'P2']))
+
+    def test_codes_overlap(self):
+        self.assertTrue(rights.codes_overlap(None, frozenset(['P1'])))
+        self.assertTrue(rights.codes_overlap(frozenset(['P1']), None))
+        self.assertTrue(rights.codes_overlap(frozenset(['P1', 'P2']), frozenset(['P2'])))
+        self.assertFalse(rights.codes_overlap(frozenset(['P1']), frozenset(['P2'])))
+
+    @staticmethod
+    def new_listener(listening=True):
+        listener = rights.ChangeListener({})
+        listener.is_listening = MagicMock(return_value=listening)
+        return listener
+
+    @staticmethod
+    def new_cache_kwargs(persons, organizations):
+        return {'persons': persons, 'organizations': organizations}
+
+    @patch('rights.threading.Thread')
+    def test_change_listener_is_listening(self, mock_thread):
+        listener = rights.ChangeListener({})
+        self.assertFalse(listener.is_listening())
+        mock_thread.assert_called_with(
+            target=listener.run, name='change-listener', daemon=True)
+        mock_thread.return_value.start.assert_called_once()
+        mock_thread.return_value.is_alive.return_value = True
+        listener.listening = True
+        self.assertTrue(listener.is_listening())
+        self.assertEqual(1, mock_thread.call_count)
+
+    @patch('rights.threading.Thread')
+    @patch('os.getpid', return_value=1)
+    def test_change_listener_is_listening_fork(self, mock_getpid, mock_thread):
+        listener = rights.ChangeListener({})
+        listener.listening = True
+        listener.thread = MagicMock()
+        mock_getpid.return_value = 2
+        self.assertFalse(listener.is_listening())
+        self.assertEqual(2, listener.pid)
+        mock_thread.return_value.start.assert_called_once()
+
+    def test_change_listener_set_listening(self):
+        listener = rights.ChangeListener({})
+        cache = MagicMock()
+        listener.caches.append(cache)
+        listener.set_listening(True)
+        self.assertTrue(listener.listening)
+        cache.clear.assert_called_once()
+        listener.set_listening(False)
+        self.assertFalse(listener.listening)
+        self.assertEqual(2, cache.clear.call_count)
+
+    def test_change_listener_handle_change(self):
+        listener = rights.ChangeListener({})
+        cache = MagicMock()
+        listener.caches.append(cache)
+        listener.handle_change(
+            '{"table": "right", "persons": ["P1"], "organizations": null}')
+        cache.handle_change.assert_called_with('right', frozenset(['P1']), None)
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            listener.handle_change('[]')
+            listener.handle_change('{"persons": ["P1"], "organizations": null}')
+            listener.handle_change('{"table": 1, "persons": null, "organizations": null}')
+            self.assertEqual([
+                'WARNING:rights:Invalid change notification: []',
+                'WARNING:rights:Invalid change notification: '
+                '{"persons": ["P1"], "organizations": null}',
+                'WARNING:rights:Invalid change notification: '
+                '{"table": 1, "persons": null, "organizations": null}'], cm.output)
+        self.assertEqual(3, cache.clear.call_count)
+        self.assertEqual(1, cache.handle_change.call_count)
+
+    @patch('rights.select.select', side_effect=[([1], [], []), ([], [], [])])
+    @patch('rights.get_db_connection')
+    def test_change_listener_listen(self, mock_get_db_connection, _):
+        conn = mock_get_db_connection.return_value
+        cur = conn.cursor.return_value.__enter__.return_value
+        conn.notifies = []
+
+        def poll():
+            if conn.poll.call_count == 1:
+                conn.notifies.append(MagicMock(payload='PAYLOAD'))
+            else:
+                raise psycopg2.OperationalError('CONNECTION_LOST')
+
+        conn.poll.side_effect = poll
+        listener = rights.ChangeListener({})
+        listener.handle_change = MagicMock()
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            with self.assertRaises(psycopg2.OperationalError):
+                listener.listen()
+            self.assertEqual(['INFO:rights:Change listener connected'], cm.output)
+        self.assertTrue(conn.autocommit)
+        cur.execute.assert_has_calls([call('LISTEN rights_changed'), call('select 1')])
+        listener.handle_change.assert_called_once_with('PAYLOAD')
+        self.assertTrue(listener.listening)
+        conn.close.assert_called_once()
+
+    @patch('rights.time.sleep', side_effect=[None, SystemExit])
+    def test_change_listener_run(self, _):
+        listener = rights.ChangeListener({})
+        listener.listen = MagicMock(
+            side_effect=[psycopg2.OperationalError('ERR'), OSError('ERR2')])
+        listener.listening = True
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            with self.assertRaises(SystemExit):
+                listener.run()
+            self.assertEqual([
+                'WARNING:rights:Change listener failed: ERR',
+                'WARNING:rights:Change listener failed: ERR2'], cm.output)
+        self.assertFalse(listener.listening)
+
+    def test_change_cache_not_listening(self):
+        cache = PlainChangeCache(self.new_listener(False), 10)
+        self.assertEqual((None, None), cache.get('KEY'))
+
+    def test_change_cache_get_put(self):
+        listener = self.new_listener()
+        cache = PlainChangeCache(listener, 10)
+        self.assertEqual([cache], listener.caches)
+        self.assertEqual((None, 0), cache.get('KEY'))
+        cache.put('KEY', 'VALUE', 0)
+        self.assertEqual(('VALUE', 0), cache.get('KEY'))
+
+    def test_change_cache_lru(self):
+        cache = PlainChangeCache(self.new_listener(), 2)
+        cache.put('KEY1', 'VALUE1', 0)
+        cache.put('KEY2', 'VALUE2', 0)
+        self.assertEqual(('VALUE1', 0), cache.get('KEY1'))
+        cache.put('KEY3', 'VALUE3', 0)
+        self.assertEqual(['KEY1', 'KEY3'], list(cache.entries))
+
+    @patch('rights.time.monotonic', return_value=100)
+    def test_change_cache_expired(self, mock_monotonic):
+        cache = PlainChangeCache(self.new_listener(), 10)
+        cache.put('KEY', 'VALUE', 0, 10)
+        cache.put('KEY_ZERO', 'VALUE', 0, 0)
+        self.assertEqual(['KEY'], list(cache.entries))
+        mock_monotonic.return_value = 110
+        self.assertEqual((None, 0), cache.get('KEY'))
+        self.assertEqual({}, cache.entries)
+
+    def test_change_cache_generation_changed(self):
+        cache = PlainChangeCache(self.new_listener(), 10)
+        _, generation = cache.get('KEY')
+        cache.evict(lambda key, value: False)
+        cache.put('KEY', 'VALUE', generation)
+        self.assertEqual({}, cache.entries)
+
+    def test_change_cache_evict_clear(self):
+        cache = PlainChangeCache(self.new_listener(), 10)
+        cache.put('KEY1', 'VALUE1', 0)
+        cache.put('KEY2', 'VALUE2', 0)
+        cache.evict(lambda key, value: value == 'VALUE1')
+        self.assertEqual(['KEY2'], list(cache.entries))
+        cache.clear()
+        self.assertEqual({}, cache.entries)
+        self.assertEqual(2, cache.generation)
+
+    @patch('os.getpid', return_value=1)
+    def test_change_cache_check_pid(self, mock_getpid):
+        cache = PlainChangeCache(self.new_listener(), 10)
+        cache.put('KEY', 'VALUE', 0)
+        mock_getpid.return_value = 2
+        self.assertEqual((None, 1), cache.get('KEY'))
+        self.assertEqual({}, cache.entries)
+        self.assertEqual(2, cache.pid)
+
+    def test_change_cache_abstract(self):
+        with self.assertRaises(TypeError):
+            rights.ChangeCache(self.new_listener(), 10)  # pylint: disable=abstract-class-instantiated
+
+    def test_search_cache_add(self):
+        cache = rights.SearchCache({'search_cache_size': 10}, self.new_listener())
+        cache.add('KEY', 'RESULT', self.new_cache_kwargs(['P1'], []), 60, 0)
+        self.assertEqual(('RESULT', frozenset(['P1']), None), cache.get('KEY')[0])
+
+    def test_search_cache_handle_change(self):
+        cache = rights.SearchCache({'search_cache_size': 10}, self.new_listener())
+        cache.add('ALL', 'R', self.new_cache_kwargs([], []), 60, 0)
+        cache.add('P1', 'R', self.new_cache_kwargs(['P1'], []), 60, 0)
+        cache.add('P2', 'R', self.new_cache_kwargs(['P2'], []), 60, 0)
+        cache.add('O1', 'R', self.new_cache_kwargs([], ['O1']), 60, 0)
+        cache.add('O2', 'R', self.new_cache_kwargs([], ['O2']), 60, 0)
+        cache.add('P2O1', 'R', self.new_cache_kwargs(['P2'], ['O1']), 60, 0)
+        cache.handle_change('right', frozenset(['P1']), frozenset(['O1']))
+        self.assertEqual(['P2', 'O2', 'P2O1'], list(cache.entries))
+        cache.handle_change('person', frozenset(['P1']), None)
+        self.assertEqual(['P2', 'P2O1'], list(cache.entries))
+
+    @patch('rights.time.monotonic', return_value=100)
+    def test_search_cache_replica_changes(self, mock_monotonic):
+        cache = rights.SearchCache({
+            'search_cache_size': 10, 'db_replica_hosts': ['replica1'],
+            'db_replica_max_lag': 3}, self.new_listener())
+        self.assertEqual(8, cache.replica_delay)
+        cache.handle_change('right', frozenset(['P1']), frozenset(['O1']))
+        cache.add('P1', 'R', self.new_cache_kwargs(['P1'], []), 60, 1)
+        cache.add('O2', 'R', self.new_cache_kwargs([], ['O2']), 60, 1)
+        self.assertEqual(['O2'], list(cache.entries))
+        mock_monotonic.return_value = 108
+        cache.add('P1', 'R', self.new_cache_kwargs(['P1'], []), 60, 1)
+        self.assertEqual(['O2', 'P1'], list(cache.entries))
+        self.assertEqual([], cache.changes)
+
+    def test_id_cache_handle_change(self):
+        cache = rights.IdCache({'id_cache_size': 10}, self.new_listener())
+        for key in [('person', 'P1'), ('person', 'P2'), ('organization', 'O1'),
+                    ('organization', 'O2')]:
+            cache.put(key, (1, None), 0)
+        cache.handle_change('right', frozenset(['P1']), frozenset(['O1']))
+        self.assertEqual(0, cache.generation)
+        cache.handle_change('person', frozenset(['P1']), None)
+        self.assertEqual(
+            [('person', 'P2'), ('organization', 'O1'), ('organization', 'O2')],
+            list(cache.entries))
+        cache.handle_change('organization', None, None)
+        self.assertEqual([('person', 'P2')], list(cache.entries))
+        cache.handle_change('person', frozenset(['P3']), None)
+        self.assertEqual([('person', 'P2')], list(cache.entries))
+        cache.handle_change('person', None, None)
+        self.assertEqual([], list(cache.entries))
+
+    @patch('rights.ID_CACHE', None)
+    def test_lookup_id_disabled(self):
+        self.assertEqual((None, None), rights.lookup_id('person', 'P1', ('F', 'L')))
+        rights.store_id('person', 'P1', 1, ('F', 'L'), None)
+        rights.discard_id('person', 'P1')
+
+    def test_lookup_id(self):
+        cache = rights.IdCache({'id_cache_size': 10}, self.new_listener())
+        with patch('rights.ID_CACHE', cache):
+            self.assertEqual((None, 0), rights.lookup_id('person', 'P1', ('F', 'L')))
+            rights.store_id('person', 'P1', 1, ('F', None), 0)
+            rights.store_id('organization', 'O1', 2, None, 0)
+            rights.store_id('organization', 'O2', None, ('N',), 0)
+            self.assertEqual((1, 0), rights.lookup_id('person', 'P1', ('F', None)))
+            self.assertEqual((1, 0), rights.lookup_id('person', 'P1', (None, None)))
+            self.assertEqual((None, 0), rights.lookup_id('person', 'P1', ('F', 'L')))
+            self.assertEqual((None, 0), rights.lookup_id('person', 'P1', ('X', None)))
+            self.assertEqual((2, 0), rights.lookup_id('organization', 'O1', ()))
+            self.assertEqual((2, 0), rights.lookup_id('organization', 'O1', (None,)))
+            self.assertEqual((None, 0), rights.lookup_id('organization', 'O1', ('N',)))
+            self.assertEqual((None, 0), rights.lookup_id('organization', 'O2', ()))
+            rights.discard_id('person', 'P1')
+            self.assertEqual((None, 1), rights.lookup_id('person', 'P1', ()))
+
     def test_get_person(self):
         cur = MagicMock()
         cur.execute = MagicMock()
@@ -160,43 +954,36 @@ class MainTestCase(unittest.TestCase):
             '\n        where code=%(str)s', {'str': '12345678901'})
         cur.fetchone.assert_called_once()
 
-    @patch('rights.get_person', return_value=(1234, 'F_NAME', 'L_NAME'))
-    def test_set_person_no_update(self, mock_get_person):
+    def test_set_person(self):
         cur = MagicMock()
         cur.execute = MagicMock()
         cur.fetchone = MagicMock(return_value=[1234])
-        self.assertEqual(1234, rights.set_person(cur, '12345678901', 'F_NAME', 'L_NAME'))
-        cur.execute.assert_not_called()
-        cur.fetchone.assert_not_called()
-        mock_get_person.assert_called_with(cur, '12345678901')
-
-    @patch('rights.get_person', return_value=(1234, 'F_NAME', 'L_NAME'))
-    def test_set_person_update(self, mock_get_person):
-        cur = MagicMock()
-        cur.execute = MagicMock()
-        cur.fetchone = MagicMock(return_value=[1234])
-        self.assertEqual(1234, rights.set_person(cur, '12345678901', 'F_NAME2', 'L_NAME2'))
+        self.assertEqual(1234, rights.set_person(cur, '12345678901', 'F_NAME', None))
         cur.execute.assert_called_with(
-            '\n                update rights.person'
-            '\n                set first_name=COALESCE(%(first_name)s, first_name),'
-            '\n                    last_name=COALESCE(%(last_name)s, last_name)'
-            '\n                where id=%(id)s', {
-                'first_name': 'F_NAME2', 'last_name': 'L_NAME2', 'id': 1234})
-        cur.fetchone.assert_not_called()
-        mock_get_person.assert_called_with(cur, '12345678901')
+            '\n            with upsert as ('
+            '\n                insert into rights.person as p (code, first_name, last_name)'
+            '\n                values (%(code)s, %(first_name)s, %(last_name)s)'
+            '\n                on conflict (code) do update'
+            '\n                set first_name=COALESCE(excluded.first_name, p.first_name),'
+            '\n                    last_name=COALESCE(excluded.last_name, p.last_name)'
+            '\n                where (p.first_name, p.last_name) is distinct from ('
+            '\n                    COALESCE(excluded.first_name, p.first_name),'
+            '\n                    COALESCE(excluded.last_name, p.last_name))'
+            '\n                returning id)'
+            '\n            select id from upsert'
+            '\n            union all'
+            '\n            select id from rights.person where code=%(code)s'
+            '\n            limit 1', {
+                'code': '12345678901', 'first_name': 'F_NAME', 'last_name': None})
+        cur.fetchone.assert_called_once()
 
-    @patch('rights.get_person', return_value=(None, None, None))
-    def test_set_person_insert(self, mock_get_person):
+    @patch('rights.get_person', return_value=(1234, 'F_NAME', 'L_NAME'))
+    def test_set_person_concurrent_insert(self, mock_get_person):
         cur = MagicMock()
         cur.execute = MagicMock()
-        cur.fetchone = MagicMock(return_value=[1234])
+        cur.fetchone = MagicMock(return_value=None)
         self.assertEqual(1234, rights.set_person(cur, '12345678901', 'F_NAME', 'L_NAME'))
-        cur.execute.assert_called_with(
-            '\n                insert into rights.person(code, first_name, last_name)'
-            '\n                values(%(code)s, %(first_name)s, %(last_name)s)'
-            '\n                returning id', {
-                'code': '12345678901', 'first_name': 'F_NAME', 'last_name': 'L_NAME'})
-        cur.fetchone.assert_called_once()
+        cur.execute.assert_called_once()
         mock_get_person.assert_called_with(cur, '12345678901')
 
     def test_get_organization(self):
@@ -221,41 +1008,33 @@ class MainTestCase(unittest.TestCase):
             '\n        where code=%(str)s', {'str': '12345678'})
         cur.fetchone.assert_called_once()
 
-    @patch('rights.get_organization', return_value=(123, 'ORG_NAME'))
-    def test_set_organization_no_update(self, mock_get_person):
+    def test_set_organization(self):
         cur = MagicMock()
         cur.execute = MagicMock()
         cur.fetchone = MagicMock(return_value=[123])
         self.assertEqual(123, rights.set_organization(cur, '12345678', 'ORG_NAME'))
-        cur.execute.assert_not_called()
-        cur.fetchone.assert_not_called()
-        mock_get_person.assert_called_with(cur, '12345678')
+        cur.execute.assert_called_with(
+            '\n            with upsert as ('
+            '\n                insert into rights.organization as o (code, name)'
+            '\n                values (%(code)s, %(name)s)'
+            '\n                on conflict (code) do update'
+            '\n                set name=COALESCE(excluded.name, o.name)'
+            '\n                where o.name is distinct from COALESCE(excluded.name, o.name)'
+            '\n                returning id)'
+            '\n            select id from upsert'
+            '\n            union all'
+            '\n            select id from rights.organization where code=%(code)s'
+            '\n            limit 1', {'code': '12345678', 'name': 'ORG_NAME'})
+        cur.fetchone.assert_called_once()
 
     @patch('rights.get_organization', return_value=(123, 'ORG_NAME'))
-    def test_set_organization_update(self, mock_get_person):
-        cur = MagicMock()
-        cur.execute = MagicMock()
-        cur.fetchone = MagicMock(return_value=[123])
-        self.assertEqual(123, rights.set_organization(cur, '12345678', 'ORG_NAME2'))
-        cur.execute.assert_called_with(
-            '\n                update rights.organization'
-            '\n                set name=%(name)s'
-            '\n                where id=%(id)s', {'name': 'ORG_NAME2', 'id': 123})
-        cur.fetchone.assert_not_called()
-        mock_get_person.assert_called_with(cur, '12345678')
-
-    @patch('rights.get_organization', return_value=(None, None))
-    def test_set_organization_insert(self, mock_get_person):
+    def test_set_organization_concurrent_insert(self, mock_get_organization):
         cur = MagicMock()
         cur.execute = MagicMock()
-        cur.fetchone = MagicMock(return_value=[123])
+        cur.fetchone = MagicMock(return_value=None)
         self.assertEqual(123, rights.set_organization(cur, '12345678', 'ORG_NAME'))
-        cur.execute.assert_called_with(
-            '\n                insert into rights.organization(code, name)'
-            '\n                values(%(code)s, %(name)s)'
-            '\n                returning id', {'code': '12345678', 'name': 'ORG_NAME'})
-        cur.fetchone.assert_called_once()
-        mock_get_person.assert_called_with(cur, '12345678')
+        cur.execute.assert_called_once()
+        mock_get_organization.assert_called_with(cur, '12345678')
 
     def test_revoke_right(self):
         cur = MagicMock()
@@ -288,10 +1067,123 @@ class MainTestCase(unittest.TestCase):
                 'person_id': 1234, 'organization_id': 123, 'right_type': 'RIGHT1',
                 'valid_from': '2020-01-01', 'valid_to': '2020-11-01'})
 
+    def test_upsert_persons(self):
+        cur = MagicMock()
+        cur.fetchall = MagicMock(return_value=[('P1', 1), ('P2', 2), ('P1', 1)])
+        self.assertEqual({'P1': 1, 'P2': 2}, rights.upsert_persons(
+            cur, {'P2': ['F2', None], 'P1': [None, 'L1']}))
+        cur.execute.assert_called_once()
+        self.assertEqual(
+            {'codes': ['P1', 'P2'], 'first_names': [None, 'F2'], 'last_names': ['L1', None]},
+            cur.execute.call_args[0][1])
+        self.assertIn('on conflict (code) do update', cur.execute.call_args[0][0])
+
+    def test_upsert_persons_concurrent_insert(self):
+        cur = MagicMock()
+        cur.fetchall = MagicMock(side_effect=[[('P1', 1)], [('P2', 2)]])
+        self.assertEqual({'P1': 1, 'P2': 2}, rights.upsert_persons(
+            cur, {'P2': ['F2', None], 'P1': [None, 'L1']}))
+        cur.execute.assert_called_with(
+            '\n                select code, id from rights.person where code=ANY(%(codes)s)',
+            {'codes': ['P2']})
+
+    def test_upsert_organizations(self):
+        cur = MagicMock()
+        cur.fetchall = MagicMock(return_value=[('O1', 1), ('O2', 2)])
+        self.assertEqual({'O1': 1, 'O2': 2}, rights.upsert_organizations(
+            cur, {'O2': 'N2', 'O1': None}))
+        cur.execute.assert_called_once()
+        self.assertEqual(
+            {'codes': ['O1', 'O2'], 'names': [None, 'N2']}, cur.execute.call_args[0][1])
+        self.assertIn('on conflict (code) do update', cur.execute.call_args[0][0])
+
+    def test_upsert_organizations_concurrent_insert(self):
+        cur = MagicMock()
+        cur.fetchall = MagicMock(side_effect=[[], [('O1', 1)]])
+        self.assertEqual({'O1': 1}, rights.upsert_organizations(cur, {'O1': None}))
+        cur.execute.assert_called_with(
+            '\n                select code, id from rights.organization where code=ANY(%(codes)s)',
+            {'codes': ['O1']})
+
+    def test_revoke_rights_by_keys(self):
+        cur = MagicMock()
+        cur.rowcount = 1
+        self.assertEqual(1, rights.revoke_rights_by_keys(
+            cur, [(1, 10, 'RIGHT1'), (2, 10, 'RIGHT2')]))
+        self.assertEqual(
+            {'person_ids': [1, 2], 'organization_ids': [10, 10],
+             'right_types': ['RIGHT1', 'RIGHT2']},
+            cur.execute.call_args[0][1])
+        self.assertIn('order by r.id\n                for update of r', cur.execute.call_args[0][0])
+
+    def test_get_revoke_rights_sql(self):
+        sql = rights.get_revoke_rights_sql([
+            ('person_code', 'organization_code', 'right_type'), ('organization_code',)])
+        self.assertIn(
+            'from unnest(%(s0_idx)s::int[], %(s0_person_code)s::varchar[], '
+            '%(s0_organization_code)s::varchar[], %(s0_right_type)s::varchar[]) '
+            'as s(idx, person_code, organization_code, right_type)', sql)
+        self.assertIn(
+            'join rights.right r on (r.person_id=p.id and r.organization_id=o.id '
+            'and r.right_type=s.right_type)', sql)
+        self.assertIn(
+            'from unnest(%(s1_idx)s::int[], %(s1_organization_code)s::varchar[]) '
+            'as s(idx, organization_code)', sql)
+        self.assertIn('join rights.right r on (r.organization_id=o.id)', sql)
+        self.assertIn('order by r.id\n                for update', sql)
+
+    @patch('rights.get_revoke_rights_sql', return_value='SQL')
+    def test_revoke_rights(self, get_revoke_rights_sql_mock):
+        cur = MagicMock()
+        cur.fetchall = MagicMock(return_value=[(None, 3), (0, 1), (2, 2)])
+        self.assertEqual((3, [1, 0, 2]), rights.revoke_rights(cur, [
+            {'person_code': 'P1', 'organization_code': 'O1', 'right_type': 'R1'},
+            {'person_code': None, 'organization_code': 'O2', 'right_type': None},
+            {'person_code': 'P2', 'organization_code': 'O2', 'right_type': 'R2'}]))
+        get_revoke_rights_sql_mock.assert_called_with([
+            ('person_code', 'organization_code', 'right_type'), ('organization_code',)])
+        cur.execute.assert_called_with('SQL', {
+            's0_idx': [0, 2], 's0_person_code': ['P1', 'P2'],
+            's0_organization_code': ['O1', 'O2'], 's0_right_type': ['R1', 'R2'],
+            's1_idx': [1], 's1_organization_code': ['O2']})
+
+    def test_add_rights(self):
+        cur = MagicMock()
+        cur.fetchall = MagicMock(return_value=[(1, 10, 'RIGHT1')])
+        self.assertEqual({(1, 10, 'RIGHT1')}, rights.add_rights(cur, [
+            {'person_id': 1, 'organization_id': 10, 'right_type': 'RIGHT1',
+             'valid_from': None, 'valid_to': datetime(2020, 1, 1, 0, 0)},
+            {'person_id': 2, 'organization_id': 10, 'right_type': 'RIGHT1',
+             'valid_from': None, 'valid_to': None}]))
+        self.assertEqual(
+            {'person_ids': [1, 2], 'organization_ids': [10, 10],
+             'right_types': ['RIGHT1', 'RIGHT1'], 'valid_froms': [None, None],
+             'valid_tos': [datetime(2020, 1, 1, 0, 0), None]},
+            cur.execute.call_args[0][1])
+
+    def test_call_set_right(self):
+        cur = MagicMock()
+        cur.fetchone = MagicMock(return_value=[555])
+        self.assertEqual(555, rights.call_set_right(
+            cur, {'code': '12345678901', 'first_name': 'FN', 'last_name': None},
+            {'code': '00000000', 'name': 'ON'},
+            {'right_type': 'RIGHT1', 'valid_from': None,
+             'valid_to': datetime(2020, 1, 1, 0, 0)}))
+        cur.execute.assert_called_with(
+            '\n            select rights.set_right('
+            '\n                %(person_code)s, %(first_name)s, %(last_name)s,'
+            '\n                %(organization_code)s, %(organization_name)s,'
+            '\n                %(right_type)s, %(valid_from)s, %(valid_to)s)', {
+                'person_code': '12345678901', 'first_name': 'FN', 'last_name': None,
+                'organization_code': '00000000', 'organization_name': 'ON',
+                'right_type': 'RIGHT1', 'valid_from': None,
+                'valid_to': datetime(2020, 1, 1, 0, 0)})
+
     def test_get_search_rights_sql(self):
         self.assertEqual(
             ('\n        select p.code, p.first_name, p.last_name, o.code, o.name,\n'
-             '            r.right_type, r.valid_from, r.valid_to, r.revoked\n'
+             "            r.right_type, to_char(r.valid_from, 'YYYY-MM-DD\"T\"HH24:MI:SS.US'),\n"
+             "            to_char(r.valid_to, 'YYYY-MM-DD\"T\"HH24:MI:SS.US'), r.revoked, r.id\n"
              '        from rights.right r\n'
              '        join rights.person p on (p.id=r.person_id)\n'
              '        join rights.organization o on (o.id=r.organization_id)\n'
@@ -303,7 +1195,9 @@ class MainTestCase(unittest.TestCase):
              '            and p.code=ANY(%(persons)s)\n'
              '            and o.code=ANY(%(organizations)s)\n'
              '            and r.right_type=ANY(%(rights)s)\n'
-             '            and (DATE(r.valid_to) - current_date) = %(days_to_expiration)s\n'
+             '            and r.valid_to>=current_date + %(expiration_from)s\n'
+             '            and r.valid_to<current_date + %(expiration_to)s + 1\n'
+             '        order by r.id\n'
              '        limit %(limit)s offset %(offset)s',
              '\n        select count(1)\n'
              '        from rights.right r\n'
@@ -317,10 +1211,68 @@ class MainTestCase(unittest.TestCase):
              '            and p.code=ANY(%(persons)s)\n'
              '            and o.code=ANY(%(organizations)s)\n'
              '            and r.right_type=ANY(%(rights)s)\n'
-             '            and (DATE(r.valid_to) - current_date) = %(days_to_expiration)s'),
+             '            and r.valid_to>=current_date + %(expiration_from)s\n'
+             '            and r.valid_to<current_date + %(expiration_to)s + 1'),
             rights.get_search_rights_sql(
                 True, ['12345678901', '12345678902'], ['12345678', '12345679'],
-                ['RIGHTS1', 'RIGHTS2'], 10))
+                ['RIGHTS1', 'RIGHTS2'], (10, 10)))
+
+    def test_get_search_rights_sql_cursor(self):
+        self.assertEqual(
+            ('\n        select p.code, p.first_name, p.last_name, o.code, o.name,\n'
+             "            r.right_type, to_char(r.valid_from, 'YYYY-MM-DD\"T\"HH24:MI:SS.US'),\n"
+             "            to_char(r.valid_to, 'YYYY-MM-DD\"T\"HH24:MI:SS.US'), r.revoked, r.id\n"
+             '        from rights.right r\n'
+             '        join rights.person p on (p.id=r.person_id)\n'
+             '        join rights.organization o on (o.id=r.organization_id)\n'
+             '        where true\n'
+             '            and p.code=ANY(%(persons)s)\n'
+             '            and r.id>%(after_id)s\n'
+             '        order by r.id\n'
+             '        limit %(limit)s',
+             '\n        select count(1)\n'
+             '        from rights.right r\n'
+             '        join rights.person p on (p.id=r.person_id)\n'
+             '        join rights.organization o on (o.id=r.organization_id)\n'
+             '        where true\n'
+             '            and p.code=ANY(%(persons)s)'),
+            rights.get_search_rights_sql(False, ['12345678901'], None, None, None, 0))
+
+    def test_get_search_rights_sql_count(self):
+        sql_query, sql_total = rights.get_search_rights_sql(
+            False, None, None, None, None, count='window')
+        self.assertIn('r.revoked, r.id,\n            count(1) over ()\n', sql_query)
+        self.assertEqual(
+            '\n        select count(1)\n'
+            '        from rights.right r\n'
+            '        join rights.person p on (p.id=r.person_id)\n'
+            '        join rights.organization o on (o.id=r.organization_id)\n'
+            '        where true', sql_total)
+        sql_query, sql_total = rights.get_search_rights_sql(
+            False, None, None, None, None, count='estimate')
+        self.assertNotIn('over ()', sql_query)
+        self.assertTrue(sql_total.startswith('\n        explain (format json) select 1\n'))
+        self.assertIsNone(rights.get_search_rights_sql(
+            False, None, None, None, None, count='none')[1])
+
+    def test_encode_cursor(self):
+        self.assertEqual('MTIz', rights.encode_cursor(123))
+        self.assertEqual(123, rights.decode_cursor('MTIz'))
+
+    def test_decode_cursor_first_page(self):
+        self.assertEqual(0, rights.decode_cursor(None))
+        self.assertEqual(0, rights.decode_cursor(''))
+
+    def test_decode_cursor_invalid(self):
+        for cursor in ['???', 'eHl6', 'LTE=', 5, ['MTIz']]:
+            with self.assertRaises(ValueError):
+                rights.decode_cursor(cursor)
+
+    def test_decode_cursor_out_of_range(self):
+        self.assertEqual(
+            2 ** 63 - 1, rights.decode_cursor(rights.encode_cursor(2 ** 63 - 1)))
+        with self.assertRaises(ValueError):
+            rights.decode_cursor(rights.encode_cursor(2 ** 63))
 
     @patch('rights.get_search_rights_sql', return_value=('SQL1', 'SQL2'))
     def test_search_rights(self, mock_get_search_rights_sql):
@@ -328,20 +1280,18 @@ class MainTestCase(unittest.TestCase):
         cur.__iter__.return_value = [
             [
                 '12345678901', 'F_NAME', 'L_NAME', '12345678', 'ORG_NAME', 'RIGHT1',
-                datetime(2020, 1, 1, 10, 35, 45, 555),
-                datetime(2020, 2, 10, 10, 35, 45, 555), False],
+                '2020-01-01T10:35:45.000555', '2020-02-10T10:35:45.000555', False, 1],
             [
                 '12345678901', 'F_NAME', 'L_NAME', '12345678', 'ORG_NAME', 'RIGHT2',
-                datetime(2020, 1, 1, 10, 35, 45, 555),
-                datetime(2020, 2, 10, 10, 35, 45, 555), False]]
+                '2020-01-01T10:35:45.000555', '2020-02-10T10:35:45.000555', False, 2]]
         cur.execute = MagicMock()
         cur.fetchone = MagicMock(return_value=[1])
         kwargs = {
             'persons': ['12345678901', '12345678902'],
             'organizations': ['12345678', '12345679'],
             'rights': ['RIGHTS1', 'RIGHTS2'],
-            'only_valid': True, 'limit': 10, 'offset': 0,
-            'days_to_expiration': 10}
+            'only_valid': True, 'limit': 10, 'offset': 0, 'after_id': None,
+            'days_to_expiration': (7, 10), 'count': 'exact'}
         expected = {
             'limit': 10, 'offset': 0, 'rights': [
                 {
@@ -360,20 +1310,471 @@ class MainTestCase(unittest.TestCase):
                         'revoked': False, 'right_type': 'RIGHT2',
                         'valid_from': '2020-01-01T10:35:45.000555',
                         'valid_to': '2020-02-10T10:35:45.000555'}}],
-            'total': 1}
+            'total': 1, 'count': 'exact'}
         self.assertEqual(expected, rights.search_rights(cur, **kwargs))
         cur.execute.assert_has_calls([
             call('SQL1', {
                 'persons': ['12345678901', '12345678902'],
                 'organizations': ['12345678', '12345679'], 'rights': ['RIGHTS1', 'RIGHTS2'],
-                'limit': 10, 'offset': 0, 'days_to_expiration': 10}),
+                'limit': 10, 'offset': 0, 'after_id': None, 'expiration_from': 7,
+                'expiration_to': 10}),
             call('SQL2', {
                 'persons': ['12345678901', '12345678902'],
                 'organizations': ['12345678', '12345679'], 'rights': ['RIGHTS1', 'RIGHTS2'],
-                'limit': 10, 'offset': 0, 'days_to_expiration': 10})])
+                'limit': 10, 'offset': 0, 'after_id': None, 'expiration_from': 7,
+                'expiration_to': 10})])
         mock_get_search_rights_sql.assert_called_with(
             True, ['12345678901', '12345678902'], ['12345678', '12345679'], ['RIGHTS1', 'RIGHTS2'],
-            10)
+            (7, 10), None, 'exact')
+
+    @patch('rights.get_search_rights_sql', return_value=('SQL1', 'SQL2'))
+    def test_search_rights_cursor(self, mock_get_search_rights_sql):
+        cur = MagicMock()
+        cur.__iter__.return_value = [
+            ['P1', None, None, 'O1', None, 'RIGHT1', None, None, False, 7],
+            ['P1', None, None, 'O1', None, 'RIGHT2', None, None, False, 9]]
+        cur.fetchone = MagicMock(return_value=[5])
+        kwargs = {
+            'persons': None, 'organizations': None, 'rights': None, 'only_valid': True,
+            'limit': 1, 'offset': 0, 'after_id': 3, 'days_to_expiration': None,
+            'count': 'window'}
+        self.assertEqual(
+            {'limit': 1, 'next_cursor': 'Nw==', 'total': 5, 'count': 'exact', 'rights': [{
+                'organization': {'code': 'O1', 'name': None},
+                'person': {'code': 'P1', 'first_name': None, 'last_name': None},
+                'right': {
+                    'revoked': False, 'right_type': 'RIGHT1', 'valid_from': None,
+                    'valid_to': None}}]},
+            rights.search_rights(cur, **kwargs))
+        self.assertEqual(
+            {'persons': None, 'organizations': None, 'rights': None, 'limit': 2, 'offset': 0,
+             'after_id': 3, 'expiration_from': None, 'expiration_to': None},
+            cur.execute.call_args_list[0][0][1])
+        mock_get_search_rights_sql.assert_called_with(True, None, None, None, None, 3, 'exact')
+
+    @patch('rights.get_search_rights_sql', return_value=('SQL1', 'SQL2'))
+    def test_search_rights_cursor_last_page(self, _):
+        cur = MagicMock()
+        cur.__iter__.return_value = [
+            ['P1', None, None, 'O1', None, 'RIGHT1', None, None, False, 7]]
+        cur.fetchone = MagicMock(return_value=[1])
+        kwargs = {
+            'persons': None, 'organizations': None, 'rights': None, 'only_valid': True,
+            'limit': 1, 'offset': 0, 'after_id': 0, 'days_to_expiration': None,
+            'count': 'exact'}
+        self.assertIsNone(rights.search_rights(cur, **kwargs)['next_cursor'])
+
+    @patch('rights.get_search_rights_sql', return_value=('SQL1', 'SQL2'))
+    def test_search_rights_count_window(self, _):
+        cur = MagicMock()
+        cur.__iter__.return_value = [
+            ['P1', None, None, 'O1', None, 'RIGHT1', None, None, False, 7, 42]]
+        kwargs = {
+            'persons': None, 'organizations': None, 'rights': None, 'only_valid': True,
+            'limit': 1, 'offset': 5, 'after_id': None, 'days_to_expiration': None,
+            'count': 'window'}
+        result = rights.search_rights(cur, **kwargs)
+        self.assertEqual((42, 'window'), (result['total'], result['count']))
+        cur.execute.assert_called_once()
+
+    @patch('rights.get_search_rights_sql', return_value=('SQL1', 'SQL2'))
+    def test_search_rights_count_window_empty(self, _):
+        cur = MagicMock()
+        cur.__iter__.return_value = []
+        cur.fetchone = MagicMock(return_value=[3])
+        kwargs = {
+            'persons': None, 'organizations': None, 'rights': None, 'only_valid': True,
+            'limit': 1, 'offset': 0, 'after_id': None, 'days_to_expiration': None,
+            'count': 'window'}
+        result = rights.search_rights(cur, **kwargs)
+        self.assertEqual((0, 'window'), (result['total'], result['count']))
+        cur.execute.assert_called_once()
+        kwargs['offset'] = 5
+        result = rights.search_rights(cur, **kwargs)
+        self.assertEqual((3, 'exact'), (result['total'], result['count']))
+        cur.execute.assert_called_with('SQL2', ANY)
+
+    @patch('rights.get_search_rights_sql', return_value=('SQL1', 'SQL2'))
+    def test_search_rights_count_estimate(self, _):
+        cur = MagicMock()
+        cur.__iter__.return_value = []
+        cur.fetchone = MagicMock(return_value=[[{'Plan': {'Plan Rows': 1234}}]])
+        kwargs = {
+            'persons': None, 'organizations': None, 'rights': None, 'only_valid': True,
+            'limit': 1, 'offset': 0, 'after_id': None, 'days_to_expiration': None,
+            'count': 'estimate'}
+        result = rights.search_rights(cur, **kwargs)
+        self.assertEqual((1234, 'estimate'), (result['total'], result['count']))
+        cur.execute.assert_called_with('SQL2', ANY)
+
+    @patch('rights.get_search_rights_sql', return_value=('SQL1', None))
+    def test_search_rights_count_none(self, _):
+        cur = MagicMock()
+        cur.__iter__.return_value = []
+        kwargs = {
+            'persons': None, 'organizations': None, 'rights': None, 'only_valid': True,
+            'limit': 1, 'offset': 0, 'after_id': None, 'days_to_expiration': None,
+            'count': 'none'}
+        result = rights.search_rights(cur, **kwargs)
+        self.assertEqual((None, 'none'), (result['total'], result['count']))
+        cur.execute.assert_called_once_with('SQL1', ANY)
+
+    def test_get_search_rights_params(self):
+        self.assertEqual(
+            {'persons': ['P1'], 'organizations': None, 'rights': None, 'limit': 11, 'offset': 0,
+             'after_id': 5, 'expiration_from': 0, 'expiration_to': 7},
+            rights.get_search_rights_params({
+                'persons': ['P1'], 'organizations': None, 'rights': None, 'limit': 10,
+                'offset': 0, 'after_id': 5, 'days_to_expiration': (0, 7)}))
+
+    def test_get_search_cache_key(self):
+        self.assertEqual(
+            (('after_id', None), ('days_to_expiration', (0, 7)), ('limit', 10),
+             ('persons', ('P1', 'P2'))),
+            rights.get_search_cache_key({
+                'persons': ['P2', 'P1', 'P2'], 'limit': 10, 'after_id': None,
+                'days_to_expiration': (0, 7)}))
+
+    def test_get_search_cache_ttl_no_boundaries(self):
+        cur = MagicMock()
+        self.assertEqual(60, rights.get_search_cache_ttl(
+            cur, {'only_valid': False, 'days_to_expiration': None}, {'count': 'exact'}, 60))
+        cur.execute.assert_not_called()
+
+    @patch('rights.get_datetime_now', return_value=datetime(2020, 1, 1, 23, 59, 30))
+    def test_get_search_cache_ttl_returned_rights(self, _):
+        cur = MagicMock()
+        cur.mogrify.return_value = b'SQL'
+        cur.fetchone.return_value = [None]
+        kwargs = {
+            'persons': [], 'organizations': [], 'rights': ['R1'], 'only_valid': True,
+            'limit': 10, 'offset': 0, 'after_id': None, 'days_to_expiration': None}
+        result = {'count': 'none', 'rights': [
+            {'right': {'valid_to': None}},
+            {'right': {'valid_to': '2020-01-01T23:59:50.000000'}},
+            {'right': {'valid_to': '2020-01-01T23:59:40.500000'}},
+            {'right': {'valid_to': '2020-01-01T23:59:00.000000'}}]}
+        self.assertEqual(10.5, rights.get_search_cache_ttl(cur, kwargs, result, 60))
+        cur.execute.assert_called_with(
+            '\n        select extract(epoch from least(min(r.valid_from)) - current_timestamp)'
+            '\n        from rights.right r'
+            '\n        join rights.person p on (p.id=r.person_id)'
+            '\n        join rights.organization o on (o.id=r.organization_id)'
+            '\n        where true'
+            '\n            and r.right_type=ANY(%(rights)s)'
+            '\n            and not r.revoked'
+            '\n            and r.valid_from>current_timestamp', {
+                'persons': [], 'organizations': [], 'rights': ['R1'], 'limit': 10,
+                'offset': 0, 'after_id': None, 'expiration_from': None, 'expiration_to': None})
+        self.assertEqual(5, rights.get_search_cache_ttl(cur, kwargs, result, 5))
+        # Matching right becomes valid before returned rights expire
+        cur.fetchone.return_value = [Decimal('2.5')]
+        self.assertEqual(2.5, rights.get_search_cache_ttl(cur, kwargs, result, 60))
+        cur.fetchone.return_value = [None]
+        result['count'] = 'estimate'
+        self.assertEqual(60, rights.get_search_cache_ttl(
+            cur, kwargs, dict(result, rights=[]), 60))
+        self.assertEqual(30, rights.get_search_cache_ttl(
+            cur, dict(kwargs, days_to_expiration=(0, 7)), dict(result, rights=[]), 60))
+        self.assertEqual(5, cur.execute.call_count)
+        self.assertEqual(30, rights.get_search_cache_ttl(
+            cur, dict(kwargs, only_valid=False, days_to_expiration=(0, 7)), result, 60))
+        self.assertEqual(5, cur.execute.call_count)
+
+    def test_get_search_cache_ttl(self):
+        cur = MagicMock()
+        cur.mogrify.return_value = b'SQL'
+        cur.fetchone.return_value = [Decimal('12.5')]
+        kwargs = {
+            'persons': ['P1'], 'organizations': [], 'rights': [], 'only_valid': True,
+            'limit': 10, 'offset': 0, 'after_id': None, 'days_to_expiration': (0, 7)}
+        self.assertEqual(12.5, rights.get_search_cache_ttl(cur, kwargs, {'count': 'exact'}, 60))
+        cur.execute.assert_called_with(
+            '\n        select extract(epoch from least((current_date + 1)::timestamptz, '
+            'min(r.valid_from) filter (where r.valid_from>current_timestamp), '
+            'min(r.valid_to) filter (where r.valid_to>current_timestamp)) - current_timestamp)'
+            '\n        from rights.right r'
+            '\n        join rights.person p on (p.id=r.person_id)'
+            '\n        join rights.organization o on (o.id=r.organization_id)'
+            '\n        where true'
+            '\n            and p.code=ANY(%(persons)s)'
+            '\n            and not r.revoked', {
+                'persons': ['P1'], 'organizations': [], 'rights': [], 'limit': 10,
+                'offset': 0, 'after_id': None, 'expiration_from': 0, 'expiration_to': 7})
+        cur.fetchone.return_value = [Decimal('120')]
+        self.assertEqual(60, rights.get_search_cache_ttl(cur, kwargs, {'count': 'window'}, 60))
+        cur.fetchone.return_value = [None]
+        self.assertEqual(60, rights.get_search_cache_ttl(
+            cur, dict(kwargs, offset=10), {'count': 'none'}, 60))
+        self.assertEqual(3, cur.execute.call_count)
+
+    @patch('rights.SEARCH_CACHE', None)
+    @patch('rights.search_rights', return_value='RESULT')
+    @patch('rights.db_connection')
+    def test_cached_search_rights_disabled(self, mock_db_connection, mock_search_rights):
+        self.assertEqual(('RESULT', False), rights.cached_search_rights('CONF', {'x': 'y'}))
+        mock_db_connection.assert_called_with('CONF')
+        mock_search_rights.assert_called_with(
+            mock_db_connection.return_value.__enter__.return_value.cursor.return_value
+            .__enter__.return_value, x='y')
+
+    @patch('rights.SEARCH_CACHE')
+    @patch('rights.db_connection')
+    def test_cached_search_rights_hit(self, mock_db_connection, mock_cache):
+        mock_cache.get.return_value = (('CACHED', None, None), 3)
+        self.assertEqual(('CACHED', True), rights.cached_search_rights('CONF', {'x': 'y'}))
+        mock_cache.get.assert_called_with((('x', 'y'),))
+        mock_db_connection.assert_not_called()
+
+    @patch('rights.get_search_cache_ttl', return_value=30)
+    @patch('rights.SEARCH_CACHE')
+    @patch('rights.search_rights', return_value='RESULT')
+    @patch('rights.db_connection')
+    def test_cached_search_rights_miss(self, mock_db_connection, _, mock_cache, mock_ttl):
+        mock_cache.get.return_value = (None, 3)
+        mock_cache.ttl = 60
+        self.assertEqual(('RESULT', False), rights.cached_search_rights('CONF', {'x': 'y'}))
+        cur = mock_db_connection.return_value.__enter__.return_value.cursor.return_value \
+            .__enter__.return_value
+        mock_ttl.assert_called_with(cur, {'x': 'y'}, 'RESULT', 60)
+        mock_cache.add.assert_called_with((('x', 'y'),), 'RESULT', {'x': 'y'}, 30, 3)
+
+    @patch('rights.get_search_cache_ttl')
+    @patch('rights.SEARCH_CACHE')
+    @patch('rights.search_rights', return_value='RESULT')
+    @patch('rights.db_connection')
+    def test_cached_search_rights_not_listening(self, _, __, mock_cache, mock_ttl):
+        mock_cache.get.return_value = (None, None)
+        self.assertEqual(('RESULT', False), rights.cached_search_rights('CONF', {'x': 'y'}))
+        mock_ttl.assert_not_called()
+        mock_cache.add.assert_not_called()
+
+    @patch('rights.cached_search_rights', return_value=({
+        'total': 1, 'count': 'exact', 'offset': 0, 'rights': [1]}, True))
+    @patch('rights.validate_search_rights_request', return_value=({'after_id': None}, None))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_search_rights_cached(self, *_):
+        with self.assertLogs(rights.LOGGER, level='DEBUG') as cm:
+            self.assertEqual('Found 1 rights', rights.process_search_rights(
+                {'CONF': 'data'}, {}, 'HEADER: ')['msg'])
+            self.assertEqual([
+                'DEBUG:rights:HEADER: Search result found in cache',
+                'INFO:rights:HEADER: Found 1 rights (exact count), returning 1 rights with '
+                'offset 0'], cm.output)
+
+    def test_get_ndjson_line(self):
+        self.assertEqual('{"a":1,"b":[null,true]}\n', rights.get_ndjson_line(
+            {'a': 1, 'b': [None, True]}))
+
+    @staticmethod
+    def new_search_record(right_id):
+        return ['P1', 'F', 'L', 'O1', 'N', 'RIGHT1', '2020-01-01T10:35:45.000555', None,
+                False, right_id]
+
+    @patch('rights.db_connection')
+    def test_stream_search_rights(self, db_connection_mock):
+        conn_mock = db_connection_mock.return_value.__enter__.return_value
+        cur = conn_mock.cursor.return_value.__enter__.return_value
+        cur.fetchmany = MagicMock(side_effect=[
+            [self.new_search_record(1), self.new_search_record(2)],
+            [self.new_search_record(3)], []])
+        kwargs = {
+            'persons': None, 'organizations': None, 'rights': None, 'only_valid': True,
+            'limit': 100, 'offset': 0, 'after_id': None, 'days_to_expiration': None}
+        line = (
+            '{"person":{"code":"P1","first_name":"F","last_name":"L"},'
+            '"organization":{"code":"O1","name":"N"},"right":{"right_type":"RIGHT1",'
+            '"valid_from":"2020-01-01T10:35:45.000555","valid_to":null,"revoked":false}}\n')
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                ['', line * 2, line,
+                 '{"code":"OK","msg":"Returned 3 rights","returned":3}\n'],
+                list(rights.stream_search_rights(
+                    {'stream_fetch_size': 2}, kwargs, 'HEADER: ')))
+            self.assertEqual(['INFO:rights:HEADER: Streamed 3 rights'], cm.output)
+        self.assertTrue(conn_mock.cursor.call_args[1]['name'].startswith('search_rights_'))
+        cur.fetchmany.assert_called_with(2)
+        self.assertEqual(100, cur.execute.call_args[0][1]['limit'])
+
+    @patch('rights.db_connection')
+    def test_stream_search_rights_cursor(self, db_connection_mock):
+        cur = db_connection_mock.return_value.__enter__.return_value.cursor.return_value.\
+            __enter__.return_value
+        cur.fetchmany = MagicMock(side_effect=[
+            [self.new_search_record(4), self.new_search_record(7)],
+            [self.new_search_record(9)]])
+        kwargs = {
+            'persons': None, 'organizations': None, 'rights': None, 'only_valid': True,
+            'limit': 2, 'offset': 0, 'after_id': 0, 'days_to_expiration': None}
+        lines = list(rights.stream_search_rights({}, kwargs, 'HEADER: '))
+        self.assertEqual(3, len(lines))
+        self.assertEqual(2, lines[1].count('\n'))
+        self.assertEqual(
+            '{"code":"OK","msg":"Returned 2 rights","returned":2,"next_cursor":"Nw=="}\n',
+            lines[2])
+        cur.fetchmany.assert_called_with(1000)
+        self.assertEqual(3, cur.execute.call_args[0][1]['limit'])
+
+    @patch('rights.db_connection')
+    def test_stream_search_rights_cursor_last_page(self, db_connection_mock):
+        cur = db_connection_mock.return_value.__enter__.return_value.cursor.return_value.\
+            __enter__.return_value
+        cur.fetchmany = MagicMock(side_effect=[[self.new_search_record(4)], []])
+        kwargs = {
+            'persons': None, 'organizations': None, 'rights': None, 'only_valid': True,
+            'limit': 2, 'offset': 0, 'after_id': 0, 'days_to_expiration': None}
+        self.assertEqual(
+            '{"code":"OK","msg":"Returned 1 rights","returned":1,"next_cursor":null}\n',
+            list(rights.stream_search_rights({}, kwargs, 'HEADER: '))[-1])
+
+    def test_search_stream_extra_row_only(self):
+        stream = rights.SearchStream({'after_id': 0, 'limit': 2})
+        self.assertEqual(1, len(stream.get_chunks(
+            [self.new_search_record(4), self.new_search_record(7)])))
+        self.assertFalse(stream.has_more)
+        self.assertEqual([], stream.get_chunks([self.new_search_record(9)]))
+        self.assertTrue(stream.has_more)
+        self.assertEqual(
+            '{"code":"OK","msg":"Returned 2 rights","returned":2,"next_cursor":"Nw=="}\n',
+            stream.get_trailer('HEADER: '))
+
+    @patch('rights.db_connection')
+    def test_stream_search_rights_db_error(self, db_connection_mock):
+        cur = db_connection_mock.return_value.__enter__.return_value.cursor.return_value.\
+            __enter__.return_value
+        cur.fetchmany = MagicMock(side_effect=[
+            [self.new_search_record(1)], psycopg2.Error('DB_ERROR_MSG')])
+        kwargs = {
+            'persons': None, 'organizations': None, 'rights': None, 'only_valid': True,
+            'limit': 100, 'offset': 0, 'after_id': None, 'days_to_expiration': None}
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            lines = list(rights.stream_search_rights({}, kwargs, 'HEADER: '))
+            self.assertEqual(
+                f'{{"code":"DB_ERROR","msg":"{rights.DB_ERROR_MSG}"}}\n', lines[-1])
+            self.assertEqual(3, len(lines))
+            self.assertEqual([
+                f'ERROR:rights:HEADER: DB_ERROR: {rights.DB_ERROR_MSG}: DB_ERROR_MSG'],
+                cm.output)
+
+    def test_get_export_rights_sql(self):
+        kwargs = {
+            'persons': ['P1'], 'organizations': None, 'rights': None, 'only_valid': False,
+            'days_to_expiration': None}
+        sql = rights.get_export_rights_sql(kwargs, 'csv')
+        self.assertTrue(sql.startswith(
+            '\n        copy (\n        select p.code as person_code, p.first_name as '
+            'person_first_name,\n'))
+        self.assertIn('\n            and p.code=ANY(%(persons)s)\n        order by r.id)', sql)
+        self.assertTrue(sql.endswith(') to stdout with (format csv, header true)'))
+        sql = rights.get_export_rights_sql(kwargs, 'ndjson')
+        self.assertIn("'valid_from', to_char(r.valid_from, 'YYYY-MM-DD\"T\"HH24:MI:SS.US')", sql)
+        self.assertTrue(sql.endswith(
+            ") to stdout with (format csv, quote e'\\x01', delimiter e'\\x02')"))
+
+    def test_export_writer(self):
+        chunks = queue.Queue()
+        writer = rights.ExportWriter(chunks, 4)
+        writer.write(b'ab')
+        self.assertTrue(chunks.empty())
+        writer.write('cd')
+        writer.write(b'e')
+        self.assertEqual(b'abcd', chunks.get_nowait())
+        writer.flush()
+        self.assertEqual(b'e', chunks.get_nowait())
+        writer.flush()
+        self.assertTrue(chunks.empty())
+
+    def test_export_writer_cancel(self):
+        chunks = queue.Queue(maxsize=1)
+        writer = rights.ExportWriter(chunks, 1)
+        writer.write(b'a')
+        writer.cancel()
+        # Does not block on full queue
+        writer.write(b'b')
+        self.assertEqual(b'a', chunks.get_nowait())
+        self.assertTrue(chunks.empty())
+
+    def test_copy_to_writer(self):
+        cur = MagicMock()
+        writer = MagicMock()
+        rights.copy_to_writer(cur, 'SQL', writer)
+        cur.copy_expert.assert_called_with('SQL', writer)
+        writer.flush.assert_called_once()
+        writer.put.assert_called_with(None)
+        err = psycopg2.Error('DB_ERROR_MSG')
+        cur.copy_expert.side_effect = err
+        rights.copy_to_writer(cur, 'SQL', writer)
+        writer.put.assert_called_with(err)
+
+    def test_copy_to_writer_unexpected_error(self):
+        cur = MagicMock()
+        writer = rights.ExportWriter(queue.Queue(), 10)
+        writer.write(b'a')
+        cur.copy_expert.side_effect = UnicodeEncodeError('ascii', 'x', 0, 1, 'ERR')
+        rights.copy_to_writer(cur, 'SQL', writer)
+        with self.assertRaises(UnicodeEncodeError):
+            rights.get_export_chunk(writer.chunks)
+        self.assertTrue(writer.chunks.empty())
+
+    @staticmethod
+    def new_export_cursor(db_connection_mock, rows):
+        def copy_expert(_, writer):
+            for row in rows:
+                writer.write(row)
+        conn_mock = db_connection_mock.return_value.__enter__.return_value
+        cur = conn_mock.cursor.return_value.__enter__.return_value
+        cur.mogrify = MagicMock(return_value=b'SQL')
+        cur.copy_expert = MagicMock(side_effect=copy_expert)
+        return conn_mock, cur
+
+    @patch('rights.get_export_rights_sql', return_value='EXPORT_SQL')
+    @patch('rights.db_connection')
+    def test_export_rights(self, db_connection_mock, get_export_rights_sql_mock):
+        _, cur = self.new_export_cursor(db_connection_mock, [b'a,b\n', b'c,d\n', b'e,f\n'])
+        kwargs = {
+            'persons': None, 'organizations': None, 'rights': None, 'only_valid': True,
+            'limit': None, 'offset': None, 'after_id': None, 'days_to_expiration': None,
+            'format': 'csv'}
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                [b'', b'a,b\nc,d\n', b'e,f\n'],
+                list(rights.export_rights({'export_chunk_size': 8}, kwargs, 'HEADER: ')))
+            self.assertEqual(['INFO:rights:HEADER: Exported 12 bytes'], cm.output)
+        get_export_rights_sql_mock.assert_called_with(kwargs, 'csv')
+        cur.mogrify.assert_called_with('EXPORT_SQL', {
+            'persons': None, 'organizations': None, 'rights': None, 'limit': None,
+            'offset': None, 'after_id': None, 'expiration_from': None, 'expiration_to': None})
+        cur.copy_expert.assert_called_with('SQL', ANY)
+
+    @patch('rights.get_export_rights_sql', return_value='EXPORT_SQL')
+    @patch('rights.db_connection')
+    def test_export_rights_db_error(self, db_connection_mock, _):
+        _, cur = self.new_export_cursor(db_connection_mock, [])
+        cur.copy_expert.side_effect = psycopg2.Error('DB_ERROR_MSG')
+        kwargs = {
+            'persons': None, 'organizations': None, 'rights': None, 'only_valid': True,
+            'limit': None, 'offset': None, 'after_id': None, 'days_to_expiration': None,
+            'format': 'csv'}
+        with self.assertRaises(psycopg2.Error):
+            next(rights.export_rights({}, kwargs, 'HEADER: '))
+
+    @patch('rights.get_export_rights_sql', return_value='EXPORT_SQL')
+    @patch('rights.db_connection')
+    def test_export_rights_client_gone(self, db_connection_mock, _):
+        conn_mock, _ = self.new_export_cursor(db_connection_mock, [b'a\n'] * 100)
+        kwargs = {
+            'persons': None, 'organizations': None, 'rights': None, 'only_valid': True,
+            'limit': None, 'offset': None, 'after_id': None, 'days_to_expiration': None,
+            'format': 'csv'}
+        chunks = rights.export_rights({'export_chunk_size': 1}, kwargs, 'HEADER: ')
+        self.assertEqual(b'', next(chunks))
+        self.assertEqual(b'a\n', next(chunks))
+        chunks.close()
+        conn_mock.cancel.assert_called_once()
+
+    def test_get_plan_rows(self):
+        self.assertEqual(12, rights.get_plan_rows([{'Plan': {'Plan Rows': 12}}]))
+        self.assertEqual(12, rights.get_plan_rows('[{"Plan": {"Plan Rows": 12.0}}]'))
 
     def test_make_response(self):
         with self.app.app_context():
@@ -388,6 +1789,18 @@ class MainTestCase(unittest.TestCase):
                     "INFO:rights:HEADER: Response: {'code': 'CODE', 'msg': 'MSG', 'response': "
                     "'RESPONSE', 'http_status': 200}"], cm.output)
 
+    @patch('rights.LOG_MAX_ITEMS', 1)
+    def test_make_response_summarized(self):
+        with self.app.app_context():
+            with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+                response = rights.make_response(
+                    {'code': 'CODE', 'msg': 'MSG', 'response': {'items': [1, 2]},
+                     'http_status': 200}, 'HEADER: ')
+                self.assertEqual({'items': [1, 2]}, response.get_json()['response'])
+                self.assertEqual([
+                    "INFO:rights:HEADER: Response: {'code': 'CODE', 'msg': 'MSG', 'response': "
+                    "{'items': [1, '... 1 more items']}, 'http_status': 200}"], cm.output)
+
     def test_make_response_no_response(self):
         with self.app.app_context():
             with self.assertLogs(rights.LOGGER, level='INFO') as cm:
@@ -414,6 +1827,53 @@ class MainTestCase(unittest.TestCase):
                     "DEBUG:rights:HEADER: Response: {'code': 'CODE', 'msg': 'MSG', 'response': "
                     "'RESPONSE', 'http_status': 200}"], cm.output)
 
+    def test_dumps_json(self):
+        data = {'b': [None, True, 1], 'a': 'x\ty"\\/'}
+        for float_free in [False, True]:
+            self.assertEqual(
+                b'{"b":[null,true,1],"a":"x\\ty\\"\\\\/"}',
+                rights.dumps_json(data, float_free=float_free))
+            self.assertEqual(
+                b'{"a":"x\\ty\\"\\\\/","b":[null,true,1]}',
+                rights.dumps_json(data, sort_keys=True, float_free=float_free))
+
+    def test_dumps_json_non_ascii(self):
+        for value in ['\u00e9', '\u2028', '\x7f', '\x00', 2 ** 70]:
+            self.assertEqual(
+                json.dumps({'a': value}, separators=(',', ':')).encode('ascii'),
+                rights.dumps_json({'a': value}, float_free=True))
+
+    def test_dumps_json_float(self):
+        for value in [
+                5e-06, 1e16, -2.5e-10, 1.7976931348623157e308, 0.1, 1e15, 3.0, 2.7e-05, 1e-05,
+                9.9e-05, 0.0001]:
+            self.assertEqual(
+                json.dumps({'a': value}, separators=(',', ':')).encode('ascii'),
+                rights.dumps_json({'a': value}))
+
+    @patch('rights.orjson', None)
+    def test_dumps_json_no_orjson(self):
+        self.assertEqual(b'{"a":"\\u00e9","b":1}', rights.dumps_json(
+            {'b': 1, 'a': '\u00e9'}, sort_keys=True))
+
+    def test_jsonify_fast(self):
+        data = {'msg': 'M\u00e9', 'code': 'OK', 'response': {'rights': [{'b': None, 'a': 1}]}}
+        with self.app.app_context():
+            expected = jsonify(data)
+            response = rights.jsonify_fast(data)
+            self.assertEqual(expected.get_data(), response.get_data())
+            self.assertEqual(expected.mimetype, response.mimetype)
+        self.app.debug = True
+        with self.app.app_context():
+            self.assertEqual(jsonify(data).get_data(), rights.jsonify_fast(data).get_data())
+
+    def test_jsonify_fast_float(self):
+        data = {'code': 'OK', 'msg': 'M', 'response': {
+            'wait_time': 5e-06, 'saturation': 0.25, 'replication_lag': 1e16,
+            'waits': 2.7e-05, 'timeouts': 1e-05}}
+        with self.app.app_context():
+            self.assertEqual(jsonify(data).get_data(), rights.jsonify_fast(data).get_data())
+
     def test_validate_config(self):
         self.assertEqual(None, rights.validate_config(self.config, 'HEADER: '))
 
@@ -716,14 +2176,14 @@ class MainTestCase(unittest.TestCase):
     @patch('rights.revoke_right')
     @patch('rights.set_organization', return_value=123)
     @patch('rights.set_person', return_value=12345)
-    @patch('rights.get_db_connection')
+    @patch('rights.db_connection')
     @patch('rights.validate_set_right_request', return_value=({
         'organization': {'code': '00000000', 'name': None},
         'person': {'code': '12345678901', 'first_name': None, 'last_name': None},
         'right': {'right_type': 'RIGHT1', 'valid_from': None, 'valid_to': None}}, None))
     @patch('rights.validate_config', return_value=None)
     def test_process_set_right(
-            self, validate_config_mock, validate_set_right_request_mock, get_db_connection_mock,
+            self, validate_config_mock, validate_set_right_request_mock, db_connection_mock,
             set_person_mock, set_organization_mock, revoke_right_mock, add_right_mock):
         with self.assertLogs(rights.LOGGER, level='INFO') as cm:
             self.assertEqual(
@@ -732,8 +2192,8 @@ class MainTestCase(unittest.TestCase):
                     {'CONF': 'data'}, {'x': 'y'}, 'HEADER: '))
             validate_config_mock.assert_called_once()
             validate_set_right_request_mock.assert_called_once()
-            get_db_connection_mock.assert_called_once()
-            cursor_mock = get_db_connection_mock.return_value.__enter__.return_value.cursor
+            db_connection_mock.assert_called_once()
+            cursor_mock = db_connection_mock.return_value.__enter__.return_value.cursor
             cursor_mock.assert_called_once()
             cursor_return_mock = cursor_mock.return_value.__enter__.return_value
             set_person_mock.assert_called_with(cursor_return_mock, '12345678901', None, None)
@@ -742,7 +2202,7 @@ class MainTestCase(unittest.TestCase):
             add_right_mock.assert_called_with(
                 cursor_return_mock, organization_id=123, person_id=12345,
                 right_type='RIGHT1', valid_from=None, valid_to=None)
-            commit_mock = get_db_connection_mock.return_value.__enter__.return_value.commit
+            commit_mock = db_connection_mock.return_value.__enter__.return_value.commit
             commit_mock.assert_called_once()
             self.assertEqual(
                 [
@@ -750,6 +2210,112 @@ class MainTestCase(unittest.TestCase):
                     'organization_code=00000000, right_type=RIGHT1'],
                 cm.output)
 
+    @patch('rights.store_id')
+    @patch('rights.lookup_id', side_effect=[(12345, 1), (None, 1)])
+    @patch('rights.add_right')
+    @patch('rights.revoke_right')
+    @patch('rights.set_organization', return_value=123)
+    @patch('rights.set_person')
+    @patch('rights.db_connection')
+    def test_set_right_statements_cached(
+            self, db_connection_mock, set_person_mock, set_organization_mock, revoke_right_mock,
+            add_right_mock, lookup_id_mock, store_id_mock):
+        kwargs = {
+            'organization': {'code': 'O1', 'name': 'N'},
+            'person': {'code': 'P1', 'first_name': 'F', 'last_name': None},
+            'right': {'right_type': 'RIGHT1', 'valid_from': None, 'valid_to': None}}
+        rights.set_right_statements({'CONF': 'data'}, kwargs)
+        lookup_id_mock.assert_has_calls([
+            call('person', 'P1', ('F', None)), call('organization', 'O1', ('N',))])
+        cur = db_connection_mock.return_value.__enter__.return_value.cursor.return_value \
+            .__enter__.return_value
+        set_person_mock.assert_not_called()
+        set_organization_mock.assert_called_with(cur, 'O1', 'N')
+        revoke_right_mock.assert_called_with(cur, 12345, 123, 'RIGHT1')
+        add_right_mock.assert_called_once()
+        db_connection_mock.return_value.__enter__.return_value.commit.assert_called_once()
+        store_id_mock.assert_has_calls([
+            call('person', 'P1', 12345, ('F', None), 1),
+            call('organization', 'O1', 123, ('N',), 1)])
+
+    @patch('rights.store_id')
+    @patch('rights.discard_id')
+    @patch('rights.lookup_id', side_effect=[(12345, 1), (123, 1)])
+    @patch('rights.add_right', side_effect=[psycopg2.IntegrityError('FK'), None])
+    @patch('rights.revoke_right')
+    @patch('rights.set_organization', return_value=124)
+    @patch('rights.set_person', return_value=12346)
+    @patch('rights.db_connection')
+    def test_set_right_statements_stale(
+            self, db_connection_mock, set_person_mock, set_organization_mock, _,
+            add_right_mock, __, discard_id_mock, store_id_mock):
+        kwargs = {
+            'organization': {'code': 'O1', 'name': 'N'},
+            'person': {'code': 'P1', 'first_name': 'F', 'last_name': None},
+            'right': {'right_type': 'RIGHT1', 'valid_from': None, 'valid_to': None}}
+        rights.set_right_statements({'CONF': 'data'}, kwargs)
+        conn = db_connection_mock.return_value.__enter__.return_value
+        conn.rollback.assert_called_once()
+        discard_id_mock.assert_has_calls([call('person', 'P1'), call('organization', 'O1')])
+        set_person_mock.assert_called_once()
+        set_organization_mock.assert_called_once()
+        self.assertEqual(2, add_right_mock.call_count)
+        add_right_mock.assert_called_with(
+            conn.cursor.return_value.__enter__.return_value, person_id=12346,
+            organization_id=124, right_type='RIGHT1', valid_from=None, valid_to=None)
+        conn.commit.assert_called_once()
+        store_id_mock.assert_has_calls([
+            call('person', 'P1', 12346, ('F', None), 1),
+            call('organization', 'O1', 124, ('N',), 1)])
+
+    @patch('rights.lookup_id', return_value=(None, None))
+    @patch('rights.add_right', side_effect=psycopg2.IntegrityError('ERR'))
+    @patch('rights.revoke_right')
+    @patch('rights.set_organization', return_value=123)
+    @patch('rights.set_person', return_value=12345)
+    @patch('rights.db_connection')
+    def test_set_right_statements_integrity_error(self, db_connection_mock, *_):
+        kwargs = {
+            'organization': {'code': 'O1', 'name': 'N'},
+            'person': {'code': 'P1', 'first_name': 'F', 'last_name': None},
+            'right': {'right_type': 'RIGHT1', 'valid_from': None, 'valid_to': None}}
+        with self.assertRaises(psycopg2.IntegrityError):
+            rights.set_right_statements({'CONF': 'data'}, kwargs)
+        db_connection_mock.return_value.__enter__.return_value.rollback.assert_not_called()
+
+    @patch('rights.set_right_statements')
+    @patch('rights.call_set_right')
+    @patch('rights.db_connection')
+    @patch('rights.validate_set_right_request', return_value=({
+        'organization': {'code': '00000000', 'name': None},
+        'person': {'code': '12345678901', 'first_name': None, 'last_name': None},
+        'right': {'right_type': 'RIGHT1', 'valid_from': None, 'valid_to': None}}, None))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_set_right_function(
+            self, validate_config_mock, validate_set_right_request_mock, db_connection_mock,
+            call_set_right_mock, set_right_statements_mock):
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                {'code': 'CREATED', 'http_status': 201, 'msg': 'New right added'},
+                rights.process_set_right(
+                    {'CONF': 'data', 'db_set_right_function': True}, {'x': 'y'}, 'HEADER: '))
+            validate_config_mock.assert_called_once()
+            validate_set_right_request_mock.assert_called_once()
+            conn_mock = db_connection_mock.return_value.__enter__.return_value
+            cursor_return_mock = conn_mock.cursor.return_value.__enter__.return_value
+            call_set_right_mock.assert_called_with(
+                cursor_return_mock, {'code': '12345678901', 'first_name': None, 'last_name': None},
+                {'code': '00000000', 'name': None},
+                {'right_type': 'RIGHT1', 'valid_from': None, 'valid_to': None})
+            set_right_statements_mock.assert_not_called()
+            conn_mock.commit.assert_not_called()
+            self.assertFalse(conn_mock.autocommit)
+            self.assertEqual(
+                [
+                    'INFO:rights:HEADER: Added new Right: person_code=12345678901, '
+                    'organization_code=00000000, right_type=RIGHT1'],
+                cm.output)
+
     @patch('rights.validate_config', return_value='ERR')
     def test_process_set_right_config_err(self, _):
         self.assertEqual(
@@ -766,6 +2332,162 @@ class MainTestCase(unittest.TestCase):
                 {'CONF': 'data'}, {'x': 'y'}, 'HEADER: '))
         validate_config_mock.assert_called_once()
 
+    def test_validate_set_rights_request(self):
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                ([
+                    ({
+                        'organization': {'code': '00000000', 'name': None},
+                        'person': {'code': '12345678901', 'first_name': None, 'last_name': None},
+                        'right': {'right_type': 'RIGHT1', 'valid_from': None, 'valid_to': None}},
+                     None),
+                    (None, {
+                        'http_status': 400, 'code': 'MISSING_PARAMETER',
+                        'msg': 'Missing parameter "person->code"'}),
+                    (None, {
+                        'http_status': 400, 'code': 'INVALID_PARAMETER',
+                        'msg': 'Right must be an object'})], None),
+                rights.validate_set_rights_request([
+                    {
+                        'organization': {'code': '00000000'}, 'person': {'code': '12345678901'},
+                        'right': {'right_type': 'RIGHT1'}},
+                    {'organization': {'code': '00000000'}},
+                    'X'], 10, 'HEADER: '))
+            self.assertEqual([
+                'WARNING:rights:HEADER: MISSING_PARAMETER: Missing parameter "person->code" '
+                "(Request: {'organization': {'code': '00000000'}})",
+                'WARNING:rights:HEADER: INVALID_PARAMETER: Right must be an object '
+                '(Request: X)'], cm.output)
+
+    def test_validate_set_rights_request_single_span(self):
+        spans = []
+        token = rights.TRACE_CONTEXT.set((spans, {'traceId': 'TRACE_ID', 'id': 'ROOT_ID'}))
+        try:
+            rights.validate_set_rights_request([
+                {
+                    'organization': {'code': '00000000'}, 'person': {'code': '12345678901'},
+                    'right': {'right_type': 'RIGHT1'}}] * 3, 10, 'HEADER: ')
+        finally:
+            rights.TRACE_CONTEXT.reset(token)
+        self.assertEqual(['validate'], [span['name'] for span in spans])
+
+    def test_validate_set_rights_request_not_list(self):
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                (None, {
+                    'http_status': 400, 'code': 'INVALID_PARAMETER',
+                    'msg': 'Request must be a list of rights'}),
+                rights.validate_set_rights_request({'x': 'y'}, 10, 'HEADER: '))
+            self.assertEqual([
+                'WARNING:rights:HEADER: INVALID_PARAMETER: Request must be a list of rights'],
+                cm.output)
+
+    def test_validate_set_rights_request_too_many(self):
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                (None, {
+                    'http_status': 400, 'code': 'INVALID_PARAMETER',
+                    'msg': 'Too many rights in request: 3 (maximum 2)'}),
+                rights.validate_set_rights_request([{}, {}, {}], 2, 'HEADER: '))
+            self.assertEqual([
+                'WARNING:rights:HEADER: INVALID_PARAMETER: Too many rights in request: 3 '
+                '(maximum 2)'], cm.output)
+
+    def test_merge_set_rights(self):
+        self.assertEqual(
+            (
+                {'P1': ['F1', 'L2'], 'P2': [None, None]},
+                {'O1': 'N1', 'O2': None},
+                {('P1', 'O1', 'R1'): 3, ('P2', 'O2', 'R1'): 2}),
+            rights.merge_set_rights([
+                {'person': {'code': 'P1', 'first_name': 'F1', 'last_name': 'L1'},
+                 'organization': {'code': 'O1', 'name': 'N1'}, 'right': {'right_type': 'R1'}},
+                None,
+                {'person': {'code': 'P2', 'first_name': None, 'last_name': None},
+                 'organization': {'code': 'O2', 'name': None}, 'right': {'right_type': 'R1'}},
+                {'person': {'code': 'P1', 'first_name': None, 'last_name': 'L2'},
+                 'organization': {'code': 'O1', 'name': None}, 'right': {'right_type': 'R1'}}]))
+
+    @patch('rights.add_rights', return_value={(1, 10, 'R1')})
+    @patch('rights.revoke_rights_by_keys')
+    @patch('rights.upsert_organizations', return_value={'O1': 10})
+    @patch('rights.upsert_persons', return_value={'P1': 1, 'P2': 2})
+    def test_set_rights(
+            self, upsert_persons_mock, upsert_organizations_mock, revoke_rights_by_keys_mock,
+            add_rights_mock):
+        cur = MagicMock()
+        right = {'right_type': 'R1', 'valid_from': None, 'valid_to': None}
+        self.assertEqual(
+            [
+                {'code': 'DUPLICATE', 'msg': 'Right is overridden by a later item'},
+                None,
+                {'code': 'CREATED', 'msg': 'New right added'},
+                {'code': 'RIGHT_NOT_ADDED', 'msg': 'Right was rejected by database'}],
+            rights.set_rights(cur, [
+                {'person': {'code': 'P1', 'first_name': 'F1', 'last_name': None},
+                 'organization': {'code': 'O1', 'name': None}, 'right': right},
+                None,
+                {'person': {'code': 'P1', 'first_name': None, 'last_name': None},
+                 'organization': {'code': 'O1', 'name': 'N1'}, 'right': right},
+                {'person': {'code': 'P2', 'first_name': None, 'last_name': None},
+                 'organization': {'code': 'O1', 'name': None}, 'right': right}]))
+        upsert_persons_mock.assert_called_with(cur, {'P1': ['F1', None], 'P2': [None, None]})
+        upsert_organizations_mock.assert_called_with(cur, {'O1': 'N1'})
+        revoke_rights_by_keys_mock.assert_called_with(cur, [(1, 10, 'R1'), (2, 10, 'R1')])
+        add_rights_mock.assert_called_with(cur, [
+            {'idx': 2, 'person_id': 1, 'organization_id': 10, 'right_type': 'R1',
+             'valid_from': None, 'valid_to': None},
+            {'idx': 3, 'person_id': 2, 'organization_id': 10, 'right_type': 'R1',
+             'valid_from': None, 'valid_to': None}])
+
+    @patch('rights.set_rights', return_value=[{'code': 'CREATED', 'msg': 'New right added'}, None])
+    @patch('rights.db_connection')
+    @patch('rights.validate_set_rights_request', return_value=([
+        ('KWARGS', None),
+        (None, {'http_status': 400, 'code': 'MISSING_PARAMETER', 'msg': 'MSG'})], None))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_set_rights(
+            self, validate_config_mock, validate_set_rights_request_mock, db_connection_mock,
+            set_rights_mock):
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                {'code': 'OK', 'http_status': 200, 'msg': 'Added 1 of 2 rights', 'response': {
+                    'created': 1, 'failed': 1, 'items': [
+                        {'code': 'CREATED', 'msg': 'New right added'},
+                        {'code': 'MISSING_PARAMETER', 'msg': 'MSG'}]}},
+                rights.process_set_rights({'CONF': 'data'}, ['x', 'y'], 'HEADER: '))
+            validate_config_mock.assert_called_once()
+            validate_set_rights_request_mock.assert_called_with(['x', 'y'], 10000, 'HEADER: ')
+            conn_mock = db_connection_mock.return_value.__enter__.return_value
+            cursor_return_mock = conn_mock.cursor.return_value.__enter__.return_value
+            set_rights_mock.assert_called_with(cursor_return_mock, ['KWARGS', None])
+            conn_mock.commit.assert_called_once()
+            self.assertEqual(
+                ['INFO:rights:HEADER: Added 1 new Rights, 1 items failed'], cm.output)
+
+    @patch('rights.db_connection')
+    @patch('rights.validate_set_rights_request', return_value=([
+        (None, {'http_status': 400, 'code': 'MISSING_PARAMETER', 'msg': 'MSG'})], None))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_set_rights_all_invalid(self, _, validate_set_rights_request_mock,
+                                            db_connection_mock):
+        self.assertEqual(
+            {'code': 'OK', 'http_status': 200, 'msg': 'Added 0 of 1 rights', 'response': {
+                'created': 0, 'failed': 1, 'items': [
+                    {'code': 'MISSING_PARAMETER', 'msg': 'MSG'}]}},
+            rights.process_set_rights({'bulk_max_items': 5}, ['x'], 'HEADER: '))
+        validate_set_rights_request_mock.assert_called_with(['x'], 5, 'HEADER: ')
+        db_connection_mock.assert_not_called()
+
+    @patch('rights.validate_set_rights_request', return_value=(None, 'ERR'))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_set_rights_request_err(self, *_):
+        self.assertEqual('ERR', rights.process_set_rights({'CONF': 'data'}, {}, 'HEADER: '))
+
+    @patch('rights.validate_config', return_value='ERR')
+    def test_process_set_rights_config_err(self, _):
+        self.assertEqual('ERR', rights.process_set_rights({'CONF': 'ERR'}, [], 'HEADER: '))
+
     def test_validate_revoke_right_request(self):
         json_data = {
             'organization_code': '00000000',
@@ -793,14 +2515,14 @@ class MainTestCase(unittest.TestCase):
     @patch('rights.revoke_right')
     @patch('rights.get_organization', return_value=(123, 'ON'))
     @patch('rights.get_person', return_value=(12345, 'FN', 'LN'))
-    @patch('rights.get_db_connection')
+    @patch('rights.db_connection')
     @patch('rights.validate_revoke_right_request', return_value=({
         'organization_code': '00000000',
         'person_code': '12345678901',
         'right_type': 'RIGHT1'}, None))
     @patch('rights.validate_config', return_value=None)
     def test_process_revoke_right(
-            self, validate_config_mock, validate_revoke_right_request_mock, get_db_connection_mock,
+            self, validate_config_mock, validate_revoke_right_request_mock, db_connection_mock,
             get_person_mock, get_organization_mock, revoke_right_mock):
         with self.assertLogs(rights.LOGGER, level='INFO') as cm:
             self.assertEqual(
@@ -809,14 +2531,14 @@ class MainTestCase(unittest.TestCase):
                     {'CONF': 'data'}, {'x': 'y'}, 'HEADER: '))
             validate_config_mock.assert_called_once()
             validate_revoke_right_request_mock.assert_called_once()
-            get_db_connection_mock.assert_called_once()
-            cursor_mock = get_db_connection_mock.return_value.__enter__.return_value.cursor
+            db_connection_mock.assert_called_once()
+            cursor_mock = db_connection_mock.return_value.__enter__.return_value.cursor
             cursor_mock.assert_called_once()
             cursor_return_mock = cursor_mock.return_value.__enter__.return_value
             get_person_mock.assert_called_with(cursor_return_mock, '12345678901')
             get_organization_mock.assert_called_with(cursor_return_mock, '00000000')
             revoke_right_mock.assert_called_with(cursor_return_mock, 12345, 123, 'RIGHT1')
-            commit_mock = get_db_connection_mock.return_value.__enter__.return_value.commit
+            commit_mock = db_connection_mock.return_value.__enter__.return_value.commit
             commit_mock.assert_called_once()
             self.assertEqual(
                 [
@@ -824,6 +2546,58 @@ class MainTestCase(unittest.TestCase):
                     'organization_code=00000000, right_type=RIGHT1'],
                 cm.output)
 
+    @patch('rights.store_id')
+    @patch('rights.lookup_id', side_effect=[(12345, 1), (123, 1)])
+    @patch('rights.revoke_right', return_value=1)
+    @patch('rights.get_organization')
+    @patch('rights.get_person')
+    @patch('rights.db_connection')
+    @patch('rights.validate_revoke_right_request', return_value=({
+        'organization_code': '00000000',
+        'person_code': '12345678901',
+        'right_type': 'RIGHT1'}, None))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_revoke_right_cached(
+            self, _, __, db_connection_mock, get_person_mock, get_organization_mock,
+            revoke_right_mock, lookup_id_mock, store_id_mock):
+        self.assertEqual(
+            {'code': 'OK', 'http_status': 200, 'msg': 'Right revoked'},
+            rights.process_revoke_right({'CONF': 'data'}, {'x': 'y'}, 'HEADER: '))
+        lookup_id_mock.assert_has_calls([
+            call('person', '12345678901', ()), call('organization', '00000000', ())])
+        get_person_mock.assert_not_called()
+        get_organization_mock.assert_not_called()
+        revoke_right_mock.assert_called_once_with(
+            db_connection_mock.return_value.__enter__.return_value.cursor.return_value
+            .__enter__.return_value, 12345, 123, 'RIGHT1')
+        db_connection_mock.return_value.__enter__.return_value.commit.assert_called_once()
+        store_id_mock.assert_not_called()
+
+    @patch('rights.store_id')
+    @patch('rights.lookup_id', side_effect=[(12345, 1), (123, 1)])
+    @patch('rights.revoke_right', side_effect=[0, 1])
+    @patch('rights.get_organization', return_value=(124, 'ON'))
+    @patch('rights.get_person', return_value=(12346, 'FN', 'LN'))
+    @patch('rights.db_connection')
+    @patch('rights.validate_revoke_right_request', return_value=({
+        'organization_code': '00000000',
+        'person_code': '12345678901',
+        'right_type': 'RIGHT1'}, None))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_revoke_right_cached_stale(
+            self, _, __, db_connection_mock, ___, ____, revoke_right_mock, _____,
+            store_id_mock):
+        self.assertEqual(
+            {'code': 'OK', 'http_status': 200, 'msg': 'Right revoked'},
+            rights.process_revoke_right({'CONF': 'data'}, {'x': 'y'}, 'HEADER: '))
+        cur = db_connection_mock.return_value.__enter__.return_value.cursor.return_value \
+            .__enter__.return_value
+        revoke_right_mock.assert_has_calls([
+            call(cur, 12345, 123, 'RIGHT1'), call(cur, 12346, 124, 'RIGHT1')])
+        store_id_mock.assert_has_calls([
+            call('person', '12345678901', 12346, None, 1),
+            call('organization', '00000000', 124, None, 1)])
+
     @patch('rights.validate_config', return_value='ERR')
     def test_process_revoke_right_config_err(self, _):
         self.assertEqual(
@@ -843,14 +2617,14 @@ class MainTestCase(unittest.TestCase):
     @patch('rights.revoke_right', return_value=0)
     @patch('rights.get_organization', return_value=(123, 'ON'))
     @patch('rights.get_person', return_value=(12345, 'FN', 'LN'))
-    @patch('rights.get_db_connection')
+    @patch('rights.db_connection')
     @patch('rights.validate_revoke_right_request', return_value=({
         'organization_code': '00000000',
         'person_code': '12345678901',
         'right_type': 'RIGHT1'}, None))
     @patch('rights.validate_config', return_value=None)
     def test_process_revoke_right_not_found(
-            self, validate_config_mock, validate_revoke_right_request_mock, get_db_connection_mock,
+            self, validate_config_mock, validate_revoke_right_request_mock, db_connection_mock,
             get_person_mock, get_organization_mock, revoke_right_mock):
         self.assertEqual(
             {'code': 'RIGHT_NOT_FOUND', 'http_status': 200, 'msg': 'No right was found'},
@@ -858,16 +2632,129 @@ class MainTestCase(unittest.TestCase):
                 {'CONF': 'data'}, {'x': 'y'}, 'HEADER: '))
         validate_config_mock.assert_called_once()
         validate_revoke_right_request_mock.assert_called_once()
-        get_db_connection_mock.assert_called_once()
-        cursor_mock = get_db_connection_mock.return_value.__enter__.return_value.cursor
+        db_connection_mock.assert_called_once()
+        cursor_mock = db_connection_mock.return_value.__enter__.return_value.cursor
         cursor_mock.assert_called_once()
         cursor_return_mock = cursor_mock.return_value.__enter__.return_value
         get_person_mock.assert_called_with(cursor_return_mock, '12345678901')
         get_organization_mock.assert_called_with(cursor_return_mock, '00000000')
         revoke_right_mock.assert_called_with(cursor_return_mock, 12345, 123, 'RIGHT1')
-        commit_mock = get_db_connection_mock.return_value.__enter__.return_value.commit
+        commit_mock = db_connection_mock.return_value.__enter__.return_value.commit
         commit_mock.assert_not_called()
 
+    def test_validate_revoke_rights_request(self):
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                ([
+                    ({'person_code': 'P1', 'organization_code': None, 'right_type': 'R1'}, None),
+                    ({'person_code': None, 'organization_code': 'O1', 'right_type': None}, None),
+                    (None, {
+                        'http_status': 400, 'code': 'INVALID_PARAMETER',
+                        'msg': 'Parameter "right_type" must be a non-empty string'}),
+                    (None, {
+                        'http_status': 400, 'code': 'INVALID_PARAMETER',
+                        'msg': 'Parameter "person_code" must be a non-empty string'}),
+                    (None, {
+                        'http_status': 400, 'code': 'INVALID_PARAMETER',
+                        'msg': 'Parameter "organization_code" must be a non-empty string'}),
+                    (None, {
+                        'http_status': 400, 'code': 'MISSING_PARAMETER',
+                        'msg': 'Missing parameter "person_code" or "organization_code"'}),
+                    (None, {
+                        'http_status': 400, 'code': 'INVALID_PARAMETER',
+                        'msg': 'Right must be an object'})], None),
+                rights.validate_revoke_rights_request([
+                    {'person_code': 'P1', 'right_type': 'R1'},
+                    {'organization_code': 'O1'},
+                    {'organization_code': 'O1', 'right_type': 5},
+                    {'person_code': 123, 'organization_code': 'O1'},
+                    {'organization_code': '', 'person_code': 'P1'},
+                    {'right_type': 'R1'},
+                    'X'], 10, 'HEADER: '))
+            self.assertEqual([
+                'WARNING:rights:HEADER: INVALID_PARAMETER: Parameter "right_type" must be a '
+                "non-empty string (Request: {'organization_code': 'O1', 'right_type': 5})",
+                'WARNING:rights:HEADER: INVALID_PARAMETER: Parameter "person_code" must be a '
+                "non-empty string (Request: {'person_code': 123, 'organization_code': 'O1'})",
+                'WARNING:rights:HEADER: INVALID_PARAMETER: Parameter "organization_code" must be '
+                "a non-empty string (Request: {'organization_code': '', 'person_code': 'P1'})",
+                'WARNING:rights:HEADER: MISSING_PARAMETER: Missing parameter "person_code" or '
+                "\"organization_code\" (Request: {'right_type': 'R1'})",
+                'WARNING:rights:HEADER: INVALID_PARAMETER: Right must be an object '
+                '(Request: X)'], cm.output)
+
+    def test_validate_revoke_rights_request_not_list(self):
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                (None, {
+                    'http_status': 400, 'code': 'INVALID_PARAMETER',
+                    'msg': 'Request must be a list of rights'}),
+                rights.validate_revoke_rights_request({'x': 'y'}, 10, 'HEADER: '))
+            self.assertEqual([
+                'WARNING:rights:HEADER: INVALID_PARAMETER: Request must be a list of rights'],
+                cm.output)
+
+    def test_validate_revoke_rights_request_too_many(self):
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                (None, {
+                    'http_status': 400, 'code': 'INVALID_PARAMETER',
+                    'msg': 'Too many rights in request: 3 (maximum 2)'}),
+                rights.validate_revoke_rights_request([{}, {}, {}], 2, 'HEADER: '))
+            self.assertEqual([
+                'WARNING:rights:HEADER: INVALID_PARAMETER: Too many rights in request: 3 '
+                '(maximum 2)'], cm.output)
+
+    @patch('rights.revoke_rights', return_value=(2, [2, 0]))
+    @patch('rights.db_connection')
+    @patch('rights.validate_revoke_rights_request', return_value=([
+        ('KWARGS1', None),
+        (None, {'http_status': 400, 'code': 'MISSING_PARAMETER', 'msg': 'MSG'}),
+        ('KWARGS2', None)], None))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_revoke_rights(
+            self, validate_config_mock, validate_revoke_rights_request_mock, db_connection_mock,
+            revoke_rights_mock):
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                {'code': 'OK', 'http_status': 200, 'msg': 'Revoked 2 rights', 'response': {
+                    'revoked': 2, 'items': [
+                        {'code': 'OK', 'msg': 'Rights revoked', 'revoked': 2},
+                        {'code': 'MISSING_PARAMETER', 'msg': 'MSG', 'revoked': 0},
+                        {'code': 'RIGHT_NOT_FOUND', 'msg': 'No right was found', 'revoked': 0}]}},
+                rights.process_revoke_rights({'CONF': 'data'}, ['x', 'y', 'z'], 'HEADER: '))
+            validate_config_mock.assert_called_once()
+            validate_revoke_rights_request_mock.assert_called_with(
+                ['x', 'y', 'z'], 10000, 'HEADER: ')
+            conn_mock = db_connection_mock.return_value.__enter__.return_value
+            cursor_return_mock = conn_mock.cursor.return_value.__enter__.return_value
+            revoke_rights_mock.assert_called_with(cursor_return_mock, ['KWARGS1', 'KWARGS2'])
+            conn_mock.commit.assert_called_once()
+            self.assertEqual(['INFO:rights:HEADER: Revoked 2 Rights'], cm.output)
+
+    @patch('rights.db_connection')
+    @patch('rights.validate_revoke_rights_request', return_value=([
+        (None, {'http_status': 400, 'code': 'MISSING_PARAMETER', 'msg': 'MSG'})], None))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_revoke_rights_all_invalid(self, _, validate_revoke_rights_request_mock,
+                                               db_connection_mock):
+        self.assertEqual(
+            {'code': 'OK', 'http_status': 200, 'msg': 'Revoked 0 rights', 'response': {
+                'revoked': 0, 'items': [
+                    {'code': 'MISSING_PARAMETER', 'msg': 'MSG', 'revoked': 0}]}},
+            rights.process_revoke_rights({'bulk_max_items': 5}, ['x'], 'HEADER: '))
+        validate_revoke_rights_request_mock.assert_called_with(['x'], 5, 'HEADER: ')
+        db_connection_mock.assert_not_called()
+
+    @patch('rights.validate_revoke_rights_request', return_value=(None, 'ERR'))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_revoke_rights_request_err(self, *_):
+        self.assertEqual('ERR', rights.process_revoke_rights({'CONF': 'data'}, {}, 'HEADER: '))
+
+    @patch('rights.validate_config', return_value='ERR')
+    def test_process_revoke_rights_config_err(self, _):
+        self.assertEqual('ERR', rights.process_revoke_rights({'CONF': 'ERR'}, [], 'HEADER: '))
+
     def test_validate_search_rights_request(self):
         json_data = {
             'organizations': ['00000000', '00000001'],
@@ -878,15 +2765,17 @@ class MainTestCase(unittest.TestCase):
             'limit': 5,
             'offset': 3}
         self.assertEqual(
-            {
+            ({
                 'limit': 5,
                 'offset': 3,
                 'only_valid': False,
-                'days_to_expiration': 10,
+                'days_to_expiration': (10, 10),
                 'organizations': ['00000000', '00000001'],
                 'persons': ['12345678901', '12345'],
-                'rights': ['RIGHT1', 'XXX']},
-            rights.validate_search_rights_request(json_data))
+                'rights': ['RIGHT1', 'XXX'],
+                'count': 'exact',
+                'after_id': None}, None),
+            rights.validate_search_rights_request(json_data, 'HEADER: '))
 
     def test_validate_search_rights_request_defaults(self):
         json_data = {
@@ -895,54 +2784,279 @@ class MainTestCase(unittest.TestCase):
             'rights': ['RIGHT1', 'XXX'],
             'days_to_expiration': 10}
         self.assertEqual(
-            {
+            ({
                 'limit': 100,
                 'offset': 0,
                 'only_valid': True,
-                'days_to_expiration': 10,
+                'days_to_expiration': (10, 10),
                 'organizations': ['00000000', '00000001'],
                 'persons': ['12345678901', '12345'],
-                'rights': ['RIGHT1', 'XXX']},
-            rights.validate_search_rights_request(json_data))
+                'rights': ['RIGHT1', 'XXX'],
+                'count': 'exact',
+                'after_id': None}, None),
+            rights.validate_search_rights_request(json_data, 'HEADER: '))
+
+    def test_validate_search_rights_request_cursor(self):
+        self.assertEqual(
+            ({
+                'limit': 100, 'offset': 0, 'only_valid': True, 'days_to_expiration': None,
+                'organizations': [], 'persons': [], 'rights': [], 'count': 'exact',
+                'after_id': 123}, None),
+            rights.validate_search_rights_request({'cursor': 'MTIz'}, 'HEADER: '))
+        self.assertEqual(
+            0, rights.validate_search_rights_request({'cursor': None}, 'HEADER: ')[0]['after_id'])
+
+    def test_validate_search_rights_request_expiration_today(self):
+        self.assertEqual((0, 0), rights.validate_search_rights_request(
+            {'days_to_expiration': 0}, 'HEADER: ')[0]['days_to_expiration'])
+
+    def test_validate_search_rights_request_expiration_range(self):
+        self.assertEqual((0, 7), rights.validate_search_rights_request(
+            {'days_to_expiration_range': {'min': 0, 'max': 7}}, 'HEADER: ')[0][
+                'days_to_expiration'])
+
+    def test_validate_search_rights_request_expiration_range_invalid(self):
+        for days_range in [{'min': 7, 'max': 0}, {'min': 1}, {'min': '1', 'max': 2}, [1, 2]]:
+            with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+                self.assertEqual(
+                    (None, {
+                        'http_status': 400, 'code': 'INVALID_PARAMETER',
+                        'msg': 'Parameter "days_to_expiration_range" must contain integers '
+                               '"min" and "max" where "min" is not bigger than "max"'}),
+                    rights.validate_search_rights_request(
+                        {'days_to_expiration_range': days_range}, 'HEADER: '))
+                self.assertEqual([
+                    'WARNING:rights:HEADER: INVALID_PARAMETER: Invalid days to expiration range '
+                    f"(Request: {{'days_to_expiration_range': {days_range}}})"], cm.output)
+
+    def test_validate_search_rights_request_expiration_both(self):
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                (None, {
+                    'http_status': 400, 'code': 'INVALID_PARAMETER',
+                    'msg': 'Parameters "days_to_expiration" and "days_to_expiration_range" '
+                           'cannot be used together'}),
+                rights.validate_search_rights_request(
+                    {'days_to_expiration': 1, 'days_to_expiration_range': {}}, 'HEADER: '))
+            self.assertEqual([
+                'WARNING:rights:HEADER: INVALID_PARAMETER: Parameters "days_to_expiration" and '
+                '"days_to_expiration_range" cannot be used together (Request: '
+                "{'days_to_expiration': 1, 'days_to_expiration_range': {}})"], cm.output)
+
+    def test_validate_search_rights_request_count(self):
+        self.assertEqual(
+            'estimate', rights.validate_search_rights_request(
+                {'count': 'estimate'}, 'HEADER: ')[0]['count'])
+
+    def test_validate_search_rights_request_invalid_count(self):
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                (None, {
+                    'http_status': 400, 'code': 'INVALID_PARAMETER',
+                    'msg': 'Invalid parameter "count", allowed values: exact, window, estimate, '
+                           'none'}),
+                rights.validate_search_rights_request({'count': 'all'}, 'HEADER: '))
+            self.assertEqual([
+                "WARNING:rights:HEADER: INVALID_PARAMETER: Invalid count mode "
+                "(Request: {'count': 'all'})"], cm.output)
+
+    def test_validate_search_rights_request_invalid_cursor(self):
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                (None, {
+                    'http_status': 400, 'code': 'INVALID_PARAMETER',
+                    'msg': 'Invalid parameter "cursor"'}),
+                rights.validate_search_rights_request({'cursor': '???'}, 'HEADER: '))
+            self.assertEqual([
+                "WARNING:rights:HEADER: INVALID_PARAMETER: Invalid cursor "
+                "(Request: {'cursor': '???'})"], cm.output)
+
+    def test_validate_search_rights_request_cursor_out_of_range(self):
+        with self.assertLogs(rights.LOGGER, level='INFO'):
+            self.assertEqual(
+                (None, {
+                    'http_status': 400, 'code': 'INVALID_PARAMETER',
+                    'msg': 'Invalid parameter "cursor"'}),
+                rights.validate_search_rights_request(
+                    {'cursor': rights.encode_cursor(2 ** 64)}, 'HEADER: '))
+
+    def test_validate_search_rights_request_cursor_limit_zero(self):
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                (None, {
+                    'http_status': 400, 'code': 'INVALID_PARAMETER',
+                    'msg': 'Parameter "limit" must be positive with "cursor"'}),
+                rights.validate_search_rights_request({'cursor': '', 'limit': 0}, 'HEADER: '))
+            self.assertEqual([
+                'WARNING:rights:HEADER: INVALID_PARAMETER: Parameter "limit" must be positive '
+                "with \"cursor\" (Request: {'cursor': '', 'limit': 0})"], cm.output)
+
+    def test_validate_search_rights_request_cursor_and_offset(self):
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                (None, {
+                    'http_status': 400, 'code': 'INVALID_PARAMETER',
+                    'msg': 'Parameters "cursor" and "offset" cannot be used together'}),
+                rights.validate_search_rights_request({'cursor': '', 'offset': 5}, 'HEADER: '))
+            self.assertEqual([
+                'WARNING:rights:HEADER: INVALID_PARAMETER: Parameters "cursor" and "offset" '
+                "cannot be used together (Request: {'cursor': '', 'offset': 5})"], cm.output)
 
     @patch('rights.search_rights', return_value={
         'total': 150,
         'offset': 0,
+        'count': 'exact',
         'rights': [1, 2, 3]
     })
-    @patch('rights.get_db_connection')
-    @patch('rights.validate_search_rights_request', return_value={
+    @patch('rights.db_connection')
+    @patch('rights.validate_search_rights_request', return_value=({
         'limit': 100,
         'offset': 0,
+        'after_id': None,
         'only_valid': True,
         'organizations': ['00000000', '00000001'],
         'persons': ['12345678901', '12345'],
-        'rights': ['RIGHT1', 'XXX']})
+        'rights': ['RIGHT1', 'XXX']}, None))
     @patch('rights.validate_config', return_value=None)
     def test_process_search_rights(
             self, validate_config_mock, validate_search_rights_request_mock,
-            get_db_connection_mock, search_rights_mock):
+            db_connection_mock, search_rights_mock):
         with self.assertLogs(rights.LOGGER, level='INFO') as cm:
             self.assertEqual(
                 {
                     'code': 'OK', 'http_status': 200, 'msg': 'Found 150 rights',
-                    'response': {'offset': 0, 'rights': [1, 2, 3], 'total': 150}},
+                    'response': {
+                        'offset': 0, 'rights': [1, 2, 3], 'total': 150, 'count': 'exact'}},
                 rights.process_search_rights(
                     {'CONF': 'data'}, {'x': 'y'}, 'HEADER: '))
             validate_config_mock.assert_called_once()
             validate_search_rights_request_mock.assert_called_once()
-            get_db_connection_mock.assert_called_once()
-            cursor_mock = get_db_connection_mock.return_value.__enter__.return_value.cursor
+            db_connection_mock.assert_called_once()
+            cursor_mock = db_connection_mock.return_value.__enter__.return_value.cursor
             cursor_mock.assert_called_once()
             cursor_return_mock = cursor_mock.return_value.__enter__.return_value
             search_rights_mock.assert_called_with(
-                cursor_return_mock, limit=100, offset=0, only_valid=True,
+                cursor_return_mock, limit=100, offset=0, after_id=None, only_valid=True,
                 organizations=['00000000', '00000001'], persons=['12345678901', '12345'],
                 rights=['RIGHT1', 'XXX'])
             self.assertEqual(
-                ['INFO:rights:HEADER: Found 150 rights, returning 3 rights with offset 0'],
+                ['INFO:rights:HEADER: Found 150 rights (exact count), returning 3 rights with '
+                 'offset 0'],
                 cm.output)
 
+    @patch('rights.search_rights', return_value={
+        'total': 150, 'count': 'exact', 'next_cursor': 'MTIz', 'rights': [1, 2, 3]})
+    @patch('rights.db_connection')
+    @patch('rights.validate_search_rights_request', return_value=({'after_id': 0}, None))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_search_rights_cursor(self, *_):
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                {
+                    'code': 'OK', 'http_status': 200, 'msg': 'Found 150 rights',
+                    'response': {
+                        'next_cursor': 'MTIz', 'rights': [1, 2, 3], 'total': 150,
+                        'count': 'exact'}},
+                rights.process_search_rights({'CONF': 'data'}, {'cursor': ''}, 'HEADER: '))
+            self.assertEqual(
+                ['INFO:rights:HEADER: Found 150 rights (exact count), returning 3 rights with '
+                 'cursor'], cm.output)
+
+    @patch('rights.search_rights', return_value={
+        'total': None, 'count': 'none', 'offset': 0, 'rights': [1, 2]})
+    @patch('rights.db_connection')
+    @patch('rights.validate_search_rights_request', return_value=({'after_id': None}, None))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_search_rights_count_none(self, *_):
+        self.assertEqual(
+            'Returning 2 rights',
+            rights.process_search_rights({'CONF': 'data'}, {'count': 'none'}, 'HEADER: ')['msg'])
+
+    @patch('rights.validate_search_rights_request', return_value=(None, 'ERR'))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_search_rights_request_err(self, *_):
+        self.assertEqual(
+            'ERR', rights.process_search_rights({'CONF': 'data'}, {'cursor': 1}, 'HEADER: '))
+
+    @patch('rights.stream_search_rights')
+    @patch('rights.validate_search_rights_request', return_value=('KWARGS', None))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_search_rights_stream(self, _, validate_search_rights_request_mock,
+                                          stream_search_rights_mock):
+        lines = iter(['', 'LINE'])
+        stream_search_rights_mock.return_value = lines
+        self.assertEqual(
+            {'http_status': 200, 'code': 'OK', 'msg': 'Streaming rights', 'stream': lines,
+             'mimetype': 'application/x-ndjson'},
+            rights.process_search_rights_stream({'CONF': 'data'}, {'x': 'y'}, 'HEADER: '))
+        validate_search_rights_request_mock.assert_called_with({'x': 'y'}, 'HEADER: ')
+        stream_search_rights_mock.assert_called_with({'CONF': 'data'}, 'KWARGS', 'HEADER: ')
+        self.assertEqual(['LINE'], list(lines))
+
+    @patch('rights.validate_search_rights_request', return_value=(None, 'ERR'))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_search_rights_stream_request_err(self, *_):
+        self.assertEqual('ERR', rights.process_search_rights_stream(
+            {'CONF': 'data'}, {'cursor': 1}, 'HEADER: '))
+
+    @patch('rights.validate_config', return_value='ERR')
+    def test_process_search_rights_stream_config_err(self, _):
+        self.assertEqual('ERR', rights.process_search_rights_stream(
+            {'CONF': 'ERR'}, {}, 'HEADER: '))
+
+    def test_validate_export_rights_request(self):
+        self.assertEqual(
+            ({
+                'persons': ['P1'], 'organizations': [], 'rights': [], 'only_valid': True,
+                'format': 'csv', 'limit': None, 'offset': None, 'after_id': None,
+                'days_to_expiration': (0, 7)}, None),
+            rights.validate_export_rights_request({
+                'persons': ['P1'], 'days_to_expiration_range': {'min': 0, 'max': 7},
+                'limit': 10}, 'HEADER: '))
+        self.assertEqual('ndjson', rights.validate_export_rights_request(
+            {'format': 'ndjson'}, 'HEADER: ')[0]['format'])
+
+    def test_validate_export_rights_request_invalid_format(self):
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                (None, {
+                    'http_status': 400, 'code': 'INVALID_PARAMETER',
+                    'msg': 'Invalid parameter "format", allowed values: csv, ndjson'}),
+                rights.validate_export_rights_request({'format': 'xml'}, 'HEADER: '))
+            self.assertEqual([
+                "WARNING:rights:HEADER: INVALID_PARAMETER: Invalid export format "
+                "(Request: {'format': 'xml'})"], cm.output)
+
+    @patch('rights.get_expiration_range', return_value=(None, 'ERR'))
+    def test_validate_export_rights_request_invalid_range(self, _):
+        self.assertEqual(
+            (None, 'ERR'), rights.validate_export_rights_request({}, 'HEADER: '))
+
+    @patch('rights.export_rights')
+    @patch('rights.validate_export_rights_request', return_value=({'format': 'ndjson'}, None))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_export_rights(self, _, validate_export_rights_request_mock,
+                                   export_rights_mock):
+        chunks = iter([b'', b'DATA'])
+        export_rights_mock.return_value = chunks
+        self.assertEqual(
+            {'http_status': 200, 'code': 'OK', 'msg': 'Exporting rights', 'stream': chunks,
+             'mimetype': 'application/x-ndjson'},
+            rights.process_export_rights({'CONF': 'data'}, {'x': 'y'}, 'HEADER: '))
+        validate_export_rights_request_mock.assert_called_with({'x': 'y'}, 'HEADER: ')
+        export_rights_mock.assert_called_with(
+            {'CONF': 'data'}, {'format': 'ndjson'}, 'HEADER: ')
+        self.assertEqual([b'DATA'], list(chunks))
+
+    @patch('rights.validate_export_rights_request', return_value=(None, 'ERR'))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_export_rights_request_err(self, *_):
+        self.assertEqual('ERR', rights.process_export_rights({'CONF': 'data'}, {}, 'HEADER: '))
+
+    @patch('rights.validate_config', return_value='ERR')
+    def test_process_export_rights_config_err(self, _):
+        self.assertEqual('ERR', rights.process_export_rights({'CONF': 'ERR'}, {}, 'HEADER: '))
+
     @patch('rights.validate_config', return_value='ERR')
     def test_process_search_rights_config_err(self, _):
         self.assertEqual(
@@ -972,14 +3086,14 @@ class MainTestCase(unittest.TestCase):
         get_required_parameter_mock.assert_called_once()
 
     @patch('rights.set_person')
-    @patch('rights.get_db_connection')
+    @patch('rights.db_connection')
     @patch('rights.validate_set_person_request', return_value=(
         {'code': '12345678901', 'first_name': 'First-name', 'last_name': 'Last-name'},
         None))
     @patch('rights.validate_config', return_value=None)
     def test_process_set_person(
             self, validate_config_mock, validate_set_person_request_mock,
-            get_db_connection_mock, set_person_mock):
+            db_connection_mock, set_person_mock):
         with self.assertLogs(rights.LOGGER, level='INFO') as cm:
             self.assertEqual(
                 {'code': 'OK', 'http_status': 200, 'msg': 'Person updated'},
@@ -987,8 +3101,8 @@ class MainTestCase(unittest.TestCase):
                     {'CONF': 'data'}, {'x': 'y'}, 'HEADER: '))
             validate_config_mock.assert_called_once()
             validate_set_person_request_mock.assert_called_once()
-            get_db_connection_mock.assert_called_once()
-            cursor_mock = get_db_connection_mock.return_value.__enter__.return_value.cursor
+            db_connection_mock.assert_called_once()
+            cursor_mock = db_connection_mock.return_value.__enter__.return_value.cursor
             cursor_mock.assert_called_once()
             cursor_return_mock = cursor_mock.return_value.__enter__.return_value
             set_person_mock.assert_called_with(
@@ -997,6 +3111,29 @@ class MainTestCase(unittest.TestCase):
                 ['INFO:rights:HEADER: Person updated: code=12345678901'],
                 cm.output)
 
+    @patch('rights.store_id')
+    @patch('rights.lookup_id', return_value=(None, 1))
+    @patch('rights.set_person', return_value=12345)
+    @patch('rights.db_connection')
+    @patch('rights.validate_set_person_request', return_value=(
+        {'code': '12345678901', 'first_name': 'F', 'last_name': None}, None))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_set_person_store_id(self, _, __, ___, ____, lookup_id_mock, store_id_mock):
+        rights.process_set_person({'CONF': 'data'}, {'x': 'y'}, 'HEADER: ')
+        lookup_id_mock.assert_called_with('person', '12345678901', ('F', None))
+        store_id_mock.assert_called_with('person', '12345678901', 12345, ('F', None), 1)
+
+    @patch('rights.lookup_id', return_value=(12345, 1))
+    @patch('rights.db_connection')
+    @patch('rights.validate_set_person_request', return_value=(
+        {'code': '12345678901', 'first_name': 'F', 'last_name': 'L'}, None))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_set_person_cached(self, _, __, db_connection_mock, ___):
+        self.assertEqual(
+            {'code': 'OK', 'http_status': 200, 'msg': 'Person updated'},
+            rights.process_set_person({'CONF': 'data'}, {'x': 'y'}, 'HEADER: '))
+        db_connection_mock.assert_not_called()
+
     @patch('rights.validate_config', return_value='ERR')
     def test_process_set_person_config_err(self, _):
         self.assertEqual(
@@ -1029,14 +3166,14 @@ class MainTestCase(unittest.TestCase):
         get_required_parameter_mock.assert_called_once()
 
     @patch('rights.set_organization')
-    @patch('rights.get_db_connection')
+    @patch('rights.db_connection')
     @patch('rights.validate_set_organization_request', return_value=(
         {'code': '00000000', 'name': 'Org name'},
         None))
     @patch('rights.validate_config', return_value=None)
     def test_process_set_organization(
             self, validate_config_mock, validate_set_organization_request_mock,
-            get_db_connection_mock, set_person_mock):
+            db_connection_mock, set_person_mock):
         with self.assertLogs(rights.LOGGER, level='INFO') as cm:
             self.assertEqual(
                 {'code': 'OK', 'http_status': 200, 'msg': 'Organization updated'},
@@ -1044,8 +3181,8 @@ class MainTestCase(unittest.TestCase):
                     {'CONF': 'data'}, {'x': 'y'}, 'HEADER: '))
             validate_config_mock.assert_called_once()
             validate_set_organization_request_mock.assert_called_once()
-            get_db_connection_mock.assert_called_once()
-            cursor_mock = get_db_connection_mock.return_value.__enter__.return_value.cursor
+            db_connection_mock.assert_called_once()
+            cursor_mock = db_connection_mock.return_value.__enter__.return_value.cursor
             cursor_mock.assert_called_once()
             cursor_return_mock = cursor_mock.return_value.__enter__.return_value
             set_person_mock.assert_called_with(
@@ -1054,6 +3191,30 @@ class MainTestCase(unittest.TestCase):
                 ['INFO:rights:HEADER: Organization updated: code=00000000'],
                 cm.output)
 
+    @patch('rights.store_id')
+    @patch('rights.lookup_id', return_value=(None, 1))
+    @patch('rights.set_organization', return_value=123)
+    @patch('rights.db_connection')
+    @patch('rights.validate_set_organization_request', return_value=(
+        {'code': '00000000', 'name': 'N'}, None))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_set_organization_store_id(
+            self, _, __, ___, ____, lookup_id_mock, store_id_mock):
+        rights.process_set_organization({'CONF': 'data'}, {'x': 'y'}, 'HEADER: ')
+        lookup_id_mock.assert_called_with('organization', '00000000', ('N',))
+        store_id_mock.assert_called_with('organization', '00000000', 123, ('N',), 1)
+
+    @patch('rights.lookup_id', return_value=(123, 1))
+    @patch('rights.db_connection')
+    @patch('rights.validate_set_organization_request', return_value=(
+        {'code': '00000000', 'name': 'N'}, None))
+    @patch('rights.validate_config', return_value=None)
+    def test_process_set_organization_cached(self, _, __, db_connection_mock, ___):
+        self.assertEqual(
+            {'code': 'OK', 'http_status': 200, 'msg': 'Organization updated'},
+            rights.process_set_organization({'CONF': 'data'}, {'x': 'y'}, 'HEADER: '))
+        db_connection_mock.assert_not_called()
+
     @patch('rights.validate_config', return_value='ERR')
     def test_process_set_organization_config_err(self, _):
         self.assertEqual(
@@ -1109,27 +3270,339 @@ class MainTestCase(unittest.TestCase):
                 ['ERROR:rights:HEADER: FORBIDDEN: Client certificate is not allowed: CLIENT_DN'],
                 cm.output)
 
-    @patch('rights.get_db_connection')
+    @patch('rights.db_connection')
     @patch('rights.validate_config', return_value=None)
-    def test_test_db(self, _, get_db_connection_mock):
+    def test_test_db(self, _, db_connection_mock):
         self.assertEqual(
             {'code': 'OK', 'http_status': 200, 'msg': 'API is ready'},
             rights.test_db(self.config, 'HEADER: '))
-        cursor_mock = get_db_connection_mock.return_value.__enter__.return_value.cursor
+        cursor_mock = db_connection_mock.return_value.__enter__.return_value.cursor
         cursor_mock.assert_called_once()
         cursor_return_mock = cursor_mock.return_value.__enter__.return_value
-        cursor_return_mock.execute.assert_called_with('select count(1) from rights."right";')
+        cursor_return_mock.execute.assert_called_with('select 1')
 
     @patch('rights.validate_config', return_value='ERR')
     def test_test_db_no_conf(self, _):
         self.assertEqual('ERR', rights.test_db(self.config, 'HEADER: '))
 
+    @patch('rights.time.monotonic', return_value=100)
+    @patch('rights.READY_STATUS', {'expires': 0.0, 'response': None})
+    @patch('rights.test_db', return_value='READY')
+    def test_get_ready_status(self, mock_test_db, mock_monotonic):
+        self.assertEqual('READY', rights.get_ready_status({'status_cache_ttl': 2}, 'HEADER: '))
+        mock_test_db.assert_called_with({'status_cache_ttl': 2}, 'HEADER: ')
+        mock_monotonic.return_value = 101.9
+        self.assertEqual('READY', rights.get_ready_status({'status_cache_ttl': 2}, 'HEADER: '))
+        self.assertEqual(1, mock_test_db.call_count)
+        mock_monotonic.return_value = 102
+        mock_test_db.side_effect = psycopg2.Error('DB_ERROR_MSG')
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                {'http_status': 500, 'code': 'DB_ERROR', 'msg': rights.DB_ERROR_MSG},
+                rights.get_ready_status({'status_cache_ttl': 2}, 'HEADER: '))
+            self.assertEqual([
+                f'ERROR:rights:HEADER: DB_ERROR: {rights.DB_ERROR_MSG}: DB_ERROR_MSG'],
+                cm.output)
+        self.assertEqual(2, mock_test_db.call_count)
+        self.assertEqual(104, rights.READY_STATUS['expires'])
+
+    @patch('rights.DB_POOL')
+    @patch('rights.REPLICAS', None)
+    @patch('rights.db_connection')
+    @patch('rights.validate_config', return_value=None)
+    def test_get_deep_status(self, _, db_connection_mock, mock_pool):
+        cur = db_connection_mock.return_value.__enter__.return_value.cursor.return_value \
+            .__enter__.return_value
+        cur.fetchone.return_value = (True, Decimal('1.5'))
+        mock_pool.stats.return_value = {
+            'in_use': 3, 'max_size': 10, 'waits': 1, 'timeouts': 0, 'idle': 2}
+        self.assertEqual(
+            {'http_status': 200, 'code': 'OK', 'msg': 'API is ready', 'response': {
+                'role': 'replica', 'replication_lag': 1.5, 'pool': {
+                    'in_use': 3, 'max_size': 10, 'saturation': 0.3, 'waits': 1,
+                    'timeouts': 0}}},
+            rights.get_deep_status(self.config, 'HEADER: '))
+        self.assertIn('pg_is_in_recovery()', cur.execute.call_args[0][0])
+
+    @patch('rights.DB_POOL', None)
+    @patch('rights.REPLICAS')
+    @patch('rights.db_connection')
+    @patch('rights.validate_config', return_value=None)
+    def test_get_deep_status_replicas(self, _, db_connection_mock, mock_replicas):
+        cur = db_connection_mock.return_value.__enter__.return_value.cursor.return_value \
+            .__enter__.return_value
+        cur.fetchone.return_value = (False, None)
+        mock_replicas.stats.return_value = [
+            {'host': 'replica1', 'healthy': True, 'replication_lag': 0.5}]
+        self.assertEqual(
+            {'http_status': 200, 'code': 'OK', 'msg': 'API is ready', 'response': {
+                'role': 'primary', 'replication_lag': None, 'replicas': [
+                    {'host': 'replica1', 'healthy': True, 'replication_lag': 0.5}]}},
+            rights.get_deep_status(self.config, 'HEADER: '))
+
+    @patch('rights.DB_POOL', None)
+    @patch('rights.REPLICAS', None)
+    @patch('rights.db_connection')
+    @patch('rights.validate_config', return_value=None)
+    def test_get_deep_status_primary(self, _, db_connection_mock):
+        cur = db_connection_mock.return_value.__enter__.return_value.cursor.return_value \
+            .__enter__.return_value
+        cur.fetchone.return_value = (False, None)
+        self.assertEqual(
+            {'http_status': 200, 'code': 'OK', 'msg': 'API is ready', 'response': {
+                'role': 'primary', 'replication_lag': None}},
+            rights.get_deep_status(self.config, 'HEADER: '))
+
+    @patch('rights.DB_POOL', None)
+    @patch('rights.REPLICAS', None)
+    @patch('rights.LOG_QUEUE_HANDLER')
+    @patch('rights.db_connection')
+    @patch('rights.validate_config', return_value=None)
+    def test_get_deep_status_log_queue(self, _, db_connection_mock, mock_log_queue_handler):
+        cur = db_connection_mock.return_value.__enter__.return_value.cursor.return_value \
+            .__enter__.return_value
+        cur.fetchone.return_value = (False, None)
+        mock_log_queue_handler.stats.return_value = {
+            'queued': 0, 'max_size': 1000, 'dropped': 0}
+        self.assertEqual(
+            {'http_status': 200, 'code': 'OK', 'msg': 'API is ready', 'response': {
+                'role': 'primary', 'replication_lag': None, 'log_queue': {
+                    'queued': 0, 'max_size': 1000, 'dropped': 0}}},
+            rights.get_deep_status(self.config, 'HEADER: '))
+
+    @patch('rights.validate_config', return_value='ERR')
+    def test_get_deep_status_no_conf(self, _):
+        self.assertEqual('ERR', rights.get_deep_status(self.config, 'HEADER: '))
+
+    @patch('rights.DB_POOL')
+    def test_get_pool_status(self, mock_pool):
+        mock_pool.stats.return_value = {'in_use': 1}
+        self.assertEqual(
+            {'code': 'OK', 'http_status': 200, 'msg': 'Database connection pool statistics',
+             'response': {'in_use': 1}},
+            rights.get_pool_status('HEADER: '))
+
+    @patch('rights.DB_POOL', None)
+    def test_get_pool_status_no_pool(self):
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                {'code': 'POOL_DISABLED', 'http_status': 200,
+                 'msg': 'Database connection pool is not initialized'},
+                rights.get_pool_status('HEADER: '))
+            self.assertEqual(['WARNING:rights:HEADER: DB pool is not initialized'], cm.output)
+
     @patch('uuid.uuid4', return_value='UUID4')
     def test_get_log_header(self, _):
         with self.app.test_request_context('url'):
             self.assertEqual('[METHOD] ', rights.get_log_header('METHOD'))
         with self.app.test_request_context('url', headers={'X-B3-TraceId': 'TRACE_ID'}):
             self.assertEqual('[METHOD TRACE_ID,UUID4] ', rights.get_log_header('METHOD'))
+            self.assertEqual(('[METHOD TRACE_ID,UUID4] ', None), rights.SQL_CONTEXT.get())
+
+    def test_get_log_header_traced(self):
+        token = rights.TRACE_CONTEXT.set(([], {'traceId': 'TRACE_ID', 'id': 'SPAN_ID'}))
+        try:
+            with self.app.test_request_context('url'):
+                self.assertEqual('[METHOD TRACE_ID,SPAN_ID] ', rights.get_log_header('METHOD'))
+        finally:
+            rights.TRACE_CONTEXT.reset(token)
+
+    @patch('os.urandom', return_value=b'\x01' * 8)
+    @patch('time.time_ns', return_value=1700000000123456789)
+    def test_new_span(self, *_):
+        self.assertEqual(
+            {'traceId': 'TRACE_ID', 'id': '0101010101010101', 'name': 'NAME',
+             'timestamp': 1700000000123456, 'parentId': 'PARENT_ID'},
+            rights.new_span('TRACE_ID', 'PARENT_ID', 'NAME'))
+        self.assertNotIn('parentId', rights.new_span('TRACE_ID', None, 'NAME'))
+
+    def test_trace_span_not_traced(self):
+        token = rights.TRACE_CONTEXT.set(None)
+        try:
+            with rights.trace_span('NAME'):
+                self.assertIsNone(rights.TRACE_CONTEXT.get())
+        finally:
+            rights.TRACE_CONTEXT.reset(token)
+
+    def test_trace_span(self):
+        spans = []
+        root = {'traceId': 'TRACE_ID', 'id': 'ROOT_ID'}
+        token = rights.TRACE_CONTEXT.set((spans, root))
+        try:
+            with rights.trace_span('OUTER'):
+                outer = rights.TRACE_CONTEXT.get()[1]
+                with self.assertRaises(ValueError):
+                    with rights.trace_span('INNER'):
+                        raise ValueError('ERR')
+            self.assertEqual((spans, root), rights.TRACE_CONTEXT.get())
+        finally:
+            rights.TRACE_CONTEXT.reset(token)
+        self.assertEqual(['INNER', 'OUTER'], [span['name'] for span in spans])
+        self.assertEqual(outer['id'], spans[0]['parentId'])
+        self.assertEqual('ROOT_ID', spans[1]['parentId'])
+        self.assertEqual({'TRACE_ID'}, {span['traceId'] for span in spans})
+        self.assertTrue(all(span['duration'] >= 1 for span in spans))
+
+    def test_traced(self):
+        @rights.traced('NAME')
+        def func(value):
+            return value * 2
+
+        spans = []
+        token = rights.TRACE_CONTEXT.set((spans, {'traceId': 'TRACE_ID', 'id': 'ROOT_ID'}))
+        try:
+            self.assertEqual(4, func(2))
+        finally:
+            rights.TRACE_CONTEXT.reset(token)
+        self.assertEqual(['NAME'], [span['name'] for span in spans])
+
+    def test_file_span_exporter(self):
+        exporter = rights.get_span_exporter({'tracing_exporter': 'file', 'tracing_file': 'FILE'})
+        self.assertIsInstance(exporter, rights.FileSpanExporter)
+        with patch('builtins.open', mock_open()) as m:
+            exporter.export([{'id': 'SPAN_ID'}])
+            m.assert_called_once_with('FILE', 'ab')
+            m().write.assert_called_once_with(b'[{"id":"SPAN_ID"}]\n')
+
+    @patch('socket.socket')
+    def test_udp_span_exporter(self, mock_socket):
+        exporter = rights.get_span_exporter({'tracing_exporter': 'udp', 'tracing_udp_port': 1234})
+        self.assertIsInstance(exporter, rights.UdpSpanExporter)
+        exporter.export([{'id': 'SPAN_ID'}])
+        mock_socket.return_value.sendto.assert_called_once_with(
+            b'[{"id":"SPAN_ID"}]', ('localhost', 1234))
+
+    @patch('importlib.import_module')
+    def test_custom_span_exporter(self, mock_import_module):
+        conf = {'tracing_exporter': 'my.module.Exporter'}
+        self.assertEqual(
+            mock_import_module.return_value.Exporter.return_value,
+            rights.get_span_exporter(conf))
+        mock_import_module.assert_called_once_with('my.module')
+        mock_import_module.return_value.Exporter.assert_called_once_with(conf)
+
+    @patch('rights.TRACER', None)
+    @patch('rights.get_span_exporter')
+    def test_init_tracing(self, mock_get_span_exporter):
+        self.assertIsNone(rights.init_tracing(self.config))
+        tracer = rights.init_tracing(dict(self.config, tracing_exporter='udp'))
+        self.assertIs(tracer, rights.TRACER)
+        self.assertEqual(mock_get_span_exporter.return_value, tracer.exporter)
+        self.assertEqual(('xtss-rights', 1.0), (tracer.service_name, tracer.sample_rate))
+
+    @patch('random.random', return_value=0.5)
+    @patch('rights.get_span_exporter')
+    def test_tracer_start(self, *_):
+        tracer = rights.Tracer({'tracing_exporter': 'file', 'tracing_sample_rate': 0.1})
+        self.assertIsNone(tracer.start('NAME', {}))
+        self.assertIsNone(tracer.start('NAME', {'X-B3-TraceId': 'TRACE_ID', 'X-B3-Sampled': '0'}))
+        span = tracer.start('NAME', {
+            'X-B3-TraceId': 'TRACE_ID', 'X-B3-SpanId': 'PARENT_ID', 'X-B3-Sampled': '1'})
+        self.assertEqual(
+            ('TRACE_ID', 'PARENT_ID', 'NAME', 'SERVER'),
+            (span['traceId'], span['parentId'], span['name'], span['kind']))
+        self.assertIsNotNone(tracer.start('NAME', {'X-B3-Flags': '1', 'X-B3-Sampled': '0'}))
+        tracer.sample_rate = 1.0
+        span = tracer.start('NAME', {})
+        self.assertEqual(32, len(span['traceId']))
+        self.assertNotIn('parentId', span)
+
+    @patch('rights.get_span_exporter')
+    def test_tracer_export(self, mock_get_span_exporter):
+        tracer = rights.Tracer({'tracing_exporter': 'file'})
+        spans = [{'id': 'SPAN_ID'}]
+        tracer.export(spans)
+        mock_get_span_exporter.return_value.export.assert_called_once_with(
+            [{'id': 'SPAN_ID', 'localEndpoint': {'serviceName': 'xtss-rights'}}])
+        mock_get_span_exporter.return_value.export.side_effect = OSError('ERR')
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            tracer.export(spans)
+            self.assertEqual(['WARNING:rights:Cannot export trace spans: ERR'], cm.output)
+
+    @patch('rights.TRACER')
+    def test_request_trace(self, mock_tracer):
+        mock_tracer.start.side_effect = lambda name, headers: rights.new_span(
+            headers['X-B3-TraceId'], headers['X-B3-SpanId'], name)
+        self.app.before_request(rights.start_trace)
+        self.app.after_request(rights.finish_trace)
+        with self.app.app_context():
+            response = self.client.get('/status/live', headers={
+                'X-B3-TraceId': 'TRACE_ID', 'X-B3-SpanId': 'PARENT_ID'})
+            self.assertEqual(200, response.status_code)
+        spans = mock_tracer.export.call_args[0][0]
+        self.assertEqual(['serialize_json', 'LiveStatus'], [span['name'] for span in spans])
+        self.assertEqual(spans[1]['id'], spans[0]['parentId'])
+        self.assertEqual('PARENT_ID', spans[1]['parentId'])
+        self.assertEqual(
+            {'http.method': 'GET', 'http.path': '/status/live', 'http.status_code': '200',
+             'code': 'OK'}, spans[1]['tags'])
+        self.assertIsNone(rights.TRACE_CONTEXT.get())
+
+    def test_add_server_timing(self):
+        token = rights.SERVER_TIMING.set(None)
+        try:
+            rights.add_server_timing('db-query', 0.5)
+            self.assertIsNone(rights.SERVER_TIMING.get())
+            rights.SERVER_TIMING.set({})
+            rights.add_server_timing('db-query', 0.5)
+            rights.add_server_timing('db-count', 0.25)
+            rights.add_server_timing('db-query', 0.5)
+            self.assertEqual({'db-query': 1.0, 'db-count': 0.25}, rights.SERVER_TIMING.get())
+        finally:
+            rights.SERVER_TIMING.reset(token)
+
+    def test_format_server_timing(self):
+        self.assertEqual(
+            'db-connect;dur=0.4, db-query;dur=12.3, total;dur=1500.0',
+            rights.format_server_timing(
+                {'db-connect': 0.00041, 'db-query': 0.01234, 'total': 1.5}))
+
+    def test_execute_sql_server_timing(self):
+        token = rights.SERVER_TIMING.set({})
+        try:
+            cur = MagicMock()
+            rights.execute_sql(cur, 'search_rights', 'SQL')
+            rights.execute_sql(cur, 'count_rights', 'SQL')
+            rights.execute_sql(cur, 'estimate_rights', 'SQL')
+            self.assertEqual(['db-query', 'db-count'], list(rights.SERVER_TIMING.get()))
+        finally:
+            rights.SERVER_TIMING.reset(token)
+
+    @patch('rights.DB_POOL', None)
+    @patch('rights.get_db_connection')
+    def test_db_connection_server_timing(self, _):
+        token = rights.SERVER_TIMING.set({})
+        try:
+            with rights.db_connection(self.config):
+                self.assertIn('db-connect', rights.SERVER_TIMING.get())
+        finally:
+            rights.SERVER_TIMING.reset(token)
+
+    @patch('rights.get_pool_status', return_value={
+        'http_status': 200, 'code': 'OK', 'msg': 'Pool stats', 'response': {'in_use': 0}})
+    def test_server_timing_header(self, _):
+        self.app.before_request(rights.start_server_timing)
+        self.app.after_request(rights.add_server_timing_header)
+        with self.app.app_context():
+            response = self.client.get('/status/pool')
+        self.assertRegex(
+            response.headers['Server-Timing'],
+            r'^serialize;dur=\d+\.\d, total;dur=\d+\.\d$')
+        self.assertIsNone(rights.SERVER_TIMING.get())
+
+    def test_server_timing_header_disabled(self):
+        with self.app.app_context():
+            response = self.client.get('/status/live')
+        self.assertNotIn('Server-Timing', response.headers)
+
+    @patch('rights.TRACER')
+    def test_request_trace_not_sampled(self, mock_tracer):
+        mock_tracer.start.return_value = None
+        self.app.before_request(rights.start_trace)
+        self.app.after_request(rights.finish_trace)
+        with self.app.app_context():
+            self.assertEqual(200, self.client.get('/status/live').status_code)
+        mock_tracer.export.assert_not_called()
 
     @patch('rights.check_client', return_value=False)
     def test_set_right_incorrect_client(self, mock_check_client):
@@ -1238,6 +3711,58 @@ class MainTestCase(unittest.TestCase):
                         'right': {'right_type': 'RIGHT1'}},
                     '[SetRight:post] ')
 
+    @patch('rights.check_client', return_value=False)
+    def test_set_rights_incorrect_client(self, mock_check_client):
+        with self.app.app_context():
+            with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+                response = self.client.post('/set-rights', json=[])
+                self.assertEqual(403, response.status_code)
+                self.assertEqual(
+                    {'code': 'FORBIDDEN', 'msg': 'Client certificate is not allowed: None'},
+                    response.json)
+                self.assertEqual([
+                    f"INFO:rights:[SetRights:post] {rights.INCOMING_REQUEST_MSG}: []",
+                    'INFO:rights:[SetRights:post] Client DN: None',
+                    'ERROR:rights:[SetRights:post] FORBIDDEN: Client certificate is not allowed: '
+                    'None',
+                    "INFO:rights:[SetRights:post] Response: {'http_status': 403, 'code': "
+                    "'FORBIDDEN', 'msg': 'Client certificate is not allowed: None'}"], cm.output)
+                mock_check_client.assert_called_with(self.config, None)
+
+    @patch('rights.process_set_rights', side_effect=psycopg2.Error('DB_ERROR_MSG'))
+    @patch('rights.check_client', return_value=True)
+    def test_set_rights_db_error_handled(self, _, mock_process_set_rights):
+        with self.app.app_context():
+            with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+                response = self.client.post('/set-rights', json=[{'x': 'y'}])
+                self.assertEqual(500, response.status_code)
+                self.assertEqual(
+                    {'code': 'DB_ERROR', 'msg': rights.DB_ERROR_MSG}, response.json)
+                self.assertEqual([
+                    f"INFO:rights:[SetRights:post] {rights.INCOMING_REQUEST_MSG}: [{{'x': 'y'}}]",
+                    'INFO:rights:[SetRights:post] Client DN: None',
+                    f'ERROR:rights:[SetRights:post] DB_ERROR: {rights.DB_ERROR_MSG}: '
+                    'DB_ERROR_MSG'], cm.output)
+                mock_process_set_rights.assert_called_with(
+                    self.config, [{'x': 'y'}], '[SetRights:post] ')
+
+    @patch('rights.process_set_rights', return_value={
+        'http_status': 200, 'code': 'OK', 'msg': 'SET_RIGHTS_OK', 'response': {'created': 1}})
+    @patch('rights.check_client', return_value=True)
+    def test_set_rights_ok(self, _, mock_process_set_rights):
+        with self.app.app_context():
+            with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+                response = self.client.post('/set-rights', json=[{'x': 'y'}])
+                self.assertEqual(200, response.status_code)
+                self.assertEqual(
+                    {'code': 'OK', 'msg': 'SET_RIGHTS_OK', 'response': {'created': 1}},
+                    response.json)
+                self.assertEqual([
+                    f"INFO:rights:[SetRights:post] {rights.INCOMING_REQUEST_MSG}: [{{'x': 'y'}}]",
+                    'INFO:rights:[SetRights:post] Client DN: None'], cm.output)
+                mock_process_set_rights.assert_called_with(
+                    self.config, [{'x': 'y'}], '[SetRights:post] ')
+
     @patch('rights.check_client', return_value=False)
     def test_revoke_right_incorrect_client(self, mock_check_client):
         with self.app.app_context():
@@ -1348,6 +3873,60 @@ class MainTestCase(unittest.TestCase):
                         'organization_code': '00000000', 'person_code': '12345678901',
                         'right_type': 'RIGHT1'}, '[RevokeRight:post] ')
 
+    @patch('rights.check_client', return_value=False)
+    def test_revoke_rights_incorrect_client(self, mock_check_client):
+        with self.app.app_context():
+            with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+                response = self.client.post('/revoke-rights', json=[])
+                self.assertEqual(403, response.status_code)
+                self.assertEqual(
+                    {'code': 'FORBIDDEN', 'msg': 'Client certificate is not allowed: None'},
+                    response.json)
+                self.assertEqual([
+                    f"INFO:rights:[RevokeRights:post] {rights.INCOMING_REQUEST_MSG}: []",
+                    'INFO:rights:[RevokeRights:post] Client DN: None',
+                    'ERROR:rights:[RevokeRights:post] FORBIDDEN: Client certificate is not '
+                    'allowed: None',
+                    "INFO:rights:[RevokeRights:post] Response: {'http_status': 403, 'code': "
+                    "'FORBIDDEN', 'msg': 'Client certificate is not allowed: None'}"], cm.output)
+                mock_check_client.assert_called_with(self.config, None)
+
+    @patch('rights.process_revoke_rights', side_effect=psycopg2.Error('DB_ERROR_MSG'))
+    @patch('rights.check_client', return_value=True)
+    def test_revoke_rights_db_error_handled(self, _, mock_process_revoke_rights):
+        with self.app.app_context():
+            with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+                response = self.client.post('/revoke-rights', json=[{'x': 'y'}])
+                self.assertEqual(500, response.status_code)
+                self.assertEqual(
+                    {'code': 'DB_ERROR', 'msg': rights.DB_ERROR_MSG}, response.json)
+                self.assertEqual([
+                    f"INFO:rights:[RevokeRights:post] {rights.INCOMING_REQUEST_MSG}: "
+                    "[{'x': 'y'}]",
+                    'INFO:rights:[RevokeRights:post] Client DN: None',
+                    f'ERROR:rights:[RevokeRights:post] DB_ERROR: {rights.DB_ERROR_MSG}: '
+                    'DB_ERROR_MSG'], cm.output)
+                mock_process_revoke_rights.assert_called_with(
+                    self.config, [{'x': 'y'}], '[RevokeRights:post] ')
+
+    @patch('rights.process_revoke_rights', return_value={
+        'http_status': 200, 'code': 'OK', 'msg': 'REVOKE_RIGHTS_OK', 'response': {'revoked': 1}})
+    @patch('rights.check_client', return_value=True)
+    def test_revoke_rights_ok(self, _, mock_process_revoke_rights):
+        with self.app.app_context():
+            with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+                response = self.client.post('/revoke-rights', json=[{'x': 'y'}])
+                self.assertEqual(200, response.status_code)
+                self.assertEqual(
+                    {'code': 'OK', 'msg': 'REVOKE_RIGHTS_OK', 'response': {'revoked': 1}},
+                    response.json)
+                self.assertEqual([
+                    f"INFO:rights:[RevokeRights:post] {rights.INCOMING_REQUEST_MSG}: "
+                    "[{'x': 'y'}]",
+                    'INFO:rights:[RevokeRights:post] Client DN: None'], cm.output)
+                mock_process_revoke_rights.assert_called_with(
+                    self.config, [{'x': 'y'}], '[RevokeRights:post] ')
+
     @patch('rights.check_client', return_value=False)
     def test_rights_incorrect_client(self, mock_check_client):
         with self.app.app_context():
@@ -1468,6 +4047,97 @@ class MainTestCase(unittest.TestCase):
                         'persons': ['12345678901', '12345'], 'rights': ['RIGHT1', 'XXX']
                     }, '[Rights:post] ')
 
+    @patch('rights.process_search_rights_stream', return_value={
+        'http_status': 200, 'code': 'OK', 'msg': 'Streaming rights',
+        'stream': iter(['', 'LINE1\n', 'LINE2\n'])})
+    @patch('rights.check_client', return_value=True)
+    def test_rights_stream_accept(self, _, mock_process_search_rights_stream):
+        with self.app.app_context():
+            response = self.client.post(
+                '/rights', json={'limit': 5}, headers={'Accept': 'application/x-ndjson'})
+            self.assertEqual(200, response.status_code)
+            self.assertEqual('application/x-ndjson', response.mimetype)
+            self.assertEqual('no', response.headers['X-Accel-Buffering'])
+            self.assertEqual(b'LINE1\nLINE2\n', response.data)
+            mock_process_search_rights_stream.assert_called_with(
+                self.config, {'limit': 5}, '[Rights:post] ')
+
+    @patch('rights.process_search_rights_stream', return_value={
+        'http_status': 200, 'code': 'OK', 'msg': 'Streaming rights', 'stream': iter(['LINE\n'])})
+    @patch('rights.process_search_rights')
+    @patch('rights.check_client', return_value=True)
+    def test_rights_stream_parameter(self, _, mock_process_search_rights,
+                                     mock_process_search_rights_stream):
+        with self.app.app_context():
+            response = self.client.post('/rights', json={'stream': True})
+            self.assertEqual(b'LINE\n', response.data)
+            mock_process_search_rights_stream.assert_called_once()
+            mock_process_search_rights.assert_not_called()
+
+    @patch('rights.process_search_rights_stream', side_effect=psycopg2.Error('DB_ERROR_MSG'))
+    @patch('rights.check_client', return_value=True)
+    def test_rights_stream_db_error_handled(self, *_):
+        with self.app.app_context():
+            with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+                response = self.client.post(
+                    '/rights', json={}, headers={'Accept': 'application/x-ndjson'})
+                self.assertEqual(500, response.status_code)
+                self.assertEqual(
+                    {'code': 'DB_ERROR', 'msg': rights.DB_ERROR_MSG}, response.json)
+                self.assertIn(
+                    f'ERROR:rights:[Rights:post] DB_ERROR: {rights.DB_ERROR_MSG}: DB_ERROR_MSG',
+                    cm.output)
+
+    @patch('rights.check_client', return_value=False)
+    def test_export_rights_incorrect_client(self, mock_check_client):
+        with self.app.app_context():
+            with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+                response = self.client.post('/rights/export', json={})
+                self.assertEqual(403, response.status_code)
+                self.assertEqual(
+                    {'code': 'FORBIDDEN', 'msg': 'Client certificate is not allowed: None'},
+                    response.json)
+                self.assertEqual([
+                    f"INFO:rights:[ExportRights:post] {rights.INCOMING_REQUEST_MSG}: {{}}",
+                    'INFO:rights:[ExportRights:post] Client DN: None',
+                    'ERROR:rights:[ExportRights:post] FORBIDDEN: Client certificate is not '
+                    'allowed: None',
+                    "INFO:rights:[ExportRights:post] Response: {'http_status': 403, 'code': "
+                    "'FORBIDDEN', 'msg': 'Client certificate is not allowed: None'}"], cm.output)
+                mock_check_client.assert_called_with(self.config, None)
+
+    @patch('rights.process_export_rights', side_effect=psycopg2.Error('DB_ERROR_MSG'))
+    @patch('rights.check_client', return_value=True)
+    def test_export_rights_db_error_handled(self, _, mock_process_export_rights):
+        with self.app.app_context():
+            with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+                response = self.client.post('/rights/export', json={'x': 'y'})
+                self.assertEqual(500, response.status_code)
+                self.assertEqual(
+                    {'code': 'DB_ERROR', 'msg': rights.DB_ERROR_MSG}, response.json)
+                self.assertEqual([
+                    f"INFO:rights:[ExportRights:post] {rights.INCOMING_REQUEST_MSG}: "
+                    "{'x': 'y'}",
+                    'INFO:rights:[ExportRights:post] Client DN: None',
+                    f'ERROR:rights:[ExportRights:post] DB_ERROR: {rights.DB_ERROR_MSG}: '
+                    'DB_ERROR_MSG',
+                    "INFO:rights:[ExportRights:post] Response: {'http_status': 500, 'code': "
+                    f"'DB_ERROR', 'msg': '{rights.DB_ERROR_MSG}'}}"], cm.output)
+                mock_process_export_rights.assert_called_with(
+                    self.config, {'x': 'y'}, '[ExportRights:post] ')
+
+    @patch('rights.process_export_rights', return_value={
+        'http_status': 200, 'code': 'OK', 'msg': 'Exporting rights',
+        'stream': iter([b'', b'a,b\n']), 'mimetype': 'text/csv'})
+    @patch('rights.check_client', return_value=True)
+    def test_export_rights_ok(self, *_):
+        with self.app.app_context():
+            response = self.client.post('/rights/export', json={})
+            self.assertEqual(200, response.status_code)
+            self.assertEqual('text/csv', response.mimetype)
+            self.assertEqual('no', response.headers['X-Accel-Buffering'])
+            self.assertEqual(b'a,b\n', response.data)
+
     @patch('rights.check_client', return_value=False)
     def test_person_incorrect_client(self, mock_check_client):
         with self.app.app_context():
@@ -1677,6 +4347,7 @@ class MainTestCase(unittest.TestCase):
                     'allow_all': False, 'allowed': ['OU=xtss,O=RIA,C=EE']},
                     {'code': '00000000', 'name': 'Org name'}, '[Organization:post] ')
 
+    @patch('rights.READY_STATUS', {'expires': 0.0, 'response': None})
     @patch('rights.test_db', side_effect=psycopg2.Error('DB_ERROR_MSG'))
     def test_status_db_error_handled(self, mock_test_db):
         with self.app.app_context():
@@ -1701,6 +4372,7 @@ class MainTestCase(unittest.TestCase):
                     'db_user': 'postgres', 'db_pass': 'password', 'db_connect_timeout': 10,
                     'allow_all': False, 'allowed': ['OU=xtss,O=RIA,C=EE']}, '[Status:get] ')
 
+    @patch('rights.READY_STATUS', {'expires': 0.0, 'response': None})
     @patch('rights.test_db', return_value={
         'http_status': 200, 'code': 'OK', 'msg': 'All Correct'})
     def test_status_ok(self, mock_test_db):
@@ -1721,29 +4393,199 @@ class MainTestCase(unittest.TestCase):
                     'db_user': 'postgres', 'db_pass': 'password', 'db_connect_timeout': 10,
                     'allow_all': False, 'allowed': ['OU=xtss,O=RIA,C=EE']}, '[Status:get] ')
 
+    def test_live_status(self):
+        with self.app.app_context():
+            with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+                response = self.client.get('/status/live')
+                self.assertEqual(200, response.status_code)
+                self.assertEqual({'code': 'OK', 'msg': 'API is live'}, response.json)
+                self.assertEqual([
+                    'INFO:rights:[LiveStatus:get] Incoming liveness status request',
+                    "INFO:rights:[LiveStatus:get] Response: {'http_status': 200, 'code': 'OK', "
+                    "'msg': 'API is live'}"], cm.output)
+
+    @patch('rights.get_deep_status')
+    @patch('rights.get_ready_status', return_value={
+        'http_status': 200, 'code': 'OK', 'msg': 'API is ready'})
+    def test_ready_status(self, mock_get_ready_status, mock_get_deep_status):
+        with self.app.app_context():
+            with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+                response = self.client.get('/status/ready')
+                self.assertEqual(200, response.status_code)
+                self.assertEqual({'code': 'OK', 'msg': 'API is ready'}, response.json)
+                self.assertEqual([
+                    'INFO:rights:[ReadyStatus:get] Incoming readiness status request',
+                    "INFO:rights:[ReadyStatus:get] Response: {'http_status': 200, 'code': 'OK', "
+                    "'msg': 'API is ready'}"], cm.output)
+                mock_get_ready_status.assert_called_with(self.config, '[ReadyStatus:get] ')
+                mock_get_deep_status.assert_not_called()
+
+    @patch('rights.DEEP_STATUS', {'expires': 0.0, 'response': None})
+    @patch('rights.get_deep_status', return_value={
+        'http_status': 200, 'code': 'OK', 'msg': 'API is ready', 'response': {
+            'role': 'primary'}})
+    def test_ready_status_deep(self, mock_get_deep_status):
+        self.config['status_deep_check'] = True
+        with self.app.app_context():
+            response = self.client.get('/status/ready?deep=true')
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(
+                {'code': 'OK', 'msg': 'API is ready', 'response': {'role': 'primary'}},
+                response.json)
+            mock_get_deep_status.assert_called_with(self.config, '[ReadyStatus:get] ')
+            # Result is cached
+            self.assertEqual(200, self.client.get('/status/ready?deep=1').status_code)
+            mock_get_deep_status.assert_called_once()
+
+    @patch('rights.get_deep_status')
+    def test_ready_status_deep_disabled(self, mock_get_deep_status):
+        with self.app.app_context():
+            with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+                response = self.client.get('/status/ready?deep=true')
+                self.assertEqual(403, response.status_code)
+                self.assertEqual(
+                    {'code': 'FORBIDDEN', 'msg': 'Deep readiness check is not enabled'},
+                    response.json)
+                self.assertEqual(
+                    'WARNING:rights:[ReadyStatus:get] FORBIDDEN: Deep readiness check is not '
+                    'enabled', cm.output[1])
+            mock_get_deep_status.assert_not_called()
+
+    @patch('rights.DEEP_STATUS', {'expires': 0.0, 'response': None})
+    @patch('rights.get_deep_status', side_effect=psycopg2.Error('DB_ERROR_MSG'))
+    def test_ready_status_deep_db_error(self, _):
+        self.config['status_deep_check'] = True
+        with self.app.app_context():
+            with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+                response = self.client.get('/status/ready?deep=1')
+                self.assertEqual(500, response.status_code)
+                self.assertEqual(
+                    {'code': 'DB_ERROR', 'msg': rights.DB_ERROR_MSG}, response.json)
+                self.assertEqual(
+                    f'ERROR:rights:[ReadyStatus:get] DB_ERROR: {rights.DB_ERROR_MSG}: '
+                    'DB_ERROR_MSG', cm.output[1])
+
+    @patch('rights.get_metrics', return_value=b'METRICS\n')
+    def test_metrics(self, mock_get_metrics):
+        with self.app.app_context():
+            response = self.client.get('/metrics')
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(b'METRICS\n', response.get_data())
+            self.assertEqual(prometheus_client.CONTENT_TYPE_LATEST, response.content_type)
+            mock_get_metrics.assert_called_once_with()
+
+    def test_get_metrics(self):
+        self.assertIn(b'rights_request_duration_seconds', rights.get_metrics())
+
+    @patch.dict('os.environ', {'PROMETHEUS_MULTIPROC_DIR': 'METRICS_DIR'})
+    @patch('prometheus_client.multiprocess.MultiProcessCollector')
+    @patch('prometheus_client.generate_latest', return_value=b'METRICS')
+    def test_get_metrics_multiprocess(self, mock_generate_latest, mock_collector):
+        self.assertEqual(b'METRICS', rights.get_metrics())
+        registry = mock_collector.call_args[0][0]
+        self.assertIsNot(prometheus_client.REGISTRY, registry)
+        mock_generate_latest.assert_called_once_with(registry)
+
+    @patch('rights.get_pool_status', return_value={
+        'http_status': 200, 'code': 'OK', 'msg': 'Pool stats', 'response': {'in_use': 0}})
+    def test_request_metrics(self, _):
+        self.app.before_request(rights.start_request_timer)
+        self.app.after_request(rights.observe_request)
+        labels = {'resource': 'PoolStatus', 'code': 'OK'}
+        count = self.get_metric('rights_request_duration_seconds_count', labels)
+        not_found_labels = {'resource': 'unknown', 'code': '404'}
+        not_found_count = self.get_metric(
+            'rights_request_duration_seconds_count', not_found_labels)
+        with self.app.app_context():
+            self.client.get('/status/pool')
+            self.client.get('/unknown')
+        self.assertEqual(
+            count + 1, self.get_metric('rights_request_duration_seconds_count', labels))
+        self.assertEqual(not_found_count + 1, self.get_metric(
+            'rights_request_duration_seconds_count', not_found_labels))
+
+    @patch('rights.get_pool_status', return_value={
+        'http_status': 200, 'code': 'OK', 'msg': 'Pool stats', 'response': {'in_use': 0}})
+    def test_pool_status_ok(self, mock_get_pool_status):
+        with self.app.app_context():
+            with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+                response = self.client.get('/status/pool')
+                self.assertEqual(200, response.status_code)
+                self.assertEqual(
+                    {'code': 'OK', 'msg': 'Pool stats', 'response': {'in_use': 0}},
+                    response.json)
+                self.assertEqual([
+                    'INFO:rights:[PoolStatus:get] Incoming pool status request',
+                    "INFO:rights:[PoolStatus:get] Response: {'http_status': 200, 'code': 'OK', "
+                    "'msg': 'Pool stats', 'response': {'in_use': 0}}"], cm.output)
+                mock_get_pool_status.assert_called_with('[PoolStatus:get] ')
+
+    @patch('rights.init_tracing', return_value=None)
+    @patch('rights.init_caches')
+    @patch('rights.init_slow_query_log')
+    @patch('rights.init_replicas')
+    @patch('rights.init_db_pool')
     @patch('rights.configure_app', return_value={'log_file': 'LOG_FILE'})
     @patch('rights.Api')
-    def test_create_app(self, mock_api, mock_configure_app):
+    def test_create_app(self, mock_api, mock_configure_app, mock_init_db_pool,
+                        mock_init_replicas, mock_init_slow_query_log, mock_init_caches,
+                        mock_init_tracing):
         mock_api_value = MagicMock()
         mock_api.return_value = mock_api_value
         app = rights.create_app('CONFIG_FILE')
         mock_configure_app.assert_called_with('CONFIG_FILE')
+        mock_init_db_pool.assert_called_with({'log_file': 'LOG_FILE'})
+        mock_init_replicas.assert_called_with({'log_file': 'LOG_FILE'})
+        mock_init_slow_query_log.assert_called_with({'log_file': 'LOG_FILE'})
+        mock_init_tracing.assert_called_with({'log_file': 'LOG_FILE'})
+        mock_init_caches.assert_called_with({'log_file': 'LOG_FILE'})
         self.assertIsInstance(app, rights.Flask)
         mock_api_value.add_resource.assert_has_calls([
             call(rights.SetRightApi, '/set-right', resource_class_kwargs={
                 'config': {'log_file': 'LOG_FILE'}}),
+            call(rights.SetRightsApi, '/set-rights', resource_class_kwargs={
+                'config': {'log_file': 'LOG_FILE'}}),
             call(rights.RevokeRightApi, '/revoke-right', resource_class_kwargs={
                 'config': {'log_file': 'LOG_FILE'}}),
+            call(rights.RevokeRightsApi, '/revoke-rights', resource_class_kwargs={
+                'config': {'log_file': 'LOG_FILE'}}),
             call(rights.RightsApi, '/rights', resource_class_kwargs={
                 'config': {'log_file': 'LOG_FILE'}}),
+            call(rights.ExportRightsApi, '/rights/export', resource_class_kwargs={
+                'config': {'log_file': 'LOG_FILE'}}),
             call(rights.PersonApi, '/person', resource_class_kwargs={
                 'config': {'log_file': 'LOG_FILE'}}),
             call(rights.OrganizationApi, '/organization', resource_class_kwargs={
                 'config': {'log_file': 'LOG_FILE'}}),
             call(rights.StatusApi, '/status', resource_class_kwargs={
+                'config': {'log_file': 'LOG_FILE'}}),
+            call(rights.LiveStatusApi, '/status/live', resource_class_kwargs={
+                'config': {'log_file': 'LOG_FILE'}}),
+            call(rights.ReadyStatusApi, '/status/ready', resource_class_kwargs={
+                'config': {'log_file': 'LOG_FILE'}}),
+            call(rights.PoolStatusApi, '/status/pool', resource_class_kwargs={
+                'config': {'log_file': 'LOG_FILE'}}),
+            call(rights.MetricsApi, '/metrics', resource_class_kwargs={
                 'config': {'log_file': 'LOG_FILE'}})
         ])
 
 
+    @patch('rights.init_tracing')
+    @patch('rights.init_caches')
+    @patch('rights.init_slow_query_log')
+    @patch('rights.init_replicas')
+    @patch('rights.init_db_pool')
+    @patch('rights.configure_app', return_value={
+        'tracing_exporter': 'file', 'server_timing': True})
+    def test_create_app_tracing(self, *_):
+        app = rights.create_app('CONFIG_FILE')
+        self.assertEqual(
+            [rights.start_request_timer, rights.start_trace, rights.start_server_timing],
+            app.before_request_funcs[None])
+        self.assertEqual(
+            [rights.observe_request, rights.finish_trace, rights.add_server_timing_header],
+            app.after_request_funcs[None])
+
+
 if __name__ == '__main__':
     unittest.main()
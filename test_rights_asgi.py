@@ -0,0 +1,578 @@
+# Disable pylint errors that are not as relevant for tests:
+# pylint: disable=missing-function-docstring missing-module-docstring missing-class-docstring
+# pylint: disable=too-many-public-methods protected-access
+
+import unittest
+from unittest.mock import patch, MagicMock, AsyncMock, call
+from flask import Flask
+import prometheus_client
+import psycopg
+import rights
+import rights_asgi
+
+
+def new_cursor():
+    cur = MagicMock()
+    cur.execute = AsyncMock()
+    cur.fetchone = AsyncMock()
+    cur.fetchall = AsyncMock()
+    cur.fetchmany = AsyncMock()
+    return cur
+
+
+def new_pool(cur):
+    pool = MagicMock()
+    conn = MagicMock()
+    pool.connection.return_value.__aenter__.return_value = conn
+    conn.cursor.return_value.__aenter__.return_value = cur
+    conn.cursor.return_value.mogrify = cur.mogrify
+    conn.set_autocommit = AsyncMock()
+    pool.open = AsyncMock()
+    pool.close = AsyncMock()
+    return pool
+
+
+def new_search_kwargs(**kwargs):
+    search_kwargs = {
+        'persons': [], 'organizations': [], 'rights': [], 'only_valid': True, 'limit': 2,
+        'offset': 0, 'after_id': None, 'days_to_expiration': None, 'count': 'exact',
+        'format': 'csv'}
+    search_kwargs.update(kwargs)
+    return search_kwargs
+
+
+def new_record(right_id):
+    return (
+        'P1', 'F', 'L', 'O1', 'ORG', 'RIGHT1', '2020-01-01T10:35:45.000555', None, False,
+        right_id)
+
+
+async def collect(generator):
+    return [item async for item in generator]
+
+
+class AsgiTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.config = {
+            'db_host': 'localhost', 'db_port': '5432', 'db_db': 'postgres',
+            'db_user': 'postgres', 'allow_all': True}
+        self.cur = new_cursor()
+        self.pool = new_pool(self.cur)
+
+    def new_app(self, config=None):
+        with patch('rights_asgi.create_pool', return_value=self.pool):
+            return rights_asgi.RightsApp(config or self.config)
+
+    @staticmethod
+    async def call_app(app, method, url, body=b'', headers=()):
+        path, _, query_string = url.partition('?')
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        await app({
+            'type': 'http', 'method': method, 'path': path, 'query_string': query_string.encode(),
+            'headers': [(name.encode(), value.encode()) for name, value in headers]},
+            receive, send)
+        return sent
+
+    @staticmethod
+    def get_metric(name, labels=None):
+        return prometheus_client.REGISTRY.get_sample_value(name, labels) or 0
+
+    @staticmethod
+    def get_flask_body(data):
+        with Flask(__name__).app_context():
+            return rights.make_response(data, '').get_data()
+
+    @patch('rights_asgi.AsyncConnectionPool')
+    def test_create_pool(self, mock_pool):
+        self.assertEqual(mock_pool.return_value, rights_asgi.create_pool(
+            dict(self.config, db_pool_max_size=20)))
+        mock_pool.assert_called_with(
+            'host=localhost port=5432 dbname=postgres user=postgres connect_timeout=5 '
+            'target_session_attrs=read-write', open=False,
+            kwargs={'cursor_factory': psycopg.AsyncClientCursor}, min_size=1, max_size=20,
+            max_idle=300, max_lifetime=3600, timeout=5)
+
+    def test_get_pool_stats(self):
+        pool = MagicMock(min_size=1, max_size=10)
+        pool.get_stats.return_value = {
+            'pool_size': 4, 'pool_available': 1, 'requests_queued': 2,
+            'requests_wait_ms': 1500, 'connections_num': 5}
+        self.assertEqual(
+            {'size': 4, 'in_use': 3, 'idle': 1, 'min_size': 1, 'max_size': 10, 'waits': 2,
+             'wait_time': 1.5, 'timeouts': 0, 'opened': 5, 'closed': 0},
+            rights_asgi.get_pool_stats(pool))
+
+    async def test_set_person(self):
+        self.cur.fetchone.side_effect = [None, (7,)]
+        self.assertEqual(7, await rights_asgi.set_person(self.cur, 'P1', 'F', None))
+        self.cur.execute.assert_has_calls([
+            call(rights.SQL_SET_PERSON, {'code': 'P1', 'first_name': 'F', 'last_name': None}),
+            call(rights.SQL_GET_PERSON, {'str': 'P1'})])
+
+    async def test_set_organization(self):
+        self.cur.fetchone.return_value = (8,)
+        self.assertEqual(8, await rights_asgi.set_organization(self.cur, 'O1', 'N'))
+        self.cur.execute.assert_called_once_with(
+            rights.SQL_SET_ORGANIZATION, {'code': 'O1', 'name': 'N'})
+
+    async def test_get_id_not_found(self):
+        self.cur.fetchone.return_value = None
+        self.assertIsNone(await rights_asgi.get_id(
+            self.cur, 'get_person', rights.SQL_GET_PERSON, 'P1'))
+
+    async def test_upsert_missing(self):
+        self.cur.fetchall.side_effect = [[('P1', 1)], [('P2', 2)]]
+        self.assertEqual({'P1': 1, 'P2': 2}, await rights_asgi.upsert(
+            self.cur, (('upsert_persons', 'SQL'), ('get_person_ids', 'SQL_IDS')),
+            ['P1', 'P2'], {'codes': ['P1', 'P2']}))
+        self.cur.execute.assert_called_with('SQL_IDS', {'codes': ['P2']})
+
+    async def test_execute_sql(self):
+        before = self.get_metric(
+            'rights_db_query_duration_seconds_count', {'statement': 'count_rights'})
+        token = rights.SERVER_TIMING.set({})
+        try:
+            await rights_asgi.execute_sql(self.cur, 'search_rights', 'SQL', {'a': 1})
+            await rights_asgi.execute_sql(self.cur, 'count_rights', 'SQL')
+            self.assertEqual(['db-query', 'db-count'], list(rights.SERVER_TIMING.get()))
+        finally:
+            rights.SERVER_TIMING.reset(token)
+        self.cur.execute.assert_has_calls([call('SQL', {'a': 1}), call('SQL')])
+        self.assertEqual(1, self.get_metric(
+            'rights_db_query_duration_seconds_count', {'statement': 'count_rights'}) - before)
+
+    async def test_connection(self):
+        token = rights.SERVER_TIMING.set({})
+        try:
+            async with rights_asgi.connection(self.pool) as conn:
+                self.assertIs(self.pool.connection.return_value.__aenter__.return_value, conn)
+                self.assertIn('db-connect', rights.SERVER_TIMING.get())
+        finally:
+            rights.SERVER_TIMING.reset(token)
+        self.pool.connection.return_value.__aexit__.assert_called_once()
+
+    async def test_set_rights(self):
+        items = [
+            {'person': {'code': 'P1', 'first_name': 'F', 'last_name': None},
+             'organization': {'code': 'O1', 'name': 'N'},
+             'right': {'right_type': 'R1', 'valid_from': None, 'valid_to': None}},
+            None]
+        self.cur.fetchall.side_effect = [[('P1', 1)], [('O1', 2)], [(1, 2, 'R1')]]
+        self.assertEqual(
+            [{'code': 'CREATED', 'msg': 'New right added'}, None],
+            await rights_asgi.set_rights(self.cur, items))
+        self.cur.execute.assert_has_calls([
+            call(rights.SQL_UPSERT_PERSONS, {
+                'codes': ['P1'], 'first_names': ['F'], 'last_names': [None]}),
+            call(rights.SQL_UPSERT_ORGANIZATIONS, {'codes': ['O1'], 'names': ['N']}),
+            call(rights.SQL_REVOKE_RIGHTS_BY_KEYS, {
+                'person_ids': [1], 'organization_ids': [2], 'right_types': ['R1']}),
+            call(rights.SQL_ADD_RIGHTS, {
+                'person_ids': [1], 'organization_ids': [2], 'right_types': ['R1'],
+                'valid_froms': [None], 'valid_tos': [None]})])
+
+    async def test_search_rights(self):
+        self.cur.fetchall.return_value = [new_record(1)]
+        self.cur.fetchone.return_value = (5,)
+        kwargs = new_search_kwargs()
+        self.assertEqual({
+            'rights': [rights.get_right_from_record(new_record(1))], 'limit': 2,
+            'offset': 0, 'total': 5, 'count': 'exact'},
+            await rights_asgi.search_rights(self.cur, kwargs))
+        count, sql_query, sql_total, params = rights.get_search_rights_query(kwargs)
+        self.assertEqual('exact', count)
+        self.cur.execute.assert_has_calls([call(sql_query, params), call(sql_total, params)])
+
+    async def test_search_rights_estimate(self):
+        self.cur.fetchall.return_value = [new_record(1), new_record(2), new_record(3)]
+        self.cur.fetchone.return_value = ([{'Plan': {'Plan Rows': 9}}],)
+        result = await rights_asgi.search_rights(
+            self.cur, new_search_kwargs(count='estimate', after_id=0))
+        self.assertEqual(
+            (9, 'estimate', rights.encode_cursor(2)),
+            (result['total'], result['count'], result['next_cursor']))
+
+    async def test_stream_search_rights(self):
+        self.cur.fetchmany.side_effect = [[new_record(1), new_record(2)], [new_record(3)]]
+        lines = await collect(rights_asgi.stream_search_rights(
+            self.pool, {'stream_fetch_size': 2}, new_search_kwargs(after_id=0), 'HEADER: '))
+        self.assertEqual([
+            '', rights.get_ndjson_line(rights.get_right_from_record(new_record(1)))
+            + rights.get_ndjson_line(rights.get_right_from_record(new_record(2))),
+            rights.get_ndjson_line({
+                'code': 'OK', 'msg': 'Returned 2 rights', 'returned': 2,
+                'next_cursor': rights.encode_cursor(2)})], lines)
+        self.cur.execute.assert_called_once()
+        self.assertEqual(2, self.cur.fetchmany.call_count)
+
+    async def test_stream_search_rights_db_error(self):
+        self.cur.fetchmany.side_effect = [[new_record(1)], psycopg.Error('ERR')]
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            lines = await collect(rights_asgi.stream_search_rights(
+                self.pool, {}, new_search_kwargs(), 'HEADER: '))
+            self.assertEqual(
+                [f'ERROR:rights:HEADER: DB_ERROR: {rights.DB_ERROR_MSG}: ERR'], cm.output)
+        self.assertEqual(
+            rights.get_ndjson_line({'code': 'DB_ERROR', 'msg': rights.DB_ERROR_MSG}),
+            lines[-1])
+
+    async def test_export_rights(self):
+        copy = MagicMock()
+        copy.__aiter__.return_value = [b'header\n', b'row1\n', b'row2\n', b'row3\n']
+        self.cur.copy.return_value.__aenter__.return_value = copy
+        self.cur.mogrify.return_value = 'COPY SQL'
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            chunks = await collect(rights_asgi.export_rights(
+                self.pool, {'export_chunk_size': 10}, new_search_kwargs(), 'HEADER: '))
+            self.assertEqual(['INFO:rights:HEADER: Exported 22 bytes'], cm.output)
+        self.assertEqual([b'', b'header\nrow1\n', b'row2\nrow3\n'], chunks)
+        self.cur.copy.assert_called_with('COPY SQL')
+
+    async def test_export_rights_empty(self):
+        self.cur.copy.return_value.__aenter__.return_value = MagicMock()
+        self.assertEqual([b''], await collect(rights_asgi.export_rights(
+            self.pool, {}, new_search_kwargs(format='ndjson'), 'HEADER: ')))
+
+    async def test_process_set_right(self):
+        self.cur.fetchone.side_effect = [(1,), (2,)]
+        json_data = {
+            'person': {'code': 'P1'}, 'organization': {'code': 'O1'},
+            'right': {'right_type': 'R1'}}
+        self.assertEqual(
+            {'http_status': 201, 'code': 'CREATED', 'msg': 'New right added'},
+            await rights_asgi.process_set_right(self.pool, self.config, json_data, ''))
+        self.assertEqual(4, self.cur.execute.call_count)
+        self.assertEqual(
+            (rights.SQL_ADD_RIGHT, {
+                'person_id': 1, 'organization_id': 2, 'right_type': 'R1', 'valid_from': None,
+                'valid_to': None}), self.cur.execute.call_args[0])
+
+    async def test_process_set_right_function(self):
+        json_data = {
+            'person': {'code': 'P1'}, 'organization': {'code': 'O1'},
+            'right': {'right_type': 'R1'}}
+        self.assertEqual('CREATED', (await rights_asgi.process_set_right(
+            self.pool, dict(self.config, db_set_right_function=True), json_data, ''))['code'])
+        self.assertEqual(rights.SQL_CALL_SET_RIGHT, self.cur.execute.call_args[0][0])
+        conn = self.pool.connection.return_value.__aenter__.return_value
+        conn.set_autocommit.assert_has_calls([call(True), call(False)])
+
+    async def test_process_set_right_invalid(self):
+        self.assertEqual('MISSING_PARAMETER', (await rights_asgi.process_set_right(
+            self.pool, self.config, {}, ''))['code'])
+        self.assertEqual('DB_CONF_ERROR', (await rights_asgi.process_set_right(
+            self.pool, {}, {}, ''))['code'])
+        self.pool.connection.assert_not_called()
+
+    async def test_process_set_rights(self):
+        self.cur.fetchall.side_effect = [[('P1', 1)], [('O1', 2)], [(1, 2, 'R1')]]
+        json_data = [
+            {'person': {'code': 'P1'}, 'organization': {'code': 'O1'},
+             'right': {'right_type': 'R1'}}, 'x']
+        response = await rights_asgi.process_set_rights(self.pool, self.config, json_data, '')
+        self.assertEqual('Added 1 of 2 rights', response['msg'])
+        self.assertEqual(['CREATED', 'INVALID_PARAMETER'], [
+            item['code'] for item in response['response']['items']])
+
+    async def test_process_revoke_right(self):
+        self.cur.fetchone.side_effect = [(1,), (2,)]
+        self.cur.rowcount = 1
+        json_data = {'person_code': 'P1', 'organization_code': 'O1', 'right_type': 'R1'}
+        self.assertEqual(
+            {'http_status': 200, 'code': 'OK', 'msg': 'Right revoked'},
+            await rights_asgi.process_revoke_right(self.pool, self.config, json_data, ''))
+        self.cur.execute.assert_called_with(
+            rights.SQL_REVOKE_RIGHT, {'person_id': 1, 'organization_id': 2, 'right_type': 'R1'})
+        self.cur.rowcount = 0
+        self.cur.fetchone.side_effect = [None, None]
+        self.assertEqual('RIGHT_NOT_FOUND', (await rights_asgi.process_revoke_right(
+            self.pool, self.config, json_data, ''))['code'])
+
+    async def test_process_revoke_rights(self):
+        self.cur.fetchall.return_value = [(None, 3), (0, 3)]
+        response = await rights_asgi.process_revoke_rights(
+            self.pool, self.config, [{'person_code': 'P1'}, {}], '')
+        self.assertEqual({'revoked': 3, 'items': [
+            {'code': 'OK', 'msg': 'Rights revoked', 'revoked': 3},
+            {'code': 'MISSING_PARAMETER',
+             'msg': 'Missing parameter "person_code" or "organization_code"', 'revoked': 0}]},
+            response['response'])
+        shapes, params = rights.get_revoke_rights_params([{'person_code': 'P1'}])
+        self.cur.execute.assert_called_with(rights.get_revoke_rights_sql(shapes), params)
+
+    async def test_process_search_rights(self):
+        self.cur.fetchall.return_value = []
+        self.cur.fetchone.return_value = (0,)
+        self.assertEqual('Found 0 rights', (await rights_asgi.process_search_rights(
+            self.pool, self.config, {}, ''))['msg'])
+
+    async def test_process_search_rights_stream(self):
+        self.cur.fetchmany.return_value = []
+        response = await rights_asgi.process_search_rights_stream(
+            self.pool, self.config, {}, '')
+        self.assertEqual(rights.NDJSON_MIMETYPE, response['mimetype'])
+        self.cur.execute.assert_called_once()
+        await response['stream'].aclose()
+
+    async def test_process_export_rights(self):
+        self.cur.copy.return_value.__aenter__.return_value = MagicMock()
+        response = await rights_asgi.process_export_rights(
+            self.pool, self.config, {'format': 'ndjson'}, '')
+        self.assertEqual(rights.NDJSON_MIMETYPE, response['mimetype'])
+        self.assertEqual('INVALID_PARAMETER', (await rights_asgi.process_export_rights(
+            self.pool, self.config, {'format': 'xml'}, ''))['code'])
+
+    async def test_process_set_person_organization(self):
+        self.cur.fetchone.return_value = (1,)
+        self.assertEqual('Person updated', (await rights_asgi.process_set_person(
+            self.pool, self.config, {'code': 'P1'}, ''))['msg'])
+        self.assertEqual('Organization updated', (await rights_asgi.process_set_organization(
+            self.pool, self.config, {'code': 'O1'}, ''))['msg'])
+        self.assertEqual('MISSING_PARAMETER', (await rights_asgi.process_set_person(
+            self.pool, self.config, {}, ''))['code'])
+
+    async def test_get_deep_status(self):
+        self.cur.fetchone.return_value = (False, None)
+        self.pool.min_size = 1
+        self.pool.max_size = 10
+        self.pool.get_stats.return_value = {'pool_size': 2, 'pool_available': 1}
+        self.assertEqual(
+            {'http_status': 200, 'code': 'OK', 'msg': 'API is ready', 'response': {
+                'role': 'primary', 'replication_lag': None, 'pool': {
+                    'in_use': 1, 'max_size': 10, 'saturation': 0.1, 'waits': 0,
+                    'timeouts': 0}}},
+            await rights_asgi.get_deep_status(self.pool, self.config, ''))
+
+    async def test_app_post(self):
+        self.cur.fetchone.return_value = (1,)
+        app = self.new_app()
+        sent = await self.call_app(
+            app, 'POST', '/person', b'{"code": "P1"}', [('X-B3-TraceId', 'TRACE')])
+        self.assertEqual(200, sent[0]['status'])
+        self.assertIn((b'content-type', b'application/json'), sent[0]['headers'])
+        self.assertEqual(self.get_flask_body(
+            {'http_status': 200, 'code': 'OK', 'msg': 'Person updated'}), sent[1]['body'])
+        self.pool.open.assert_called_once_with(wait=False)
+
+    async def test_app_post_db_error(self):
+        self.cur.execute.side_effect = psycopg.OperationalError('NO_DB')
+        app = self.new_app()
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            sent = await self.call_app(app, 'POST', '/organization', b'{"code": "O1"}')
+            self.assertIn(
+                f'ERROR:rights:[Organization:post] DB_ERROR: {rights.DB_ERROR_MSG}: NO_DB',
+                cm.output)
+        self.assertEqual(500, sent[0]['status'])
+        self.assertEqual(self.get_flask_body(
+            {'http_status': 500, 'code': 'DB_ERROR', 'msg': rights.DB_ERROR_MSG}),
+            sent[1]['body'])
+
+    async def test_app_post_forbidden(self):
+        app = self.new_app(dict(self.config, allow_all=False, allowed=['DN']))
+        sent = await self.call_app(
+            app, 'POST', '/rights', b'{}', [('X-Ssl-Client-S-Dn', 'OTHER')])
+        self.assertEqual(403, sent[0]['status'])
+        self.assertEqual(self.get_flask_body(
+            {'http_status': 403, 'code': 'FORBIDDEN',
+             'msg': 'Client certificate is not allowed: OTHER'}), sent[1]['body'])
+
+    async def test_app_post_bad_json(self):
+        sent = await self.call_app(self.new_app(), 'POST', '/rights', b'{bad')
+        self.assertEqual(400, sent[0]['status'])
+        self.assertEqual(
+            b'{"message": "The browser (or proxy) sent a request that this server could not '
+            b'understand."}\n', sent[1]['body'])
+
+    async def test_app_stream(self):
+        self.cur.fetchmany.side_effect = [[new_record(1)], []]
+        sent = await self.call_app(
+            self.new_app(), 'POST', '/rights', b'{}', [('Accept', 'application/x-ndjson')])
+        self.assertEqual(200, sent[0]['status'])
+        self.assertIn((b'content-type', b'application/x-ndjson'), sent[0]['headers'])
+        self.assertIn((b'x-accel-buffering', b'no'), sent[0]['headers'])
+        self.assertEqual(
+            rights.get_ndjson_line(rights.get_right_from_record(new_record(1))),
+            sent[1]['body'].decode('utf-8'))
+        self.assertTrue(sent[2]['more_body'])
+        self.assertEqual({'type': 'http.response.body', 'body': b''}, sent[3])
+
+    async def test_app_not_found_method_not_allowed_options(self):
+        app = self.new_app()
+        sent = await self.call_app(app, 'GET', '/unknown')
+        self.assertEqual((404, rights_asgi.NOT_FOUND_BODY), (sent[0]['status'], sent[1]['body']))
+        sent = await self.call_app(app, 'GET', '/rights')
+        self.assertEqual(405, sent[0]['status'])
+        self.assertIn((b'allow', b'OPTIONS, POST'), sent[0]['headers'])
+        sent = await self.call_app(app, 'OPTIONS', '/status')
+        self.assertEqual(200, sent[0]['status'])
+        self.assertIn((b'allow', b'OPTIONS, GET, HEAD'), sent[0]['headers'])
+
+    async def test_app_status(self):
+        self.cur.fetchone.return_value = (1,)
+        app = self.new_app()
+        sent = await self.call_app(app, 'GET', '/status')
+        self.assertEqual(self.get_flask_body(
+            {'http_status': 200, 'code': 'OK', 'msg': 'API is ready'}), sent[1]['body'])
+        sent = await self.call_app(app, 'HEAD', '/status/ready')
+        self.assertEqual(b'', sent[1]['body'])
+        # Readiness result is cached
+        self.assertEqual(1, self.cur.execute.call_count)
+        sent = await self.call_app(app, 'GET', '/status/live')
+        self.assertEqual(self.get_flask_body(
+            {'http_status': 200, 'code': 'OK', 'msg': 'API is live'}), sent[1]['body'])
+
+    async def test_app_status_error_cached(self):
+        self.cur.execute.side_effect = psycopg.OperationalError('NO_DB')
+        app = self.new_app()
+        with self.assertLogs(rights.LOGGER, level='INFO'):
+            sent = await self.call_app(app, 'GET', '/status/ready')
+            await self.call_app(app, 'GET', '/status')
+        self.assertEqual(500, sent[0]['status'])
+        self.assertEqual(1, self.cur.execute.call_count)
+
+    async def test_app_deep_and_pool_status(self):
+        self.cur.fetchone.return_value = (True, 1.5)
+        self.pool.min_size = 1
+        self.pool.max_size = 10
+        self.pool.get_stats.return_value = {}
+        config = dict(self.config, status_deep_check=True)
+        app = self.new_app(config)
+        sent = await self.call_app(app, 'GET', '/status/ready?deep=true')
+        self.assertIn(b'"replication_lag":1.5', sent[1]['body'])
+        # Result is cached
+        await self.call_app(app, 'GET', '/status/ready?deep=1')
+        self.assertEqual(1, self.cur.execute.call_count)
+        sent = await self.call_app(app, 'GET', '/status/pool')
+        self.assertIn(b'"max_size":10', sent[1]['body'])
+        self.cur.execute.side_effect = psycopg.OperationalError('NO_DB')
+        with self.assertLogs(rights.LOGGER, level='INFO'):
+            sent = await self.call_app(self.new_app(config), 'GET', '/status/ready?deep=1')
+        self.assertEqual(500, sent[0]['status'])
+
+    async def test_app_metrics(self):
+        self.cur.fetchone.return_value = (1,)
+        labels = {'resource': 'Person', 'code': 'OK'}
+        before = self.get_metric('rights_request_duration_seconds_count', labels)
+        await self.call_app(self.new_app(), 'POST', '/person', b'{"code": "P1"}')
+        self.assertEqual(
+            1, self.get_metric('rights_request_duration_seconds_count', labels) - before)
+        before = self.get_metric(
+            'rights_request_duration_seconds_count', {'resource': 'unknown', 'code': '404'})
+        await self.call_app(self.new_app(), 'GET', '/unknown')
+        self.assertEqual(1, self.get_metric(
+            'rights_request_duration_seconds_count',
+            {'resource': 'unknown', 'code': '404'}) - before)
+        sent = await self.call_app(self.new_app(), 'GET', '/metrics')
+        self.assertEqual(200, sent[0]['status'])
+        self.assertIn(
+            (b'content-type', prometheus_client.CONTENT_TYPE_LATEST.encode()),
+            sent[0]['headers'])
+        self.assertIn(b'rights_request_duration_seconds_count{code="OK",resource="Person"}',
+                      sent[1]['body'])
+
+    async def test_app_server_timing(self):
+        self.cur.fetchone.return_value = (1,)
+        sent = await self.call_app(
+            self.new_app(dict(self.config, server_timing=True)), 'POST', '/person',
+            b'{"code": "P1"}')
+        self.assertRegex(
+            dict(sent[0]['headers'])[b'server-timing'].decode(),
+            r'^db-connect;dur=\d+\.\d, db-query;dur=\d+\.\d, serialize;dur=\d+\.\d, '
+            r'total;dur=\d+\.\d$')
+        self.assertIsNone(rights.SERVER_TIMING.get())
+        sent = await self.call_app(self.new_app(), 'GET', '/status/live')
+        self.assertNotIn(b'server-timing', dict(sent[0]['headers']))
+
+    @patch('rights.TRACER')
+    async def test_app_trace(self, mock_tracer):
+        self.cur.fetchone.return_value = (1,)
+        mock_tracer.start.return_value = {'traceId': 'TRACE', 'id': 'SPAN', 'name': 'Person'}
+        with self.assertLogs(rights.LOGGER, level='INFO') as cm:
+            await self.call_app(
+                self.new_app(), 'POST', '/person', b'{"code": "P1"}', [('X-B3-Sampled', '1')])
+        self.assertIn('INFO:rights:[Person:post TRACE,SPAN] Response: {\'http_status\': 200, '
+                      '\'code\': \'OK\', \'msg\': \'Person updated\'}', cm.output)
+        self.assertEqual('Person', mock_tracer.start.call_args[0][0])
+        self.assertEqual('1', mock_tracer.start.call_args[0][1].get('X-B3-Sampled'))
+        spans = mock_tracer.export.call_args[0][0]
+        self.assertEqual(
+            ['parse_json', 'check_client', 'validate', 'pool_checkout', 'sql set_person',
+             'serialize_json', 'Person'], [span['name'] for span in spans])
+        self.assertEqual({
+            'http.method': 'POST', 'http.path': '/person', 'http.status_code': '200',
+            'code': 'OK'}, spans[-1]['tags'])
+        self.assertTrue(all(span['parentId'] == 'SPAN' for span in spans[:-1]))
+        self.assertIsNone(rights.TRACE_CONTEXT.get())
+
+    async def test_app_deep_status_disabled(self):
+        with self.assertLogs(rights.LOGGER, level='INFO'):
+            sent = await self.call_app(self.new_app(), 'GET', '/status/ready?deep=true')
+        self.assertEqual(403, sent[0]['status'])
+        self.cur.execute.assert_not_called()
+
+    async def test_app_lifespan(self):
+        app = self.new_app()
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        send = AsyncMock()
+        await app({'type': 'lifespan'}, AsyncMock(side_effect=messages), send)
+        send.assert_has_calls([
+            call({'type': 'lifespan.startup.complete'}),
+            call({'type': 'lifespan.shutdown.complete'})])
+        self.pool.open.assert_called_once_with(wait=False)
+        self.pool.close.assert_called_once()
+
+    async def test_app_disconnect_before_body(self):
+        send = AsyncMock()
+        await self.new_app()(
+            {'type': 'http', 'method': 'POST', 'path': '/rights', 'headers': []},
+            AsyncMock(return_value={'type': 'http.disconnect'}), send)
+        send.assert_not_called()
+
+    async def test_send_stream_disconnect(self):
+        closed = []
+
+        async def stream():
+            try:
+                yield b'chunk1'
+                yield b'chunk2'
+            finally:
+                closed.append(True)
+
+        sent = []
+        response = {'http_status': 200, 'stream': stream(), 'mimetype': 'text/csv'}
+        receive = AsyncMock(return_value={'type': 'http.disconnect'})
+
+        async def send(message):
+            sent.append(message)
+            # Letting disconnect watcher run
+            await rights_asgi.asyncio.sleep(0)
+
+        await rights_asgi.send_stream(send, receive, response)
+        self.assertIn((b'content-type', b'text/csv; charset=utf-8'), sent[0]['headers'])
+        # Client disconnected after response start
+        self.assertEqual(1, len(sent))
+        self.assertEqual([True], closed)
+
+    @patch('rights.init_tracing')
+    @patch('rights_asgi.create_pool')
+    @patch('rights.configure_app', return_value={'log_file': 'LOG_FILE'})
+    def test_create_app(self, mock_configure_app, mock_create_pool, mock_init_tracing):
+        app = rights_asgi.create_app('CONFIG_FILE')
+        self.assertIsInstance(app, rights_asgi.RightsApp)
+        mock_configure_app.assert_called_with('CONFIG_FILE')
+        mock_create_pool.assert_called_with({'log_file': 'LOG_FILE'})
+        mock_init_tracing.assert_called_with({'log_file': 'LOG_FILE'})
+
+
+if __name__ == '__main__':
+    unittest.main()